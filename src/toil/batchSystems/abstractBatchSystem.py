@@ -91,6 +91,20 @@ class AbstractBatchSystem(object):
         """
         raise NotImplementedError()
 
+    def setUpdateListener(self, listener):
+        """
+        Set a callable that this batch system invokes without arguments, from any thread,
+        whenever a job becomes available from :meth:`.getUpdatedBatchJob`. This lets the leader
+        wait for events from several sources at once instead of polling the batch system.
+
+        :param callable listener: the callable to invoke, or None to stop invoking it
+
+        :return: True if the listener will be invoked, False if this batch system doesn't
+                 support listeners and must be polled
+        :rtype: bool
+        """
+        return False
+
     @abstractmethod
     def issueBatchJob(self, jobNode):
         """
@@ -202,6 +216,10 @@ class BatchSystemSupport(AbstractBatchSystem):
     Partial implementation of AbstractBatchSystem, support methods.
     """
 
+    # Whether this batch system calls _notifyUpdateListener() after each job it makes available
+    # from getUpdatedBatchJob()
+    notifiesUpdateListener = False
+
     def __init__(self, config, maxCores, maxMemory, maxDisk):
         """
         Initializes initial state of the object
@@ -231,6 +249,22 @@ class BatchSystemSupport(AbstractBatchSystem):
         self.workerCleanupInfo = WorkerCleanupInfo(workDir=self.config.workDir,
                                                    workflowID=self.config.workflowID,
                                                    cleanWorkDir=self.config.cleanWorkDir)
+        self._updateListener = None
+
+    def setUpdateListener(self, listener):
+        if not self.notifiesUpdateListener:
+            return False
+        self._updateListener = listener
+        return True
+
+    def _notifyUpdateListener(self):
+        """
+        Invokes the listener set with :meth:`.setUpdateListener`, if any. Must be called after
+        the updated job has been made available from :meth:`.getUpdatedBatchJob`.
+        """
+        listener = self._updateListener
+        if listener is not None:
+            listener()
 
     def checkResourceRequest(self, memory, cores, disk):
         """
@@ -339,9 +373,12 @@ class NodeInfo(object):
 
     The workers attribute is an integer reflecting the number of workers currently active workers
     on the node.
+
+    The cacheHits and cacheMisses attributes are the numbers of reads of the node's file store
+    cache that found the file in the cache, or didn't, by all jobs that ran on the node.
     """
     def __init__(self, coresUsed, memoryUsed, coresTotal, memoryTotal,
-                 requestedCores, requestedMemory, workers):
+                 requestedCores, requestedMemory, workers, cacheHits=0, cacheMisses=0):
         self.coresUsed = coresUsed
         self.memoryUsed = memoryUsed
 
@@ -353,6 +390,9 @@ class NodeInfo(object):
 
         self.workers = workers
 
+        self.cacheHits = cacheHits
+        self.cacheMisses = cacheMisses
+
 
 class AbstractScalableBatchSystem(AbstractBatchSystem):
     """
@@ -17,12 +17,14 @@ from __future__ import absolute_import
 import os
 import shutil
 import logging
+import tempfile
 import time
 from threading import Thread
 from abc import ABCMeta, abstractmethod
 
 # Python 3 compatibility imports
 from six.moves.queue import Empty, Queue
+from six import iteritems
 
 from bd2k.util.objects import abstractclassmethod
 
@@ -40,10 +42,28 @@ class AbstractGridEngineBatchSystem(BatchSystemSupport):
     implemented.
     """
 
+    notifiesUpdateListener = True
+
     class Worker(Thread):
 
         __metaclass__ = ABCMeta
 
+        # The environment variable in which the batch system passes the index of a task in a job
+        # array to the task, or None if the batch system does not support job arrays. Subclasses
+        # that set this must implement prepareArraySubmission().
+        arrayTaskIDVariable = None
+
+        # The largest number of tasks to submit in one job array
+        maxArraySize = 1000
+
+        # Bounds of the interval in seconds between two queries of the batch system for the
+        # status of the running jobs. The interval grows by pollBackoffFactor with every query
+        # that finds no finished job and drops back to minPollInterval whenever jobs finish or
+        # are submitted.
+        minPollInterval = 1
+        maxPollInterval = 60
+        pollBackoffFactor = 1.5
+
         def __init__(self, newJobsQueue, updatedJobsQueue, killQueue, killedJobsQueue, boss):
             """
             Abstract worker interface class. All instances are created with five
@@ -66,6 +86,8 @@ class AbstractGridEngineBatchSystem(BatchSystemSupport):
             self.boss = boss
             self.allocatedCpus = dict()
             self.batchJobIDs = dict()
+            self.pollInterval = self.minPollInterval
+            self.lastPollTime = 0
 
         def getBatchSystemID(self, jobID):
             """
@@ -95,43 +117,111 @@ class AbstractGridEngineBatchSystem(BatchSystemSupport):
             del self.allocatedCpus[jobID]
             del self.batchJobIDs[jobID]
 
-        def createJobs(self, newJob):
+        def createJobs(self, newJobs):
             """
-            Create a new job with the Toil job ID. Implementation-specific; called
-            by AbstractGridEngineWorker.run()
+            Submit waiting jobs to the batch system as long as there are cores left. Waiting jobs
+            with the same requirements are submitted together as a single job array if the batch
+            system supports job arrays. Called by AbstractGridEngineWorker.run()
 
-            :param string newJob: Toil job ID
+            :param list newJobs: tuples of Toil job ID, cores, memory and command of the jobs
+                   issued since the last call
             """
             activity = False
-            # Load new job id if present:
-            if newJob is not None:
-                self.waitingJobs.append(newJob)
+            self.waitingJobs.extend(newJobs)
             # Launch jobs as necessary:
             while (len(self.waitingJobs) > 0
                    and sum(self.allocatedCpus.values()) < int(self.boss.maxCores)):
                 activity = True
-                jobID, cpu, memory, command = self.waitingJobs.pop(0)
+                jobs = self._takeWaitingJobs()
+                if len(jobs) > 1:
+                    self._submitArray(jobs)
+                else:
+                    jobID, cpu, memory, command = jobs[0]
+
+                    # prepare job submission command
+                    subLine = self.prepareSubmission(cpu, memory, jobID, command)
+                    logger.debug("Running %r", subLine)
+
+                    # submit job and get batch system ID
+                    batchJobID = self.submitJob(subLine)
+                    logger.debug("Submitted job %s", str(batchJobID))
+                    self._addRunningJob(jobID, cpu, batchJobID, None)
+            if activity:
+                # Jobs just submitted may be short, so poll for their status soon
+                self.pollInterval = self.minPollInterval
+            return activity
 
-                # prepare job submission command
-                subLine = self.prepareSubmission(cpu, memory, jobID, command)
-                logger.debug("Running %r", subLine)
+        def _takeWaitingJobs(self):
+            """
+            Removes the first waiting job from the list of waiting jobs along with as many later
+            ones of the same requirements as the free cores and the maximum size of a job array
+            allow.
 
-                # submit job and get batch system ID
+            :rtype: list
+            """
+            first = self.waitingJobs.pop(0)
+            jobs = [first]
+            if self.arrayTaskIDVariable is not None:
+                freeCpus = int(self.boss.maxCores) - sum(self.allocatedCpus.values()) - first[1]
+                remainingJobs = []
+                for job in self.waitingJobs:
+                    if (job[1:3] == first[1:3] and job[1] <= freeCpus
+                            and len(jobs) < self.maxArraySize):
+                        jobs.append(job)
+                        freeCpus -= job[1]
+                    else:
+                        remainingJobs.append(job)
+                self.waitingJobs = remainingJobs
+            return jobs
+
+        def _submitArray(self, jobs):
+            """
+            Submits the given jobs, which must have the same requirements, as one job array.
+            Task i of the array runs the command of the i-th job, counting from 1.
+            """
+            _, cpu, memory, _ = jobs[0]
+            jobIDs = [jobID for jobID, _, _, _ in jobs]
+            scriptPath = self._writeArrayScript([command for _, _, _, command in jobs])
+            try:
+                subLine = self.prepareArraySubmission(cpu, memory, jobIDs, scriptPath)
+                logger.debug("Running %r", subLine)
                 batchJobID = self.submitJob(subLine)
-                logger.debug("Submitted job %s", str(batchJobID))
-
-                # Store dict for mapping Toil job ID to batch job ID
-                # TODO: Note that this currently stores a tuple of (batch system
-                # ID, Task), but the second value is None by default and doesn't
-                # seem to be used
-                self.batchJobIDs[jobID] = (batchJobID, None)
-
-                # Add to queue of running jobs
-                self.runningJobs.add(jobID)
+            finally:
+                # The batch system keeps its own copy of the script once it is submitted
+                os.remove(scriptPath)
+            logger.debug("Submitted job array %s with %i tasks", str(batchJobID), len(jobs))
+            for task, jobID in enumerate(jobIDs, 1):
+                self._addRunningJob(jobID, cpu, batchJobID, task)
+
+        def _writeArrayScript(self, commands):
+            """
+            Writes a shell script that runs the command with the index of the array task
+            running the script, counting from 1.
 
-                # Add to allocated resources
-                self.allocatedCpus[jobID] = cpu
-            return activity
+            :return: the path to the script
+            :rtype: str
+            """
+            fd, scriptPath = tempfile.mkstemp(prefix='toil_array_', suffix='.sh')
+            with os.fdopen(fd, 'w') as script:
+                script.write('#!/bin/sh\n')
+                script.write('case "$%s" in\n' % self.arrayTaskIDVariable)
+                for task, command in enumerate(commands, 1):
+                    script.write('%i) %s ;;\n' % (task, command))
+                script.write('*) echo "Unknown array task: $%s" >&2; exit 1 ;;\n'
+                             % self.arrayTaskIDVariable)
+                script.write('esac\n')
+            return scriptPath
+
+        def _addRunningJob(self, jobID, cpu, batchJobID, task):
+            # Store dict for mapping Toil job ID to batch job ID and, for jobs submitted as part
+            # of a job array, the index of the task in the array
+            self.batchJobIDs[jobID] = (batchJobID, task)
+
+            # Add to queue of running jobs
+            self.runningJobs.add(jobID)
+
+            # Add to allocated resources
+            self.allocatedCpus[jobID] = cpu
 
         def killJobs(self):
             """
@@ -158,38 +248,49 @@ class AbstractGridEngineBatchSystem(BatchSystemSupport):
                     # code is redundant w/ other implementations
                     self.killJob(jobID)
                 else:
-                    if jobID in self.waitingJobs:
-                        self.waitingJobs.remove(jobID)
+                    self.waitingJobs = [job for job in self.waitingJobs if job[0] != jobID]
                     self.killedJobsQueue.put(jobID)
                     killList.remove(jobID)
 
             # Wait to confirm the kill
             while killList:
+                exitCodes = self.getJobExitCodes([self.getBatchSystemID(jobID)
+                                                  for jobID in killList])
                 for jobID in list(killList):
-                    batchJobID = self.getBatchSystemID(jobID)
-                    if self.getJobExitCode(batchJobID) is not None:
+                    if exitCodes.get(self.getBatchSystemID(jobID)) is not None:
                         logger.debug('Adding jobID %s to killedJobsQueue', jobID)
                         self.killedJobsQueue.put(jobID)
                         killList.remove(jobID)
                         self.forgetJob(jobID)
                 if len(killList) > 0:
-                    logger.warn("Some jobs weren't killed, trying again in %is.", self.boss.sleepSeconds())
-                    time.sleep(self.boss.sleepSeconds())
+                    logger.warn("Some jobs weren't killed, trying again in %is.", self.minPollInterval)
+                    time.sleep(self.minPollInterval)
 
             return True
 
         def checkOnJobs(self):
             """
-            Check and update status of all running jobs.
+            Check and update status of all running jobs, with a single query of the batch system,
+            unless the current poll interval has not yet passed since the last check.
             """
+            if not self.runningJobs or time.time() - self.lastPollTime < self.pollInterval:
+                return False
+            self.lastPollTime = time.time()
             activity = False
-            for jobID in list(self.runningJobs):
-                batchJobID = self.getBatchSystemID(jobID)
-                status = self.getJobExitCode(batchJobID)
+            batchJobIDs = dict((self.getBatchSystemID(jobID), jobID) for jobID in self.runningJobs)
+            exitCodes = self.getJobExitCodes(list(batchJobIDs))
+            for batchJobID, jobID in iteritems(batchJobIDs):
+                status = exitCodes.get(batchJobID)
                 if status is not None:
                     activity = True
                     self.updatedJobsQueue.put((jobID, status))
+                    self.boss._notifyUpdateListener()
                     self.forgetJob(jobID)
+            if activity:
+                self.pollInterval = self.minPollInterval
+            else:
+                self.pollInterval = min(self.pollInterval * self.pollBackoffFactor,
+                                        self.maxPollInterval)
             return activity
 
         def run(self):
@@ -199,19 +300,28 @@ class AbstractGridEngineBatchSystem(BatchSystemSupport):
 
             while True:
                 activity = False
-                newJob = None
-                if not self.newJobsQueue.empty():
-                    activity = True
+                # Take all jobs issued so far, such that jobs issued together can be submitted
+                # together
+                newJobs = []
+                shutdown = False
+                while not self.newJobsQueue.empty():
                     newJob = self.newJobsQueue.get()
                     if newJob is None:
-                        logger.debug('Received queue sentinel.')
+                        shutdown = True
                         break
+                    newJobs.append(newJob)
+                if shutdown:
+                    logger.debug('Received queue sentinel.')
+                    break
+                activity |= bool(newJobs)
                 activity |= self.killJobs()
-                activity |= self.createJobs(newJob)
+                activity |= self.createJobs(newJobs)
                 activity |= self.checkOnJobs()
                 if not activity:
-                    logger.debug('No activity, sleeping for %is', self.boss.sleepSeconds())
-                    time.sleep(self.boss.sleepSeconds())
+                    # Wake up frequently to submit new jobs and kill jobs; checkOnJobs() only
+                    # polls the batch system once the poll interval has passed
+                    logger.debug('No activity, sleeping for %is', self.minPollInterval)
+                    time.sleep(self.minPollInterval)
 
         @abstractmethod
         def prepareSubmission(self, cpu, memory, jobID, command):
@@ -228,6 +338,22 @@ class AbstractGridEngineBatchSystem(BatchSystemSupport):
             """
             raise NotImplementedError()
 
+        def prepareArraySubmission(self, cpu, memory, jobIDs, scriptPath):
+            """
+            Preparation in putting together a command-line string for submitting a job array
+            (via submitJob()) whose tasks each run the given script. Only called if
+            arrayTaskIDVariable is set.
+
+            :param: string cpu    : cores needed by each task
+            :param: string memory : memory needed by each task
+            :param: list jobIDs   : Toil job IDs of the tasks, the i-th one is task i + 1
+            :param: string scriptPath: the shell script to be run by every task of the array.
+                    It is deleted as soon as the array is submitted.
+
+            :rtype: list
+            """
+            raise NotImplementedError()
+
         @abstractmethod
         def submitJob(self, subLine):
             """
@@ -265,12 +391,25 @@ class AbstractGridEngineBatchSystem(BatchSystemSupport):
         def getJobExitCode(self, batchJobID):
             """
             Returns job exit code. Implementation-specific; called by
-            AbstractGridEngineWorker.checkOnJobs()
+            AbstractGridEngineWorker.getJobExitCodes()
 
             :param string batchjobID: batch system job ID
             """
             raise NotImplementedError()
 
+        def getJobExitCodes(self, batchJobIDs):
+            """
+            Returns the exit codes of the given jobs. Called by
+            AbstractGridEngineWorker.checkOnJobs() and AbstractGridEngineWorker.killJobs().
+            This implementation calls getJobExitCode() for each job. Implementations should
+            override it to get the status of all jobs with a single query of the batch system.
+
+            :param: list batchJobIDs: batch system job IDs
+
+            :rtype: dict: the exit code of each job, or None for jobs that have not finished
+            """
+            return dict((batchJobID, self.getJobExitCode(batchJobID)) for batchJobID in batchJobIDs)
+
 
     def __init__(self, config, maxCores, maxMemory, maxDisk):
         super(AbstractGridEngineBatchSystem, self).__init__(config, maxCores, maxMemory, maxDisk)
@@ -335,10 +474,7 @@ class AbstractGridEngineBatchSystem(BatchSystemSupport):
             if killedJobId in self.currentJobs:
                 self.currentJobs.remove(killedJobId)
             if jobIDs:
-                sleep = self.sleepSeconds()
-                logger.debug('Some kills (%s) still pending, sleeping %is', len(jobIDs),
-                             sleep)
-                time.sleep(sleep)
+                logger.debug('Some kills (%s) still pending', len(jobIDs))
 
     def getIssuedBatchJobIDs(self):
         """
@@ -374,17 +510,19 @@ class AbstractGridEngineBatchSystem(BatchSystemSupport):
             raise ValueError(type(self).__name__ + " does not support commata in environment variable values")
         return super(AbstractGridEngineBatchSystem,self).setEnv(name, value)
 
-    @classmethod
     def getWaitDuration(self):
-        return 5
+        """
+        The current interval between two status queries of the worker, which grows while no
+        jobs finish.
+        """
+        return self.worker.pollInterval
 
     @classmethod
     def getRescueBatchJobFrequency(cls):
         return 30 * 60 # Half an hour
 
-    @classmethod
-    def sleepSeconds(cls):
-        return 1
+    def sleepSeconds(self):
+        return self.worker.pollInterval
 
     @abstractclassmethod
     def obtainSystemConstants(cls):
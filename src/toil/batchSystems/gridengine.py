@@ -33,22 +33,26 @@ class GridEngineBatchSystem(AbstractGridEngineBatchSystem):
 
     class Worker(AbstractGridEngineBatchSystem.Worker):
 
+        arrayTaskIDVariable = 'SGE_TASK_ID'
+
         """
         Grid Engine-specific AbstractGridEngineWorker methods
         """
         def getRunningJobIDs(self):
             times = {}
-            currentjobs = dict((str(self.batchJobIDs[x][0]), x) for x in self.runningJobs)
+            currentjobs = dict((self.getBatchSystemID(x), x) for x in self.runningJobs)
             process = subprocess.Popen(["qstat"], stdout=subprocess.PIPE)
             stdout, stderr = process.communicate()
 
             for currline in stdout.split('\n'):
                 items = currline.strip().split()
                 if items:
-                    if items[0] in currentjobs and items[4] == 'r':
+                    # Running tasks of job arrays have their index in the last column
+                    batchJobID = items[0] if len(items) < 10 else items[0] + '.' + items[9]
+                    if batchJobID in currentjobs and items[4] == 'r':
                         jobstart = " ".join(items[5:7])
                         jobstart = time.mktime(time.strptime(jobstart, "%m/%d/%Y %H:%M:%S"))
-                        times[currentjobs[items[0]]] = time.time() - jobstart
+                        times[currentjobs[batchJobID]] = time.time() - jobstart
 
             return times
 
@@ -58,35 +62,90 @@ class GridEngineBatchSystem(AbstractGridEngineBatchSystem):
         def prepareSubmission(self, cpu, memory, jobID, command):
             return self.prepareQsub(cpu, memory, jobID) + [command]
 
+        def prepareArraySubmission(self, cpu, memory, jobIDs, scriptPath):
+            qsubline = self.prepareQsub(cpu, memory, jobIDs[0])
+            # Submit the script rather than a command, such that qsub keeps a copy of it
+            qsubline[qsubline.index('-b') + 1] = 'n'
+            # Grid Engine ignores the shebang unless the queue is configured otherwise, and runs
+            # the script with the shell of the queue, csh by default
+            return qsubline + ['-S', '/bin/sh', '-t', '1-{}'.format(len(jobIDs)), scriptPath]
+
         def submitJob(self, subLine):
             process = subprocess.Popen(subLine, stdout=subprocess.PIPE)
             result = int(process.stdout.readline().strip().split('.')[0])
             return result
 
         def getJobExitCode(self, sgeJobID):
-            # the task is set as part of the job ID if using getBatchSystemID()
-            job, task = (sgeJobID, None)
-            if '.' in sgeJobID:
-                job, task = sgeJobID.split('.', 1)
+            return self.getJobExitCodes([sgeJobID])[sgeJobID]
+
+        def getJobExitCodes(self, sgeJobIDs):
+            # A single qstat lists the jobs that are still queued or running. The others have
+            # finished, and a single qacct per job, or per job array, gets their exit codes.
+            exitCodes = dict.fromkeys(sgeJobIDs)
+            queuedJobIDs = self._getQueuedJobIDs()
+            if queuedJobIDs is None:
+                # The status of the jobs is unknown, try again on the next poll
+                return exitCodes
+            finishedJobIDs = dict()
+            for sgeJobID in sgeJobIDs:
+                if sgeJobID not in queuedJobIDs:
+                    # the task is set as part of the job ID if using getBatchSystemID()
+                    job = sgeJobID.split('.', 1)[0]
+                    finishedJobIDs.setdefault(job, []).append(sgeJobID)
+            for job, jobIDs in iteritems(finishedJobIDs):
+                accountedExitCodes = self._getAccountedExitCodes(job)
+                for sgeJobID in jobIDs:
+                    exitCodes[sgeJobID] = accountedExitCodes.get(sgeJobID)
+            return exitCodes
 
+        """
+        Implementation-specific helper methods
+        """
+        def _getQueuedJobIDs(self):
+            """
+            :return: the IDs of the jobs that are pending or running, with the task of each task
+                     of a job array listed as "job.task", or None if qstat failed
+            :rtype: set
+            """
+            queuedJobIDs = set()
+            # -g d lists each task of a job array on a line of its own, with the task last
+            try:
+                stdout = subprocess.check_output(['qstat', '-g', 'd'])
+            except (subprocess.CalledProcessError, OSError) as e:
+                # An overloaded qmaster fails every now and then
+                logger.warn("Failed to get the status of the jobs from qstat: %s", e)
+                return None
+            for line in stdout.split('\n')[2:]:
+                items = line.strip().split()
+                if items:
+                    queuedJobIDs.add(items[0])
+                    queuedJobIDs.add(items[0] + '.' + items[-1])
+            return queuedJobIDs
+
+        def _getAccountedExitCodes(self, job):
+            """
+            :return: the exit code of the given job, or of each finished task if it is a job
+                     array, as recorded by the accounting of Grid Engine
+            :rtype: dict
+            """
             args = ["qacct", "-j", str(job)]
-
-            if task is not None:
-                args.extend(["-t", str(task)])
-
             logger.debug("Running %r", args)
             process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            exitCodes = dict()
+            sgeJobID, failed = job, False
             for line in process.stdout:
-                if line.startswith("failed") and int(line.split()[1]) == 1:
-                    return 1
+                if line.startswith("taskid"):
+                    task = line.split()[1]
+                    sgeJobID = job if task == 'undefined' else job + '.' + task
+                elif line.startswith("failed"):
+                    failed = int(line.split()[1]) == 1
                 elif line.startswith("exit_status"):
-                    logger.debug('Exit Status: %r', line.split()[1])
-                    return int(line.split()[1])
-            return None
+                    logger.debug('Exit Status of %s: %r', sgeJobID, line.split()[1])
+                    exitCodes[sgeJobID] = 1 if failed else int(line.split()[1])
+                    sgeJobID, failed = job, False
+            process.wait()
+            return exitCodes
 
-        """
-        Implementation-specific helper methods
-        """
         def prepareQsub(self, cpu, mem, jobID):
             qsubline = ['qsub', '-V', '-b', 'y', '-terse', '-j', 'y', '-cwd',
                         '-N', 'toil_job_' + str(jobID)]
@@ -118,10 +177,6 @@ class GridEngineBatchSystem(AbstractGridEngineBatchSystem):
     The interface for SGE aka Sun GridEngine.
     """
 
-    @classmethod
-    def getWaitDuration(cls):
-        return 0.0
-
     @classmethod
     def obtainSystemConstants(cls):
         lines = filter(None, map(str.strip, subprocess.check_output(["qhost"]).split('\n')))
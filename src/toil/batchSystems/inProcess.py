@@ -0,0 +1,92 @@
+# Copyright (C) 2015-2016 Regents of the University of California
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import absolute_import
+import logging
+import os
+import threading
+import time
+
+from toil.batchSystems.singleMachine import SingleMachineBatchSystem
+from toil.batchSystems.workerPool import isWorkerCommand
+from toil.common import Toil
+from toil.worker import workerScript
+
+log = logging.getLogger(__name__)
+
+
+class InProcessBatchSystem(SingleMachineBatchSystem):
+    """
+    Like the single-machine batch system but runs the workers in the threads of the leader
+    process instead of spawning a new process for each of them. Without the cost of starting a
+    worker process, workflows of many small jobs run considerably faster and the time spent by
+    the leader and the job store stands out when profiling.
+
+    All jobs share the working directory, the environment and the standard output and error of
+    the leader process, and none of them can be killed. Killing a worker that already runs waits
+    for it to finish and discards its result. Commands other than those of Toil workers are run
+    in a new process, just like the single-machine batch system does it.
+
+    Caching is always disabled for the workers. The caching file store tells whether a job died
+    by the ID of its process, which all workers share with the leader, so it would never reclaim
+    the space in the cache held by a job that crashed.
+    """
+
+    def __init__(self, config, maxCores, maxMemory, maxDisk):
+        super(InProcessBatchSystem, self).__init__(config, maxCores, maxMemory, maxDisk)
+        # Holds the job stores used by the current worker thread, by locator
+        self.localJobStores = threading.local()
+
+    def _runJob(self, jobCommand, jobID, environment):
+        if not isWorkerCommand(jobCommand):
+            return super(InProcessBatchSystem, self)._runJob(jobCommand, jobID, environment)
+        jobStoreLocator, jobStoreID = jobCommand.split()[1:]
+        info = self.runningJobs[jobID]
+        if info.killIntended:
+            return
+        startTime = time.time()
+        statusCode = 1
+        try:
+            jobStore = self._getJobStore(jobStoreLocator)
+            workerScript(jobStore, jobStore.config, jobStoreID, redirectOutputToLogFile=False)
+            statusCode = 0
+        except:
+            log.exception('The worker for job %s failed.', self.jobs[jobID])
+        self._reportJob(jobID, info, statusCode, time.time() - startTime)
+
+    def _getJobStore(self, jobStoreLocator):
+        """
+        Returns the job store at the given location for use by the current thread. Job stores
+        aren't necessarily thread-safe so each worker thread gets its own instance.
+
+        :rtype: toil.jobStores.abstractJobStore.AbstractJobStore
+        """
+        try:
+            jobStores = self.localJobStores.jobStores
+        except AttributeError:
+            jobStores = self.localJobStores.jobStores = {}
+        try:
+            return jobStores[jobStoreLocator]
+        except KeyError:
+            jobStore = jobStores[jobStoreLocator] = Toil.resumeJobStore(jobStoreLocator)
+            jobStore.config.disableCaching = True
+            return jobStore
+
+    def setEnv(self, name, value=None):
+        """
+        Sets the environment variable in the leader process, in which the workers run, in addition
+        to the environment of the jobs run in a new process.
+        """
+        super(InProcessBatchSystem, self).setEnv(name, value)
+        os.environ[name] = self.environment[name]
@@ -113,6 +113,36 @@ def getjobexitcode(lsfJobID):
         logger.debug("Cant determine exit code for job or job still running: " + str(job))
         return None
 
+def getjobexitcodes(lsfJobIDs):
+        """
+        Gets the exit codes of the given jobs with a single bjobs query. Jobs bjobs no longer
+        knows about are looked up with getjobexitcode(), which falls back to bacct.
+
+        :return: the exit code of each job, or None if it has not finished
+        :rtype: dict
+        """
+        jobs = dict((str(job), (job, task)) for job, task in lsfJobIDs)
+        args = ["bjobs", "-a", "-w"] + list(jobs)
+        logger.debug("Checking job exit codes for %i jobs via bjobs", len(jobs))
+        process = subprocess.Popen(args, stdout = subprocess.PIPE, stderr = subprocess.STDOUT)
+        exitCodes = dict()
+        for line in process.stdout:
+            items = line.strip().split()
+            if len(items) > 2 and items[0] in jobs:
+                if items[2] == 'DONE':
+                    logger.debug("bjobs detected job completed for job: " + items[0])
+                    exitCodes[jobs[items[0]]] = 0
+                elif items[2] == 'EXIT':
+                    logger.debug("bjobs detected job failed for job: " + items[0])
+                    exitCodes[jobs[items[0]]] = 1
+                else:
+                    exitCodes[jobs[items[0]]] = None
+        process.wait()
+        for lsfJobID in lsfJobIDs:
+            if lsfJobID not in exitCodes:
+                exitCodes[lsfJobID] = getjobexitcode(lsfJobID)
+        return exitCodes
+
 class Worker(Thread):
     def __init__(self, newJobsQueue, updatedJobsQueue, boss):
         Thread.__init__(self)
@@ -137,10 +167,11 @@ class Worker(Thread):
                 self.runningjobs.add((lsfJobID, None))
 
             # Test known job list
-            for lsfJobID in list(self.runningjobs):
-                exit = getjobexitcode(lsfJobID)
+            exitCodes = getjobexitcodes(list(self.runningjobs)) if self.runningjobs else {}
+            for lsfJobID, exit in exitCodes.items():
                 if exit is not None:
                     self.updatedJobsQueue.put((lsfJobID, exit))
+                    self.boss._notifyUpdateListener()
                     self.runningjobs.remove(lsfJobID)
 
             time.sleep(10)
@@ -150,6 +181,8 @@ class LSFBatchSystem(BatchSystemSupport):
     The interface for running jobs on lsf, runs all the jobs you give it as they come in,
     but in parallel.
     """
+    notifiesUpdateListener = True
+
     @classmethod
     def supportsWorkerCleanup(cls):
         return False
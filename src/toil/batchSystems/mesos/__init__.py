@@ -17,6 +17,7 @@ from Queue import Queue
 from collections import namedtuple
 from functools import total_ordering
 from bisect import bisect
+from itertools import islice
 from threading import Lock
 
 TaskData = namedtuple('TaskData', (
@@ -36,6 +37,10 @@ TaskData = namedtuple('TaskData', (
 
 class JobQueue(object):
 
+    # The number of jobs at the front of the queue of a job type that are considered when looking
+    # for the job that best fits a node, which bounds the cost of doing so
+    placementWindow = 100
+
     def __init__(self):
         # mapping of jobTypes to queues of jobs of that type
         self.queues = {}
@@ -58,9 +63,36 @@ class JobQueue(object):
         with self.jobLock:
             return [job.jobID for queue in self.queues.values() for job in list(queue.queue)]
 
-    def nextJobOfType(self, jobType):
+    def firstJobsOfType(self, jobType):
+        """
+        :return: The jobs of the given type that nextJobOfType() chooses from
+        """
+        with self.jobLock:
+            return list(islice(self.queues.get(jobType, Queue()).queue, self.placementWindow))
+
+    def nextJobOfType(self, jobType, score=None):
+        """
+        Removes and returns a job of the given type, the one that was inserted first unless a
+        score function is given.
+
+        :param score: A function that rates how well a job fits the node it is about to be
+               placed on. Of the first jobs in the queue, the one with the highest positive score
+               is returned instead of the first job.
+        """
         with self.jobLock:
-            job = self.queues[jobType].get(block=False)
+            queue = self.queues[jobType]
+            bestIndex, bestScore = 0, 0
+            if score is not None:
+                for index, job in enumerate(islice(queue.queue, self.placementWindow)):
+                    jobScore = score(job)
+                    if jobScore > bestScore:
+                        bestIndex, bestScore = index, jobScore
+            if bestIndex == 0:
+                job = queue.get(block=False)
+            else:
+                # The queue is only ever accessed with the job lock held
+                job = queue.queue[bestIndex]
+                del queue.queue[bestIndex]
             if self.queues[jobType].empty():
                 del self.queues[jobType]
                 self.sortedTypes.remove(jobType)
@@ -156,5 +188,7 @@ ToilJob = namedtuple('ToilJob', (
     'userScript',
     # A dictionary with additional environment variables to be set on the worker process
     'environment',
+    # The IDs of the files the job declared as its inputs, see JobNode.inputs
+    'inputs',
     # A named tuple containing all the required info for cleaning up the worker node
     'workerCleanupInfo'))
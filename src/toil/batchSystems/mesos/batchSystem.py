@@ -41,6 +41,7 @@ from toil.batchSystems.abstractBatchSystem import (AbstractScalableBatchSystem,
                                                    BatchSystemSupport,
                                                    NodeInfo)
 from toil.batchSystems.mesos import ToilJob, ResourceRequirement, TaskData, JobQueue
+from toil.lib.bloomFilter import BloomFilter
 
 log = logging.getLogger(__name__)
 
@@ -59,6 +60,8 @@ class MesosBatchSystem(BatchSystemSupport,
     node.
     """
 
+    notifiesUpdateListener = True
+
     @classmethod
     def supportsHotDeployment(cls):
         return True
@@ -74,6 +77,9 @@ class MesosBatchSystem(BatchSystemSupport,
             self.slaveId = slaveId
             self.nodeInfo = nodeInfo
             self.lastSeen = lastSeen
+            # A BloomFilter of the IDs of the files in the node's cache, as last reported by the
+            # executor, or None if it hasn't reported any
+            self.cachedFiles = None
 
     def __init__(self, config, maxCores, maxMemory, maxDisk):
         super(MesosBatchSystem, self).__init__(config, maxCores, maxMemory, maxDisk)
@@ -168,6 +174,7 @@ class MesosBatchSystem(BatchSystemSupport,
                       command=jobNode.command,
                       userScript=self.userScript,
                       environment=self.environment.copy(),
+                      inputs=jobNode.inputs,
                       workerCleanupInfo=self.workerCleanupInfo)
         jobType = job.resources
         log.debug("Queueing the job command: %s with job id: %s ...", jobNode.command, str(jobID))
@@ -340,11 +347,38 @@ class MesosBatchSystem(BatchSystemSupport,
         return cores, memory, disk, preemptable
 
     def _prepareToRun(self, jobType, offer):
-        # Get the first element to insure FIFO
-        job = self.jobQueues.nextJobOfType(jobType)
+        # Get the first element to insure FIFO, unless a job has its inputs cached on the node
+        job = self.jobQueues.nextJobOfType(jobType, self._cachedInputCounter(offer))
         task = self._newMesosTask(job, offer)
         return task
 
+    def _cachedInputCounter(self, offer):
+        """
+        :return: A function that returns the number of inputs of a job that are probably in the
+                 cache of the offered node, or None if the node didn't report its cache
+        """
+        executor = self.executors.get(socket.gethostbyname(offer.hostname))
+        cachedFiles = None if executor is None else executor.cachedFiles
+        if cachedFiles is None:
+            return None
+        return lambda job: sum(1 for fileStoreID in job.inputs if fileStoreID in cachedFiles)
+
+    def _sortOffersByCachedInputs(self, offers, jobTypes):
+        """
+        Sorts the offers such that the nodes that have the inputs of more of the queued jobs in
+        their cache get to run jobs first.
+        """
+        jobs = [job for jobType in jobTypes for job in self.jobQueues.firstJobsOfType(jobType)
+                if job.inputs]
+        if not jobs:
+            return offers
+        scores = {}
+        for offer in offers:
+            countCachedInputs = self._cachedInputCounter(offer)
+            scores[offer.id.value] = (0 if countCachedInputs is None else
+                                      sum(countCachedInputs(job) for job in jobs))
+        return sorted(offers, key=lambda offer: -scores[offer.id.value])
+
     def _updateStateToRunning(self, offer, runnableTasks):
         for task in runnableTasks:
             resourceKey = int(task.task_id.value)
@@ -381,7 +415,7 @@ class MesosBatchSystem(BatchSystemSupport,
 
         unableToRun = True
         # Right now, gives priority to largest jobs
-        for offer in offers:
+        for offer in self._sortOffersByCachedInputs(offers, jobTypes):
             runnableTasks = []
             # TODO: In an offer, can there ever be more than one resource with the same name?
             offerCores, offerMemory, offerDisk, offerPreemptable = self._parseOffer(offer)
@@ -527,6 +561,7 @@ class MesosBatchSystem(BatchSystemSupport,
             else:
                 self.killedJobIds.add(jobID)
             self.updatedJobsQueue.put((jobID, _exitStatus, wallTime))
+            self._notifyUpdateListener()
             slaveIP = None
             try:
                 slaveIP = self.runningJobMap[jobID].slaveIP
@@ -579,6 +614,8 @@ class MesosBatchSystem(BatchSystemSupport,
                 requestedMemory = sum(taskData.memory for taskData in resources)
                 executor.nodeInfo = NodeInfo(requestedCores=requestedCores, requestedMemory=requestedMemory, **v)
                 self.executors[nodeAddress] = executor
+            elif k == 'cachedFiles':
+                executor.cachedFiles = BloomFilter.fromString(v)
             else:
                 raise RuntimeError("Unknown message field '%s'." % k)
 
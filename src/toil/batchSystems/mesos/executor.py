@@ -32,6 +32,8 @@ from mesos.interface import mesos_pb2
 import mesos.native
 from struct import pack
 from toil.batchSystems.abstractBatchSystem import BatchSystemSupport
+from toil.common import Toil
+from toil.fileStore import summarizeFileStoreCache
 from toil.resource import Resource
 
 log = logging.getLogger(__name__)
@@ -120,10 +122,32 @@ class MesosExecutor(mesos.interface.Executor):
                                         coresTotal=psutil.cpu_count(),
                                         memoryTotal=psutil.virtual_memory().total,
                                         workers=len(self.runningTasks))
+                cacheSummary = self._summarizeCache()
+                if cacheSummary is not None:
+                    cachedFiles, message.nodeInfo['cacheHits'], \
+                        message.nodeInfo['cacheMisses'] = cacheSummary
+                    # Lets the scheduler place jobs on the node that has their inputs cached
+                    message.cachedFiles = cachedFiles.toString()
             driver.sendFrameworkMessage(repr(message))
             # Prevent workers launched together from repeatedly hitting the leader at the same time
             sleep(random.randint(45, 75))
 
+    def _summarizeCache(self):
+        """
+        :return: The summary of the file store cache on this node, see summarizeFileStoreCache(),
+                 or None if there is none or it can't be read
+        """
+        # The workflow is only known once the first task was launched
+        info = self.workerCleanupInfo
+        if info is None:
+            return None
+        try:
+            return summarizeFileStoreCache(Toil.getWorkflowDir(info.workflowID, info.workDir),
+                                           info.workflowID)
+        except Exception:
+            log.warning('Failed to summarize the file store cache.', exc_info=True)
+            return None
+
     def launchTask(self, driver, task):
         """
         Invoked by SchedulerDriver when a Mesos task should be launched by this executor
@@ -29,11 +29,17 @@ def _parasolOptions(addOptionFn):
 def _singleMachineOptions(addOptionFn):
     addOptionFn("--scale", dest="scale", default=None,
                 help=("A scaling factor to change the value of all submitted tasks's submitted cores. "
-                      "Used in singleMachine batch system. default=%s" % 1))
+                      "Used in the singleMachine and inProcess batch systems. default=%s" % 1))
     addOptionFn("--linkImports", dest="linkImports", default=False, action='store_true',
                 help=("When using Toil's importFile function for staging, input files are copied to the job store. "
                       "Specifying this option saves space by hard-linking imported files. As long as caching is "
                       "enabled Toil will protect the file automatically by changing the permissions to read-only."))
+    addOptionFn("--workerPoolSize", dest="workerPoolSize", default=None,
+                help=("The number of long-lived processes the singleMachine batch system keeps for "
+                      "running Toil workers. Each worker is forked from one of them, with Toil and "
+                      "the modules of earlier workers already imported, instead of being started "
+                      "as a new process. This saves the start-up time of each job. 0 disables "
+                      "the pool. default=%s" % 0))
 
 
 def _mesosOptions(addOptionFn):
@@ -87,6 +93,7 @@ def setDefaultOptions(config):
     # single machine
     config.scale = 1
     config.linkImports = False
+    config.workerPoolSize = 0
 
     # mesos
     config.mesosMasterAddress = 'localhost:5050'
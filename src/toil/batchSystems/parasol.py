@@ -40,6 +40,8 @@ class ParasolBatchSystem(BatchSystemSupport):
     The interface for Parasol.
     """
 
+    notifiesUpdateListener = True
+
     @classmethod
     def supportsWorkerCleanup(cls):
         return False
@@ -344,6 +346,7 @@ class ParasolBatchSystem(BatchSystemSupport):
                         else:
                             wallTime = float(endTime - startTime)
                         self.updatedJobsQueue.put((jobId, status, wallTime))
+                        self._notifyUpdateListener()
                 time.sleep(1)
         except:
             logger.warn("Error occurred while parsing parasol results files.")
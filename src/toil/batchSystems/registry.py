@@ -28,6 +28,10 @@ def _singleMachineBatchSystemFactory():
     from toil.batchSystems.singleMachine import SingleMachineBatchSystem
     return SingleMachineBatchSystem
 
+def _inProcessBatchSystemFactory():
+    from toil.batchSystems.inProcess import InProcessBatchSystem
+    return InProcessBatchSystem
+
 def _mesosBatchSystemFactory():
     from toil.batchSystems.mesos.batchSystem import MesosBatchSystem
     return MesosBatchSystem
@@ -41,6 +45,8 @@ _DEFAULT_REGISTRY = {
     'parasol'        : _parasolBatchSystemFactory,
     'singleMachine'  : _singleMachineBatchSystemFactory,
     'single_machine' : _singleMachineBatchSystemFactory,
+    'inProcess'      : _inProcessBatchSystemFactory,
+    'in_process'     : _inProcessBatchSystemFactory,
     'gridEngine'     : _gridengineBatchSystemFactory,
     'gridengine'     : _gridengineBatchSystemFactory,
     'lsf'            : _lsfBatchSystemFactory,
@@ -54,6 +60,7 @@ _DEFAULT_REGISTRY = {
 _UNIQUE_NAME = {
     'parasol',
     'singleMachine',
+    'inProcess',
     'gridEngine',
     'LSF',
     'Mesos',
@@ -13,22 +13,26 @@
 # limitations under the License.
 
 from __future__ import absolute_import
-from contextlib import contextmanager
+from collections import deque, namedtuple
+import errno
 import logging
 import multiprocessing
 import os
+import signal
 import subprocess
 import time
 import math
 from threading import Thread
-from threading import Lock, Condition
+from threading import Lock, Condition, Event
 
 # Python 3 compatibility imports
+from six import itervalues
 from six.moves.queue import Empty, Queue
 from six.moves import xrange
 
 import toil
 from toil.batchSystems.abstractBatchSystem import BatchSystemSupport, InsufficientSystemResources
+from toil.batchSystems.workerPool import WorkerPool, isWorkerCommand
 
 log = logging.getLogger(__name__)
 
@@ -39,6 +43,8 @@ class SingleMachineBatchSystem(BatchSystemSupport):
     come in, but in parallel.
     """
 
+    notifiesUpdateListener = True
+
     @classmethod
     def supportsHotDeployment(cls):
         return False
@@ -58,6 +64,12 @@ class SingleMachineBatchSystem(BatchSystemSupport):
     """
     physicalMemory = toil.physicalMemory()
 
+    maxBackfillDelay = 600
+    """
+    The number of seconds the oldest waiting job may be overtaken by jobs that fit into the free
+    resources when it doesn't. After that, no other job is started until the oldest one fits.
+    """
+
     def __init__(self, config, maxCores, maxMemory, maxDisk):
         if maxCores > self.numCores:
             log.warn('Limiting maxCores to CPU count of system (%i).', self.numCores)
@@ -87,11 +99,11 @@ class SingleMachineBatchSystem(BatchSystemSupport):
         """
         :type: dict[str,toil.job.JobNode]
         """
-        # A queue of jobs waiting to be executed. Consumed by the workers.
+        # A queue of jobs whose resources were acquired by the scheduler. Consumed by the workers.
         self.inputQueue = Queue()
         # A queue of finished jobs. Produced by the workers.
         self.outputQueue = Queue()
-        # A dictionary mapping IDs of currently running jobs to their Info objects
+        # A dictionary mapping IDs of jobs whose resources were acquired to their Info objects
         self.runningJobs = {}
         """
         :type: dict[str,Info]
@@ -101,19 +113,38 @@ class SingleMachineBatchSystem(BatchSystemSupport):
         """
         :type list[Thread]
         """
-        # Variables involved with non-blocking resource acquisition
-        self.acquisitionTimeout = 5
-        self.acquisitionRetryDelay = 10
-        self.aquisitionCondition = Condition()
+        # Guards the resource pools and the waiting jobs. Notified whenever a job finishes.
+        self.schedulerCondition = Condition()
+        # The jobs waiting for resources, in the order they were issued, in a queue for each
+        # distinct combination of requirements, such that the scheduler only has to consider the
+        # first job of each queue.
+        self.waitingJobs = {}
+        """
+        :type: dict[(int,int,int),deque[WaitingJob]]
+        """
+        # The IDs of the waiting jobs. A killed job is removed from here but stays in its queue
+        # in waitingJobs until the scheduler gets to it.
+        self.waitingJobIDs = set()
+        # Counts the jobs issued so far, to tell which waiting job is the oldest
+        self.jobSequence = 0
+        # The number of jobs started by the scheduler and the time they spent waiting, in seconds
+        self.jobsStarted = 0
+        self.totalQueueWait = 0.0
+        self.maxQueueWait = 0.0
 
         # A pool representing available CPU in units of minCores
-        self.coreFractions = ResourcePool(self.numWorkers, 'cores', self.acquisitionTimeout)
+        self.coreFractions = ResourcePool(self.numWorkers, 'cores')
         # A lock to work around the lack of thread-safety in Python's subprocess module
         self.popenLock = Lock()
         # A pool representing available memory in bytes
-        self.memory = ResourcePool(self.maxMemory, 'memory', self.acquisitionTimeout)
+        self.memory = ResourcePool(self.maxMemory, 'memory')
         # A pool representing the available space in bytes
-        self.disk = ResourcePool(self.maxDisk, 'disk', self.acquisitionTimeout)
+        self.disk = ResourcePool(self.maxDisk, 'disk')
+        # Long-lived processes that run the Toil workers, if requested
+        self.workerPool = None
+        if config.workerPoolSize > 0:
+            log.debug('Starting a pool of %i worker processes.', config.workerPoolSize)
+            self.workerPool = WorkerPool(config.workerPoolSize, self.popenLock)
 
         log.debug('Setting up the thread pool with %i workers, '
                  'given a minimum CPU fraction of %f '
@@ -132,58 +163,156 @@ class SingleMachineBatchSystem(BatchSystemSupport):
             if args is None:
                 log.debug('Received queue sentinel.')
                 break
-            jobCommand, jobID, jobCores, jobMemory, jobDisk, environment = args
-            while True:
-                try:
-                    coreFractions = int(jobCores / self.minCores)
-                    log.debug('Acquiring %i bytes of memory from a pool of %s.', jobMemory,
-                              self.memory)
-                    with self.memory.acquisitionOf(jobMemory):
-                        log.debug('Acquiring %i fractional cores from a pool of %s to satisfy a '
-                                  'request of %f cores', coreFractions, self.coreFractions,
-                                  jobCores)
-                        with self.coreFractions.acquisitionOf(coreFractions):
-                            with self.disk.acquisitionOf(jobDisk):
-                                startTime = time.time() #Time job is started
-                                with self.popenLock:
-                                    popen = subprocess.Popen(jobCommand,
-                                                             shell=True,
-                                                             env=dict(os.environ, **environment))
-                                statusCode = None
-                                info = Info(time.time(), popen, killIntended=False)
-                                try:
-                                    self.runningJobs[jobID] = info
-                                    try:
-                                        statusCode = popen.wait()
-                                        if 0 != statusCode:
-                                            if statusCode != -9 or not info.killIntended:
-                                                log.error("Got exit code %i (indicating failure) "
-                                                          "from job %s.", statusCode,
-                                                          self.jobs[jobID])
-                                    finally:
-                                        self.runningJobs.pop(jobID)
-                                finally:
-                                    if statusCode is not None and not info.killIntended:
-                                        self.outputQueue.put((jobID, statusCode,
-                                                              time.time() - startTime))
-                except ResourcePool.AcquisitionTimeoutException as e:
-                    log.debug('Could not acquire enough (%s) to run job (%s). Requested: (%s), '
-                              'Avaliable: %s. Sleeping for 10s.', e.resource, jobID, e.requested,
-                              e.available)
-                    with self.aquisitionCondition:
-                        # Make threads sleep for the given delay, or until another job finishes.
-                        # Whichever is sooner.
-                        self.aquisitionCondition.wait(timeout=self.acquisitionRetryDelay)
-                    continue
-                else:
+            jobCommand, jobID, coreFractions, jobMemory, jobDisk, environment = args
+            try:
+                self._runJob(jobCommand, jobID, environment)
+            finally:
+                with self.schedulerCondition:
+                    info = self.runningJobs.pop(jobID)
+                    info.finished.set()
+                    self.coreFractions.release(coreFractions)
+                    self.memory.release(jobMemory)
+                    self.disk.release(jobDisk)
                     log.debug('Finished job. self.coreFractions ~ %s and self.memory ~ %s',
                               self.coreFractions.value, self.memory.value)
-                    with self.aquisitionCondition:
-                        # Wake up sleeping threads
-                        self.aquisitionCondition.notifyAll()
-                    break
+                    self._schedule()
+                    self.schedulerCondition.notifyAll()
         log.debug('Exiting worker thread normally.')
 
+    def _schedule(self):
+        """
+        Starts waiting jobs for as long as there are enough free resources for one of them. Must
+        be called with the scheduler condition held.
+        """
+        while True:
+            job = self._chooseJob()
+            if job is None:
+                break
+            shape = (job.coreFractions, job.memory, job.disk)
+            jobs = self.waitingJobs[shape]
+            jobs.popleft()
+            if not jobs:
+                del self.waitingJobs[shape]
+            self.waitingJobIDs.remove(job.jobID)
+            self.runningJobs[job.jobID] = Info(time.time(), None, killIntended=False)
+            self.coreFractions.acquire(job.coreFractions)
+            self.memory.acquire(job.memory)
+            self.disk.acquire(job.disk)
+            queueWait = time.time() - job.issueTime
+            self.jobsStarted += 1
+            self.totalQueueWait += queueWait
+            self.maxQueueWait = max(self.maxQueueWait, queueWait)
+            log.debug('Starting job %s after %.3fs in the queue.', job.jobID, queueWait)
+            self.inputQueue.put((job.command, job.jobID, job.coreFractions, job.memory, job.disk,
+                                 job.environment))
+
+    def _chooseJob(self):
+        """
+        Returns the waiting job to start next, or None if no job should be started until another
+        one finishes. That is the oldest job if it fits into the free resources. Otherwise, it is
+        the job that leaves the fewest cores, memory and disk unused, in that order, unless the
+        oldest job has been waiting for longer than maxBackfillDelay.
+
+        :rtype: WaitingJob|None
+        """
+        for shape in list(self.waitingJobs):
+            jobs = self.waitingJobs[shape]
+            while jobs and jobs[0].jobID not in self.waitingJobIDs:
+                # Skip the jobs killed while waiting
+                jobs.popleft()
+            if not jobs:
+                del self.waitingJobs[shape]
+        if not self.waitingJobs:
+            return None
+        heads = [jobs[0] for jobs in itervalues(self.waitingJobs)]
+        oldest = min(heads, key=lambda job: job.sequence)
+        if self._fits(oldest):
+            return oldest
+        if time.time() - oldest.issueTime > self.maxBackfillDelay:
+            return None
+        fitting = [job for job in heads if self._fits(job)]
+        if not fitting:
+            return None
+        return max(fitting, key=lambda job: (job.coreFractions, job.memory, job.disk))
+
+    def _fits(self, job):
+        return (self.coreFractions.fits(job.coreFractions)
+                and self.memory.fits(job.memory)
+                and self.disk.fits(job.disk))
+
+    def _runJob(self, jobCommand, jobID, environment):
+        """
+        Runs the given command in a new process group, waits for it to finish and reports its
+        exit status unless it was killed intentionally. The resources of the job must have been
+        acquired by the scheduler.
+        """
+        if self.workerPool is not None and isWorkerCommand(jobCommand):
+            return self._runPooledJob(jobCommand, jobID, environment)
+        info = self.runningJobs[jobID]
+        startTime = time.time() #Time job is started
+        with self.popenLock:
+            if info.killIntended:
+                return
+            # Killing the process group kills the processes started by the job, too
+            popen = subprocess.Popen(jobCommand,
+                                     shell=True,
+                                     env=dict(os.environ, **environment),
+                                     preexec_fn=os.setpgrp)
+        self._setProcess(info, popen)
+        statusCode = popen.wait()
+        self._reportJob(jobID, info, statusCode, time.time() - startTime)
+
+    def _runPooledJob(self, jobCommand, jobID, environment):
+        """
+        Like _runJob() but runs the worker in a process of the worker pool.
+        """
+        info = self.runningJobs[jobID]
+        if info.killIntended:
+            return
+        statusCode, wallTime = self.workerPool.run(
+            jobCommand, environment, lambda pid: self._setProcess(info, PooledJob(pid)))
+        self._reportJob(jobID, info, statusCode, wallTime)
+
+    def _setProcess(self, info, popen):
+        """
+        Records the process running a job, killing it if the job was killed before it started.
+        """
+        with self.schedulerCondition:
+            info.popen = popen
+            if info.killIntended:
+                self._killProcessGroup(popen.pid)
+
+    def _reportJob(self, jobID, info, statusCode, wallTime):
+        """
+        Passes the exit status of a job on to the leader unless the job was killed intentionally.
+        """
+        if 0 != statusCode:
+            if statusCode != -9 or not info.killIntended:
+                log.error("Got exit code %i (indicating failure) "
+                          "from job %s.", statusCode, self.jobs[jobID])
+        with self.schedulerCondition:
+            if info.killIntended:
+                return
+            self.outputQueue.put((jobID, statusCode, wallTime))
+        self._notifyUpdateListener()
+
+    @staticmethod
+    def _killProcessGroup(pid):
+        """
+        Kills the process group led by the process with the given ID, or only the process if it
+        doesn't lead a group yet.
+        """
+        try:
+            os.killpg(pid, signal.SIGKILL)
+        except OSError as e:
+            if e.errno != errno.ESRCH:
+                raise
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except OSError as e:
+                if e.errno != errno.ESRCH:
+                    raise
+
     def issueBatchJob(self, jobNode):
         """
         Adds the command and resources to a queue to be run.
@@ -205,22 +334,41 @@ class SingleMachineBatchSystem(BatchSystemSupport):
             jobID = self.jobIndex
             self.jobIndex += 1
         self.jobs[jobID] = jobNode.command
-        self.inputQueue.put((jobNode.command, jobID, cores, jobNode.memory,
-                             jobNode.disk, self.environment.copy()))
+        with self.schedulerCondition:
+            job = WaitingJob(jobID=jobID, command=jobNode.command,
+                             coreFractions=int(round(cores / self.minCores)),
+                             memory=jobNode.memory, disk=jobNode.disk,
+                             environment=self.environment.copy(), issueTime=time.time(),
+                             sequence=self.jobSequence)
+            self.jobSequence += 1
+            shape = (job.coreFractions, job.memory, job.disk)
+            self.waitingJobs.setdefault(shape, deque()).append(job)
+            self.waitingJobIDs.add(jobID)
+            self._schedule()
         return jobID
 
     def killBatchJobs(self, jobIDs):
         """
-        Kills jobs by ID
+        Kills jobs by ID. A job that hasn't started yet is dropped. A running job is killed along
+        with the processes it started. All jobs are killed before waiting for any of them to
+        finish.
         """
         log.debug('Killing jobs: {}'.format(jobIDs))
-        for jobID in jobIDs:
-            if jobID in self.runningJobs:
-                info = self.runningJobs[jobID]
-                info.killIntended = True
-                os.kill(info.popen.pid, 9)
-                while jobID in self.runningJobs:
-                    pass
+        killedJobs = []
+        with self.schedulerCondition:
+            for jobID in jobIDs:
+                if jobID in self.waitingJobIDs:
+                    self.waitingJobIDs.remove(jobID)
+                    self.jobs.pop(jobID, None)
+                elif jobID in self.runningJobs:
+                    info = self.runningJobs[jobID]
+                    info.killIntended = True
+                    if info.popen is not None:
+                        self._killProcessGroup(info.popen.pid)
+                    killedJobs.append((jobID, info))
+        for jobID, info in killedJobs:
+            info.finished.wait()
+            self.jobs.pop(jobID, None)
 
     def getIssuedBatchJobIDs(self):
         """
@@ -230,13 +378,19 @@ class SingleMachineBatchSystem(BatchSystemSupport):
 
     def getRunningBatchJobIDs(self):
         now = time.time()
-        return {jobID: now - info.time for jobID, info in self.runningJobs.items()}
+        with self.schedulerCondition:
+            return {jobID: now - info.time for jobID, info in self.runningJobs.items()}
 
     def shutdown(self):
         """
         Cleanly terminate worker threads. Add sentinels to inputQueue equal to maxThreads. Join
         all worker threads.
         """
+        with self.schedulerCondition:
+            # Jobs that haven't started yet never will
+            self.waitingJobs.clear()
+            self.waitingJobIDs.clear()
+            log.debug('Scheduler statistics: %s', self.getSchedulerStats())
         # Remove reference to inputQueue (raises exception if inputQueue is used after method call)
         inputQueue = self.inputQueue
         self.inputQueue = None
@@ -244,8 +398,29 @@ class SingleMachineBatchSystem(BatchSystemSupport):
             inputQueue.put(None)
         for thread in self.workerThreads:
             thread.join()
+        if self.workerPool is not None:
+            self.workerPool.shutdown()
         BatchSystemSupport.workerCleanup(self.workerCleanupInfo)
 
+    def getSchedulerStats(self):
+        """
+        Returns statistics about the scheduling of jobs so far: the number of jobs started and
+        still waiting, the average and maximum time a job waited for resources, in seconds, and
+        the average fraction of the cores, memory and disk used by jobs since this batch system
+        was created.
+
+        :rtype: dict[str,int|float]
+        """
+        with self.schedulerCondition:
+            return dict(jobsStarted=self.jobsStarted,
+                        jobsWaiting=len(self.waitingJobIDs),
+                        meanQueueWait=(self.totalQueueWait / self.jobsStarted
+                                       if self.jobsStarted else 0.0),
+                        maxQueueWait=self.maxQueueWait,
+                        coreUtilization=self.coreFractions.utilization(),
+                        memoryUtilization=self.memory.utilization(),
+                        diskUtilization=self.disk.utilization())
+
     def getUpdatedBatchJob(self, maxWait):
         """
         Returns a map of the run jobs and the return value of their processes.
@@ -269,6 +444,7 @@ class SingleMachineBatchSystem(BatchSystemSupport):
     @classmethod
     def setOptions(cls, setOption):
         setOption("scale", default=1)
+        setOption("workerPoolSize", int, default=0)
         
 class Info(object):
     # Can't use namedtuple here since killIntended needs to be mutable
@@ -276,76 +452,78 @@ class Info(object):
         self.time = startTime
         self.popen = popen
         self.killIntended = killIntended
+        # Set once the job is done and its resources are released
+        self.finished = Event()
+
+
+class PooledJob(object):
+    # Stands in for the Popen object of a job run by the worker pool, which only needs its PID
+    def __init__(self, pid):
+        self.pid = pid
+
+
+class WaitingJob(namedtuple('WaitingJob', (
+    'jobID', 'command',
+    # The cores required by the job in units of minCores
+    'coreFractions',
+    'memory', 'disk', 'environment',
+    # The time the job was issued at
+    'issueTime',
+    # The number of jobs issued before this one
+    'sequence'))):
+    pass
 
 
 class ResourcePool(object):
-    def __init__(self, initial_value, resourceType, timeout):
+    """
+    An amount of a resource that is taken by jobs while they run. Records how much of it was used
+    over time. Not thread-safe, the batch system guards its pools with the scheduler condition.
+    """
+
+    def __init__(self, initial_value, resourceType):
         super(ResourcePool, self).__init__()
-        self.condition = Condition()
+        self.initialValue = initial_value
         self.value = initial_value
         self.resourceType = resourceType
-        self.timeout = timeout
+        self.creationTime = self.updateTime = time.time()
+        # The integral of the amount in use over time
+        self.usage = 0.0
+
+    def fits(self, amount):
+        return amount <= self.value
 
     def acquire(self, amount):
-        with self.condition:
-            startTime = time.time()
-            while amount > self.value:
-                if time.time() - startTime >= self.timeout:
-                    # This means the thread timed out waiting for the resource.  We exit the nested
-                    # context managers in worker to prevent blocking of a resource due to
-                    # unavailability of a nested resource request.
-                    raise self.AcquisitionTimeoutException(resource=self.resourceType,
-                                                           requested=amount, available=self.value)
-                # Allow 5 seconds to get the resource, else quit through the above if condition.
-                # This wait + timeout is the last thing in the loop such that a request that takes
-                # longer than 5s due to multiple wakes under the 5 second threshold are still
-                # honored.
-                self.condition.wait(timeout=self.timeout)
-            self.value -= amount
-            self.__validate()
+        assert self.fits(amount)
+        self.__update()
+        self.value -= amount
+        self.__validate()
 
     def release(self, amount):
-        with self.condition:
-            self.value += amount
-            self.__validate()
-            self.condition.notifyAll()
+        self.__update()
+        self.value += amount
+        self.__validate()
+
+    def utilization(self):
+        """
+        :return: The average fraction of the resource that was in use since the pool was created
+        :rtype: float
+        """
+        self.__update()
+        elapsed = self.updateTime - self.creationTime
+        if elapsed <= 0 or self.initialValue <= 0:
+            return 0.0
+        return self.usage / (elapsed * self.initialValue)
+
+    def __update(self):
+        now = time.time()
+        self.usage += (self.initialValue - self.value) * (now - self.updateTime)
+        self.updateTime = now
 
     def __validate(self):
-        assert 0 <= self.value
+        assert 0 <= self.value <= self.initialValue
 
     def __str__(self):
         return str(self.value)
 
     def __repr__(self):
         return "ResourcePool(%i)" % self.value
-
-    @contextmanager
-    def acquisitionOf(self, amount):
-        self.acquire(amount)
-        try:
-            yield
-        finally:
-            self.release(amount)
-
-    class AcquisitionTimeoutException(Exception):
-        """
-        To be raised when a resource request times out.
-        """
-
-        def __init__(self, resource, requested, available):
-            """
-            Creates an instance of this exception that indicates which resource is insufficient for
-            current demands, as well as the amount requested and amount actually available.
-
-            :param str resource: string representing the resource type
-
-            :param int|float requested: the amount of the particular resource requested that resulted
-                   in this exception
-
-            :param int|float available: amount of the particular resource actually available
-            """
-            self.requested = requested
-            self.available = available
-            self.resource = resource
-
-
@@ -43,6 +43,9 @@ class TorqueBatchSystem(AbstractGridEngineBatchSystem):
         def __init__(self, newJobsQueue, updatedJobsQueue, killQueue, killedJobsQueue, boss):
             super(self.__class__, self).__init__(newJobsQueue, updatedJobsQueue, killQueue, killedJobsQueue, boss)
             self._version = self._pbsVersion()
+            # The index of a task in a job array is passed in a variable whose name depends on the
+            # flavour of PBS
+            self.arrayTaskIDVariable = 'PBS_ARRAY_INDEX' if self._version == "pro" else 'PBS_ARRAYID'
 
         def _pbsVersion(self):
             """ Determines PBS/Torque version via pbsnodes
@@ -66,19 +69,27 @@ class TorqueBatchSystem(AbstractGridEngineBatchSystem):
         """
         Torque-specific AbstractGridEngineWorker methods
         """
+        def getBatchSystemID(self, jobID):
+            job, task = self.batchJobIDs[jobID]
+            job = str(job).strip()
+            # qsub reports a job array as <job>[].<server>, PBS refers to its tasks as
+            # <job>[<task>].<server>
+            return job if task is None else job.replace('[]', '[{}]'.format(task), 1)
+
         def getRunningJobIDs(self):
             times = {}
             
-            currentjobs = dict((str(self.batchJobIDs[x][0].strip()), x) for x in self.runningJobs)
+            currentjobs = dict((self.getBatchSystemID(x).split('.')[0], x) for x in self.runningJobs)
             logger.debug("getRunningJobIDs current jobs are: " + str(currentjobs))
             # Limit qstat to current username to avoid clogging the batch system on heavily loaded clusters
             #job_user = os.environ.get('USER')
             #process = subprocess.Popen(['qstat', '-u', job_user], stdout=subprocess.PIPE)
             # -x shows exit status in PBSPro, not XML output like OSS PBS
+            # -t lists the tasks of job arrays
             if self._version == "pro":
-                process = subprocess.Popen(['qstat', '-x'], stdout=subprocess.PIPE)
+                process = subprocess.Popen(['qstat', '-x', '-t'], stdout=subprocess.PIPE)
             elif self._version == "oss":
-                process = subprocess.Popen(['qstat'], stdout=subprocess.PIPE)
+                process = subprocess.Popen(['qstat', '-t'], stdout=subprocess.PIPE)
 
 
             stdout, stderr = process.communicate()
@@ -88,7 +99,7 @@ class TorqueBatchSystem(AbstractGridEngineBatchSystem):
             for currline in stdout.split('\n'):
                 items = currline.strip().split()
                 if items:
-                    jobid = items[0].strip()
+                    jobid = items[0].strip().split('.')[0]
                     if jobid in currentjobs:
                         logger.debug("getRunningJobIDs job status for is: " + items[4])
                     if jobid in currentjobs and items[4] == 'R':
@@ -124,35 +135,63 @@ class TorqueBatchSystem(AbstractGridEngineBatchSystem):
         def prepareSubmission(self, cpu, memory, jobID, command):
             return self.prepareQsub(cpu, memory, jobID) + [self.generateTorqueWrapper(command)]
 
+        def prepareArraySubmission(self, cpu, memory, jobIDs, scriptPath):
+            # Run the tasks in the submission directory, like generateTorqueWrapper() does
+            with open(scriptPath) as fh:
+                shebang = fh.readline()
+                script = fh.read()
+            with open(scriptPath, 'w') as fh:
+                fh.write(shebang + "cd $PBS_O_WORKDIR\n\n" + script)
+            arrayOption = '-J' if self._version == "pro" else '-t'
+            return (self.prepareQsub(cpu, memory, jobIDs[0]) +
+                    [arrayOption, '1-{}'.format(len(jobIDs)), scriptPath])
+
         def submitJob(self, subLine):
             process = subprocess.Popen(subLine, stdout=subprocess.PIPE)
             so, se = process.communicate()
             return so
 
         def getJobExitCode(self, torqueJobID):
+            return self.getJobExitCodes([torqueJobID])[torqueJobID]
+
+        def getJobExitCodes(self, torqueJobIDs):
+            # qstat reports on all given jobs at once
+            jobNumbers = dict((str(torqueJobID).strip().split('.')[0], torqueJobID)
+                              for torqueJobID in torqueJobIDs)
             if self._version == "pro":
-                args = ["qstat", "-x", "-f", str(torqueJobID).split('.')[0]]
+                args = ["qstat", "-x", "-f"] + list(jobNumbers)
             elif self._version == "oss":
-                args = ["qstat", "-f", str(torqueJobID).split('.')[0]]
+                args = ["qstat", "-f"] + list(jobNumbers)
 
+            exitCodes = dict.fromkeys(torqueJobIDs)
+            torqueJobID = None
             process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
             for line in process.stdout:
                 line = line.strip()
-                #logger.debug("getJobExitCode exit status: " + line)
-                # Case differences due to PBSPro vs OSS Torque qstat outputs
-                if line.startswith("failed") or line.startswith("FAILED") and int(line.split()[1]) == 1:
-                    return 1
-                if line.startswith("exit_status") or line.startswith("Exit_status"):
-                    status = line.split(' = ')[1]
-                    logger.debug('Exit Status: ' + status)
-                    return int(status)
+                #logger.debug("getJobExitCodes exit status: " + line)
+                if line.startswith("Job Id:"):
+                    torqueJobID = jobNumbers.get(line.split(':', 1)[1].strip().split('.')[0])
+                    continue
                 if 'unknown job id' in line.lower():
                     # some clusters configure Torque to forget everything about just
                     # finished jobs instantly, apparently for performance reasons
-                    logger.debug('Batch system no longer remembers about job {}'.format(torqueJobID))
-                    # return assumed success; status files should reveal failure
-                    return 0
-            return None
+                    unknownJobID = jobNumbers.get(line.split()[-1].split('.')[0])
+                    if unknownJobID is not None:
+                        logger.debug('Batch system no longer remembers about job {}'.format(unknownJobID))
+                        # assume success; status files should reveal failure
+                        exitCodes[unknownJobID] = 0
+                    continue
+                if torqueJobID is None or exitCodes[torqueJobID] is not None:
+                    continue
+                # Case differences due to PBSPro vs OSS Torque qstat outputs
+                if line.startswith("failed") or line.startswith("FAILED") and int(line.split()[1]) == 1:
+                    exitCodes[torqueJobID] = 1
+                elif line.startswith("exit_status") or line.startswith("Exit_status"):
+                    status = line.split(' = ')[1]
+                    logger.debug('Exit Status of %s: %s', torqueJobID, status)
+                    exitCodes[torqueJobID] = int(status)
+            process.wait()
+            return exitCodes
 
         """
         Implementation-specific helper methods
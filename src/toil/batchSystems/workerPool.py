@@ -0,0 +1,266 @@
+# Copyright (C) 2015-2016 Regents of the University of California
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+A pool of long-lived processes that run Toil workers for the single-machine batch system.
+
+Each process of the pool has Toil imported. It receives the command of a worker over a pipe,
+forks a child that runs the worker and sends back the exit status of the child and the time it
+took. Once the child is done, the process imports every module the child imported, including the
+user script, such that the next worker it forks starts with those modules already loaded. A
+worker that crashes only takes down its own child. If a process of the pool dies, it is replaced.
+"""
+
+from __future__ import absolute_import
+
+import importlib
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+from threading import Lock
+
+# Python 3 compatibility imports
+from six.moves import cPickle, xrange
+
+log = logging.getLogger(__name__)
+
+
+def isWorkerCommand(jobCommand):
+    """
+    :return: True if the given command runs a Toil worker, such that a pool can run it
+    :rtype: bool
+    """
+    args = jobCommand.split()
+    return len(args) == 3 and os.path.basename(args[0]) == '_toil_worker'
+
+
+class WorkerPool(object):
+    """
+    A pool of processes running Toil workers, see the module documentation. It is safe to run
+    workers from several threads at once. A thread that finds no idle process in the pool starts
+    an additional one, which is stopped once it is no longer needed.
+    """
+
+    def __init__(self, size, popenLock):
+        """
+        :param int size: The number of processes to start right away and to keep in the pool
+
+        :param threading.Lock popenLock: The lock to hold while starting a process, see
+               :class:`toil.batchSystems.singleMachine.SingleMachineBatchSystem`
+        """
+        self.size = size
+        self.popenLock = popenLock
+        self.lock = Lock()
+        self.idleProcesses = []
+        for _ in xrange(size):
+            self.idleProcesses.append(PooledProcess(popenLock))
+
+    def run(self, jobCommand, environment, onStart):
+        """
+        Runs the given worker command in a process of the pool and waits for it to finish.
+
+        :param str jobCommand: A command for which :func:`isWorkerCommand` is True
+
+        :param dict environment: The variables to add to the environment of the worker
+
+        :param onStart: A function to invoke with the PID of the process running the worker, as
+               soon as it is running. Killing that process kills the worker.
+
+        :return: The exit status of the worker, negative if it was killed by a signal, and the
+                 time it took to run, in seconds
+        :rtype: (int, float)
+        """
+        with self.lock:
+            process = self.idleProcesses.pop() if self.idleProcesses else None
+        if process is None:
+            process = PooledProcess(self.popenLock)
+        try:
+            statusCode, wallTime = process.run(jobCommand, environment, onStart)
+        except PooledProcess.ProcessDiedException as e:
+            log.error('The pooled process running the worker for command %s died. Replacing it. '
+                      '%s', jobCommand, e)
+            process.stop()
+            with self.lock:
+                if len(self.idleProcesses) < self.size:
+                    self.idleProcesses.append(PooledProcess(self.popenLock))
+            return 1, 0.0
+        with self.lock:
+            if len(self.idleProcesses) < self.size:
+                self.idleProcesses.append(process)
+                process = None
+        if process is not None:
+            process.stop()
+        return statusCode, wallTime
+
+    def shutdown(self):
+        """
+        Stops the idle processes of the pool. Workers still running are not affected.
+        """
+        with self.lock:
+            processes, self.idleProcesses = self.idleProcesses, []
+        for process in processes:
+            process.stop()
+
+
+class PooledProcess(object):
+    """
+    The batch system's end of a process in a :class:`WorkerPool`. Only one thread at a time may
+    use an instance of this class.
+    """
+
+    class ProcessDiedException(Exception):
+        """
+        Raised when the process exits while it is running a worker.
+        """
+
+    def __init__(self, popenLock):
+        # The process needs to find Toil even if the leader was started with a different sys.path
+        toilPath = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        pythonPath = os.environ.get('PYTHONPATH')
+        environment = dict(os.environ,
+                           PYTHONPATH=toilPath if not pythonPath else pythonPath + os.pathsep +
+                                                                      toilPath)
+        with popenLock:
+            self.popen = subprocess.Popen([sys.executable, '-m', __name__],
+                                          stdin=subprocess.PIPE,
+                                          stdout=subprocess.PIPE,
+                                          close_fds=True,
+                                          env=environment)
+
+    def run(self, jobCommand, environment, onStart):
+        """
+        See :meth:`WorkerPool.run`.
+        """
+        try:
+            cPickle.dump((jobCommand, environment), self.popen.stdin, cPickle.HIGHEST_PROTOCOL)
+            self.popen.stdin.flush()
+            onStart(cPickle.load(self.popen.stdout))
+            return cPickle.load(self.popen.stdout)
+        except (IOError, EOFError) as e:
+            raise self.ProcessDiedException('Process %i exited: %s' % (self.popen.pid, e))
+
+    def stop(self):
+        """
+        Tells the process to exit once it is idle and waits for it to do so.
+        """
+        try:
+            self.popen.stdin.close()
+        except IOError:
+            pass
+        self.popen.stdout.close()
+        self.popen.wait()
+
+
+def _runWorker(jobCommand, environment, reportFd, importedModules):
+    """
+    Runs the worker with the given command in the current, freshly forked process and never
+    returns. Before exiting, writes the names of the modules imported by the worker and the
+    entries it added to sys.path to the given file.
+    """
+    statusCode = 1
+    try:
+        # Like the processes started by the batch system itself, the worker leads a process
+        # group, such that killing the group kills the processes it started, too.
+        os.setpgrp()
+        os.environ.update(environment)
+        sys.argv = jobCommand.split()
+        from toil import worker
+        # The worker expects to be the main program, see ModuleDescriptor._runningOnWorker()
+        sys.modules['__main__'] = worker
+        worker.main()
+        statusCode = 0
+    except SystemExit as e:
+        statusCode = 0 if e.code is None else e.code if isinstance(e.code, int) else 1
+    except:
+        traceback.print_exc()
+    finally:
+        try:
+            report = cPickle.dumps(([name for name, module in list(sys.modules.items())
+                                     if module is not None and name not in importedModules],
+                                    list(sys.path)), cPickle.HIGHEST_PROTOCOL)
+            os.write(reportFd, report)
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(statusCode)
+
+
+def _importModules(report):
+    """
+    Imports the modules a worker imported, as reported by :func:`_runWorker`, into the current
+    process. Modules that fail to import are skipped.
+    """
+    moduleNames, workerPath = cPickle.loads(report)
+    for entry in workerPath:
+        if entry not in sys.path:
+            sys.path.append(entry)
+    for name in sorted(moduleNames):
+        if name not in sys.modules and name != '__main__':
+            try:
+                importlib.import_module(name)
+            except Exception:
+                log.debug('Failed to import module %s into the worker pool.', name)
+
+
+def main():
+    """
+    The main loop of a process of the pool. Receives the command and environment of a worker
+    on standard input and writes the PID of the worker's process followed by its exit status
+    and wall time to standard output, each of them pickled.
+    """
+    logging.basicConfig()
+    # Keep the channel to the batch system away from the workers, whose output goes to the
+    # standard error of the pool instead
+    channelIn = os.fdopen(os.dup(0), 'rb')
+    channelOut = os.fdopen(os.dup(1), 'wb')
+    devNull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devNull, 0)
+    os.close(devNull)
+    os.dup2(2, 1)
+    # Workers forked from here start with Toil loaded
+    import toil.worker
+    reportFile = tempfile.TemporaryFile()
+    while True:
+        try:
+            jobCommand, environment = cPickle.load(channelIn)
+        except EOFError:
+            break
+        importedModules = set(sys.modules)
+        reportFile.seek(0)
+        reportFile.truncate()
+        startTime = time.time()
+        pid = os.fork()
+        if pid == 0:
+            channelIn.close()
+            channelOut.close()
+            _runWorker(jobCommand, environment, reportFile.fileno(), importedModules)
+        cPickle.dump(pid, channelOut, cPickle.HIGHEST_PROTOCOL)
+        channelOut.flush()
+        _, status = os.waitpid(pid, 0)
+        wallTime = time.time() - startTime
+        statusCode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+        cPickle.dump((statusCode, wallTime), channelOut, cPickle.HIGHEST_PROTOCOL)
+        channelOut.flush()
+        reportFile.seek(0)
+        report = reportFile.read()
+        if report:
+            _importModules(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -69,6 +69,7 @@ class Config(object):
         self.clean = None
         self.cleanWorkDir = None
         self.clusterStats = None
+        self.jobStoreJournal = False
 
         #Restarting the workflow options
         self.restart = False
@@ -111,9 +112,20 @@ class Config(object):
         self.retryCount = 0
         self.maxJobDuration = sys.maxsize
         self.rescueJobsFrequency = 3600
+        self.leaderSnapshotFrequency = 600
 
         #Misc
         self.disableCaching = False
+        self.cacheEvictionPolicy = 'lru'
+        self.nodeCacheDir = None
+        self.nodeCacheSize = 107374182400
+        self.parallelDownloadThreshold = 268435456
+        self.downloadPartSize = 67108864
+        self.downloadThreads = 8
+        self.prefetchThreads = 4
+        self.asyncWriteThreads = 4
+        self.uploadThreads = 2
+        self.transferThreads = 8
         self.maxLogFileSize = 64000
         self.writeLogs = None
         self.writeLogsGzip = None
@@ -184,6 +196,7 @@ class Config(object):
         elif self.clean is None:
             self.clean = "onSuccess"
         setOption('clusterStats')
+        setOption("jobStoreJournal")
 
         #Restarting the workflow options
         setOption("restart")
@@ -237,9 +250,22 @@ class Config(object):
         setOption("retryCount", int, iC(0))
         setOption("maxJobDuration", int, iC(1))
         setOption("rescueJobsFrequency", int, iC(1))
+        setOption("leaderSnapshotFrequency", int, iC(0))
 
         #Misc
         setOption("disableCaching")
+        setOption("cacheEvictionPolicy")
+        setOption("nodeCacheDir")
+        if self.nodeCacheDir is not None:
+            self.nodeCacheDir = os.path.abspath(self.nodeCacheDir)
+        setOption("nodeCacheSize", h2b, iC(1))
+        setOption("parallelDownloadThreshold", h2b, iC(0))
+        setOption("downloadPartSize", h2b, iC(1))
+        setOption("downloadThreads", int, iC(1))
+        setOption("prefetchThreads", int, iC(0))
+        setOption("asyncWriteThreads", int, iC(1))
+        setOption("uploadThreads", int, iC(1))
+        setOption("transferThreads", int, iC(1))
         setOption("maxLogFileSize", h2b, iC(1))
         setOption("writeLogs")
         setOption("writeLogsGzip")
@@ -312,6 +338,11 @@ def _addOptions(addGroupFn, config):
                      "but an absolute path can also be passed to specify where this file "
                      "should be written. This options only applies when using scalable batch "
                      "systems.")
+    addOptionFn("--jobStoreJournal", dest="jobStoreJournal", action="store_true", default=None,
+                help="Append updates to jobs to a journal instead of rewriting the job in the "
+                     "job store every time. The journal is periodically compacted into the job "
+                     "store. This saves metadata operations on shared file systems like NFS or "
+                     "Lustre. Currently only supported by the file job store.")
     #
     #Restarting the workflow options
     #
@@ -472,6 +503,12 @@ def _addOptions(addGroupFn, config):
                       help=("Period of time to wait (in seconds) between checking for "
                             "missing/overlong jobs, that is jobs which get lost by the batch "
                             "system. Expert parameter. default=%s" % config.rescueJobsFrequency))
+    addOptionFn("--leaderSnapshotFrequency", dest="leaderSnapshotFrequency", default=None,
+                      help=("Period of time to wait (in seconds) between snapshots of the jobs the "
+                            "leader is working on. A restarted workflow only examines the jobs in "
+                            "the latest snapshot and their successors instead of the entire job "
+                            "graph. Set to 0 to disable snapshots. default=%s"
+                            % config.leaderSnapshotFrequency))
 
     #
     #Misc options
@@ -481,6 +518,55 @@ def _addOptions(addGroupFn, config):
                 help='Disables caching in the file store. This flag must be set to use '
                      'a batch system that does not support caching such as Grid Engine, Parasol, '
                      'LSF, or Slurm')
+    # toil.fileStore imports this module
+    from toil.fileStore import evictionPolicies
+    addOptionFn('--cacheEvictionPolicy', dest='cacheEvictionPolicy', default=None,
+                choices=sorted(evictionPolicies),
+                help='The order in which files no job is using are evicted from the cache of a '
+                     'node: least recently used first (lru), least frequently used first (lfu) or '
+                     'fewest uses per byte first (gdsf). default=%s' % config.cacheEvictionPolicy)
+    addOptionFn('--nodeCacheDir', dest='nodeCacheDir', default=None,
+                help='A directory on each node in which to keep the files imported into the job '
+                     'store, keyed by their content, for use by later workflow attempts and by '
+                     'other workflows on the node that set the same directory. A file imported by '
+                     'several workflows is then downloaded only once per node. The directory is '
+                     'created if it does not exist and is not removed when the workflow ends. '
+                     'Disabled by default.')
+    addOptionFn('--nodeCacheSize', dest='nodeCacheSize', default=None,
+                help='The maximum total size of the files in the directory given by '
+                     '--nodeCacheDir. Files are evicted by the --cacheEvictionPolicy when it is '
+                     'exceeded. Standard suffixes like K, Ki, M, Mi, G or Gi are supported. '
+                     'default=%s' % bytes2human(config.nodeCacheSize, symbols='iec'))
+    addOptionFn('--parallelDownloadThreshold', dest='parallelDownloadThreshold', default=None,
+                help='The size above which files are read from the job store in parts of '
+                     '--downloadPartSize, up to --downloadThreads of them at a time, if the job '
+                     'store supports it. Standard suffixes like K, Ki, M, Mi, G or Gi are '
+                     'supported. default=%s'
+                     % bytes2human(config.parallelDownloadThreshold, symbols='iec'))
+    addOptionFn('--downloadPartSize', dest='downloadPartSize', default=None,
+                help='The size of the parts in which large files are read from the job store. '
+                     'Standard suffixes like K, Ki, M, Mi, G or Gi are supported. default=%s'
+                     % bytes2human(config.downloadPartSize, symbols='iec'))
+    addOptionFn('--downloadThreads', dest='downloadThreads', default=None,
+                help='The maximum number of parts of a large file read from the job store at '
+                     'the same time. default=%s' % config.downloadThreads)
+    addOptionFn('--prefetchThreads', dest='prefetchThreads', default=None,
+                help='The maximum number of input files a job declared with Job.addInputs() '
+                     'that are downloaded at the same time before and while the job runs. 0 '
+                     'disables prefetching. default=%s' % config.prefetchThreads)
+    addOptionFn('--asyncWriteThreads', dest='asyncWriteThreads', default=None,
+                help='The number of threads with which the caching file store writes the files of '
+                     'a job to the job store in the background. default=%s'
+                     % config.asyncWriteThreads)
+    addOptionFn('--uploadThreads', dest='uploadThreads', default=None,
+                help='The maximum number of parts of a large file that each of these threads '
+                     'writes to the job store at the same time, if the job store supports it. '
+                     'Each part is held in memory while it is written. default=%s'
+                     % config.uploadThreads)
+    addOptionFn('--transferThreads', dest='transferThreads', default=None,
+                help='The maximum number of files that a job reading or writing many files at '
+                     'once, with readGlobalFiles() or writeGlobalFiles(), transfers at the same '
+                     'time. default=%s' % config.transferThreads)
     addOptionFn("--maxLogFileSize", dest="maxLogFileSize", default=None,
                 help=("The maximum size of a job log file to keep (in bytes), log files "
                       "larger than this will be truncated to the last X bytes. Setting "
@@ -732,9 +818,8 @@ class Toil(object):
         try:
             self._setBatchSystemEnvVars()
             self._serialiseEnv()
-            self._cacheAllJobs()
             self._setProvisioner()
-            rootJobGraph = self._jobStore.clean(jobCache=self._jobCache)
+            rootJobGraph = self._cleanJobStore()
             return self._runMainLoop(rootJobGraph)
         finally:
             self._shutdownBatchSystem()
@@ -919,6 +1004,29 @@ class Toil(object):
             cPickle.dump(os.environ, fileHandle, cPickle.HIGHEST_PROTOCOL)
         logger.info("Written the environment for the jobs to the environment file")
 
+    def _cleanJobStore(self):
+        """
+        Cleans up the job store of a restarted workflow, using the latest snapshot of the
+        leader's state if possible.
+
+        :return: The root job graph
+        :rtype: toil.jobGraph.JobGraph
+        """
+        # toil.toilState indirectly imports this module
+        from toil.toilState import ToilState
+        jobStoreIDs = None
+        if self.config.leaderSnapshotFrequency:
+            jobStoreIDs = ToilState.readSnapshot(self._jobStore)
+        if jobStoreIDs is None:
+            self._cacheAllJobs()
+            return self._jobStore.clean(jobCache=self._jobCache)
+        else:
+            logger.info('Loading the %i jobs recorded in the snapshot of the leader\'s state',
+                        len(jobStoreIDs))
+            self._jobCache = self._jobStore.loadMany(jobStoreIDs)
+            logger.info('{} jobs downloaded.'.format(len(self._jobCache)))
+            return self._jobStore.clean(jobCache=self._jobCache, activeJobsOnly=True)
+
     def _cacheAllJobs(self):
         """
         Downloads all jobs in the current job store into self.jobCache.
@@ -18,31 +18,37 @@ from abc import abstractmethod, ABCMeta
 from bd2k.util.objects import abstractclassmethod
 
 import base64
-from collections import namedtuple, defaultdict
+from collections import namedtuple, defaultdict, Counter
 
 import dill
 import errno
+import io
 import logging
 import os
 import shutil
+import sqlite3
 import stat
 import tempfile
 import time
 import uuid
 
 from contextlib import contextmanager
-from fcntl import flock, LOCK_EX, LOCK_UN
 from functools import partial
-from hashlib import sha1
-from threading import Thread, Semaphore, Event
+from fcntl import flock, LOCK_EX, LOCK_UN
+from hashlib import sha1, sha256
+from multiprocessing.pool import ThreadPool
+from threading import Thread, Semaphore, Event, current_thread
 
 # Python 3 compatibility imports
-from six.moves.queue import Empty, Queue
+from six.moves.queue import Empty, Full, Queue
+from six import iteritems, itervalues
 from six.moves import xrange
 
 from bd2k.util.humanize import bytes2human
 from toil.common import cacheDirName, getDirSizeRecursively, getFileSystemSize
 from toil.lib.bioio import makePublicDir
+from toil.lib.bloomFilter import BloomFilter
+from toil.lib.localTransfer import copyFile, copyFileObj
 from toil.resource import ModuleDescriptor
 
 logger = logging.getLogger(__name__)
@@ -99,6 +105,7 @@ class FileStore(object):
     _pendingFileWritesLock = Semaphore()
     _pendingFileWrites = set()
     _terminateEvent = Event()  # Used to signify crashes in threads
+    _changeDir = True  # Whether to change into the local temp dir of the job while it runs
 
     __metaclass__ = ABCMeta
 
@@ -112,11 +119,36 @@ class FileStore(object):
         self.loggingMessages = []
         self.filesToDelete = set()
         self.jobsToDelete = set()
+        # Counts the hits and misses of the job on the cache of the node and the number of bytes
+        # it evicted from it. Stays empty if caching is disabled.
+        self.cacheStats = Counter()
+        self.nodeCache = NodeCache.forConfig(jobStore.config)
+        # Maps the IDs of the input files being prefetched to the result of their download and the
+        # path they are downloaded to. See _startPrefetching.
+        self._prefetches = {}
+        self._prefetchPool = None
+        self._prefetchStart = self._prefetchEnd = None
+        # Counts the prefetched files, the time from the start of prefetching to the end of the
+        # last download and the time the job waited for downloads to complete.
+        self.prefetchStats = Counter()
 
     @staticmethod
-    def createFileStore(jobStore, jobGraph, localTempDir, inputBlockFn, caching):
+    def createFileStore(jobStore, jobGraph, localTempDir, inputBlockFn, caching,
+                        terminateEvent=None, changeDir=True):
+        """
+        :param threading.Event terminateEvent: the event used to signify crashes in the threads of
+               the file store. If None, the event shared by all file stores in this process is used.
+
+        :param bool changeDir: whether to change the working directory of this process to the
+               local temp dir of the job while it runs. Only one job in a process can run in a
+               working directory other than the process' one at any time.
+        """
         fileStoreCls = CachingFileStore if caching else NonCachingFileStore
-        return fileStoreCls(jobStore, jobGraph, localTempDir, inputBlockFn)
+        fileStore = fileStoreCls(jobStore, jobGraph, localTempDir, inputBlockFn)
+        if terminateEvent is not None:
+            fileStore._terminateEvent = terminateEvent
+        fileStore._changeDir = changeDir
+        return fileStore
 
     @abstractmethod
     @contextmanager
@@ -213,6 +245,54 @@ class FileStore(object):
         """
         raise NotImplementedError()
 
+    def writeGlobalFiles(self, localFileNames, cleanup=False):
+        """
+        Uploads many files to the job store at once, up to --transferThreads of them at the same
+        time. This is much faster than calling writeGlobalFile for each file if the files are
+        small.
+
+        :param list[str] localFileNames: The paths to the local files to upload.
+        :param bool cleanup: is as in :func:`toil.fileStore.FileStore.writeGlobalFile`.
+        :return: the IDs of the files, in the order of the given paths
+        :rtype: list[toil.fileStore.FileID]
+        """
+        return self._transferConcurrently(partial(self.writeGlobalFile, cleanup=cleanup),
+                                          localFileNames)
+
+    def readGlobalFiles(self, fileStoreIDs, cache=True, mutable=None):
+        """
+        Downloads many files from the job store at once, up to --transferThreads of them at the
+        same time. This is much faster than calling readGlobalFile for each file if the files are
+        small. Each file is stored in the local temp directory under a name chosen by the file
+        store.
+
+        :param list[toil.fileStore.FileID] fileStoreIDs: The job store IDs of the files
+        :param bool cache: Described in :func:`toil.fileStore.CachingFileStore.readGlobalFile`
+        :param bool mutable: Described in :func:`toil.fileStore.CachingFileStore.readGlobalFile`
+        :return: The absolute paths to the local copies of the files, in the order of the IDs
+        :rtype: list[str]
+        """
+        return self._transferConcurrently(partial(self.readGlobalFile, cache=cache,
+                                                  mutable=mutable),
+                                          fileStoreIDs)
+
+    def _transferConcurrently(self, transfer, items):
+        """
+        Applies the given function to each item, in up to --transferThreads threads.
+
+        :return: The results of the function, in the order of the items
+        :rtype: list
+        """
+        threads = min(self.jobStore.config.transferThreads, len(items))
+        if threads <= 1:
+            return [transfer(item) for item in items]
+        pool = ThreadPool(threads)
+        try:
+            return pool.map(transfer, items)
+        finally:
+            pool.terminate()
+            pool.join()
+
     @abstractmethod
     def readGlobalFileStream(self, fileStoreID):
         """
@@ -250,6 +330,132 @@ class FileStore(object):
     def exportFile(self, jobStoreFileID, dstUrl):
         raise NotImplementedError()
 
+    def _readFileFromJobStore(self, fileStoreID, localFilePath):
+        """
+        Moves the prefetched copy of the file to the given path or, if the file wasn't prefetched,
+        downloads it from the job store.
+        """
+        prefetchedFilePath = self._waitForPrefetch(fileStoreID)
+        if prefetchedFilePath is None:
+            self._fetchFile(fileStoreID, localFilePath)
+        else:
+            shutil.move(prefetchedFilePath, localFilePath)
+
+    def _fetchFile(self, fileStoreID, localFilePath):
+        """
+        Downloads the file from the job store to the given path, through the node cache if it is
+        enabled and the file ID carries the key of the file's content.
+        """
+        contentKey = getattr(fileStoreID, 'contentKey', None)
+        if self.nodeCache is None or contentKey is None:
+            self._downloadFile(fileStoreID, localFilePath)
+        elif self.nodeCache.readFile(contentKey, localFilePath,
+                                     partial(self._downloadFile, fileStoreID)):
+            logger.debug('Node cache hit on file with ID \'%s\'.', fileStoreID)
+
+    def _downloadFile(self, fileStoreID, localFilePath):
+        """
+        Downloads the file from the job store to the given path, in parallel parts if the file ID
+        says the file is larger than the configured threshold.
+        """
+        config = self.jobStore.config
+        size = getattr(fileStoreID, 'size', None)
+        if size is not None and size > config.parallelDownloadThreshold:
+            logger.debug('Reading file with ID \'%s\' in parts.', fileStoreID)
+            self.jobStore.readFileInParallel(fileStoreID, localFilePath,
+                                             partSize=config.downloadPartSize,
+                                             threads=config.downloadThreads)
+        else:
+            self.jobStore.readFile(fileStoreID, localFilePath)
+
+    def _readFileStreamFromJobStore(self, fileStoreID):
+        """
+        Like :meth:`_readFileFromJobStore` but returns a context manager yielding a file handle.
+        The file is read from the node cache if it is there, but not added to it otherwise.
+        """
+        prefetchedFilePath = self._waitForPrefetch(fileStoreID)
+        if prefetchedFilePath is not None:
+            return open(prefetchedFilePath, 'rb')
+        contentKey = getattr(fileStoreID, 'contentKey', None)
+        if self.nodeCache is not None and contentKey is not None:
+            cachedFile = self.nodeCache.openFile(contentKey)
+            if cachedFile is not None:
+                logger.debug('Node cache hit on file with ID \'%s\'.', fileStoreID)
+                return cachedFile
+        return self.jobStore.readFileStream(fileStoreID)
+
+    def _startPrefetching(self, fileStoreIDs):
+        """
+        Starts downloading the given files from the job store in the background, such that
+        reading them later only blocks until their download is complete. Files that don't need to
+        be downloaded, according to :meth:`_needsPrefetch`, are skipped.
+
+        :param list[str] fileStoreIDs: The IDs of the files the job declared as its inputs
+        """
+        threads = self.jobStore.config.prefetchThreads
+        fileStoreIDs = [fileStoreID for fileStoreID in set(fileStoreIDs)
+                        if self._needsPrefetch(fileStoreID)]
+        if threads < 1 or not fileStoreIDs:
+            return
+        logger.debug('Prefetching %i input files.', len(fileStoreIDs))
+        prefetchDir = self.getLocalTempDir()
+        self._prefetchPool = ThreadPool(min(threads, len(fileStoreIDs)))
+        self._prefetchStart = self._prefetchEnd = time.time()
+        for fileStoreID in fileStoreIDs:
+            prefetchedFilePath = os.path.join(prefetchDir, str(uuid.uuid4()))
+            result = self._prefetchPool.apply_async(self._prefetch,
+                                                    (fileStoreID, prefetchedFilePath))
+            self._prefetches[fileStoreID] = result, prefetchedFilePath
+        self._prefetchPool.close()
+        self.prefetchStats['files'] += len(fileStoreIDs)
+
+    def _needsPrefetch(self, fileStoreID):
+        """
+        :return: Whether the given input file of the job should be downloaded in the background
+        :rtype: bool
+        """
+        return True
+
+    def _prefetch(self, fileStoreID, prefetchedFilePath):
+        self._fetchFile(fileStoreID, prefetchedFilePath)
+        self._prefetchEnd = max(self._prefetchEnd, time.time())
+
+    def _waitForPrefetch(self, fileStoreID):
+        """
+        Waits for the background download of the given file, if there is one.
+
+        :return: The path of the downloaded file or None if it wasn't prefetched or the download
+                 failed. The file is handed over to the caller and won't be returned again.
+        :rtype: str|None
+        """
+        try:
+            result, prefetchedFilePath = self._prefetches.pop(fileStoreID)
+        except KeyError:
+            return None
+        if not result.ready():
+            start = time.time()
+            result.wait()
+            self.prefetchStats['waitTime'] += time.time() - start
+        try:
+            result.get()
+        except Exception:
+            logger.warning('Failed to prefetch file with ID \'%s\'. Reading it again.',
+                           fileStoreID, exc_info=True)
+            return None
+        return prefetchedFilePath
+
+    def _stopPrefetching(self):
+        """
+        Abandons the background downloads that haven't started yet, waits for the others and
+        records how long prefetching took.
+        """
+        if self._prefetchPool is not None:
+            self._prefetchPool.terminate()
+            self._prefetchPool.join()
+            self._prefetchPool = None
+            self._prefetches.clear()
+            self.prefetchStats['time'] += self._prefetchEnd - self._prefetchStart
+
     # A utility method for accessing filenames
     def _resolveAbsoluteLocalPath(self, filePath):
         """
@@ -267,55 +473,6 @@ class FileStore(object):
         else:
             return os.path.join(self.localTempDir, filePath)
 
-    class _StateFile(object):
-        """
-        Utility class to read and write dill-ed state dictionaries from/to a file into a namespace.
-        """
-        def __init__(self, stateDict):
-            assert isinstance(stateDict, dict)
-            self.__dict__.update(stateDict)
-
-        @abstractclassmethod
-        @contextmanager
-        def open(cls, outer=None):
-            """
-            This is a context manager that state file and reads it into an object that is returned
-            to the user in the yield.
-
-            :param outer: Instance of the calling class (to use outer methods).
-            """
-            raise NotImplementedError()
-
-        @classmethod
-        def _load(cls, fileName):
-            """
-            Load the state of the cache from the state file
-
-            :param str fileName: Path to the cache state file.
-            :return: An instance of the state as a namespace.
-            :rtype: _StateFile
-            """
-            # Read the value from the cache state file then initialize and instance of
-            # _CacheState with it.
-            with open(fileName, 'r') as fH:
-                infoDict = dill.load(fH)
-            return cls(infoDict)
-
-        def write(self, fileName):
-            """
-            Write the current state into a temporary file then atomically rename it to the main
-            state file.
-
-            :param str fileName: Path to the state file.
-            """
-            with open(fileName + '.tmp', 'w') as fH:
-                # Based on answer by user "Mark" at:
-                # http://stackoverflow.com/questions/2709800/how-to-pickle-yourself
-                # We can't pickle nested classes. So we have to pickle the variables of the class
-                # If we ever change this, we need to ensure it doesn't break FileID
-                dill.dump(self.__dict__, fH)
-            os.rename(fileName + '.tmp', fileName)
-
     # Methods related to the deferred function logic
     @abstractclassmethod
     def findAndHandleDeadJobs(cls, nodeInfo, batchSystemShutdown=False):
@@ -420,19 +577,313 @@ class FileStore(object):
         raise NotImplementedError()
 
 
+class EvictionPolicy(object):
+    """
+    Decides in which order the caching file store evicts the files in the cache of a node that no
+    job is using. A cached file gets a priority when it is added to the cache and whenever it is
+    read from the cache, and the files with the lowest priority are evicted first.
+    """
+    __metaclass__ = ABCMeta
+
+    @abstractmethod
+    def priority(self, fileSize, hits, lastAccess, inflation):
+        """
+        :param int fileSize: The size of the cached file in bytes
+        :param int hits: The number of times the file was read from the cache
+        :param float lastAccess: The time the file was last added to or read from the cache
+        :param float inflation: The priority of the most recently evicted file, 0 before the first
+               eviction
+        :rtype: float
+        """
+        raise NotImplementedError()
+
+
+class LRUEvictionPolicy(EvictionPolicy):
+    """
+    Evicts the least recently used file first.
+    """
+
+    def priority(self, fileSize, hits, lastAccess, inflation):
+        return lastAccess
+
+
+class LFUEvictionPolicy(EvictionPolicy):
+    """
+    Evicts the least frequently used file first and among equally used files the least recently
+    used one.
+    """
+
+    def priority(self, fileSize, hits, lastAccess, inflation):
+        return hits
+
+
+class GDSFEvictionPolicy(EvictionPolicy):
+    """
+    Greedy-Dual-Size-Frequency. Evicts the file with the fewest uses per byte first, which keeps
+    many small popular files rather than a few large ones in the cache. Each eviction raises the
+    inflation value, so files that were only popular in the past eventually get evicted too.
+    """
+
+    def priority(self, fileSize, hits, lastAccess, inflation):
+        return inflation + float(hits + 1) / max(fileSize, 1)
+
+
+evictionPolicies = dict(lru=LRUEvictionPolicy, lfu=LFUEvictionPolicy, gdsf=GDSFEvictionPolicy)
+
+
+class NodeCache(object):
+    """
+    A cache of files on a node that is shared by the workflows that run on the node and outlives
+    them, unlike the cache of the caching file store, which belongs to a single workflow. Files
+    are keyed by the SHA-256 digest of their content, such that a file imported by many
+    workflows, a large reference for example, is downloaded only once per node. The node cache
+    has its own size limit, which isn't counted against the disk requirements of jobs, and evicts
+    files according to the eviction policy of the workflow that adds a file to it.
+
+    Only files whose :class:`FileID` carries the key of their content go through the node cache.
+    The job store computes the key when it imports a file while the node cache is enabled.
+    """
+
+    def __init__(self, path, maxSize, policy):
+        """
+        :param str path: The directory of the node cache. It is created if it doesn't exist.
+        :param int maxSize: The maximum total size of the files in the node cache in bytes
+        :param EvictionPolicy policy: The policy by which files are evicted
+        """
+        self.path = path
+        self.maxSize = maxSize
+        self.policy = policy
+        self._connection = None
+        self._semaphore = Semaphore()
+
+    @classmethod
+    def forConfig(cls, config):
+        """
+        :return: The node cache configured for the workflow or None if it is disabled
+        :rtype: NodeCache|None
+        """
+        if config.nodeCacheDir is None:
+            return None
+        return cls(config.nodeCacheDir, config.nodeCacheSize,
+                   evictionPolicies[config.cacheEvictionPolicy]())
+
+    @staticmethod
+    def contentKeyForPath(filePath):
+        """
+        :return: The key of the content of the given file
+        :rtype: str
+        """
+        hasher = sha256()
+        with open(filePath, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                hasher.update(chunk)
+        return hasher.hexdigest()
+
+    class HashingWritable(object):
+        """
+        Wraps a writable stream and computes the key of the content written to it.
+        """
+
+        def __init__(self, writable):
+            self.writable = writable
+            self.hasher = sha256()
+
+        def write(self, data):
+            self.hasher.update(data)
+            self.writable.write(data)
+
+        def __getattr__(self, name):
+            return getattr(self.writable, name)
+
+        @property
+        def contentKey(self):
+            return self.hasher.hexdigest()
+
+    def openFile(self, contentKey):
+        """
+        Opens the file with the given content in the node cache and records the access.
+
+        :return: A file handle or None if the file isn't in the node cache
+        """
+        with self._transaction() as state:
+            row = state.execute('SELECT fileSize, hits FROM files WHERE contentKey = ?',
+                                (contentKey,)).fetchone()
+            if row is None:
+                return None
+            try:
+                cachedFile = open(self._filePath(contentKey), 'rb')
+            except IOError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+                # Someone removed the file from the node cache by hand
+                state.execute('DELETE FROM files WHERE contentKey = ?', (contentKey,))
+                return None
+            fileSize, hits = row
+            self._index(state, contentKey, fileSize, hits + 1)
+            return cachedFile
+
+    def readFile(self, contentKey, localFilePath, download):
+        """
+        Copies the file with the given content to the given path. If the file isn't in the node
+        cache, it is downloaded and added to the node cache first.
+
+        :param str contentKey: The key of the content of the file
+        :param str localFilePath: The path to copy the file to
+        :param callable download: A function that downloads the file to the path passed to it
+        :return: Whether the file was already in the node cache
+        :rtype: bool
+        """
+        cachedFile = self.openFile(contentKey)
+        wasCached = cachedFile is not None
+        if not wasCached:
+            cachedFile = self._addFile(contentKey, localFilePath, download)
+            if cachedFile is None:
+                return False
+        # Once open, the file can be read even if it is evicted in the meantime. The local copy
+        # mustn't be a link since its number of links matters to the caching file store.
+        with cachedFile:
+            with open(localFilePath, 'wb') as localFile:
+                copyFileObj(cachedFile, localFile)
+        return wasCached
+
+    def _addFile(self, contentKey, localFilePath, download):
+        """
+        Downloads the file with the given content into the node cache, evicting other files as
+        needed to stay within the size limit. If the file can't be added, it is moved to the given
+        local path instead.
+
+        :return: A handle on the file in the node cache or None if it couldn't be added
+        """
+        # Makes sure the directory of the node cache exists
+        with self._transaction():
+            pass
+        fd, tempPath = tempfile.mkstemp(dir=self.path, prefix='.')
+        os.close(fd)
+        try:
+            download(tempPath)
+            fileStat = os.stat(tempPath)
+            if fileStat.st_nlink > 1:
+                # The download linked the file, from a job store on the same file system for
+                # example. The node cache outlives the workflow, so it needs a copy of its own.
+                linkPath = tempPath + '.link'
+                os.rename(tempPath, linkPath)
+                try:
+                    copyFile(linkPath, tempPath)
+                finally:
+                    os.remove(linkPath)
+            fileSize = fileStat.st_size
+            if fileSize > self.maxSize:
+                shutil.move(tempPath, localFilePath)
+                return None
+            if self.contentKeyForPath(tempPath) != contentKey:
+                logger.warn('The content of the file downloaded for key %s does not match the '
+                            'key. Not adding it to the node cache.', contentKey)
+                shutil.move(tempPath, localFilePath)
+                return None
+            cachedFilePath = self._filePath(contentKey)
+            try:
+                os.mkdir(os.path.dirname(cachedFilePath))
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+            with self._transaction() as state:
+                self._makeRoom(state, contentKey, fileSize)
+                os.rename(tempPath, cachedFilePath)
+                self._index(state, contentKey, fileSize, 0)
+                return open(cachedFilePath, 'rb')
+        finally:
+            if os.path.exists(tempPath):
+                os.remove(tempPath)
+
+    def _makeRoom(self, state, contentKey, fileSize):
+        """
+        Evicts files until the file with the given content and size fits into the node cache.
+        """
+        (cached,), = state.execute('SELECT COALESCE(SUM(fileSize), 0) FROM files '
+                                   'WHERE contentKey != ?', (contentKey,))
+        evictable = state.execute('SELECT contentKey, fileSize, priority FROM files '
+                                  'WHERE contentKey != ? ORDER BY priority, lastAccess',
+                                  (contentKey,)).fetchall()
+        for evictedKey, evictedSize, priority in evictable:
+            if cached + fileSize <= self.maxSize:
+                break
+            try:
+                os.remove(self._filePath(evictedKey))
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+            state.execute('DELETE FROM files WHERE contentKey = ?', (evictedKey,))
+            state.execute('UPDATE cache SET inflation = ?', (priority,))
+            cached -= evictedSize
+            logger.debug('Evicted file with key %s from the node cache.', evictedKey)
+
+    def _index(self, state, contentKey, fileSize, hits):
+        """
+        Records an access to the file with the given content in the eviction index.
+        """
+        (inflation,), = state.execute('SELECT inflation FROM cache')
+        now = time.time()
+        state.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)',
+                      (contentKey, fileSize, hits, now,
+                       self.policy.priority(fileSize, hits, now, inflation)))
+
+    def _filePath(self, contentKey):
+        return os.path.join(self.path, contentKey[:2], contentKey)
+
+    @contextmanager
+    def _transaction(self):
+        """
+        Runs the body in a write transaction on the index of the node cache, which is created
+        along with the node cache directory if it doesn't exist.
+        """
+        with self._semaphore:
+            if self._connection is None:
+                try:
+                    os.makedirs(self.path)
+                except OSError as e:
+                    if e.errno != errno.EEXIST:
+                        raise
+                connection = CachingFileStore._CacheState.connect(
+                    os.path.join(self.path, 'nodeCache.db'))
+                connection.execute('PRAGMA journal_mode=WAL')
+                with CachingFileStore._CacheState.transaction(connection) as state:
+                    state.execute('CREATE TABLE IF NOT EXISTS files (contentKey TEXT PRIMARY KEY, '
+                                  'fileSize INTEGER, hits INTEGER, lastAccess REAL, '
+                                  'priority REAL)')
+                    state.execute('CREATE INDEX IF NOT EXISTS filesIndex '
+                                  'ON files (priority, lastAccess)')
+                    state.execute('CREATE TABLE IF NOT EXISTS cache (inflation REAL)')
+                    (rows,), = state.execute('SELECT COUNT(*) FROM cache')
+                    if rows == 0:
+                        state.execute('INSERT INTO cache VALUES (0.0)')
+                self._connection = connection
+            with CachingFileStore._CacheState.transaction(self._connection) as state:
+                yield state
+
+    def __del__(self):
+        if self._connection is not None:
+            self._connection.close()
+
+
 class CachingFileStore(FileStore):
     """
     A cache-enabled file store that attempts to use hard-links and asynchronous job store writes to
     reduce I/O between, and during jobs.
     """
 
+    # The maximum number of files waiting to be written to the job store asynchronously
+    maxQueuedWrites = 64
+
     def __init__(self, jobStore, jobGraph, localTempDir, inputBlockFn):
         super(CachingFileStore, self).__init__(jobStore, jobGraph, localTempDir, inputBlockFn)
         # Variables related to asynchronous writes.
-        self.workerNumber = 2
-        self.queue = Queue()
+        self.workerNumber = self.jobStore.config.asyncWriteThreads
+        # Writing to the queue blocks while it is full, which limits the number of file handles
+        # held open for asynchronous writes
+        self.queue = Queue(maxsize=self.maxQueuedWrites)
         self.updateSemaphore = Semaphore()
         self.mutable = self.jobStore.config.readGlobalFileMutableByDefault
+        self.evictionPolicy = evictionPolicies[self.jobStore.config.cacheEvictionPolicy]()
         self.workers = map(lambda i: Thread(target=self.asyncWrite),
                            range(self.workerNumber))
         for worker in self.workers:
@@ -445,6 +896,10 @@ class CachingFileStore(FileStore):
                                           cacheDirName(self.jobStore.config.workflowID))
         self.cacheLockFile = os.path.join(self.localCacheDir, '.cacheLock')
         self.cacheStateFile = os.path.join(self.localCacheDir, '_cacheState')
+        # The connection to the cache state database, opened once the cache directory exists. The
+        # semaphore serializes the transactions of the threads of this instance on it.
+        self._stateConnection = None
+        self._stateSemaphore = Semaphore()
         # Since each worker has it's own unique CachingFileStore instance, and only one Job can run
         # at a time on a worker, we can bookkeep the job's file store operated files in a
         # dictionary.
@@ -471,13 +926,13 @@ class CachingFileStore(FileStore):
         startingDir = os.getcwd()
         self.localTempDir = makePublicDir(os.path.join(self.localTempDir, str(uuid.uuid4())))
         # Check the status of all jobs on this node. If there are jobs that started and died before
-        # cleaning up their presence from the cache state file, restore the cache file to a state
-        # where the jobs don't exist.
-        with self._CacheState.open(self) as cacheInfo:
-            self.findAndHandleDeadJobs(cacheInfo)
-            # While we have a lock on the cache file, run a naive check to see if jobs on this node
-            # have greatly gone over their requested limits.
-            if cacheInfo.sigmaJob < 0:
+        # cleaning up their presence from the cache state, restore the cache state to one where
+        # the jobs don't exist.
+        self.findAndHandleDeadJobs(self.localCacheDir)
+        with self._stateTransaction(write=False) as state:
+            # Run a naive check to see if jobs on this node have greatly gone over their requested
+            # limits.
+            if self._CacheState.load(state).sigmaJob < 0:
                 logger.warning('Detecting that one or more jobs on this node have used more '
                                'resources than requested.  Turn on debug logs to see more'
                                'information on cache usage.')
@@ -487,9 +942,12 @@ class CachingFileStore(FileStore):
         # Cleanup the cache to free up enough space for this job (if needed)
         self.cleanCache(jobReqs)
         try:
-            os.chdir(self.localTempDir)
+            if self._changeDir:
+                os.chdir(self.localTempDir)
+            self._startPrefetching(job._inputs)
             yield
         finally:
+            self._stopPrefetching()
             diskUsed = getDirSizeRecursively(self.localTempDir)
             logString = ("Job {jobName} used {percent:.2f}% ({humanDisk}B [{disk}B] used, "
                          "{humanRequestedDisk}B [{requestedDisk}B] requested) at the end of "
@@ -506,18 +964,32 @@ class CachingFileStore(FileStore):
                                  "the user script to avoid the chance  of failure due to "
                                  "incorrectly requested resources. " + logString,
                                  level=logging.WARNING)
-            os.chdir(startingDir)
+            if self.cacheStats:
+                self.logToMaster('CACHE: Job {jobName} had {hits} cache hits and {misses} cache '
+                                 'misses, and evicted {humanEvicted}B [{evicted}B] from the '
+                                 'cache.'.format(jobName=self.jobName,
+                                                 hits=self.cacheStats['hits'],
+                                                 misses=self.cacheStats['misses'],
+                                                 humanEvicted=bytes2human(
+                                                     self.cacheStats['evictedBytes']),
+                                                 evicted=self.cacheStats['evictedBytes']),
+                                 level=logging.DEBUG)
+            if self._changeDir:
+                os.chdir(startingDir)
             self.cleanupInProgress = True
             # Delete all the job specific files and return sizes to jobReqs
             self.returnJobReqs(jobReqs)
-            with self._CacheState.open(self) as cacheInfo:
-                # Carry out any user-defined cleanup actions
-                deferredFunctions = cacheInfo.jobState[self.jobID]['deferredFunctions']
-                failures = self._runDeferredFunctions(deferredFunctions)
-                for failure in failures:
-                    self.logToMaster('Deferred function "%s" failed.' % failure, logging.WARN)
-                # Finally delete the job from the cache state file
-                cacheInfo.jobState.pop(self.jobID)
+            # Carry out any user-defined cleanup actions
+            with self._stateTransaction(write=False) as state:
+                deferredFunctions = self._CacheState.getJob(state, self.jobID)['deferredFunctions']
+            failures = self._runDeferredFunctions(deferredFunctions)
+            for failure in failures:
+                self.logToMaster('Deferred function "%s" failed.' % failure, logging.WARN)
+            # Finally delete the job from the cache state
+            with self._stateTransaction() as state:
+                self._CacheState.recordReads(state, self.cacheStats['hits'],
+                                             self.cacheStats['misses'])
+                self._CacheState.removeJob(state, self.jobID)
 
     # Functions related to reading, writing and removing files to/from the job store
     def writeGlobalFile(self, localFileName, cleanup=False):
@@ -526,6 +998,33 @@ class CachingFileStore(FileStore):
         used, carry out the appropriate cache functions.
         """
         absLocalFileName = self._resolveAbsoluteLocalPath(localFileName)
+        # If the file is from the scope of local temp dir
+        if absLocalFileName.startswith(self.localTempDir):
+            # Can read without a lock because we're only reading job-specific info.
+            with self._stateTransaction(write=False) as state:
+                jobSpecificFiles = self._CacheState.getJobFilePaths(state, self.jobID)
+            jobStoreFileID = self._uploadFile(absLocalFileName, cleanup, jobSpecificFiles)
+            # Local files are cached by default, unless they were written from previously read
+            # files.
+            if absLocalFileName not in jobSpecificFiles:
+                self.addToCache(absLocalFileName, jobStoreFileID, 'write')
+            else:
+                self._updateJobSpecificFiles(jobStoreFileID, absLocalFileName, 0.0, False)
+        else:
+            jobStoreFileID = self._uploadFile(absLocalFileName, cleanup)
+            # Non local files are NOT cached by default, but they are tracked as local files.
+            self._updateJobSpecificFiles(jobStoreFileID, None, 0.0, False)
+        return FileID.forPath(jobStoreFileID, absLocalFileName)
+
+    def _uploadFile(self, absLocalFileName, cleanup, jobSpecificFiles=()):
+        """
+        Writes a file to the job store for writeGlobalFile() but leaves caching it to the caller.
+
+        :param list[str] jobSpecificFiles: The paths of the local copies of files the job has
+               read or written
+        :return: The job store ID of the file
+        :rtype: str
+        """
         # What does this do?
         cleanupID = None if not cleanup else self.jobGraph.jobStoreID
         # If the file is from the scope of local temp dir
@@ -535,9 +1034,6 @@ class CachingFileStore(FileStore):
             # barring the case where the file being written was one that was previously read
             # from the file store. In that case, you want to copy to the file store so that
             # the two have distinct nlink counts.
-            # Can read without a lock because we're only reading job-specific info.
-            jobSpecificFiles = self._CacheState._load(self.cacheStateFile).jobState[
-                self.jobID]['filesToFSIDs'].keys()
             # Saying nlink is 2 implicitly means we are using the job file store, and it is on
             # the same device as the work dir.
             if self.nlinkThreshold == 2 and absLocalFileName not in jobSpecificFiles:
@@ -566,24 +1062,56 @@ class CachingFileStore(FileStore):
                 # A file handle added to the queue allows the asyncWrite threads to remove their
                 # jobID from _pendingFileWrites. Therefore, a file should only be added after
                 # its fileID is added to _pendingFileWrites
-                self.queue.put((fileHandle, jobStoreFileID))
+                while True:
+                    try:
+                        self.queue.put((fileHandle, jobStoreFileID), timeout=2)
+                    except Full:
+                        if self._terminateEvent.isSet():
+                            raise RuntimeError("The termination flag is set, exiting")
+                    else:
+                        break
             # Else write directly to the job store.
             else:
                 jobStoreFileID = self.jobStore.writeFile(absLocalFileName, cleanupID)
-            # Local files are cached by default, unless they were written from previously read
-            # files.
-            if absLocalFileName not in jobSpecificFiles:
-                self.addToCache(absLocalFileName, jobStoreFileID, 'write')
-            else:
-                self._JobState.updateJobSpecificFiles(self, jobStoreFileID, absLocalFileName,
-                                                      0.0, False)
         # Else write directly to the job store.
         else:
             jobStoreFileID = self.jobStore.writeFile(absLocalFileName, cleanupID)
-            # Non local files are NOT cached by default, but they are tracked as local files.
-            self._JobState.updateJobSpecificFiles(self, jobStoreFileID, None,
-                                                  0.0, False)
-        return FileID.forPath(jobStoreFileID, absLocalFileName)
+        return jobStoreFileID
+
+    def writeGlobalFiles(self, localFileNames, cleanup=False):
+        """
+        Like :meth:`FileStore.writeGlobalFiles` but the files are also added to the cache as
+        writeGlobalFile() does, taking the cache lock and updating the cache state once for all
+        of them.
+        """
+        absLocalFileNames = [self._resolveAbsoluteLocalPath(localFileName)
+                             for localFileName in localFileNames]
+        # Can read without a lock because we're only reading job-specific info.
+        with self._stateTransaction(write=False) as state:
+            jobSpecificFiles = set(self._CacheState.getJobFilePaths(state, self.jobID))
+        jobStoreFileIDs = self._transferConcurrently(
+            lambda absLocalFileName: self._uploadFile(absLocalFileName, cleanup,
+                                                      jobSpecificFiles),
+            absLocalFileNames)
+        balanced = True
+        with self.cacheLock():
+            with self._stateTransaction() as state:
+                for absLocalFileName, jobStoreFileID in zip(absLocalFileNames, jobStoreFileIDs):
+                    if not absLocalFileName.startswith(self.localTempDir):
+                        self._CacheState.addJobFile(state, self.jobID, jobStoreFileID, None,
+                                                    0.0, False)
+                    elif absLocalFileName in jobSpecificFiles:
+                        self._CacheState.addJobFile(state, self.jobID, jobStoreFileID,
+                                                    absLocalFileName, 0.0, False)
+                    else:
+                        cacheInfo = self._addToCache(state, absLocalFileName, jobStoreFileID,
+                                                     'write', self.mutable)
+                        balanced = balanced and cacheInfo.isBalanced()
+        if not balanced:
+            self.logToMaster('CACHE: The cache was not balanced on returning file size',
+                             logging.WARN)
+        return [FileID.forPath(jobStoreFileID, absLocalFileName)
+                for absLocalFileName, jobStoreFileID in zip(absLocalFileNames, jobStoreFileIDs)]
 
     def writeGlobalFileStream(self, cleanup=False):
         # TODO: Make this work with caching
@@ -638,14 +1166,14 @@ class CachingFileStore(FileStore):
         with self.cacheLock() as lockFileHandle:
             if fileIsLocal and self._fileIsCached(fileStoreID):
                 logger.debug('CACHE: Cache hit on file with ID \'%s\'.' % fileStoreID)
+                self.cacheStats['hits'] += 1
                 assert not os.path.exists(localFilePath)
                 if mutable:
-                    shutil.copyfile(cachedFileName, localFilePath)
-                    cacheInfo = self._CacheState._load(self.cacheStateFile)
-                    jobState = self._JobState(cacheInfo.jobState[self.jobID])
-                    jobState.addToJobSpecFiles(fileStoreID, localFilePath, -1, None)
-                    cacheInfo.jobState[self.jobID] = jobState.__dict__
-                    cacheInfo.write(self.cacheStateFile)
+                    copyFile(cachedFileName, localFilePath)
+                    with self._stateTransaction() as state:
+                        self._CacheState.addJobFile(state, self.jobID, fileStoreID, localFilePath,
+                                                    -1, None)
+                        self._CacheState.recordCacheHit(state, fileStoreID, self.evictionPolicy)
                 else:
                     os.link(cachedFileName, localFilePath)
                     self.returnFileSize(fileStoreID, localFilePath, lockFileHandle,
@@ -666,6 +1194,7 @@ class CachingFileStore(FileStore):
             # cache if specified.
             else:
                 logger.debug('CACHE: Cache miss on file with ID \'%s\'.' % fileStoreID)
+                self.cacheStats['misses'] += 1
                 if fileIsLocal and cache:
                     # If caching of the downloaded file is desired, First create the harbinger
                     # file so other jobs know not to redundantly download the same file.  Write
@@ -678,8 +1207,8 @@ class CachingFileStore(FileStore):
                     # Use try:finally: so that the .harbinger file is removed whether the
                     # download succeeds or not.
                     try:
-                        self.jobStore.readFile(fileStoreID,
-                                               '/.'.join(os.path.split(cachedFileName)))
+                        self._readFileFromJobStore(fileStoreID,
+                                                   '/.'.join(os.path.split(cachedFileName)))
                     except:
                         if os.path.exists('/.'.join(os.path.split(cachedFileName))):
                             os.remove('/.'.join(os.path.split(cachedFileName)))
@@ -698,7 +1227,7 @@ class CachingFileStore(FileStore):
                 else:
                     # Release the cache lock since the remaining stuff is not cache related.
                     flock(lockFileHandle, LOCK_UN)
-                    self.jobStore.readFile(fileStoreID, localFilePath)
+                    self._readFileFromJobStore(fileStoreID, localFilePath)
                     os.chmod(localFilePath, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
                     # Now that we have the file, we have 2 options. It's modifiable or not.
                     # Either way, we need to account for FileJobStore making links instead of
@@ -709,18 +1238,142 @@ class CachingFileStore(FileStore):
                             # job store is FilejobStore, and the job store and local temp dir
                             # are on the same device. An atomic rename removes the nlink on the
                             # file handle linked from the job store.
-                            shutil.copyfile(localFilePath, localFilePath + '.tmp')
+                            copyFile(localFilePath, localFilePath + '.tmp')
                             os.rename(localFilePath + '.tmp', localFilePath)
-                        self._JobState.updateJobSpecificFiles(self, fileStoreID, localFilePath,
-                                                              -1, False)
+                        self._updateJobSpecificFiles(fileStoreID, localFilePath, -1, False)
                     # If it was immutable
                     else:
                         if self.nlinkThreshold == 2:
                             self._accountForNlinkEquals2(localFilePath)
-                        self._JobState.updateJobSpecificFiles(self, fileStoreID, localFilePath,
-                                                              0.0, False)
+                        self._updateJobSpecificFiles(fileStoreID, localFilePath, 0.0, False)
         return localFilePath
 
+    def readGlobalFiles(self, fileStoreIDs, cache=True, mutable=None):
+        """
+        Like :meth:`FileStore.readGlobalFiles` but the cache is used as readGlobalFile() does.
+        The cache lock is taken and the cache state is updated once for the files that are
+        already cached and once for the files that are downloaded, instead of for each file.
+        """
+        for fileStoreID in fileStoreIDs:
+            if fileStoreID in self.filesToDelete:
+                raise RuntimeError('Trying to access a file in the jobStore you\'ve deleted: '
+                                   '%s' % fileStoreID)
+        if mutable is None:
+            mutable = self.mutable
+        localFilePaths = [self.getLocalTempFileName() for _ in fileStoreIDs]
+        # The files this job downloads, and the harbingers of the ones it will add to the cache
+        downloads = []
+        harbingerFiles = {}
+        # The files that another job is downloading, or this one is already
+        pendingFiles = []
+        balanced = True
+        with self.cacheLock():
+            with self._stateTransaction() as state:
+                for fileStoreID, localFilePath in zip(fileStoreIDs, localFilePaths):
+                    harbingerFile = self.HarbingerFile(self, fileStoreID=fileStoreID)
+                    if self._fileIsCached(fileStoreID):
+                        logger.debug('CACHE: Cache hit on file with ID \'%s\'.' % fileStoreID)
+                        self.cacheStats['hits'] += 1
+                        if mutable:
+                            copyFile(self.encodedFileID(fileStoreID), localFilePath)
+                            self._CacheState.addJobFile(state, self.jobID, fileStoreID,
+                                                        localFilePath, -1, None)
+                            self._CacheState.recordCacheHit(state, fileStoreID,
+                                                            self.evictionPolicy)
+                        else:
+                            os.link(self.encodedFileID(fileStoreID), localFilePath)
+                            cacheInfo = self._returnFileSize(state, fileStoreID, localFilePath,
+                                                             fileAlreadyCached=True)
+                            balanced = balanced and cacheInfo.isBalanced()
+                    elif fileStoreID in harbingerFiles or harbingerFile.exists():
+                        pendingFiles.append((fileStoreID, localFilePath))
+                    else:
+                        logger.debug('CACHE: Cache miss on file with ID \'%s\'.' % fileStoreID)
+                        self.cacheStats['misses'] += 1
+                        downloads.append((fileStoreID, localFilePath))
+                        if cache:
+                            # Tell other jobs not to download the file, see readGlobalFile()
+                            harbingerFile.write()
+                            harbingerFiles[fileStoreID] = harbingerFile
+        if cache:
+            balanced = self._downloadIntoCache(downloads, harbingerFiles, mutable) and balanced
+        else:
+            self._transferConcurrently(lambda download: self._readFileFromJobStore(*download),
+                                       downloads)
+            with self._stateTransaction() as state:
+                for fileStoreID, localFilePath in downloads:
+                    self._addUncachedFile(state, fileStoreID, localFilePath, mutable)
+        if not balanced:
+            self.logToMaster('CACHE: The cache was not balanced on returning file size',
+                             logging.WARN)
+        # By now, the files this job downloaded are in the cache unless there was no room
+        for fileStoreID, localFilePath in pendingFiles:
+            self.readGlobalFile(fileStoreID, userPath=localFilePath, cache=cache, mutable=mutable)
+        return localFilePaths
+
+    def _downloadIntoCache(self, downloads, harbingerFiles, mutable):
+        """
+        Downloads files into the cache for readGlobalFiles() and then adds them to the cache with
+        the cache lock held and in a single cache state transaction.
+
+        :param list[(str, str)] downloads: The job store ID of each file and the path of the
+               local copy of it to create
+        :param dict[str,CachingFileStore.HarbingerFile] harbingerFiles: The harbinger of each
+               file, all of which are deleted in the end
+        :return: Whether the cache was balanced after returning the size of every file to the job
+        :rtype: bool
+        """
+        def partialFileName(fileStoreID):
+            return '/.'.join(os.path.split(self.encodedFileID(fileStoreID)))
+
+        try:
+            self._transferConcurrently(
+                lambda download: self._readFileFromJobStore(download[0],
+                                                            partialFileName(download[0])),
+                downloads)
+        except:
+            with self.cacheLock():
+                for fileStoreID, harbingerFile in iteritems(harbingerFiles):
+                    if os.path.exists(partialFileName(fileStoreID)):
+                        os.remove(partialFileName(fileStoreID))
+                    harbingerFile._delete()
+            raise
+        balanced = True
+        with self.cacheLock():
+            try:
+                with self._stateTransaction() as state:
+                    for fileStoreID, localFilePath in downloads:
+                        os.rename(partialFileName(fileStoreID), self.encodedFileID(fileStoreID))
+                        cacheInfo = self._addToCache(state, localFilePath, fileStoreID, 'read',
+                                                     mutable)
+                        if cacheInfo is not None:
+                            balanced = balanced and cacheInfo.isBalanced()
+            finally:
+                for harbingerFile in itervalues(harbingerFiles):
+                    harbingerFile._delete()
+        return balanced
+
+    def _addUncachedFile(self, state, fileStoreID, localFilePath, mutable):
+        """
+        Records a file that was downloaded without adding it to the cache, like readGlobalFile()
+        does, in the given cache state transaction.
+        """
+        os.chmod(localFilePath, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+        if mutable:
+            if self.nlinkThreshold == 2:
+                # Break the link to the job store copy, see readGlobalFile()
+                copyFile(localFilePath, localFilePath + '.tmp')
+                os.rename(localFilePath + '.tmp', localFilePath)
+            self._CacheState.addJobFile(state, self.jobID, fileStoreID, localFilePath, -1,
+                                        False)
+        else:
+            if self.nlinkThreshold == 2:
+                fileStats = os.stat(localFilePath)
+                assert fileStats.st_nlink >= self.nlinkThreshold
+                self._CacheState.update(state, sigmaJob=-fileStats.st_size)
+            self._CacheState.addJobFile(state, self.jobID, fileStoreID, localFilePath, 0.0,
+                                        False)
+
     def exportFile(self, jobStoreFileID, dstUrl):
         while jobStoreFileID in self._pendingFileWrites:
             # The file is still being writting to the job store - wait for this process to finish prior to
@@ -729,101 +1382,205 @@ class CachingFileStore(FileStore):
         self.jobStore.exportFile(jobStoreFileID, dstUrl)
 
     def readGlobalFileStream(self, fileStoreID):
+        """
+        Returns a handle to the cached copy of the file if there is one. Otherwise the file is
+        written to the cache while it is streamed from the job store, so the caller can start
+        reading before the download is complete. If another job on the node is already streaming
+        the file into the cache, the handle follows that download instead of starting another.
+        """
         if fileStoreID in self.filesToDelete:
             raise RuntimeError(
                 "Trying to access a file in the jobStore you've deleted: %s" % fileStoreID)
-
-        # If fileStoreID is in the cache provide a handle from the local cache
-        if self._fileIsCached(fileStoreID):
-            logger.debug('CACHE: Cache hit on file with ID \'%s\'.' % fileStoreID)
-            return open(self.encodedFileID(fileStoreID), 'r')
-        else:
+        cachedFileName = self.encodedFileID(fileStoreID)
+        harbingerFile = self.HarbingerFile(self, cachedFileName=cachedFileName)
+        with self.cacheLock() as lockFileHandle:
+            # A file that is downloaded in full before being cached can't be followed, so wait
+            # for it like readGlobalFile does.
+            while (not self._fileIsCached(fileStoreID) and harbingerFile.exists() and
+                   not os.path.exists(harbingerFile.streamingFileName)):
+                harbingerFile.waitOnDownload(lockFileHandle)
+            # If fileStoreID is in the cache provide a handle from the local cache
+            if self._fileIsCached(fileStoreID):
+                logger.debug('CACHE: Cache hit on file with ID \'%s\'.' % fileStoreID)
+                self.cacheStats['hits'] += 1
+                with self._stateTransaction() as state:
+                    self._CacheState.recordCacheHit(state, fileStoreID, self.evictionPolicy)
+                return open(cachedFileName, 'r')
+            elif harbingerFile.exists():
+                logger.debug('CACHE: Following the download of file with ID \'%s\' into the '
+                             'cache.' % fileStoreID)
+                self.cacheStats['hits'] += 1
+                return io.BufferedReader(self.DownloadFollower(self, harbingerFile))
             logger.debug('CACHE: Cache miss on file with ID \'%s\'.' % fileStoreID)
-            return self.jobStore.readFileStream(fileStoreID)
+            self.cacheStats['misses'] += 1
+            fileSize = getattr(fileStoreID, 'size', None)
+            if (self.nlinkThreshold == 2 or fileStoreID in self._prefetches or
+                    fileSize is None):
+                # Files in a local job store are linked into the cache rather than copied and a
+                # prefetched file is already on the node, so there is nothing to gain. Without
+                # its size, there is no telling whether the file would fit into the cache.
+                return self._readFileStreamFromJobStore(fileStoreID)
+            with self._stateTransaction() as state:
+                cacheInfo = self._CacheState.load(state)
+                cacheInfo.sigmaJob += fileSize
+                if not cacheInfo.isBalanced():
+                    logger.debug('CACHE: No room to stream file with ID \'%s\' into the '
+                                 'cache.' % fileStoreID)
+                    return self._readFileStreamFromJobStore(fileStoreID)
+                # Count the copy against this job's disk while it is being written, such that
+                # the space is returned should the job die
+                self._CacheState.update(state, sigmaJob=fileSize)
+                self._CacheState.addToJobReqs(state, self.jobID, fileSize)
+            # Announce the download to other jobs before creating the file they can follow
+            harbingerFile.write()
+            partialFile = io.open(harbingerFile.streamingFileName, 'wb', buffering=0)
+        return self._streamIntoCache(fileStoreID, fileSize, partialFile, harbingerFile)
+
+    @contextmanager
+    def _streamIntoCache(self, fileStoreID, fileSize, partialFile, harbingerFile):
+        """
+        Yields a handle to the file in the job store that passes everything read through it on
+        to the partial copy of the file in the cache. If the caller reads the entire file, the
+        copy is added to the cache if there is still room for it. Otherwise it is dropped.
+
+        :param int fileSize: The size of the file, which was added to this job's disk
+        :param file partialFile: The streaming file of the harbinger, opened for writing
+        :param CachingFileStore.HarbingerFile harbingerFile: The harbinger of the download
+        """
+        try:
+            with partialFile:
+                with self._readFileStreamFromJobStore(fileStoreID) as source:
+                    reader = self.CacheFillingReader(source, partialFile)
+                    yield io.BufferedReader(reader)
+        except:
+            self._abandonStreamIntoCache(fileSize, harbingerFile)
+            raise
+        if not reader.complete:
+            # Rather than download the rest of a file the caller doesn't need, drop the partial
+            # copy. Jobs following the download read the rest from the job store.
+            logger.debug('CACHE: Not caching file with ID \'%s\', which was only read in '
+                         'part.' % fileStoreID)
+            self._abandonStreamIntoCache(fileSize, harbingerFile)
+            return
+        cachedFileName = self.encodedFileID(fileStoreID)
+        with self.cacheLock():
+            os.rename(harbingerFile.streamingFileName, cachedFileName)
+            # Cached files can never be modified.
+            os.chmod(cachedFileName, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+            with self._stateTransaction() as state:
+                # The copy now counts against the cache instead of the job
+                self._CacheState.update(state, sigmaJob=-fileSize)
+                self._CacheState.addToJobReqs(state, self.jobID, -fileSize)
+                fileSize = os.stat(cachedFileName).st_size
+                cacheInfo = self._CacheState.load(state)
+                cacheInfo.cached += fileSize
+                if cacheInfo.isBalanced():
+                    logger.debug('CACHE: Added file with ID \'%s\' to the cache.' % fileStoreID)
+                    self._CacheState.addCachedFile(state, fileStoreID, fileSize,
+                                                   self.evictionPolicy)
+                else:
+                    os.remove(cachedFileName)
+                    cacheInfo.cached -= fileSize
+                    logger.debug('CACHE: Could not add streamed file with ID \'%s\' to the '
+                                 'cache.' % fileStoreID)
+                cacheInfo.save(state)
+            # Only now that the outcome is known may the jobs following the download stop
+            harbingerFile._delete()
+
+    def _abandonStreamIntoCache(self, fileSize, harbingerFile):
+        """
+        Drops the partial copy of a file that was being streamed into the cache and returns
+        the space reserved for it, see _streamIntoCache().
+        """
+        with self.cacheLock():
+            with self._stateTransaction() as state:
+                self._CacheState.update(state, sigmaJob=-fileSize)
+                self._CacheState.addToJobReqs(state, self.jobID, -fileSize)
+            # Deleting the harbinger also deletes the partial copy
+            harbingerFile._delete()
 
     def deleteLocalFile(self, fileStoreID):
-        # The local file may or may not have been cached. If it was, we need to do some
-        # bookkeeping. If it wasn't, we just delete the file and continue with no might need
-        # some bookkeeping if the file store and cache live on the same filesystem. We can know
-        # if a file was cached or not based on the value held in the third tuple value for the
-        # dict item having key = fileStoreID. If it was cached, it holds the value True else
-        # False.
-        with self._CacheState.open(self) as cacheInfo:
-            jobState = self._JobState(cacheInfo.jobState[self.jobID])
-            if fileStoreID not in jobState.jobSpecificFiles.keys():
-                # EOENT indicates that the file did not exist
-                raise OSError(errno.ENOENT, "Attempting to delete a non-local file")
-            # filesToDelete is a dictionary of file: fileSize
-            filesToDelete = jobState.jobSpecificFiles[fileStoreID]
-            allOwnedFiles = jobState.filesToFSIDs
-            for (fileToDelete, fileSize) in filesToDelete.items():
-                # Handle the case where a file not in the local temp dir was written to
-                # filestore
-                if fileToDelete is None:
-                    filesToDelete.pop(fileToDelete)
-                    allOwnedFiles[fileToDelete].remove(fileStoreID)
-                    cacheInfo.jobState[self.jobID] = jobState.__dict__
-                    cacheInfo.write(self.cacheStateFile)
-                    continue
-                # If the file size is zero (copied into the local temp dir) or -1 (mutable), we
-                # can safely delete without any bookkeeping
-                if fileSize in (0, -1):
-                    # Only remove the file if there is only one FSID associated with it.
-                    if len(allOwnedFiles[fileToDelete]) == 1:
-                        try:
-                            os.remove(fileToDelete)
-                        except OSError as err:
-                            if err.errno == errno.ENOENT and fileSize == -1:
-                                logger.debug('%s was read mutably and deleted by the user',
-                                             fileToDelete)
-                            else:
-                                raise IllegalDeletionCacheError(fileToDelete)
-                    allOwnedFiles[fileToDelete].remove(fileStoreID)
-                    filesToDelete.pop(fileToDelete)
-                    cacheInfo.jobState[self.jobID] = jobState.__dict__
-                    cacheInfo.write(self.cacheStateFile)
-                    continue
-                # If not, we need to do bookkeeping
-                # Get the size of the file to be deleted, and the number of jobs using the file
-                # at the moment.
-                if not os.path.exists(fileToDelete):
-                    raise IllegalDeletionCacheError(fileToDelete)
-                fileStats = os.stat(fileToDelete)
-                if fileSize != fileStats.st_size:
-                    logger.warn("the size on record differed from the real size by " +
-                                "%s bytes" % str(fileSize - fileStats.st_size))
-                # Remove the file and return file size to the job
-                if len(allOwnedFiles[fileToDelete]) == 1:
-                    os.remove(fileToDelete)
-                cacheInfo.sigmaJob += fileSize
-                filesToDelete.pop(fileToDelete)
-                allOwnedFiles[fileToDelete].remove(fileStoreID)
-                jobState.updateJobReqs(fileSize, 'remove')
-                cacheInfo.jobState[self.jobID] = jobState.__dict__
-            # If the job is not in the process of cleaning up, then we may need to remove the
-            # cached copy of the file as well.
-            if not self.cleanupInProgress:
-                # If the file is cached and if other jobs are using the cached copy of the file,
-                # or if retaining the file in the cache doesn't affect the cache equation, then
-                # don't remove it from cache.
-                if self._fileIsCached(fileStoreID):
-                    cachedFile = self.encodedFileID(fileStoreID)
-                    jobsUsingFile = os.stat(cachedFile).st_nlink
-                    if not cacheInfo.isBalanced() and jobsUsingFile == self.nlinkThreshold:
-                        os.remove(cachedFile)
-                        cacheInfo.cached -= fileSize
-                self.logToMaster('Successfully deleted cached copy of file with ID '
-                                 '\'%s\'.' % fileStoreID, level=logging.DEBUG)
-            self.logToMaster('Successfully deleted local copies of file with ID '
-                             '\'%s\'.' % fileStoreID, level=logging.DEBUG)
+        # The local copies of the file may or may not be links to the cached copy. If they are, we
+        # need to do some bookkeeping and removing them changes the number of jobs using the
+        # cached copy, so this happens with the cache lock held.
+        with self.cacheLock():
+            with self._stateTransaction() as state:
+                self._deleteLocalCopies(state, fileStoreID)
+                # If the job is not in the process of cleaning up, then we may need to remove the
+                # cached copy of the file as well.
+                if not self.cleanupInProgress:
+                    # If the file is cached and if other jobs are using the cached copy of the
+                    # file, or if retaining the file in the cache doesn't affect the cache
+                    # equation, then don't remove it from cache.
+                    if self._fileIsCached(fileStoreID):
+                        cachedFile = self.encodedFileID(fileStoreID)
+                        cachedFileStats = os.stat(cachedFile)
+                        cacheInfo = self._CacheState.load(state)
+                        if (not cacheInfo.isBalanced() and
+                                cachedFileStats.st_nlink == self.nlinkThreshold):
+                            os.remove(cachedFile)
+                            if self.nlinkThreshold != 2:
+                                cacheInfo.cached -= cachedFileStats.st_size
+                            cacheInfo.save(state)
+                            self._CacheState.removeCachedFile(state, fileStoreID)
+                    self.logToMaster('Successfully deleted cached copy of file with ID '
+                                     '\'%s\'.' % fileStoreID, level=logging.DEBUG)
+        self.logToMaster('Successfully deleted local copies of file with ID '
+                         '\'%s\'.' % fileStoreID, level=logging.DEBUG)
+
+    def _deleteLocalCopies(self, state, fileStoreID):
+        """
+        Deletes the local copies of the file made by this job and returns the size of those that
+        are links to the cached copy to the job. The cache lock must be held.
+
+        :param sqlite3.Connection state: The cache state, in a transaction
+        :param str fileStoreID: job store Identifier for the file
+        """
+        jobFiles = self._CacheState.getJobFiles(state, self.jobID, fileStoreID)
+        if not jobFiles:
+            # EOENT indicates that the file did not exist
+            raise OSError(errno.ENOENT, "Attempting to delete a non-local file")
+        for fileToDelete, fileSize in jobFiles:
+            # Handle the case where a file not in the local temp dir was written to filestore
+            if fileToDelete is None:
+                self._CacheState.removeJobFile(state, self.jobID, fileStoreID, fileToDelete)
+                continue
+            # Only remove the file if there is only one FSID associated with it.
+            isOnlyCopy = self._CacheState.countJobFileIDs(state, self.jobID, fileToDelete) == 1
+            # If the file size is zero (copied into the local temp dir) or -1 (mutable), we can
+            # safely delete without any bookkeeping
+            if fileSize in (0, -1):
+                if isOnlyCopy:
+                    try:
+                        os.remove(fileToDelete)
+                    except OSError as err:
+                        if err.errno == errno.ENOENT and fileSize == -1:
+                            logger.debug('%s was read mutably and deleted by the user',
+                                         fileToDelete)
+                        else:
+                            raise IllegalDeletionCacheError(fileToDelete)
+                self._CacheState.removeJobFile(state, self.jobID, fileStoreID, fileToDelete)
+                continue
+            # If not, we need to do bookkeeping
+            # Get the size of the file to be deleted, and the number of jobs using the file
+            # at the moment.
+            if not os.path.exists(fileToDelete):
+                raise IllegalDeletionCacheError(fileToDelete)
+            fileStats = os.stat(fileToDelete)
+            if fileSize != fileStats.st_size:
+                logger.warn("the size on record differed from the real size by " +
+                            "%s bytes" % str(fileSize - fileStats.st_size))
+            # Remove the file and return file size to the job
+            if isOnlyCopy:
+                os.remove(fileToDelete)
+            self._CacheState.update(state, sigmaJob=fileSize)
+            self._CacheState.removeJobFile(state, self.jobID, fileStoreID, fileToDelete)
+            self._CacheState.addToJobReqs(state, self.jobID, fileSize)
 
     def deleteGlobalFile(self, fileStoreID):
-        jobStateIsPopulated = False
-        with self._CacheState.open(self) as cacheInfo:
-            if self.jobID in cacheInfo.jobState:
-                jobState = self._JobState(cacheInfo.jobState[self.jobID])
-                jobStateIsPopulated = True
-        if jobStateIsPopulated and fileStoreID in jobState.jobSpecificFiles.keys():
+        with self._stateTransaction(write=False) as state:
+            jobFiles = self._CacheState.getJobFiles(state, self.jobID, fileStoreID)
+        if jobFiles:
             # Use deleteLocalFile in the backend to delete the local copy of the file.
             self.deleteLocalFile(fileStoreID)
             # At this point, the local file has been deleted, and possibly the cached copy. If
@@ -861,6 +1618,20 @@ class CachingFileStore(FileStore):
             cacheLockFile.close()
             logger.debug("CACHE: Released lock")
 
+    @contextmanager
+    def _stateTransaction(self, write=True):
+        """
+        This is a context manager to run a transaction on the cache state, see _CacheState. To
+        avoid deadlocks between workers, the cache lock must be acquired before the transaction
+        is begun, never while it is open.
+
+        :param bool write: Whether the state is updated in the transaction
+        :yields: The connection to the cache state database, in the transaction
+        """
+        with self._stateSemaphore:
+            with self._CacheState.transaction(self._stateConnection, write) as state:
+                yield state
+
     def _setupCache(self):
         """
         Setup the cache based on the provided values for localCacheDir.
@@ -886,22 +1657,41 @@ class CachingFileStore(FileStore):
                 else:
                     raise
         # You can't reach here unless a local cache directory has been created successfully
-        with self._CacheState.open(self) as cacheInfo:
-            # Ensure this cache is from the correct attempt at the workflow!  If it isn't, we
-            # need to reset the cache lock file
-            if cacheInfo.attemptNumber != self.workflowAttemptNumber:
-                if cacheInfo.nlink == 2:
-                    cacheInfo.cached = 0  # cached file sizes are accounted for by job store
-                else:
-                    allCachedFiles = [os.path.join(self.localCacheDir, x)
-                                      for x in os.listdir(self.localCacheDir)
-                                      if not self._isHidden(x)]
-                    cacheInfo.cached = sum([os.stat(cachedFile).st_size
-                                            for cachedFile in allCachedFiles])
-                    # TODO: Delete the working directories
-                cacheInfo.sigmaJob = 0
-                cacheInfo.attemptNumber = self.workflowAttemptNumber
-            self.nlinkThreshold = cacheInfo.nlink
+        self._stateConnection = self._CacheState.connect(self.cacheStateFile)
+        with self._stateTransaction(write=False) as state:
+            cacheInfo = self._CacheState.load(state)
+        # Ensure this cache is from the correct attempt at the workflow!  If it isn't, we need to
+        # reset the cache state
+        if cacheInfo.attemptNumber != self.workflowAttemptNumber:
+            with self.cacheLock():
+                with self._stateTransaction() as state:
+                    cacheInfo = self._CacheState.load(state)
+                    if cacheInfo.attemptNumber != self.workflowAttemptNumber:
+                        allCachedFiles = [os.path.join(self.localCacheDir, x)
+                                          for x in os.listdir(self.localCacheDir)
+                                          if not self._isHidden(x)]
+                        allCachedFiles = [(cachedFile, os.stat(cachedFile).st_size)
+                                          for cachedFile in allCachedFiles]
+                        if cacheInfo.nlink == 2:
+                            # cached file sizes are accounted for by job store
+                            cacheInfo.cached = 0
+                        else:
+                            cacheInfo.cached = sum(size for _, size in allCachedFiles)
+                            # TODO: Delete the working directories
+                        # Index the files left by the previous attempt for eviction
+                        cacheInfo.inflation = 0.0
+                        cacheInfo.save(state)
+                        for cachedFile, size in allCachedFiles:
+                            self._CacheState.addCachedFile(state, self.decodedFileID(cachedFile),
+                                                           size, self.evictionPolicy)
+                        cacheInfo.sigmaJob = 0
+                        cacheInfo.attemptNumber = self.workflowAttemptNumber
+                        cacheInfo.save(state)
+        self.nlinkThreshold = cacheInfo.nlink
+        if self.nlinkThreshold == 2:
+            # The cached files are links to the files in the job store, which is better than any
+            # copy the node cache could provide and is required by the accounting of the cache.
+            self.nodeCache = None
 
     def _createCacheLockFile(self, tempCacheDir):
         """
@@ -928,8 +1718,8 @@ class CachingFileStore(FileStore):
             'cached': 0,
             'sigmaJob': 0,
             'cacheDir': self.localCacheDir,
-            'jobState': {}})
-        cacheInfo.write(personalCacheStateFile)
+            'inflation': 0.0})
+        cacheInfo.create(personalCacheStateFile)
 
     def encodedFileID(self, jobStoreFileID):
         """
@@ -951,6 +1741,10 @@ class CachingFileStore(FileStore):
         """
         return os.path.exists(self.encodedFileID(jobStoreFileID))
 
+    def _needsPrefetch(self, fileStoreID):
+        # Files in a local job store are linked into the cache, which is as fast as it gets
+        return self.nlinkThreshold != 2 and not self._fileIsCached(fileStoreID)
+
     def decodedFileID(self, cachedFilePath):
         """
         Decode a cached fileName back to a job store file ID.
@@ -984,71 +1778,84 @@ class CachingFileStore(FileStore):
         if mutable is None:
             mutable = self.mutable
         assert isinstance(mutable, bool)
-        with self.cacheLock() as lockFileHandle:
-            cachedFile = self.encodedFileID(jobStoreFileID)
-            # The file to be cached MUST originate in the environment of the TOIL temp directory
-            if (os.stat(self.localCacheDir).st_dev !=
-                    os.stat(os.path.dirname(localFilePath)).st_dev):
-                raise InvalidSourceCacheError('Attempting to cache a file across file systems '
-                                              'cachedir = %s, file = %s.' % (self.localCacheDir,
-                                                                             localFilePath))
-            if not localFilePath.startswith(self.localTempDir):
-                raise InvalidSourceCacheError('Attempting a cache operation on a non-local file '
-                                              '%s.' % localFilePath)
-            if callingFunc == 'read' and mutable:
-                shutil.copyfile(cachedFile, localFilePath)
-                fileSize = os.stat(cachedFile).st_size
-                cacheInfo = self._CacheState._load(self.cacheStateFile)
-                cacheInfo.cached += fileSize if cacheInfo.nlink != 2 else 0
-                if not cacheInfo.isBalanced():
-                    os.remove(cachedFile)
-                    cacheInfo.cached -= fileSize if cacheInfo.nlink != 2 else 0
-                    logger.debug('Could not download both download ' +
-                                 '%s as mutable and add to ' % os.path.basename(localFilePath) +
-                                 'cache. Hence only mutable copy retained.')
-                else:
-                    logger.info('CACHE: Added file with ID \'%s\' to the cache.' %
-                                jobStoreFileID)
-                jobState = self._JobState(cacheInfo.jobState[self.jobID])
-                jobState.addToJobSpecFiles(jobStoreFileID, localFilePath, -1, False)
-                cacheInfo.jobState[self.jobID] = jobState.__dict__
-                cacheInfo.write(self.cacheStateFile)
+        with self.cacheLock():
+            with self._stateTransaction() as state:
+                cacheInfo = self._addToCache(state, localFilePath, jobStoreFileID, callingFunc,
+                                             mutable)
+        if cacheInfo is not None and not cacheInfo.isBalanced():
+            self.logToMaster('CACHE: The cache was not balanced on returning file size',
+                             logging.WARN)
+
+    def _addToCache(self, state, localFilePath, jobStoreFileID, callingFunc, mutable):
+        """
+        Does the work of addToCache() in the given cache state transaction, such that many files
+        can be added at once. Requires the cache lock.
+
+        :return: The node-wide accounting if the file size was returned to the job, else None
+        :rtype: CachingFileStore._CacheState|None
+        """
+        cachedFile = self.encodedFileID(jobStoreFileID)
+        # The file to be cached MUST originate in the environment of the TOIL temp directory
+        if (os.stat(self.localCacheDir).st_dev !=
+                os.stat(os.path.dirname(localFilePath)).st_dev):
+            raise InvalidSourceCacheError('Attempting to cache a file across file systems '
+                                          'cachedir = %s, file = %s.' % (self.localCacheDir,
+                                                                         localFilePath))
+        if not localFilePath.startswith(self.localTempDir):
+            raise InvalidSourceCacheError('Attempting a cache operation on a non-local file '
+                                          '%s.' % localFilePath)
+        if callingFunc == 'read' and mutable:
+            copyFile(cachedFile, localFilePath)
+            fileSize = os.stat(cachedFile).st_size
+            cacheInfo = self._CacheState.load(state)
+            cacheInfo.cached += fileSize if cacheInfo.nlink != 2 else 0
+            if not cacheInfo.isBalanced():
+                os.remove(cachedFile)
+                cacheInfo.cached -= fileSize if cacheInfo.nlink != 2 else 0
+                logger.debug('Could not download both download ' +
+                             '%s as mutable and add to ' %
+                             os.path.basename(localFilePath) +
+                             'cache. Hence only mutable copy retained.')
             else:
-                # There are two possibilities, read and immutable, and write. both cases do
-                # almost the same thing except for the direction of the os.link hence we're
-                # writing them together.
-                if callingFunc == 'read':  # and mutable is inherently False
-                    src = cachedFile
-                    dest = localFilePath
-                    # To mirror behaviour of shutil.copyfile
-                    if os.path.exists(dest):
-                        os.remove(dest)
-                else:  # write
-                    src = localFilePath
-                    dest = cachedFile
-                try:
-                    os.link(src, dest)
-                except OSError as err:
-                    if err.errno != errno.EEXIST:
-                        raise
-                    # If we get the EEXIST error, it can only be from write since in read we are
-                    # explicitly deleting the file.  This shouldn't happen with the .partial
-                    # logic hence we raise a cache error.
-                    raise CacheError('Attempting to recache a file %s.' % src)
-                else:
-                    # Chmod the cached file. Cached files can never be modified.
-                    os.chmod(cachedFile, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
-                    # Return the filesize of cachedFile to the job and increase the cached size
-                    # The values passed here don't matter since rFS looks at the file only for
-                    # the stat
-                    self.returnFileSize(jobStoreFileID, localFilePath, lockFileHandle,
-                                        fileAlreadyCached=False)
-                if callingFunc == 'read':
-                    logger.debug('CACHE: Read file with ID \'%s\' from the cache.' %
-                                 jobStoreFileID)
-                else:
-                    logger.debug('CACHE: Added file with ID \'%s\' to the cache.' %
-                                 jobStoreFileID)
+                logger.info('CACHE: Added file with ID \'%s\' to the cache.' %
+                            jobStoreFileID)
+                self._CacheState.addCachedFile(state, jobStoreFileID, fileSize,
+                                               self.evictionPolicy)
+            cacheInfo.save(state)
+            self._CacheState.addJobFile(state, self.jobID, jobStoreFileID, localFilePath,
+                                        -1, False)
+            return None
+        # There are two possibilities, read and immutable, and write. both cases do almost the
+        # same thing except for the direction of the os.link hence we're writing them together.
+        if callingFunc == 'read':  # and mutable is inherently False
+            src = cachedFile
+            dest = localFilePath
+            # To mirror behaviour of shutil.copyfile
+            if os.path.exists(dest):
+                os.remove(dest)
+        else:  # write
+            src = localFilePath
+            dest = cachedFile
+        try:
+            os.link(src, dest)
+        except OSError as err:
+            if err.errno != errno.EEXIST:
+                raise
+            # If we get the EEXIST error, it can only be from write since in read we are
+            # explicitly deleting the file.  This shouldn't happen with the .partial logic hence
+            # we raise a cache error.
+            raise CacheError('Attempting to recache a file %s.' % src)
+        # Chmod the cached file. Cached files can never be modified.
+        os.chmod(cachedFile, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+        # Return the filesize of cachedFile to the job and increase the cached size. The values
+        # passed here don't matter since rFS looks at the file only for the stat
+        cacheInfo = self._returnFileSize(state, jobStoreFileID, localFilePath,
+                                         fileAlreadyCached=False)
+        if callingFunc == 'read':
+            logger.debug('CACHE: Read file with ID \'%s\' from the cache.' % jobStoreFileID)
+        else:
+            logger.debug('CACHE: Added file with ID \'%s\' to the cache.' % jobStoreFileID)
+        return cacheInfo
 
     def returnFileSize(self, fileStoreID, cachedFileSource, lockFileHandle,
                        fileAlreadyCached=False):
@@ -1064,22 +1871,37 @@ class CachingFileStore(FileStore):
         :param bool fileAlreadyCached: A flag to indicate whether the file was already cached or
                not. If it was, then it means that you don't need to add the filesize to cache again.
         """
+        with self._stateTransaction() as state:
+            cacheInfo = self._returnFileSize(state, fileStoreID, cachedFileSource,
+                                             fileAlreadyCached)
+        if not cacheInfo.isBalanced():
+            self.logToMaster('CACHE: The cache was not balanced on returning file size',
+                             logging.WARN)
+
+    def _returnFileSize(self, state, fileStoreID, cachedFileSource, fileAlreadyCached):
+        """
+        Does the work of returnFileSize() in the given cache state transaction.
+
+        :return: The node-wide accounting after returning the file size
+        :rtype: CachingFileStore._CacheState
+        """
         fileSize = os.stat(cachedFileSource).st_size
-        cacheInfo = self._CacheState._load(self.cacheStateFile)
+        cacheInfo = self._CacheState.load(state)
         # If the file isn't cached, add the size of the file to the cache pool. However, if the
         # nlink threshold is not 1 -  i.e. it is 2 (it can only be 1 or 2), then don't do this
         # since the size of the file is accounted for by the file store copy.
         if not fileAlreadyCached and self.nlinkThreshold == 1:
             cacheInfo.cached += fileSize
         cacheInfo.sigmaJob -= fileSize
-        if not cacheInfo.isBalanced():
-            self.logToMaster('CACHE: The cache was not balanced on returning file size',
-                             logging.WARN)
+        cacheInfo.save(state)
+        if fileAlreadyCached:
+            self._CacheState.recordCacheHit(state, fileStoreID, self.evictionPolicy)
+        else:
+            self._CacheState.addCachedFile(state, fileStoreID, fileSize, self.evictionPolicy)
         # Add the info to the job specific cache info
-        jobState = self._JobState(cacheInfo.jobState[self.jobID])
-        jobState.addToJobSpecFiles(fileStoreID, cachedFileSource, fileSize, True)
-        cacheInfo.jobState[self.jobID] = jobState.__dict__
-        cacheInfo.write(self.cacheStateFile)
+        self._CacheState.addJobFile(state, self.jobID, fileStoreID, cachedFileSource,
+                                    fileSize, True)
+        return cacheInfo
 
     @staticmethod
     def _isHidden(filePath):
@@ -1102,68 +1924,75 @@ class CachingFileStore(FileStore):
 
         :param float newJobReqs: the total number of bytes of files allowed in the cache.
         """
-        with self._CacheState.open(self) as cacheInfo:
+        with self._stateTransaction() as state:
             # Add the new job's disk requirements to the sigmaJobDisk variable
-            cacheInfo.sigmaJob += newJobReqs
-            # Initialize the job state here. we use a partial in the jobSpecificFiles call so
-            # that this entire thing is pickleable. Based on answer by user Nathaniel Gentile at
-            # http://stackoverflow.com/questions/2600790
-            assert self.jobID not in cacheInfo.jobState
-            cacheInfo.jobState[self.jobID] = {
-                'jobName': self.jobName,
-                'jobReqs': newJobReqs,
-                'jobDir': self.localTempDir,
-                'jobSpecificFiles': defaultdict(partial(defaultdict,int)),
-                'filesToFSIDs': defaultdict(set),
-                'pid': os.getpid(),
-                'deferredFunctions': []}
+            self._CacheState.update(state, sigmaJob=newJobReqs)
+            # Initialize the job state here.
+            self._CacheState.addJob(state, self.jobID, self.jobName, newJobReqs,
+                                    self.localTempDir, os.getpid())
             # If the caching equation is balanced, do nothing.
-            if cacheInfo.isBalanced():
+            if self._CacheState.load(state).isBalanced():
                 return None
-
-            # List of deletable cached files.  A deletable cache file is one
-            #  that is not in use by any other worker (identified by the number of symlinks to
-            # the file)
-            allCacheFiles = [os.path.join(self.localCacheDir, x)
-                             for x in os.listdir(self.localCacheDir)
-                             if not self._isHidden(x)]
-            allCacheFiles = [(path, os.stat(path)) for path in allCacheFiles]
-            # TODO mtime vs ctime
-            deletableCacheFiles = {(path, inode.st_mtime, inode.st_size)
-                                   for path, inode in allCacheFiles
-                                   if inode.st_nlink == self.nlinkThreshold}
-
-            # Sort in descending order of mtime so the first items to be popped from the list
-            # are the least recently created.
-            deletableCacheFiles = sorted(deletableCacheFiles, key=lambda x: (-x[1], -x[2]))
-            logger.debug('CACHE: Need %s bytes for new job. Detecting an estimated %s (out of a '
-                         'total %s) bytes available for running the new job. The size of the cache '
-                         'is %s bytes.', newJobReqs,
-                         (cacheInfo.total - (cacheInfo.cached + cacheInfo.sigmaJob - newJobReqs)),
-                         cacheInfo.total, cacheInfo.cached)
-            logger.debug('CACHE: Evicting files to make room for the new job.')
-
-            # Now do the actual file removal
-            totalEvicted = 0
-            while not cacheInfo.isBalanced() and len(deletableCacheFiles) > 0:
-                cachedFile, fileCreateTime, cachedFileSize = deletableCacheFiles.pop()
-                os.remove(cachedFile)
-                cacheInfo.cached -= cachedFileSize if self.nlinkThreshold != 2 else 0
-                totalEvicted += cachedFileSize
-                assert cacheInfo.cached >= 0
-                logger.debug('CACHE: Evicted  file with ID \'%s\' (%s bytes)' %
-                             (self.decodedFileID(cachedFile), cachedFileSize))
-            logger.debug('CACHE: Evicted a total of %s bytes. Available space is now %s bytes.',
-                         totalEvicted,
-                         (cacheInfo.total - (cacheInfo.cached + cacheInfo.sigmaJob - newJobReqs)))
-            if not cacheInfo.isBalanced():
-                raise CacheUnbalancedError()
+        # Evicting files depends on the number of links to them, so it requires the cache lock.
+        with self.cacheLock():
+            with self._stateTransaction() as state:
+                cacheInfo = self._CacheState.load(state)
+                # Another job may have freed up space in the meantime
+                if cacheInfo.isBalanced():
+                    return None
+
+                logger.debug('CACHE: Need %s bytes for new job. Detecting an estimated %s (out of '
+                             'a total %s) bytes available for running the new job. The size of '
+                             'the cache is %s bytes.', newJobReqs,
+                             (cacheInfo.total -
+                              (cacheInfo.cached + cacheInfo.sigmaJob - newJobReqs)),
+                             cacheInfo.total, cacheInfo.cached)
+                logger.debug('CACHE: Evicting files to make room for the new job.')
+
+                # Now do the actual file removal, in the order of the eviction index. Only files
+                # that are not in use by any other worker (identified by the number of links to
+                # the file) can be evicted.
+                totalEvicted = 0
+                for fileStoreID, priority in self._CacheState.getCachedFiles(state):
+                    if cacheInfo.isBalanced():
+                        break
+                    cachedFile = self.encodedFileID(fileStoreID)
+                    try:
+                        cachedFileStats = os.stat(cachedFile)
+                    except OSError as err:
+                        if err.errno != errno.ENOENT:
+                            raise
+                        self._CacheState.removeCachedFile(state, fileStoreID)
+                        continue
+                    if cachedFileStats.st_nlink != self.nlinkThreshold:
+                        continue
+                    cachedFileSize = cachedFileStats.st_size
+                    os.remove(cachedFile)
+                    self._CacheState.removeCachedFile(state, fileStoreID)
+                    cacheInfo.inflation = priority
+                    cacheInfo.cached -= cachedFileSize if self.nlinkThreshold != 2 else 0
+                    totalEvicted += cachedFileSize
+                    assert cacheInfo.cached >= 0
+                    logger.debug('CACHE: Evicted  file with ID \'%s\' (%s bytes)' %
+                                 (fileStoreID, cachedFileSize))
+                self.cacheStats['evictedBytes'] += totalEvicted
+                logger.debug('CACHE: Evicted a total of %s bytes. Available space is now %s '
+                             'bytes.', totalEvicted,
+                             (cacheInfo.total -
+                              (cacheInfo.cached + cacheInfo.sigmaJob - newJobReqs)))
+                cacheInfo.save(state)
+                if not cacheInfo.isBalanced():
+                    # The job won't run, so take it out of the cache state again.
+                    self._CacheState.update(state, sigmaJob=-newJobReqs)
+                    self._CacheState.removeJob(state, self.jobID)
+        if not cacheInfo.isBalanced():
+            raise CacheUnbalancedError()
 
     def removeSingleCachedFile(self, fileStoreID):
         """
         Removes a single file described by the fileStoreID from the cache forcibly.
         """
-        with self._CacheState.open(self) as cacheInfo:
+        with self.cacheLock():
             cachedFile = self.encodedFileID(fileStoreID)
             cachedFileStats = os.stat(cachedFile)
             # We know the file exists because this function was called in the if block.  So we
@@ -1173,8 +2002,11 @@ class CachingFileStore(FileStore):
             # Remove the file size from the cached file size if the jobstore is not fileJobStore
             # and then delete the file
             os.remove(cachedFile)
-            if self.nlinkThreshold != 2:
-                cacheInfo.cached -= cachedFileStats.st_size
+            with self._stateTransaction() as state:
+                if self.nlinkThreshold != 2:
+                    self._CacheState.update(state, cached=-cachedFileStats.st_size)
+                self._CacheState.removeCachedFile(state, fileStoreID)
+                cacheInfo = self._CacheState.load(state)
             if not cacheInfo.isBalanced():
                 self.logToMaster('CACHE: The cache was not balanced on removing single file',
                                  logging.WARN)
@@ -1201,10 +2033,8 @@ class CachingFileStore(FileStore):
         """
         fileStats = os.stat(localFilePath)
         assert fileStats.st_nlink >= self.nlinkThreshold
-        with self._CacheState.open(self) as cacheInfo:
-            cacheInfo.sigmaJob -= fileStats.st_size
-            jobState = self._JobState(cacheInfo.jobState[self.jobID])
-            jobState.updateJobReqs(fileStats.st_size, 'remove')
+        with self._stateTransaction() as state:
+            self._CacheState.update(state, sigmaJob=-fileStats.st_size)
 
     def returnJobReqs(self, jobReqs):
         """
@@ -1213,34 +2043,202 @@ class CachingFileStore(FileStore):
 
         :param float jobReqs: Original size requirement of the job
         """
-        # Since we are only reading this job's specific values from the state file, we don't
-        # need a lock
-        jobState = self._JobState(self._CacheState._load(self.cacheStateFile
-                                                         ).jobState[self.jobID])
-        for x in jobState.jobSpecificFiles.keys():
-            self.deleteLocalFile(x)
-        with self._CacheState.open(self) as cacheInfo:
-            cacheInfo.sigmaJob -= jobReqs
+        # Since we are only reading this job's specific values from the state, we don't need a
+        # lock
+        with self._stateTransaction(write=False) as state:
+            jobStoreFileIDs = self._CacheState.getJobFileIDs(state, self.jobID)
+        if jobStoreFileIDs:
+            # Delete all local copies at once rather than taking the cache lock for each file
+            with self.cacheLock():
+                with self._stateTransaction() as state:
+                    for x in jobStoreFileIDs:
+                        self._deleteLocalCopies(state, x)
+        with self._stateTransaction() as state:
+            self._CacheState.update(state, sigmaJob=-jobReqs)
             # assert cacheInfo.isBalanced() # commenting this out for now. God speed
 
-    class _CacheState(FileStore._StateFile):
+    class _CacheState(object):
         """
-        Utility class to read and write the cache lock file. Also for checking whether the
-        caching equation is balanced or not.  It extends the _StateFile class to add other cache
-        related functions.
+        Utility class to read and update the state of the cache, which is shared by all workers
+        on the node in a SQLite database in the cache directory. Also for checking whether the
+        caching equation is balanced or not.
+
+        The cache table has a single row with the node-wide accounting of the cache, the jobs
+        table a row for each job using the cache and the jobFiles table a row for each local copy
+        of a file made by a job. The cachedFiles table is the eviction index, with a row for each
+        file in the cache and its priority according to the eviction policy. The state is read
+        and updated in short transactions, see transaction(). Reads don't block the writer or
+        other reads since the database uses a write-ahead log.
+
+        An instance of this class is a snapshot of the node-wide accounting.
         """
+        # The number of seconds to wait for the transaction of another worker to finish
+        busyTimeout = 3600
+
+        def __init__(self, stateDict):
+            assert isinstance(stateDict, dict)
+            self.__dict__.update(stateDict)
+            # The values of the counters at the time of loading, see save()
+            self._loadedCounters = (self.cached, self.sigmaJob)
+
+        @classmethod
+        def connect(cls, fileName):
+            """
+            Opens a connection to the cache state database.
+
+            :param str fileName: Path to the cache state file.
+            :rtype: sqlite3.Connection
+            """
+            # Transactions are begun and ended explicitly by transaction()
+            connection = sqlite3.connect(fileName, timeout=cls.busyTimeout,
+                                         isolation_level=None, check_same_thread=False)
+            connection.text_factory = str
+            return connection
+
+        @staticmethod
+        @contextmanager
+        def transaction(connection, write=True):
+            """
+            This is a context manager that runs the body in a transaction that is committed if the
+            body succeeds and rolled back otherwise. A write transaction holds the write lock on
+            the database from the start such that no other worker can update the state between
+            the reads and updates in the body.
+
+            :param sqlite3.Connection connection: The connection to the cache state database
+            :param bool write: Whether the state is updated in the transaction
+            """
+            connection.execute('BEGIN IMMEDIATE' if write else 'BEGIN')
+            try:
+                yield connection
+            except:
+                connection.execute('ROLLBACK')
+                raise
+            else:
+                connection.execute('COMMIT')
+
         @classmethod
         @contextmanager
         def open(cls, outer=None):
             """
-            This is a context manager that opens the cache state file and reads it into an object
-            that is returned to the user in the yield
+            This is a context manager that acquires the cache lock and reads the state of the
+            cache, including that of the jobs, into an object that is returned to the user in the
+            yield. Changes to the node-wide accounting are written back.
             """
             assert outer is not None
             with outer.cacheLock():
-                cacheInfo = cls._load(outer.cacheStateFile)
-                yield cacheInfo
-                cacheInfo.write(outer.cacheStateFile)
+                with outer._stateTransaction() as state:
+                    cacheInfo = cls.load(state, withJobs=True)
+                    yield cacheInfo
+                    cacheInfo.save(state)
+
+        def create(self, fileName):
+            """
+            Create the cache state database with the node-wide accounting of this object.
+
+            :param str fileName: Path to the cache state file.
+            """
+            connection = self.connect(fileName)
+            try:
+                connection.execute('PRAGMA journal_mode=WAL')
+                with self.transaction(connection) as state:
+                    # The hits and misses are the node-wide numbers of reads from the cache, see
+                    # recordReads()
+                    state.execute('CREATE TABLE cache (nlink INTEGER, attemptNumber INTEGER, '
+                                  'total INTEGER, cached INTEGER, sigmaJob INTEGER, '
+                                  'cacheDir TEXT, inflation REAL, hits INTEGER, misses INTEGER)')
+                    state.execute('CREATE TABLE jobs (jobID TEXT PRIMARY KEY, jobName TEXT, '
+                                  'jobReqs INTEGER, jobDir TEXT, pid INTEGER, '
+                                  'deferredFunctions BLOB)')
+                    # The path is NULL for files written from outside the local temp dir. The size
+                    # is 0 for copies, -1 for mutable copies and the size of the file for links to
+                    # the cached copy.
+                    state.execute('CREATE TABLE jobFiles (jobID TEXT, fileStoreID TEXT, '
+                                  'filePath TEXT, fileSize INTEGER)')
+                    state.execute('CREATE INDEX jobFilesIndex ON jobFiles (jobID, fileStoreID)')
+                    state.execute('CREATE TABLE cachedFiles (fileStoreID TEXT PRIMARY KEY, '
+                                  'fileSize INTEGER, hits INTEGER, lastAccess REAL, '
+                                  'priority REAL)')
+                    state.execute('CREATE INDEX cachedFilesIndex '
+                                  'ON cachedFiles (priority, lastAccess)')
+                    state.execute('INSERT INTO cache VALUES (?, ?, ?, ?, ?, ?, ?, 0, 0)',
+                                  (self.nlink, self.attemptNumber, self.total, self.cached,
+                                   self.sigmaJob, self.cacheDir, self.inflation))
+            finally:
+                connection.close()
+
+        @classmethod
+        def load(cls, state, withJobs=False):
+            """
+            Load the node-wide accounting of the cache.
+
+            :param sqlite3.Connection state: The cache state, in a transaction
+            :param bool withJobs: If True, the state of the jobs using the cache is loaded into the
+                   jobState attribute as a dictionary of job state dictionaries, see getJob()
+            :rtype: CachingFileStore._CacheState
+            """
+            nlink, attemptNumber, total, cached, sigmaJob, cacheDir, inflation = state.execute(
+                'SELECT nlink, attemptNumber, total, cached, sigmaJob, cacheDir, inflation '
+                'FROM cache').fetchone()
+            stateDict = dict(nlink=nlink, attemptNumber=attemptNumber, total=total,
+                             cached=cached, sigmaJob=sigmaJob, cacheDir=cacheDir,
+                             inflation=inflation)
+            if withJobs:
+                stateDict['jobState'] = {jobID: cls.getJob(state, jobID)
+                                         for jobID, _ in cls.getJobs(state)}
+            return cls(stateDict)
+
+        @classmethod
+        def _load(cls, fileName):
+            """
+            Load the state of the cache, including that of the jobs, from the cache state file.
+
+            :param str fileName: Path to the cache state file.
+            :rtype: CachingFileStore._CacheState
+            """
+            connection = cls.connect(fileName)
+            try:
+                with cls.transaction(connection, write=False) as state:
+                    return cls.load(state, withJobs=True)
+            finally:
+                connection.close()
+
+        def save(self, state):
+            """
+            Write the node-wide accounting of this object. The cached and sigmaJob counters are
+            adjusted by the amount they were changed by since they were loaded, such that updates
+            made by other workers in the meantime are not lost.
+
+            :param sqlite3.Connection state: The cache state, in a write transaction
+            """
+            loadedCached, loadedSigmaJob = self._loadedCounters
+            state.execute('UPDATE cache SET nlink = ?, attemptNumber = ?, total = ?, '
+                          'inflation = ?, cached = cached + ?, sigmaJob = sigmaJob + ?',
+                          (self.nlink, self.attemptNumber, self.total, self.inflation,
+                           self.cached - loadedCached, self.sigmaJob - loadedSigmaJob))
+            self._loadedCounters = (self.cached, self.sigmaJob)
+
+        def write(self, fileName):
+            """
+            Write the node-wide accounting of this object to the cache state file, see save().
+
+            :param str fileName: Path to the cache state file.
+            """
+            connection = self.connect(fileName)
+            try:
+                with self.transaction(connection) as state:
+                    self.save(state)
+            finally:
+                connection.close()
+
+        @staticmethod
+        def update(state, cached=0, sigmaJob=0):
+            """
+            Add the given amounts to the node-wide accounting.
+
+            :param sqlite3.Connection state: The cache state, in a write transaction
+            """
+            state.execute('UPDATE cache SET cached = cached + ?, sigmaJob = sigmaJob + ?',
+                          (cached, sigmaJob))
 
         def isBalanced(self):
             """
@@ -1267,109 +2265,266 @@ class CachingFileStore(FileStore):
             # totalFree = totalStats.f_bavail * totalStats.f_frsize
             # return totalFree < jobReqs
 
-    # Methods related to the deferred function logic
-    @classmethod
-    def findAndHandleDeadJobs(cls, nodeInfo, batchSystemShutdown=False):
-        """
+        # Methods related to the state of the jobs using the cache
+        @staticmethod
+        def addJob(state, jobID, jobName, jobReqs, jobDir, pid):
+            state.execute('INSERT INTO jobs VALUES (?, ?, ?, ?, ?, ?)',
+                          (jobID, jobName, jobReqs, jobDir, pid,
+                           sqlite3.Binary(dill.dumps([]))))
 
-        :param toil.fileStore.CachingFileStore._CacheState nodeInfo: The state of the node cache as
-               a _CacheState object
-        """
-        # A list of tuples of (hashed job id, pid or process running job)
-        registeredJobs = [(jid, state['pid']) for jid, state in nodeInfo.jobState.items()]
-        for jobID, jobPID in registeredJobs:
-            if not cls._pidExists(jobPID):
-                jobState = CachingFileStore._JobState(nodeInfo.jobState[jobID])
-                logger.warning('Detected that job (%s) prematurely terminated.  Fixing the state '
-                               'of the cache.', jobState.jobName)
-                if not batchSystemShutdown:
-                    logger.debug("Returning dead job's used disk to cache.")
-                    # Delete the old work directory if it still exists, to remove unwanted nlinks.
-                    # Do this only during the life of the program and dont' do it during the
-                    # batch system cleanup.  Leave that to the batch system cleanup code.
-                    if os.path.exists(jobState.jobDir):
-                        shutil.rmtree(jobState.jobDir)
-                    nodeInfo.sigmaJob -= jobState.jobReqs
-                logger.debug('Running user-defined deferred functions.')
-                cls._runDeferredFunctions(jobState.deferredFunctions)
-                # Remove job from the cache state file
-                nodeInfo.jobState.pop(jobID)
+        @staticmethod
+        def getJobs(state):
+            """
+            :return: The ID of each job using the cache and that of the process running it
+            :rtype: list[(str, int)]
+            """
+            return state.execute('SELECT jobID, pid FROM jobs').fetchall()
 
-    def _registerDeferredFunction(self, deferredFunction):
-        with self._CacheState.open(self) as cacheInfo:
-            cacheInfo.jobState[self.jobID]['deferredFunctions'].append(deferredFunction)
-            logger.debug('Registered "%s" with job "%s".', deferredFunction, self.jobName)
+        @staticmethod
+        def getJob(state, jobID):
+            """
+            :return: The state of the job as a dictionary with the keys jobName, jobReqs, jobDir,
+                     pid and deferredFunctions, or None if the job is not using the cache
+            :rtype: dict
+            """
+            row = state.execute('SELECT jobName, jobReqs, jobDir, pid, deferredFunctions '
+                                'FROM jobs WHERE jobID = ?', (jobID,)).fetchone()
+            if row is None:
+                return None
+            jobName, jobReqs, jobDir, pid, deferredFunctions = row
+            return dict(jobName=jobName, jobReqs=jobReqs, jobDir=jobDir, pid=pid,
+                        deferredFunctions=dill.loads(bytes(deferredFunctions)))
 
-    class _JobState(object):
-        """
-        This is a utility class to handle the state of a job in terms of it's current disk
-        requirements, working directory, and job specific files.
-        """
+        @classmethod
+        def removeJob(cls, state, jobID):
+            """
+            Remove the job and its local files from the state.
 
-        def __init__(self, dictObj):
-            assert isinstance(dictObj, dict)
-            self.__dict__.update(dictObj)
+            :return: The state of the job before it was removed, see getJob()
+            :rtype: dict
+            """
+            jobState = cls.getJob(state, jobID)
+            state.execute('DELETE FROM jobs WHERE jobID = ?', (jobID,))
+            state.execute('DELETE FROM jobFiles WHERE jobID = ?', (jobID,))
+            return jobState
 
-        @classmethod
-        def updateJobSpecificFiles(cls, outer, jobStoreFileID, filePath, fileSize, cached):
+        @staticmethod
+        def addToJobReqs(state, jobID, amount):
             """
-            This method will update the job specifc files in the job state object. It deals with
-            opening a cache lock file, etc.
-
-            :param toil.fileStore.CachingFileStore outer: An instance of CachingFileStore
-            :param str jobStoreFileID: job store Identifier for the file
-            :param str filePath: The path to the file
-            :param float fileSize: The size of the file (may be deprecated soon)
-            :param bool cached: T : F : None :: cached : not cached : mutably read
+            Add the amount to the disk required by the job, e.g. the size of a file it no longer
+            shares with the cache.
             """
-            with outer._CacheState.open(outer) as cacheInfo:
-                jobState = cls(cacheInfo.jobState[outer.jobID])
-                jobState.addToJobSpecFiles(jobStoreFileID, filePath, fileSize, cached)
-                cacheInfo.jobState[outer.jobID] = jobState.__dict__
+            state.execute('UPDATE jobs SET jobReqs = jobReqs + ? WHERE jobID = ?',
+                          (amount, jobID))
+
+        @staticmethod
+        def addDeferredFunction(state, jobID, deferredFunction):
+            (deferredFunctions,), = state.execute('SELECT deferredFunctions FROM jobs '
+                                                  'WHERE jobID = ?', (jobID,))
+            deferredFunctions = dill.loads(bytes(deferredFunctions))
+            deferredFunctions.append(deferredFunction)
+            state.execute('UPDATE jobs SET deferredFunctions = ? WHERE jobID = ?',
+                          (sqlite3.Binary(dill.dumps(deferredFunctions)), jobID))
 
-        def addToJobSpecFiles(self, jobStoreFileID, filePath, fileSize, cached):
+        @classmethod
+        def addJobFile(cls, state, jobID, jobStoreFileID, filePath, fileSize, cached):
             """
-            This is the real method that actually does the updations.
+            Record a local copy of a file made by the job.
 
             :param jobStoreFileID: job store Identifier for the file
             :param filePath: The path to the file
             :param fileSize: The size of the file (may be deprecated soon)
             :param cached: T : F : None :: cached : not cached : mutably read
             """
-            # If there is no entry for the jsfID, make one. self.jobSpecificFiles is a default
-            # dict of default dicts and the absence of a key will return an empty dict
-            # (equivalent to a None for the if)
-            if not self.jobSpecificFiles[jobStoreFileID]:
-                self.jobSpecificFiles[jobStoreFileID][filePath] = fileSize
-            else:
-                # If there's no entry for the filepath, create one
-                if not self.jobSpecificFiles[jobStoreFileID][filePath]:
-                    self.jobSpecificFiles[jobStoreFileID][filePath] = fileSize
+            existing = state.execute('SELECT fileSize FROM jobFiles WHERE jobID = ? '
+                                     'AND fileStoreID = ? AND filePath IS ?',
+                                     (jobID, jobStoreFileID, filePath)).fetchone()
+            if existing is not None:
                 # This should never happen
-                else:
+                if existing[0]:
                     raise RuntimeError()
-            # Now add the file to the reverse mapper. This will speed up cleanup and local file
-            # deletion.
-            self.filesToFSIDs[filePath].add(jobStoreFileID)
+                cls.removeJobFile(state, jobID, jobStoreFileID, filePath)
+            state.execute('INSERT INTO jobFiles VALUES (?, ?, ?, ?)',
+                          (jobID, jobStoreFileID, filePath, fileSize))
+            # If the file was added to the cache, its size is subtracted from the requirements.
             if cached:
-                self.updateJobReqs(fileSize, 'add')
+                cls.addToJobReqs(state, jobID, -fileSize)
+
+        @staticmethod
+        def removeJobFile(state, jobID, jobStoreFileID, filePath):
+            state.execute('DELETE FROM jobFiles WHERE jobID = ? AND fileStoreID = ? '
+                          'AND filePath IS ?', (jobID, jobStoreFileID, filePath))
 
-        def updateJobReqs(self, fileSize, actions):
+        @staticmethod
+        def getJobFiles(state, jobID, jobStoreFileID):
             """
-            This method will update the current state of the disk required by the job after the
-            most recent cache operation.
+            :return: The path and the size of each local copy of the file made by the job
+            :rtype: list[(str, int)]
+            """
+            return state.execute('SELECT filePath, fileSize FROM jobFiles '
+                                 'WHERE jobID = ? AND fileStoreID = ?',
+                                 (jobID, jobStoreFileID)).fetchall()
+
+        @staticmethod
+        def getJobFileIDs(state, jobID):
+            """
+            :return: The job store IDs of the files the job has local copies of
+            :rtype: list[str]
+            """
+            return [fileStoreID for fileStoreID, in
+                    state.execute('SELECT DISTINCT fileStoreID FROM jobFiles WHERE jobID = ?',
+                                  (jobID,))]
 
-            :param fileSize: Size of the last file added/removed from the cache
-            :param actions: 'add' or 'remove'
+        @staticmethod
+        def getJobFilePaths(state, jobID):
+            """
+            :return: The paths of the local copies of files made by the job
+            :rtype: set[str]
+            """
+            return {filePath for filePath, in
+                    state.execute('SELECT filePath FROM jobFiles WHERE jobID = ?', (jobID,))}
+
+        @staticmethod
+        def countJobFileIDs(state, jobID, filePath):
+            """
+            :return: The number of job store files the local file at the path is a copy of
+            :rtype: int
             """
-            assert actions in ('add', 'remove')
-            multiplier = 1 if actions == 'add' else -1
-            # If the file was added to the cache, the value is subtracted from the requirements,
-            # and it is added if the file was removed form the cache.
-            self.jobReqs -= (fileSize * multiplier)
+            (count,), = state.execute('SELECT COUNT(*) FROM jobFiles '
+                                      'WHERE jobID = ? AND filePath IS ?', (jobID, filePath))
+            return count
 
-        def isPopulated(self):
-            return self.__dict__ != {}
+        # Methods related to the eviction index
+        @classmethod
+        def addCachedFile(cls, state, fileStoreID, fileSize, policy):
+            """
+            Add a file that was just added to the cache to the eviction index.
+
+            :param EvictionPolicy policy: The eviction policy of the workflow
+            """
+            now = time.time()
+            priority = policy.priority(fileSize, 0, now, cls.getInflation(state))
+            state.execute('INSERT OR REPLACE INTO cachedFiles VALUES (?, ?, 0, ?, ?)',
+                          (fileStoreID, fileSize, now, priority))
+
+        @classmethod
+        def recordCacheHit(cls, state, fileStoreID, policy):
+            """
+            Record in the eviction index that a file was read from the cache.
+
+            :param EvictionPolicy policy: The eviction policy of the workflow
+            """
+            row = state.execute('SELECT fileSize, hits FROM cachedFiles WHERE fileStoreID = ?',
+                                (fileStoreID,)).fetchone()
+            if row is None:
+                # The file was evicted in the meantime
+                return
+            fileSize, hits = row
+            now = time.time()
+            priority = policy.priority(fileSize, hits + 1, now, cls.getInflation(state))
+            state.execute('UPDATE cachedFiles SET hits = ?, lastAccess = ?, priority = ? '
+                          'WHERE fileStoreID = ?', (hits + 1, now, priority, fileStoreID))
+
+        @staticmethod
+        def removeCachedFile(state, fileStoreID):
+            state.execute('DELETE FROM cachedFiles WHERE fileStoreID = ?', (fileStoreID,))
+
+        @staticmethod
+        def getCachedFiles(state):
+            """
+            :return: The job store ID and the priority of each file in the cache, in the order in
+                     which they should be evicted
+            :rtype: list[(str, float)]
+            """
+            return state.execute('SELECT fileStoreID, priority FROM cachedFiles '
+                                 'ORDER BY priority, lastAccess').fetchall()
+
+        @staticmethod
+        def getInflation(state):
+            (inflation,), = state.execute('SELECT inflation FROM cache')
+            return inflation
+
+        @staticmethod
+        def recordReads(state, hits, misses):
+            """
+            Add the cache hits and misses of a job to the node-wide numbers.
+            """
+            state.execute('UPDATE cache SET hits = hits + ?, misses = misses + ?',
+                          (hits, misses))
+
+        @staticmethod
+        def getReads(state):
+            """
+            :return: The node-wide numbers of cache hits and misses
+            :rtype: (int, int)
+            """
+            (hits, misses), = state.execute('SELECT hits, misses FROM cache')
+            return hits, misses
+
+    # Methods related to the deferred function logic
+    @classmethod
+    def findAndHandleDeadJobs(cls, nodeInfo, batchSystemShutdown=False):
+        """
+
+        :param str nodeInfo: The cache directory of the node
+        """
+        connection = cls._CacheState.connect(os.path.join(nodeInfo, '_cacheState'))
+        try:
+            # A list of tuples of (hashed job id, pid or process running job)
+            with cls._CacheState.transaction(connection, write=False) as state:
+                registeredJobs = cls._CacheState.getJobs(state)
+            deadJobIDs = [jobID for jobID, jobPID in registeredJobs
+                          if not cls._pidExists(jobPID)]
+            if not deadJobIDs:
+                return
+            deadJobs = []
+            # Removing the work directory of a dead job changes the number of links to the cached
+            # files it used, so this is done with the cache lock held.
+            with open(os.path.join(nodeInfo, '.cacheLock'), 'w') as cacheLockFile:
+                flock(cacheLockFile, LOCK_EX)
+                with cls._CacheState.transaction(connection) as state:
+                    for jobID in deadJobIDs:
+                        # Remove job from the cache state. Another worker may have done so already.
+                        jobState = cls._CacheState.removeJob(state, jobID)
+                        if jobState is None:
+                            continue
+                        if not batchSystemShutdown:
+                            cls._CacheState.update(state, sigmaJob=-jobState['jobReqs'])
+                        deadJobs.append(jobState)
+                for jobState in deadJobs:
+                    logger.warning('Detected that job (%s) prematurely terminated.  Fixing the '
+                                   'state of the cache.', jobState['jobName'])
+                    if not batchSystemShutdown:
+                        logger.debug("Returning dead job's used disk to cache.")
+                        # Delete the old work directory if it still exists, to remove unwanted
+                        # nlinks. Do this only during the life of the program and dont' do it
+                        # during the batch system cleanup.  Leave that to the batch system cleanup
+                        # code.
+                        if os.path.exists(jobState['jobDir']):
+                            shutil.rmtree(jobState['jobDir'])
+        finally:
+            connection.close()
+        for jobState in deadJobs:
+            logger.debug('Running user-defined deferred functions.')
+            cls._runDeferredFunctions(jobState['deferredFunctions'])
+
+    def _registerDeferredFunction(self, deferredFunction):
+        with self._stateTransaction() as state:
+            self._CacheState.addDeferredFunction(state, self.jobID, deferredFunction)
+        logger.debug('Registered "%s" with job "%s".', deferredFunction, self.jobName)
+
+    def _updateJobSpecificFiles(self, jobStoreFileID, filePath, fileSize, cached):
+        """
+        This method will record a local copy of a file made by this job in the cache state.
+
+        :param str jobStoreFileID: job store Identifier for the file
+        :param str filePath: The path to the file
+        :param float fileSize: The size of the file (may be deprecated soon)
+        :param bool cached: T : F : None :: cached : not cached : mutably read
+        """
+        with self._stateTransaction() as state:
+            self._CacheState.addJobFile(state, self.jobID, jobStoreFileID, filePath, fileSize,
+                                        cached)
 
     class HarbingerFile(object):
         """
@@ -1394,10 +2549,15 @@ class CachingFileStore(FileStore):
                 self.fileStoreID = fileStore.decodedFileID(cachedFileName)
             self.fileStore = fileStore
             self.harbingerFileName = '/.'.join(os.path.split(cachedFileName)) + '.harbinger'
+            # The partial copy of the file, if it is being streamed into the cache such that
+            # other jobs can read it while it is being downloaded.
+            self.streamingFileName = '/.'.join(os.path.split(cachedFileName)) + '.streaming'
 
         def write(self):
             self.fileStore.logToMaster('CACHE: Creating a harbinger file for (%s). '
                                        % self.fileStoreID, logging.DEBUG)
+            # A streaming file left behind by a dead job must not be mistaken for this download
+            self._deleteStreamingFile()
             with open(self.harbingerFileName + '.tmp', 'w') as harbingerFile:
                 harbingerFile.write(str(os.getpid()))
             # Make this File read only to prevent overwrites
@@ -1448,8 +2608,147 @@ class CachingFileStore(FileStore):
             assert self.exists()
             self.fileStore.logToMaster('CACHE: Deleting the harbinger file for (%s)' %
                                        self.fileStoreID, logging.DEBUG)
+            self._deleteStreamingFile()
             os.remove(self.harbingerFileName)
 
+        def _deleteStreamingFile(self):
+            try:
+                os.remove(self.streamingFileName)
+            except OSError as err:
+                if err.errno != errno.ENOENT:
+                    raise
+
+    class CacheFillingReader(io.RawIOBase):
+        """
+        Reads a file from the job store and writes everything it reads to the partial copy of
+        the file in the cache, from which other jobs on the node may read it concurrently.
+        """
+
+        def __init__(self, source, partialFile):
+            """
+            :param file source: The stream of the file in the job store
+            :param file partialFile: The unbuffered partial copy of the file, opened for writing
+            """
+            super(CachingFileStore.CacheFillingReader, self).__init__()
+            self.source = source
+            self.partialFile = partialFile
+            # Whether the entire file was read
+            self.complete = False
+
+        def readable(self):
+            return True
+
+        def readinto(self, b):
+            data = self.source.read(len(b))
+            if not data and len(b) > 0:
+                self.complete = True
+            self.partialFile.write(data)
+            b[:len(data)] = data
+            return len(data)
+
+    class DownloadFollower(io.RawIOBase):
+        """
+        Reads the partial copy of a file that another job is streaming into the cache, waiting
+        for more of it whenever the reader catches up with the download. Should the download
+        fail, the rest of the file is read from the job store.
+        """
+        # The number of seconds to wait for more of the file to be downloaded
+        pollInterval = 0.1
+
+        def __init__(self, fileStore, harbingerFile):
+            """
+            Must be called with the cache lock held, while the harbinger file exists.
+
+            :param CachingFileStore fileStore: The file store of the following job
+            :param CachingFileStore.HarbingerFile harbingerFile: The harbinger of the download
+            """
+            super(CachingFileStore.DownloadFollower, self).__init__()
+            self.fileStore = fileStore
+            self.harbingerFile = harbingerFile
+            self.partialFile = io.open(harbingerFile.streamingFileName, 'rb', buffering=0)
+            self.offset = 0
+            self.fallback = None
+
+        def readable(self):
+            return True
+
+        def readinto(self, b):
+            while True:
+                if self.fallback is not None:
+                    data = self.fallback.read(len(b))
+                else:
+                    data = self.partialFile.read(len(b))
+                    if not data and not self._downloadInProgress():
+                        # Read what was written before the download ended
+                        data = self.partialFile.read(len(b))
+                        if not data and not self._downloadSucceeded():
+                            self._fallBack()
+                            continue
+                    elif not data:
+                        time.sleep(self.pollInterval)
+                        continue
+                b[:len(data)] = data
+                self.offset += len(data)
+                return len(data)
+
+        def _downloadInProgress(self):
+            try:
+                pid = self.harbingerFile.read()
+            except IOError as err:
+                if err.errno != errno.ENOENT:
+                    raise
+                return False
+            if FileStore._pidExists(pid):
+                # The harbinger may belong to a later download of the same file, by this or
+                # another process, in which case the download being followed is over.
+                try:
+                    streamingFileStats = os.stat(self.harbingerFile.streamingFileName)
+                except OSError as err:
+                    if err.errno != errno.ENOENT:
+                        raise
+                    return False
+                partialFileStats = os.fstat(self.partialFile.fileno())
+                return ((streamingFileStats.st_dev, streamingFileStats.st_ino) ==
+                        (partialFileStats.st_dev, partialFileStats.st_ino))
+            # The job that was streaming the file died, so remove its harbinger.
+            with self.fileStore.cacheLock():
+                if self.harbingerFile.exists() and self.harbingerFile.read() == pid:
+                    self.harbingerFile._delete()
+            return False
+
+        def _downloadSucceeded(self):
+            try:
+                cachedFileStats = os.stat(self.fileStore.encodedFileID(
+                    self.harbingerFile.fileStoreID))
+            except OSError as err:
+                if err.errno != errno.ENOENT:
+                    raise
+                return False
+            partialFileStats = os.fstat(self.partialFile.fileno())
+            return ((cachedFileStats.st_dev, cachedFileStats.st_ino) ==
+                    (partialFileStats.st_dev, partialFileStats.st_ino))
+
+        def _fallBack(self):
+            logger.warning('The download of file with ID \'%s\' by another job failed. Reading '
+                           'the rest of it from the job store.', self.harbingerFile.fileStoreID)
+            self.fallbackContext = self.fileStore.jobStore.readFileStream(
+                self.harbingerFile.fileStoreID)
+            self.fallback = self.fallbackContext.__enter__()
+            # Skip the part of the file that was already read
+            remaining = self.offset
+            while remaining > 0:
+                data = self.fallback.read(min(remaining, 1024 * 1024))
+                if not data:
+                    break
+                remaining -= len(data)
+
+        def close(self):
+            if not self.closed:
+                self.partialFile.close()
+                if self.fallback is not None:
+                    self.fallbackContext.__exit__(None, None, None)
+            super(CachingFileStore.DownloadFollower, self).close()
+
     # Functions related to async updates
     def asyncWrite(self):
         """
@@ -1482,8 +2781,8 @@ class CachingFileStore(FileStore):
                 # We pass in a fileHandle, rather than the file-name, in case
                 # the file itself is deleted. The fileHandle itself should persist
                 # while we maintain the open file handle
-                with self.jobStore.updateFileStream(jobStoreFileID) as outputFileHandle:
-                    shutil.copyfileobj(inputFileHandle, outputFileHandle)
+                self.jobStore.updateFileInParts(jobStoreFileID, inputFileHandle,
+                                                threads=self.jobStore.config.uploadThreads)
                 inputFileHandle.close()
                 # Remove the file from the lock files
                 with self._pendingFileWritesLock:
@@ -1494,6 +2793,27 @@ class CachingFileStore(FileStore):
             self._terminateEvent.set()
             raise
 
+    def _stopWriters(self):
+        """
+        Tells the threads writing files to the job store to exit once the queued writes are done
+        and waits for them to do so.
+        """
+        # The instance may be destroyed by one of its own threads once that thread drops the last
+        # reference to it, which happens in a long-lived process like the leader
+        threads = [thread for thread in self.workers if thread is not current_thread()]
+        # One sentinel per thread. Threads that died can't empty the bounded queue, so never
+        # block on it for long, and stop once no thread is left to take a sentinel.
+        sentinels = len(threads)
+        while sentinels > 0 and any(thread.is_alive() for thread in threads):
+            try:
+                self.queue.put(None, timeout=2)
+            except Full:
+                pass
+            else:
+                sentinels -= 1
+        for thread in threads:
+            thread.join()
+
     def _updateJobWhenDone(self):
         """
         Asynchronously update the status of the job on the disk, first waiting \
@@ -1504,11 +2824,7 @@ class CachingFileStore(FileStore):
         def asyncUpdate():
             try:
                 # Wait till all file writes have completed
-                for i in xrange(len(self.workers)):
-                    self.queue.put(None)
-
-                for thread in self.workers:
-                    thread.join()
+                self._stopWriters()
 
                 # Wait till input block-fn returns - in the event of an exception
                 # this will eventually terminate
@@ -1569,21 +2885,42 @@ class CachingFileStore(FileStore):
         """
         :param dir_: The directory that will contain the cache state file.
         """
-        cacheInfo = cls._CacheState._load(os.path.join(dir_, '_cacheState'))
-        cls.findAndHandleDeadJobs(cacheInfo, batchSystemShutdown=True)
+        cls.findAndHandleDeadJobs(dir_, batchSystemShutdown=True)
         shutil.rmtree(dir_)
 
+    @classmethod
+    def summarizeCache(cls, cacheDir, errorRate=0.01):
+        """
+        Summarizes the content of the cache for placing jobs on the node that has their inputs.
+
+        :param str cacheDir: The cache directory of the node
+        :param float errorRate: The error rate of the summary, see BloomFilter
+        :return: A summary of the IDs of the files in the cache, and the node-wide numbers of
+                 cache hits and misses
+        :rtype: (BloomFilter, int, int)
+        """
+        connection = cls._CacheState.connect(os.path.join(cacheDir, '_cacheState'))
+        try:
+            with cls._CacheState.transaction(connection, write=False) as state:
+                fileStoreIDs = [fileStoreID for fileStoreID, _ in
+                                cls._CacheState.getCachedFiles(state)]
+                hits, misses = cls._CacheState.getReads(state)
+        finally:
+            connection.close()
+        summary = BloomFilter(capacity=len(fileStoreIDs), errorRate=errorRate)
+        summary.update(fileStoreIDs)
+        return summary, hits, misses
+
     def __del__(self):
         """
         Cleanup function that is run when destroying the class instance that ensures that all the
         file writing threads exit.
         """
         self.updateSemaphore.acquire()
-        for i in xrange(len(self.workers)):
-            self.queue.put(None)
-        for thread in self.workers:
-            thread.join()
+        self._stopWriters()
         self.updateSemaphore.release()
+        if self._stateConnection is not None:
+            self._stateConnection.close()
 
 
 class NonCachingFileStore(FileStore):
@@ -1613,9 +2950,12 @@ class NonCachingFileStore(FileStore):
             logger.warning('Starting job %s with less than 10%% of disk space remaining.',
                            self.jobName)
         try:
-            os.chdir(self.localTempDir)
+            if self._changeDir:
+                os.chdir(self.localTempDir)
+            self._startPrefetching(job._inputs)
             yield
         finally:
+            self._stopPrefetching()
             diskUsed = getDirSizeRecursively(self.localTempDir)
             logString = ("Job {jobName} used {percent:.2f}% ({humanDisk}B [{disk}B] used, "
                          "{humanRequestedDisk}B [{requestedDisk}B] requested) at the end of "
@@ -1631,7 +2971,8 @@ class NonCachingFileStore(FileStore):
                 self.logToMaster("Job used more disk than requested. Consider modifying the user "
                                  "script to avoid the chance of failure due to incorrectly "
                                  "requested resources. " + logString, level=logging.WARNING)
-            os.chdir(startingDir)
+            if self._changeDir:
+                os.chdir(startingDir)
             jobState = self._readJobState(self.jobStateFile)
             deferredFunctions = jobState['deferredFunctions']
             failures = self._runDeferredFunctions(deferredFunctions)
@@ -1655,13 +2996,13 @@ class NonCachingFileStore(FileStore):
         else:
             localFilePath = self.getLocalTempFileName()
 
-        self.jobStore.readFile(fileStoreID, localFilePath)
+        self._readFileFromJobStore(fileStoreID, localFilePath)
         self.localFileMap[fileStoreID].append(localFilePath)
         return localFilePath
 
     @contextmanager
     def readGlobalFileStream(self, fileStoreID):
-        with self.jobStore.readFileStream(fileStoreID) as f:
+        with self._readFileStreamFromJobStore(fileStoreID) as f:
             yield f
 
     def exportFile(self, jobStoreFileID, dstUrl):
@@ -1838,16 +3179,22 @@ class FileID(str):
     A class to wrap the job store file id returned by writeGlobalFile and any attributes we may want
     to add to it.
     """
-    def __new__(cls, fileStoreID, *args):
+    def __new__(cls, fileStoreID, *args, **kwargs):
         return super(FileID, cls).__new__(cls, fileStoreID)
 
-    def __init__(self, fileStoreID, size):
+    def __init__(self, fileStoreID, size, contentKey=None):
+        """
+        :param int size: The size of the file in bytes
+        :param str contentKey: The key of the content of the file in the node cache, if known.
+               See :class:`NodeCache`.
+        """
         super(FileID, self).__init__(fileStoreID)
         self.size = size
+        self.contentKey = contentKey
 
     @classmethod
-    def forPath(cls, fileStoreID, filePath):
-        return cls(fileStoreID, os.stat(filePath).st_size)
+    def forPath(cls, fileStoreID, filePath, contentKey=None):
+        return cls(fileStoreID, os.stat(filePath).st_size, contentKey=contentKey)
 
 
 def shutdownFileStore(workflowDir, workflowID):
@@ -1876,6 +3223,24 @@ def shutdownFileStore(workflowDir, workflowID):
         NonCachingFileStore.shutdown(workflowDir)
 
 
+def summarizeFileStoreCache(workflowDir, workflowID):
+    """
+    Summarizes the content of the cache of the workflow on this node, see
+    :meth:`CachingFileStore.summarizeCache`.
+
+    :param str workflowDir: The path to the cache directory
+    :param str workflowID: The workflow ID for this invocation of the workflow
+    :return: None if the workflow doesn't cache files on this node or hasn't run a job here yet
+    :rtype: (BloomFilter, int, int)|None
+    """
+    cacheDir = os.path.join(workflowDir, cacheDirName(workflowID))
+    # The cache directory is only created once the cache state file exists, see _setupCache()
+    if os.path.exists(cacheDir):
+        return CachingFileStore.summarizeCache(cacheDir)
+    else:
+        return None
+
+
 class CacheError(Exception):
     """
     Error Raised if the user attempts to add a non-local file to cache
@@ -20,6 +20,7 @@ import inspect
 import logging
 import os
 import sys
+import threading
 import time
 import uuid
 import dill
@@ -47,12 +48,89 @@ from toil.resource import ModuleDescriptor
 logger = logging.getLogger( __name__ )
 
 
+# Maps each distinct tuple of requirement values to a canonical instance of it so that the many
+# jobs sharing the same requirements share a single tuple. Tuples can't be referenced weakly, so
+# the number of interned tuples is capped instead, beyond which requirements aren't interned.
+_internedRequirements = {}
+_maxInternedRequirements = 10000
+
+
+def _internRequirements(values):
+    """
+    :param tuple values: the cores, memory, disk and preemptable requirement of a job
+
+    :rtype: tuple, an equal, canonical tuple or, once the cap on interned tuples is reached, the
+            given tuple itself
+
+    >>> _internRequirements((1, 2, 3, None)) is _internRequirements((1, 2, 3, None))
+    True
+    >>> _internRequirements((1.0, 2, 3, True))
+    (1.0, 2, 3, True)
+    """
+    # 1, 1.0 and True are equal, so the key includes the types in order to preserve them
+    key = values + tuple(map(type, values))
+    try:
+        return _internedRequirements[key]
+    except KeyError:
+        if len(_internedRequirements) >= _maxInternedRequirements:
+            return values
+        return _internedRequirements.setdefault(key, values)
+
+
+# Maps each class to the names of the slots declared by it and its base classes
+_slotNames = {}
+
+
+def _getSlotNames(cls):
+    """
+    :rtype: tuple[str], the names of the slots declared by the given class and its base classes
+    """
+    try:
+        return _slotNames[cls]
+    except KeyError:
+        names = tuple(name
+                      for c in reversed(cls.__mro__)
+                      for name in c.__dict__.get('__slots__', ())
+                      if name not in ('__dict__', '__weakref__'))
+        return _slotNames.setdefault(cls, names)
+
+
+def _requirementProperty(index):
+    """
+    Returns a property for accessing the requirement at the given index in the tuple of a job's
+    requirement values. Assigning to the property replaces the tuple.
+    """
+    def getter(self):
+        return self._requirementValues[index]
+
+    def setter(self, value):
+        values = list(self._requirementValues)
+        values[index] = value
+        self._requirementValues = _internRequirements(tuple(values))
+
+    return property(getter, setter)
+
+
 class JobLikeObject(object):
     """
     Inherit from this class to add requirement properties to a job (or job-like) object.
     If the object doesn't specify explicit requirements, these properties will fall back
     to the configured defaults. If the value cannot be determined, an AttributeError is raised.
+
+    The leader holds many instances of this class, so it and its subclasses used by the leader
+    declare their attributes in __slots__. Their pickled state is a dictionary of attribute
+    values, the format used before they were slotted.
     """
+    __slots__ = ('unitName', 'jobName', '_requirementValues', '_config')
+
+    # The names of the attributes holding the values in _requirementValues, in order
+    _requirementAttributes = ('_cores', '_memory', '_disk', '_preemptable')
+
+    _cores = _requirementProperty(0)
+    _memory = _requirementProperty(1)
+    _disk = _requirementProperty(2)
+    _preemptable = _requirementProperty(3)
+
     def __init__(self, requirements, unitName, jobName=None):
         cores = requirements.get('cores')
         memory = requirements.get('memory')
@@ -64,12 +142,36 @@ class JobLikeObject(object):
             assert isinstance(jobName, str)
         self.unitName = unitName
         self.jobName = jobName if jobName is not None else self.__class__.__name__
-        self._cores = self._parseResource('cores', cores)
-        self._memory = self._parseResource('memory', memory)
-        self._disk = self._parseResource('disk', disk)
-        self._preemptable = preemptable
+        self._requirementValues = _internRequirements((self._parseResource('cores', cores),
+                                                       self._parseResource('memory', memory),
+                                                       self._parseResource('disk', disk),
+                                                       preemptable))
         self._config = None
 
+    def __getstate__(self):
+        """
+        :rtype: dict, maps the name of each attribute of this object to its value
+        """
+        state = dict(getattr(self, '__dict__', {}))
+        for name in _getSlotNames(type(self)):
+            try:
+                state[name] = getattr(self, name)
+            except AttributeError:
+                # Unset slots are omitted, like missing entries in an instance dictionary
+                pass
+        state.update(zip(self._requirementAttributes, state.pop('_requirementValues')))
+        return state
+
+    def __setstate__(self, state):
+        """
+        :param dict state: the attribute values as returned by __getstate__()
+        """
+        state = dict(state)
+        self._requirementValues = _internRequirements(
+            tuple(state.pop(name, None) for name in self._requirementAttributes))
+        for name, value in iteritems(state):
+            setattr(self, name, value)
+
     @property
     def disk(self):
         """
@@ -185,12 +287,17 @@ class JobNode(JobLikeObject):
     """
     This object bridges the job graph, job, and batchsystem classes
     """
+    __slots__ = ('jobStoreID', 'predecessorNumber', 'command', 'inputs')
+
     def __init__(self, requirements, jobName, unitName, jobStoreID,
-                 command, predecessorNumber=1):
+                 command, predecessorNumber=1, inputs=()):
         super(JobNode, self).__init__(requirements=requirements, unitName=unitName, jobName=jobName)
         self.jobStoreID = jobStoreID
         self.predecessorNumber = predecessorNumber
         self.command = command
+        # The IDs of the files the job declared as its inputs, used by batch systems to place the
+        # job on a node that has them cached. FileIDs are stored as plain strings.
+        self.inputs = tuple(str(fileStoreID) for fileStoreID in inputs)
 
     def __str__(self):
         return super(JobNode, self).__str__() + ' ' + self.jobStoreID
@@ -200,7 +307,7 @@ class JobNode(JobLikeObject):
 
     def __eq__(self, other):
         if isinstance(other, self.__class__):
-            return self.__dict__ == other.__dict__
+            return self.__getstate__() == other.__getstate__()
         return NotImplemented
 
     def __ne__(self, other):
@@ -209,7 +316,7 @@ class JobNode(JobLikeObject):
         return NotImplemented
 
     def __repr__(self):
-        return '%s( **%r )' % (self.__class__.__name__, self.__dict__)
+        return '%s( **%r )' % (self.__class__.__name__, self.__getstate__())
 
     @classmethod
     def fromJobGraph(cls, jobGraph):
@@ -224,7 +331,8 @@ class JobNode(JobLikeObject):
                    command=jobGraph.command,
                    jobName=jobGraph.jobName,
                    unitName=jobGraph.unitName,
-                   predecessorNumber=jobGraph.predecessorNumber)
+                   predecessorNumber=jobGraph.predecessorNumber,
+                   inputs=jobGraph.inputs)
 
     @classmethod
     def fromJob(cls, job, command, predecessorNumber):
@@ -242,14 +350,17 @@ class JobNode(JobLikeObject):
                    command=command,
                    jobName=job.jobName,
                    unitName=job.unitName,
-                   predecessorNumber=predecessorNumber)
+                   predecessorNumber=predecessorNumber,
+                   # Promised inputs are only known once the job is loaded on a worker
+                   inputs=[fileStoreID for fileStoreID in job._inputs
+                           if not isinstance(fileStoreID, Promise)])
 
 class Job(JobLikeObject):
     """
     Class represents a unit of work in toil.
     """
     def __init__(self, memory=None, cores=None, disk=None, preemptable=None, unitName=None,
-                 checkpoint=False):
+                 checkpoint=False, inputs=()):
         """
         This method must be called by any overriding constructor.
 
@@ -261,6 +372,7 @@ class Job(JobLikeObject):
             exhausting all their retries, remove any successor jobs and rerun this job to restart the
             subtree. Job must be a leaf vertex in the job graph when initially defined, see
             :func:`toil.job.Job.checkNewCheckpointsAreCutVertices`.
+        :param inputs: the IDs of files the job will read, see :func:`toil.job.Job.addInputs`.
         :type cores: int or string convertable by bd2k.util.humanize.human2bytes to an int
         :type disk: int or string convertable by bd2k.util.humanize.human2bytes to an int
         :type preemptable: bool
@@ -294,6 +406,9 @@ class Job(JobLikeObject):
         self._rvs = collections.defaultdict(list)
         self._promiseJobStore = None
         self._fileStore = None
+        #See Job.addInputs
+        self._inputs = []
+        self.addInputs(*inputs)
 
     def run(self, fileStore):
         """
@@ -307,6 +422,22 @@ class Job(JobLikeObject):
         """
         pass
 
+    def addInputs(self, *fileStoreIDs):
+        """
+        Declares files the job will read with :func:`toil.fileStore.FileStore.readGlobalFile` or
+        :func:`toil.fileStore.FileStore.readGlobalFileStream`. The worker starts downloading them
+        in the background before the job runs, such that reading a file only blocks until its
+        download is complete.
+
+        :param fileStoreIDs: the IDs of the files, or promises of them, for example the return
+               value of a predecessor as returned by :func:`toil.job.Job.rv`.
+        :return: this job, so that it can be declared along with its successors, e.g.
+                 ``job.addChildJobFn(f, fileID).addInputs(fileID)``
+        :rtype: toil.job.Job
+        """
+        self._inputs.extend(fileStoreIDs)
+        return self
+
     def addChild(self, childJob):
         """
         Adds childJob to be run as child of this job. Child jobs will be run \
@@ -1249,13 +1380,14 @@ class Job(JobLikeObject):
 
         # If the job is not a checkpoint job, add the promise files to delete
         # to the list of jobStoreFileIDs to delete
+        promiseFilesToDelete = Promise.getFilesToDelete()
         if not self.checkpoint:
-            for jobStoreFileID in Promise.filesToDelete:
+            for jobStoreFileID in promiseFilesToDelete:
                 fileStore.deleteGlobalFile(jobStoreFileID)
         else:
             # Else copy them to the job wrapper to delete later
-            jobGraph.checkpointFilesToDelete = list(Promise.filesToDelete)
-        Promise.filesToDelete.clear()
+            jobGraph.checkpointFilesToDelete = list(promiseFilesToDelete)
+        promiseFilesToDelete.clear()
         # Now indicate the asynchronous update of the job can happen
         fileStore._updateJobWhenDone()
         # Change dir back to cwd dir, if changed by job (this is a safety issue)
@@ -1269,7 +1401,13 @@ class Job(JobLikeObject):
                     time=str(time.time() - startTime),
                     clock=str(totalCpuTime - startClock),
                     class_name=self._jobName(),
-                    memory=str(totalMemoryUsage)
+                    memory=str(totalMemoryUsage),
+                    cache_hits=fileStore.cacheStats['hits'],
+                    cache_misses=fileStore.cacheStats['misses'],
+                    cache_evicted_bytes=fileStore.cacheStats['evictedBytes'],
+                    prefetched_files=fileStore.prefetchStats['files'],
+                    prefetch_time=str(fileStore.prefetchStats['time']),
+                    prefetch_wait_time=str(fileStore.prefetchStats['waitTime'])
                 )
             )
 
@@ -1519,6 +1657,8 @@ class EncapsulatedJob(Job):
 
 
 class ServiceJobNode(JobNode):
+    __slots__ = ('startJobStoreID', 'terminateJobStoreID', 'errorJobStoreID')
+
     def __init__(self, jobStoreID, memory, cores, disk, preemptable, startJobStoreID, terminateJobStoreID,
                  errorJobStoreID, unitName, jobName, command, predecessorNumber):
         requirements = dict(memory=memory, cores=cores, disk=disk, preemptable=preemptable)
@@ -1648,10 +1788,25 @@ class Promise(object):
     :type: toil.jobStores.abstractJobStore.AbstractJobStore
     """
 
-    filesToDelete = set()
+    _local = threading.local()
     """
-    A set of IDs of files containing promised values when we know we won't need them anymore
+    Holds the set of IDs of files containing promised values that were resolved by the current
+    thread, see :meth:`getFilesToDelete`
     """
+
+    @classmethod
+    def getFilesToDelete(cls):
+        """
+        :return: the set of IDs of files containing promised values resolved by the current thread
+                 when we know we won't need them anymore
+        :rtype: set[str]
+        """
+        try:
+            return cls._local.filesToDelete
+        except AttributeError:
+            filesToDelete = cls._local.filesToDelete = set()
+            return filesToDelete
+
     def __init__(self, job, path):
         """
         :param Job job: the job whose return value this promise references
@@ -1692,7 +1847,7 @@ class Promise(object):
         # if it belongs to a different workflow that was run earlier in the current process.
         if cls._jobstore is None or cls._jobstore.config.jobStore != jobStoreLocator:
             cls._jobstore = Toil.resumeJobStore(jobStoreLocator)
-        cls.filesToDelete.add(jobStoreFileID)
+        cls.getFilesToDelete().add(jobStoreFileID)
         with cls._jobstore.readFileStream(jobStoreFileID) as fileHandle:
             # If this doesn't work then the file containing the promise may not exist or be
             # corrupted
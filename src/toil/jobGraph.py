@@ -26,6 +26,10 @@ class JobGraph(JobNode):
     scripts is persisted separately since it may be much bigger than the state managed by this
     class and should therefore only be held in memory for brief periods of time.
     """
+    __slots__ = ('remainingRetryCount', 'filesToDelete', 'predecessorsFinished', 'stack',
+                 'logJobStoreFileID', 'services', 'terminateJobStoreID', 'startJobStoreID',
+                 'errorJobStoreID', 'checkpoint', 'checkpointFilesToDelete', 'chainedJobs')
+
     def __init__(self, command, memory, cores, disk, unitName, jobName, preemptable,
                  jobStoreID, remainingRetryCount, predecessorNumber,
                  filesToDelete=None, predecessorsFinished=None,
@@ -35,14 +39,16 @@ class JobGraph(JobNode):
                  logJobStoreFileID=None,
                  checkpoint=None,
                  checkpointFilesToDelete=None,
-                 chainedJobs=None):
+                 chainedJobs=None,
+                 inputs=()):
         requirements = {'memory': memory, 'cores': cores, 'disk': disk,
                         'preemptable': preemptable}
         super(JobGraph, self).__init__(command=command,
                                        requirements=requirements,
                                        unitName=unitName, jobName=jobName,
                                        jobStoreID=jobStoreID,
-                                       predecessorNumber=predecessorNumber)
+                                       predecessorNumber=predecessorNumber,
+                                       inputs=inputs)
 
         # The number of times the job should be retried if it fails This number is reduced by
         # retries until it is zero and then no further retries are made
@@ -134,6 +140,7 @@ class JobGraph(JobNode):
                    remainingRetryCount=tryCount,
                    predecessorNumber=jobNode.predecessorNumber,
                    unitName=jobNode.unitName, jobName=jobNode.jobName,
+                   inputs=jobNode.inputs,
                    **jobNode._requirements)
 
     def __eq__(self, other):
@@ -19,6 +19,8 @@ import re
 from abc import ABCMeta, abstractmethod
 from contextlib import contextmanager, closing
 from datetime import timedelta
+from itertools import chain
+from multiprocessing.pool import ThreadPool
 from uuid import uuid4
 
 # Python 3 compatibility imports
@@ -28,8 +30,9 @@ import six.moves.urllib.parse as urlparse
 
 from bd2k.util.retry import retry_http
 
-from toil.fileStore import FileID
+from toil.fileStore import FileID, NodeCache
 from toil.job import JobException
+from toil.jobStores.serializers import CompactJobSerializer
 from bd2k.util import memoize
 from bd2k.util.objects import abstractclassmethod
 
@@ -107,6 +110,11 @@ class AbstractJobStore(object):
     """
     __metaclass__ = ABCMeta
 
+    # Converts jobs to and from the binary representation persisted by the job store. Any
+    # object with serialize() and deserialize() methods like the ones of the classes in
+    # toil.jobStores.serializers can be plugged in here.
+    jobSerializer = CompactJobSerializer()
+
     def __init__(self):
         """
         Create an instance of the job store. The instance will not be fully functional until
@@ -300,8 +308,15 @@ class AbstractJobStore(object):
         """
         if sharedFileName is None:
             with self.writeFileStream() as (writable, jobStoreFileID):
-                otherCls._readFromUrl(url, writable)
-                return FileID(jobStoreFileID, otherCls.getSize(url))
+                if self.config.nodeCacheDir is None:
+                    otherCls._readFromUrl(url, writable)
+                    return FileID(jobStoreFileID, otherCls.getSize(url))
+                else:
+                    # Key the file by its content so it can be shared through the node cache
+                    writable = NodeCache.HashingWritable(writable)
+                    otherCls._readFromUrl(url, writable)
+                    return FileID(jobStoreFileID, otherCls.getSize(url),
+                                  contentKey=writable.contentKey)
         else:
             self._requireValidSharedFileName(sharedFileName)
             with self.writeSharedFileStream(sharedFileName) as writable:
@@ -418,7 +433,7 @@ class AbstractJobStore(object):
 
     # Cleanup functions
 
-    def clean(self, jobCache=None):
+    def clean(self, jobCache=None, activeJobsOnly=False):
         """
         Function to cleanup the state of a job store after a restart.
         Fixes jobs that might have been partially updated. Resets the try counts and removes jobs
@@ -427,30 +442,30 @@ class AbstractJobStore(object):
         :param dict[str,toil.jobGraph.JobGraph] jobCache: if a value it must be a dict
                from job ID keys to JobGraph object values. Jobs will be loaded from the cache
                (which can be downloaded from the job store in a batch) instead of piecemeal when
-               recursed into.
+               recursed into. Jobs that are missing from the cache are added to it once loaded.
+
+        :param bool activeJobsOnly: if True, only fix the jobs that may have been issued, i.e.
+               the jobs reachable from the root job via the successors to be run next of jobs
+               whose command has run, and their services. Successors further down a job's stack
+               haven't been issued and need no fixing. Orphaned jobs left behind by failed
+               attempts to run a job are not removed, which would require examining every job.
         """
         if jobCache is None:
             logger.warning("Cleaning jobStore recursively. This may be slow.")
 
-        # Functions to get and check the existence of jobs, using the jobCache
-        # if present
+        # The jobs loaded so far, including the ones in the jobCache if present
+        loadedJobs = {} if jobCache is None else jobCache
+
+        # Functions to get and check the existence of jobs, using the loaded jobs if possible
         def getJob(jobId):
-            if jobCache is not None:
-                try:
-                    return jobCache[jobId]
-                except KeyError:
-                    self.load(jobId)
-            else:
-                return self.load(jobId)
+            try:
+                return loadedJobs[jobId]
+            except KeyError:
+                jobGraph = loadedJobs[jobId] = self.load(jobId)
+                return jobGraph
 
         def haveJob(jobId):
-            if jobCache is not None:
-                if jobId in jobCache:
-                    return True
-                else:
-                    return self.exists(jobId)
-            else:
-                return self.exists(jobId)
+            return jobId in loadedJobs or self.exists(jobId)
 
         def getJobs():
             if jobCache is not None:
@@ -458,33 +473,36 @@ class AbstractJobStore(object):
             else:
                 return self.jobs()
 
+        def getSuccessorIDs(jobGraph):
+            if not activeJobsOnly:
+                stack = jobGraph.stack
+            else:
+                # The successors of a job are run after its command. Successors that completed
+                # are only removed from the job's stack when it is run again, so the successors
+                # to be run next are in the last level of the stack with any remaining jobs.
+                stack = []
+                if jobGraph.command is None:
+                    for jobs in reversed(jobGraph.stack):
+                        jobs = [jobNode for jobNode in jobs if haveJob(jobNode.jobStoreID)]
+                        if jobs:
+                            stack = [jobs]
+                            break
+            # Traverse jobs in stack and service jobs
+            return [jobNode.jobStoreID
+                    for jobs in chain(stack, jobGraph.services)
+                    for jobNode in jobs]
+
         # Iterate from the root jobGraph and collate all jobs that are reachable from it
         # All other jobs returned by self.jobs() are orphaned and can be removed
-        reachableFromRoot = set()
-
-        def getConnectedJobs(jobGraph):
-            if jobGraph.jobStoreID in reachableFromRoot:
-                return
-            reachableFromRoot.add(jobGraph.jobStoreID)
-            # Traverse jobs in stack
-            for jobs in jobGraph.stack:
-                for successorJobStoreID in map(lambda x: x.jobStoreID, jobs):
-                    if (successorJobStoreID not in reachableFromRoot
-                        and haveJob(successorJobStoreID)):
-                        getConnectedJobs(getJob(successorJobStoreID))
-            # Traverse service jobs
-            for jobs in jobGraph.services:
-                for serviceJobStoreID in map(lambda x: x.jobStoreID, jobs):
-                    if haveJob(serviceJobStoreID):
-                        assert serviceJobStoreID not in reachableFromRoot
-                        reachableFromRoot.add(serviceJobStoreID)
-
         logger.info("Checking job graph connectivity...")
-        getConnectedJobs(self.loadRootJob())
+        reachableFromRoot = set(jobGraph.jobStoreID for jobGraph in
+                                self.traverse([self.loadRootJob()], getSuccessorIDs,
+                                              jobCache=loadedJobs))
         logger.info("%d jobs reachable from root." % len(reachableFromRoot))
 
         # Cleanup jobs that are not reachable from the root, and therefore orphaned
-        jobsToDelete = filter(lambda x: x.jobStoreID not in reachableFromRoot, getJobs())
+        jobsToDelete = [] if activeJobsOnly else filter(
+            lambda x: x.jobStoreID not in reachableFromRoot, getJobs())
         for jobGraph in jobsToDelete:
             # clean up any associated files before deletion
             for fileID in jobGraph.filesToDelete:
@@ -519,7 +537,7 @@ class AbstractJobStore(object):
                 stackSizeFn = lambda: sum(map(len, jobGraph.stack))
                 startStackSize = stackSizeFn()
                 # Remove deleted jobs
-                jobGraph.stack = map(lambda x: filter(lambda y: self.exists(y.jobStoreID), x),
+                jobGraph.stack = map(lambda x: filter(lambda y: haveJob(y.jobStoreID), x),
                                        jobGraph.stack)
                 # Remove empty stuff from the stack
                 jobGraph.stack = filter(lambda x: len(x) > 0, jobGraph.stack)
@@ -708,6 +726,116 @@ class AbstractJobStore(object):
         """
         raise NotImplementedError()
 
+    def loadMany(self, jobStoreIDs):
+        """
+        Loads the jobs referenced by the given IDs. Unlike :meth:`.load`, this method does not
+        raise an exception for jobs that don't exist, it simply omits them from the result. This
+        implementation loads one job at a time. Subclasses should override it if the underlying
+        storage mechanism can load multiple jobs in fewer round trips.
+
+        :param Iterable[str] jobStoreIDs: the IDs of the jobs to load
+
+        :return: a dictionary mapping the ID of each existing job to that job
+        :rtype: dict[str,toil.jobGraph.JobGraph]
+        """
+        jobs = {}
+        for jobStoreID in jobStoreIDs:
+            try:
+                jobs[jobStoreID] = self.load(jobStoreID)
+            except NoSuchJobException:
+                pass
+        return jobs
+
+    def updateMany(self, jobs):
+        """
+        Persists the given jobs in this store. Each job is updated atomically but the batch as a
+        whole isn't. This implementation updates one job at a time. Subclasses should override
+        it if the underlying storage mechanism can update multiple jobs in fewer round trips.
+
+        :param Iterable[toil.jobGraph.JobGraph] jobs: the jobs to write to this job store
+        """
+        for job in jobs:
+            self.update(job)
+
+    def deleteMany(self, jobStoreIDs):
+        """
+        Removes the jobs with the given IDs from this store. Like :meth:`.delete`, this operation
+        is idempotent. This implementation deletes one job at a time. Subclasses should override
+        it if the underlying storage mechanism can delete multiple jobs in fewer round trips.
+
+        :param Iterable[str] jobStoreIDs: the IDs of the jobs to delete from this job store
+        """
+        for jobStoreID in jobStoreIDs:
+            self.delete(jobStoreID)
+
+    # The maximum number of threads traverse() uses to load jobs concurrently
+    traversalThreads = 16
+
+    # The maximum number of jobs traverse() loads with a single call to loadMany()
+    traversalBatchSize = 100
+
+    def traverse(self, rootJobs, getSuccessorIDs, jobCache=None, ignoreMissing=True):
+        """
+        Traverses the job graph breadth-first, starting at the given jobs. The successors of all
+        jobs on one level of the graph are loaded concurrently before any of them is visited,
+        using up to :attr:`traversalThreads` threads, each invoking :meth:`.loadMany` for up to
+        :attr:`traversalBatchSize` jobs at a time. The traversal is iterative, so the depth of
+        the graph isn't limited by Python's recursion limit.
+
+        :param Iterable[toil.jobGraph.JobGraph] rootJobs: the jobs to start at
+
+        :param getSuccessorIDs: a function that takes a job and returns the IDs of the jobs to
+               visit after it. It is invoked in the calling thread once the caller is done with
+               the job, i.e. when the caller asks for the next job, and may therefore depend on
+               state the caller updates while visiting jobs.
+
+        :param dict[str,toil.jobGraph.JobGraph] jobCache: if a value it must be a dict from job
+               ID keys to JobGraph object values. Jobs will be taken from the cache instead of
+               being loaded and loaded jobs will be added to it.
+
+        :param bool ignoreMissing: if True, successors that don't exist are skipped, otherwise
+               NoSuchJobException is raised for them
+
+        :return: the jobs in the order they are visited, each job at most once
+        :rtype: Iterator[toil.jobGraph.JobGraph]
+        """
+        if jobCache is None:
+            jobCache = {}
+        pool = None
+        try:
+            level = list(rootJobs)
+            visited = set(jobGraph.jobStoreID for jobGraph in level)
+            while level:
+                successorIDs = []
+                for jobGraph in level:
+                    yield jobGraph
+                    for successorID in getSuccessorIDs(jobGraph):
+                        if successorID not in visited:
+                            visited.add(successorID)
+                            successorIDs.append(successorID)
+                idsToLoad = [x for x in successorIDs if x not in jobCache]
+                batches = [idsToLoad[i:i + self.traversalBatchSize]
+                           for i in range(0, len(idsToLoad), self.traversalBatchSize)]
+                if len(batches) > 1 and self.traversalThreads > 1:
+                    if pool is None:
+                        pool = ThreadPool(self.traversalThreads)
+                    loadedJobs = pool.map(self.loadMany, batches)
+                else:
+                    loadedJobs = map(self.loadMany, batches)
+                for jobs in loadedJobs:
+                    jobCache.update(jobs)
+                level = []
+                for successorID in successorIDs:
+                    try:
+                        level.append(jobCache[successorID])
+                    except KeyError:
+                        if not ignoreMissing:
+                            raise NoSuchJobException(successorID)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
     def jobs(self):
         """
         Best effort attempt to return iterator on all jobs in the store. The iterator may not
@@ -820,6 +948,65 @@ class AbstractJobStore(object):
         """
         raise NotImplementedError()
 
+    def readFileInParallel(self, jobStoreFileID, localFilePath, partSize, threads):
+        """
+        Like :meth:`.readFile` but reads the file in parts of the given size, using up to the
+        given number of concurrent connections to the underlying storage. This is faster than
+        :meth:`.readFile` for large files if the bandwidth of a single connection is limited.
+
+        This implementation simply invokes :meth:`.readFile`. Subclasses should override it if
+        the underlying storage supports reading ranges of a file.
+
+        :param str jobStoreFileID: ID of the file to be copied
+
+        :param str localFilePath: the local path indicating where to place the contents of the
+               given file in the job store
+
+        :param int partSize: the size of each part in bytes
+
+        :param int threads: the maximum number of parts to read at the same time
+        """
+        self.readFile(jobStoreFileID, localFilePath)
+
+    @staticmethod
+    def _partRanges(size, partSize):
+        """
+        Splits a file of the given size into consecutive ranges of at most the given size.
+
+        >>> list(AbstractJobStore._partRanges(5, 2))
+        [(0, 2), (2, 4), (4, 5)]
+        >>> list(AbstractJobStore._partRanges(0, 2))
+        []
+
+        :return: the start (inclusive) and end (exclusive) offset of each range
+        :rtype: Iterator[(int,int)]
+        """
+        for start in range(0, size, partSize):
+            yield start, min(start + partSize, size)
+
+    def updateFileInParts(self, jobStoreFileID, readable, threads):
+        """
+        Replaces the existing version of a file in the job store with the content read from the
+        given file handle. Large files are written in parts, up to the given number of them at a
+        time, which are held in memory while they are written.
+
+        This implementation copies the content to :meth:`.updateFileStream`. Subclasses should
+        override it if the underlying storage supports writing the parts of a file concurrently.
+
+        :param str jobStoreFileID: the ID of the file in the job store to be updated
+
+        :param readable: a file handle to read the new content of the file from
+
+        :param int threads: the maximum number of parts to write at the same time
+
+        :raise ConcurrentFileModificationException: if the file was modified concurrently during
+               an invocation of this method
+
+        :raise NoSuchFileException: if the specified file does not exist
+        """
+        with self.updateFileStream(jobStoreFileID) as writable:
+            shutil.copyfileobj(readable, writable)
+
     @abstractmethod
     def deleteFile(self, jobStoreFileID):
         """
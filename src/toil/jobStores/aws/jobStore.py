@@ -15,6 +15,8 @@
 from __future__ import absolute_import
 
 from contextlib import contextmanager, closing
+from multiprocessing.pool import ThreadPool
+from threading import BoundedSemaphore
 import logging
 
 import re
@@ -26,7 +28,7 @@ import urlparse
 import urllib
 
 # Python 3 compatibility imports
-from six.moves import xrange, cPickle, StringIO, reprlib
+from six.moves import xrange, StringIO, reprlib
 from six import iteritems
 
 from bd2k.util import strict_bool
@@ -52,7 +54,7 @@ from toil.jobStores.aws.utils import (SDBHelper,
                                       bucket_location_to_region,
                                       region_to_bucket_location, copyKeyMultipart,
                                       uploadFromPath, chunkedFileUpload, fileSizeAndTime)
-from toil.jobStores.utils import WritablePipe, ReadablePipe
+from toil.jobStores.utils import WritablePipe, ReadablePipe, batches, readPartsInParallel
 from toil.jobGraph import JobGraph
 import toil.lib.encryption as encryption
 
@@ -233,11 +235,11 @@ class AWSJobStore(AbstractJobStore):
         else:
             binary,_ = SDBHelper.attributesToBinary(item)
             assert binary is not None
-        job = cPickle.loads(binary)
+        job = self.jobSerializer.deserialize(binary)
         return job
 
     def _awsJobToItem(self, job):
-        binary = cPickle.dumps(job, protocol=cPickle.HIGHEST_PROTOCOL)
+        binary = self.jobSerializer.serialize(job)
         if len(binary) > SDBHelper.maxBinarySize():
             #Store as an overlarge job in S3
             with self.writeFileStream() as (writable, fileID):
@@ -299,7 +301,51 @@ class AWSJobStore(AbstractJobStore):
             with attempt:
                 assert self.jobsDomain.put_attributes(job.jobStoreID, item)
 
+    # SDB limits the number of comparisons in a select expression to 20, the number of items in
+    # a batch operation to 25 and the size of a batch put to 1 MB
+    itemsPerBatchSelect = 20
     itemsPerBatchDelete = 25
+    itemsPerBatchPut = 25
+    maxBatchPutSize = 1 << 20
+
+    def _selectItems(self, domain, attributes, predicate, values):
+        """
+        Selects the given attributes of all items in the given domain for which the given
+        predicate matches any of the given values, issuing as few select requests as possible.
+
+        :param str attributes: the attributes to select, e.g. '*'
+        :param str predicate: the left-hand side of the 'in' comparison, e.g. 'itemName()'
+        :param Iterable[str] values: the values to compare against
+        :rtype: Iterator[boto.sdb.item.Item]
+        """
+        for batch in batches(values, self.itemsPerBatchSelect):
+            items = None
+            for attempt in retry_sdb():
+                with attempt:
+                    items = list(domain.select(
+                        consistent_read=True,
+                        query="select %s from `%s` where %s in (%s)" % (
+                            attributes, domain.name, predicate,
+                            ', '.join("'%s'" % value for value in batch))))
+            assert items is not None
+            for item in items:
+                yield item
+
+    def loadMany(self, jobStoreIDs):
+        jobs = {}
+        for item in self._selectItems(self.jobsDomain, '*', 'itemName()', jobStoreIDs):
+            jobs[item.name] = self._awsJobFromItem(item)
+        log.debug("Loaded %d job(s)", len(jobs))
+        return jobs
+
+    def updateMany(self, jobs):
+        items = ((job.jobStoreID, self._awsJobToItem(job)) for job in jobs)
+        for batch in batches(items, self.itemsPerBatchPut, maxSize=self.maxBatchPutSize,
+                             sizeOf=lambda jobItem: sum(map(len, jobItem[1].values()))):
+            log.debug("Updating %d job(s)", len(batch))
+            for attempt in retry_sdb():
+                with attempt:
+                    assert self.jobsDomain.batch_put_attributes(dict(batch))
 
     def delete(self, jobStoreID):
         # remove job and replace with jobStoreId.
@@ -326,21 +372,45 @@ class AWSJobStore(AbstractJobStore):
         assert items is not None
         if items:
             log.debug("Deleting %d file(s) associated with job %s", len(items), jobStoreID)
-            n = self.itemsPerBatchDelete
-            batches = [items[i:i + n] for i in range(0, len(items), n)]
-            for batch in batches:
-                itemsDict = {item.name: None for item in batch}
-                for attempt in retry_sdb():
-                    with attempt:
-                        self.filesDomain.batch_delete_attributes(itemsDict)
-            for item in items:
-                version = item.get('version')
-                for attempt in retry_s3():
-                    with attempt:
-                        if version:
-                            self.filesBucket.delete_key(key_name=item.name, version_id=version)
-                        else:
-                            self.filesBucket.delete_key(key_name=item.name)
+            self._deleteFileItems(items)
+
+    def deleteMany(self, jobStoreIDs):
+        jobStoreIDs = list(jobStoreIDs)
+        for item in self._selectItems(self.jobsDomain, 'overlargeID', 'itemName()', jobStoreIDs):
+            if "overlargeID" in item:
+                log.debug("Deleting job %s from filestore", item.name)
+                self.deleteFile(item["overlargeID"])
+        for batch in batches(jobStoreIDs, self.itemsPerBatchDelete):
+            log.debug("Deleting %d job(s)", len(batch))
+            for attempt in retry_sdb():
+                with attempt:
+                    self.jobsDomain.batch_delete_attributes({jobStoreID: None
+                                                             for jobStoreID in batch})
+        items = list(self._selectItems(self.filesDomain, 'version', 'ownerID', jobStoreIDs))
+        if items:
+            log.debug("Deleting %d file(s) associated with %d job(s)",
+                      len(items), len(jobStoreIDs))
+            self._deleteFileItems(items)
+
+    def _deleteFileItems(self, items):
+        """
+        Deletes the given items from the files domain along with the S3 keys they refer to.
+
+        :param list[boto.sdb.item.Item] items: items with at least the 'version' attribute
+        """
+        for batch in batches(items, self.itemsPerBatchDelete):
+            itemsDict = {item.name: None for item in batch}
+            for attempt in retry_sdb():
+                with attempt:
+                    self.filesDomain.batch_delete_attributes(itemsDict)
+        for item in items:
+            version = item.get('version')
+            for attempt in retry_s3():
+                with attempt:
+                    if version:
+                        self.filesBucket.delete_key(key_name=item.name, version_id=version)
+                    else:
+                        self.filesBucket.delete_key(key_name=item.name)
 
     def getEmptyFileStoreID(self, jobStoreID=None):
         info = self.FileInfo.create(jobStoreID)
@@ -509,6 +579,12 @@ class AWSJobStore(AbstractJobStore):
         info.save()
         log.debug("Wrote %r from path %r.", info, localFilePath)
 
+    def updateFileInParts(self, jobStoreFileID, readable, threads):
+        info = self.FileInfo.loadOrFail(jobStoreFileID)
+        info.uploadInParts(readable, threads)
+        info.save()
+        log.debug("Wrote %r from file handle in parts.", info)
+
     @contextmanager
     def updateFileStream(self, jobStoreFileID):
         info = self.FileInfo.loadOrFail(jobStoreFileID)
@@ -525,6 +601,11 @@ class AWSJobStore(AbstractJobStore):
         log.debug("Reading %r into %r.", info, localFilePath)
         info.download(localFilePath)
 
+    def readFileInParallel(self, jobStoreFileID, localFilePath, partSize, threads):
+        info = self.FileInfo.loadOrFail(jobStoreFileID)
+        log.debug("Reading %r into %r in parallel.", info, localFilePath)
+        info.downloadInParallel(localFilePath, partSize, threads)
+
     @contextmanager
     def readFileStream(self, jobStoreFileID):
         info = self.FileInfo.loadOrFail(jobStoreFileID)
@@ -1058,6 +1139,59 @@ class AWSJobStore(AbstractJobStore):
 
             assert bool(self.version) == (self.content is None)
 
+        def uploadInParts(self, readable, threads):
+            store = self.outer
+            buf = readable.read(store.partSize)
+            if len(buf) < store.partSize:
+                # The file fits into a single part
+                with self.uploadStream(multipart=False) as writable:
+                    writable.write(buf)
+                return
+            headers = self._s3EncryptionHeaders()
+            for attempt in retry_s3():
+                with attempt:
+                    upload = store.filesBucket.initiate_multipart_upload(key_name=self.fileID,
+                                                                         headers=headers)
+            # Limits the number of parts held in memory, such that reading from the file handle
+            # blocks while all threads are busy
+            partSlots = BoundedSemaphore(threads)
+
+            def uploadPart(partNum, buf):
+                try:
+                    for attempt in retry_s3():
+                        with attempt:
+                            upload.upload_part_from_file(fp=StringIO(buf),
+                                                         part_num=partNum,
+                                                         headers=headers)
+                finally:
+                    partSlots.release()
+
+            pool = ThreadPool(threads)
+            try:
+                results = []
+                # part numbers are 1-based
+                for partNum in itertools.count(1):
+                    partSlots.acquire()
+                    results.append(pool.apply_async(uploadPart, (partNum, buf)))
+                    buf = readable.read(store.partSize)
+                    if not buf:
+                        break
+                for result in results:
+                    # reraises any exception raised while uploading the part
+                    result.get()
+            except:
+                with panic(log=log):
+                    for attempt in retry_s3():
+                        with attempt:
+                            upload.cancel_upload()
+            else:
+                for attempt in retry_s3():
+                    with attempt:
+                        self.version = upload.complete_upload().version_id
+            finally:
+                pool.close()
+                pool.join()
+
         def copyFrom(self, srcKey):
             """
             Copies contents of source key into this file.
@@ -1139,6 +1273,38 @@ class AWSJobStore(AbstractJobStore):
             else:
                 assert False
 
+        def downloadInParallel(self, localFilePath, partSize, threads):
+            if self.content is not None or threads < 2:
+                self.download(localFilePath)
+            elif self.version:
+                headers = self._s3EncryptionHeaders()
+                for attempt in retry_s3():
+                    with attempt:
+                        size = self.outer.filesBucket.get_key(self.fileID,
+                                                              version_id=self.version,
+                                                              headers=headers).size
+
+                def readRange(start, end):
+                    def readPart(writable):
+                        # Boto keys aren't thread-safe so each part gets its own
+                        key = self.outer.filesBucket.get_key(self.fileID, validate=False)
+                        rangeHeaders = dict(headers, Range='bytes=%d-%d' % (start, end - 1))
+                        for attempt in retry_s3():
+                            with attempt:
+                                # A retry overwrites whatever the failed attempt wrote
+                                writable.seek(start)
+                                key.get_contents_to_file(writable,
+                                                         headers=rangeHeaders,
+                                                         version_id=self.version)
+                    return start, readPart
+
+                readPartsInParallel(localFilePath,
+                                    [readRange(start, end)
+                                     for start, end in self.outer._partRanges(size, partSize)],
+                                    threads)
+            else:
+                assert False
+
         @contextmanager
         def downloadStream(self):
             info = self
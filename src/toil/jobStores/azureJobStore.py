@@ -26,7 +26,6 @@ from contextlib import contextmanager
 from datetime import datetime, timedelta
 
 # Python 3 compatibility imports
-from six.moves import cPickle
 from six.moves.http_client import HTTPException
 from six.moves.configparser import RawConfigParser, NoOptionError
 
@@ -42,7 +41,7 @@ from bd2k.util import strict_bool, memoize
 from bd2k.util.exceptions import panic
 from bd2k.util.retry import retry
 
-from toil.jobStores.utils import WritablePipe, ReadablePipe
+from toil.jobStores.utils import WritablePipe, ReadablePipe, batches, readPartsInParallel
 from toil.jobGraph import JobGraph
 from toil.jobStores.abstractJobStore import (AbstractJobStore,
                                              NoSuchJobException,
@@ -215,7 +214,7 @@ class AzureJobStore(AbstractJobStore):
 
         for jobEntity in self.jobItems.query_entities_auto():
             # Process the items in the page
-            yield AzureJob.fromEntity(jobEntity)
+            yield AzureJob.fromEntity(jobEntity, self.jobSerializer)
             total_processed += 1
 
             if total_processed % 1000 == 0:
@@ -228,7 +227,7 @@ class AzureJobStore(AbstractJobStore):
     def create(self, jobNode):
         jobStoreID = self._newJobID()
         job = AzureJob.fromJobNode(jobNode, jobStoreID, self._defaultTryCount())
-        entity = job.toItem(chunkSize=self.jobChunkSize)
+        entity = job.toItem(self.jobSerializer, chunkSize=self.jobChunkSize)
         entity['RowKey'] = jobStoreID
         self.jobItems.insert_entity(entity=entity)
         return job
@@ -242,11 +241,12 @@ class AzureJobStore(AbstractJobStore):
         jobEntity = self.jobItems.get_entity(row_key=jobStoreID)
         if jobEntity is None:
             raise NoSuchJobException(jobStoreID)
-        return AzureJob.fromEntity(jobEntity)
+        return AzureJob.fromEntity(jobEntity, self.jobSerializer)
 
     def update(self, job):
         self.jobItems.update_entity(row_key=job.jobStoreID,
-                                    entity=job.toItem(chunkSize=self.jobChunkSize))
+                                    entity=job.toItem(self.jobSerializer,
+                                                      chunkSize=self.jobChunkSize))
 
     def delete(self, jobStoreID):
         try:
@@ -259,6 +259,97 @@ class AzureJobStore(AbstractJobStore):
             jobStoreFileID = fileEntity.RowKey
             self.deleteFile(jobStoreFileID)
 
+    # The Table service limits a filter to 15 comparisons, and an entity group transaction to 100
+    # operations and a payload of 4 MB.
+    comparisonsPerFilter = 15
+    operationsPerTransaction = 100
+    maxTransactionSize = 4 * 1024 * 1024
+
+    def _queryEntitiesIn(self, table, key, values):
+        """
+        Yields all entities in the given table whose value for the given key is any of the given
+        values, issuing as few queries as possible.
+
+        :param AzureTable table: the table to query
+        :param str key: 'PartitionKey' or 'RowKey'
+        :param Iterable[str] values: the values to match
+        """
+        for batch in batches(values, self.comparisonsPerFilter):
+            filterString = ' or '.join("%s eq '%s'" % (key, value) for value in batch)
+            for entity in table.query_entities_auto(filter=filterString):
+                yield entity
+
+    def _transaction(self, operations):
+        """
+        Performs the given table operations in entity group transactions. All entities involved
+        must be in the same partition.
+
+        :param Iterable[(Callable,int)] operations: pairs of a function that invokes a single
+               operation on self.tableService and the approximate payload size of that operation
+        """
+        for batch in batches(operations, self.operationsPerTransaction,
+                             maxSize=self.maxTransactionSize, sizeOf=lambda op: op[1]):
+            for attempt in retry_azure():
+                with attempt:
+                    self.tableService.begin_batch()
+                    try:
+                        for operation, _ in batch:
+                            operation()
+                    except:
+                        with panic(logger):
+                            self.tableService.cancel_batch()
+                    else:
+                        self.tableService.commit_batch()
+
+    def loadMany(self, jobStoreIDs):
+        jobs = {}
+        for jobEntity in self._queryEntitiesIn(self.jobItems, 'RowKey', jobStoreIDs):
+            jobStoreID = jobEntity.RowKey
+            jobs[jobStoreID] = AzureJob.fromEntity(jobEntity, self.jobSerializer)
+        return jobs
+
+    def updateMany(self, jobs):
+        def updateOperation(job):
+            entity = job.toItem(self.jobSerializer, chunkSize=self.jobChunkSize)
+            entity['PartitionKey'] = AzureTable.defaultPartition
+            size = sum(len(prop.value) for prop in entity.itervalues()
+                       if isinstance(prop, EntityProperty))
+
+            def operation():
+                self.tableService.update_entity(table_name=self.jobItems.tableName,
+                                                partition_key=AzureTable.defaultPartition,
+                                                row_key=job.jobStoreID,
+                                                entity=entity)
+            return operation, size
+
+        self._transaction(updateOperation(job) for job in jobs)
+
+    def deleteMany(self, jobStoreIDs):
+        jobStoreIDs = list(jobStoreIDs)
+        # A transaction fails as a whole if it deletes a missing entity, so only delete the jobs
+        # that still exist
+        existingIDs = [jobEntity.RowKey for jobEntity in
+                       self._queryEntitiesIn(self.jobItems, 'RowKey', jobStoreIDs)]
+
+        def deleteOperation(jobStoreID):
+            def operation():
+                self.tableService.delete_entity(table_name=self.jobItems.tableName,
+                                                partition_key=AzureTable.defaultPartition,
+                                                row_key=jobStoreID)
+            return operation, 0
+
+        try:
+            self._transaction(deleteOperation(jobStoreID) for jobStoreID in existingIDs)
+        except AzureMissingResourceHttpError:
+            # Some job was deleted concurrently, fall back to idempotent single deletions
+            for jobStoreID in existingIDs:
+                try:
+                    self.jobItems.delete_entity(row_key=jobStoreID)
+                except AzureMissingResourceHttpError:
+                    pass
+        for fileEntity in self._queryEntitiesIn(self.jobFileIDs, 'PartitionKey', jobStoreIDs):
+            self.deleteFile(fileEntity.RowKey)
+
     def getEnv(self):
         return dict(AZURE_ACCOUNT_KEY=self.accountKey)
 
@@ -341,6 +432,37 @@ class AzureJobStore(AbstractJobStore):
         except AzureMissingResourceHttpError:
             raise NoSuchFileException(jobStoreFileID)
 
+    def readFileInParallel(self, jobStoreFileID, localFilePath, partSize, threads):
+        try:
+            blobProps = self.files.get_blob_properties(blob_name=jobStoreFileID)
+        except AzureMissingResourceHttpError:
+            raise NoSuchFileException(jobStoreFileID)
+        encrypted = strict_bool(blobProps['x-ms-meta-encrypted'])
+        if encrypted and self.keyPath is None:
+            raise AssertionError('Content is encrypted but no key was provided.')
+        # Blocks are encrypted individually so parts must consist of whole blocks
+        blockSize = self._maxAzureBlockBytes
+        blocksPerPart = max(1, partSize // blockSize)
+        contentBlockSize = blockSize - encryption.overhead if encrypted else blockSize
+
+        def readRange(start, end):
+            def readPart(writable):
+                for blockStart in range(start, end, blockSize):
+                    blockEnd = min(blockStart + blockSize, end)
+                    buf = self.files.get_blob(blob_name=jobStoreFileID,
+                                              x_ms_range="bytes=%d-%d" % (blockStart,
+                                                                          blockEnd - 1))
+                    if encrypted:
+                        buf = encryption.decrypt(buf, self.keyPath)
+                    writable.write(buf)
+            return start // blockSize * contentBlockSize, readPart
+
+        readPartsInParallel(localFilePath,
+                            [readRange(start, end)
+                             for start, end in self._partRanges(int(blobProps['Content-Length']),
+                                                                blocksPerPart * blockSize)],
+                            threads)
+
     def deleteFile(self, jobStoreFileID):
         try:
             self.files.delete_blob(blob_name=jobStoreFileID)
@@ -761,20 +883,22 @@ class AzureJob(JobGraph):
     defaultAttrs = ['PartitionKey', 'RowKey', 'etag', 'Timestamp']
 
     @classmethod
-    def fromEntity(cls, jobEntity):
+    def fromEntity(cls, jobEntity, serializer):
         """
         :type jobEntity: Entity
+        :param serializer: the job store's job serializer
         :rtype: AzureJob
         """
         jobEntity = jobEntity.__dict__
         for attr in cls.defaultAttrs:
             del jobEntity[attr]
-        return cls.fromItem(jobEntity)
+        return cls.fromItem(jobEntity, serializer)
 
     @classmethod
-    def fromItem(cls, item):
+    def fromItem(cls, item, serializer):
         """
         :type item: dict
+        :param serializer: the job store's job serializer
         :rtype: AzureJob
         """
         chunkedJob = item.items()
@@ -784,17 +908,18 @@ class AzureJob(JobGraph):
             wholeJobString = chunkedJob[0][1].value
         else:
             wholeJobString = ''.join(item[1].value for item in chunkedJob)
-        return cPickle.loads(bz2.decompress(wholeJobString))
+        return serializer.deserialize(bz2.decompress(wholeJobString))
 
-    def toItem(self, chunkSize=maxAzureTablePropertySize):
+    def toItem(self, serializer, chunkSize=maxAzureTablePropertySize):
         """
+        :param serializer: the job store's job serializer
         :param chunkSize: the size of a chunk for splitting up the serialized job into chunks
         that each fit into a property value of the an Azure table entity
         :rtype: dict
         """
         assert chunkSize <= maxAzureTablePropertySize
         item = {}
-        serializedAndEncodedJob = bz2.compress(cPickle.dumps(self, protocol=cPickle.HIGHEST_PROTOCOL))
+        serializedAndEncodedJob = bz2.compress(serializer.serialize(self))
         jobChunks = [serializedAndEncodedJob[i:i + chunkSize]
                      for i in range(0, len(serializedAndEncodedJob), chunkSize)]
         for attributeOrder, chunk in enumerate(jobChunks):
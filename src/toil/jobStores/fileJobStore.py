@@ -15,22 +15,29 @@
 from __future__ import absolute_import
 
 from contextlib import contextmanager
+import atexit
 import logging
 import pickle as pickler
-import random
 import shutil
 import os
+import struct
 import tempfile
+import threading
 import stat
 import errno
+import uuid
+import zlib
+from fcntl import flock, LOCK_EX, LOCK_UN
 
 # Python 3 compatibility imports
+from six import iteritems, itervalues
 from six.moves import xrange
 
 from bd2k.util.exceptions import require
 
-from toil.fileStore import FileID
+from toil.fileStore import FileID, NodeCache
 from toil.lib.bioio import absSymPath
+from toil.lib.localTransfer import copyFile, LINK
 from toil.jobStores.abstractJobStore import (AbstractJobStore,
                                              NoSuchJobException,
                                              NoSuchFileException,
@@ -45,12 +52,39 @@ class FileJobStore(AbstractJobStore):
     """
     A job store that uses a directory on a locally attached file system. To be compatible with
     distributed batch systems, that file system must be shared by all worker nodes.
+
+    All job and file IDs are paths relative to the `tmp` directory of the job store. Jobs live in
+    a hashed fan-out tree below `tmp/jobs`, files that aren't associated with a job live in a
+    similar tree below `tmp/files`. Processes that create jobs append their IDs to one of a fixed
+    number of segments of the job index in `tmp/index`, chosen by the job ID, so that
+    :meth:`jobs` can stream the job IDs instead of having to walk the entire tree. Stats and logging files are kept in `tmp/stats`, and moved
+    to `tmp/stats/read` once they have been processed.
+
+    In journaled mode, see :meth:`update`, updates to jobs are appended to a per-process journal
+    in `tmp/journal` instead of rewriting the job file. An empty marker file in the job's
+    directory names each journal holding records for that job that have not been compacted into
+    the job file yet.
     """
 
-    # Parameters controlling the creation of temporary files
+    # The number of directory levels in the hashed fan-out trees and the number of hex digits of
+    # the hash consumed by each level
+    fanOutLevels = 2
+    fanOutWidth = 2
+
+    # Parameters of the legacy layout in which jobs, files and stats were placed in randomly
+    # chosen directories directly below `tmp`. Only used for migrating such job stores.
     validDirs = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789"
     levels = 2
 
+    # The number of segments of the job index, each of which is shared by all processes
+    numJobIndexSegments = 16
+
+    # The number of seconds between compactions of the journal in journaled mode
+    journalCompactionInterval = 5
+
+    # The prefix of the names of the marker files in a job's directory, see _appendToJournal
+    journalMarkerPrefix = 'journal.'
+
     def __init__(self, path):
         """
         :param str path: Path to directory holding the job store
@@ -60,7 +94,32 @@ class FileJobStore(AbstractJobStore):
         logger.debug("Path to job store directory is '%s'.", self.jobStoreDir)
         # Directory where temporary files go
         self.tempFilesDir = os.path.join(self.jobStoreDir, 'tmp')
+        self.jobsDir = os.path.join(self.tempFilesDir, 'jobs')
+        self.filesDir = os.path.join(self.tempFilesDir, 'files')
+        self.statsDir = os.path.join(self.tempFilesDir, 'stats')
+        self.readStatsDir = os.path.join(self.statsDir, 'read')
+        self.jobIndexDir = os.path.join(self.tempFilesDir, 'index')
+        self.journalDir = os.path.join(self.tempFilesDir, 'journal')
         self.linkImports = None
+        # Maps the paths of the segments of the job index that this instance appends to to their
+        # open file, opened lazily
+        self._openJobIndexSegments = {}
+        # Whether job updates are journaled, taken from the config
+        self.journal = False
+        # Guards the journal state below, some of which is shared with the compaction thread
+        self._journalLock = threading.RLock()
+        # Serializes compactions of the journal
+        self._journalCompactionLock = threading.Lock()
+        # The open journal that this instance appends to and its name, created lazily
+        self._journalFile = None
+        self._journalName = None
+        # Maps the ID of every job with records in the open journal to a tuple of the job's
+        # class, its latest version and the pickled values of its attributes at that version
+        self._journalPending = {}
+        # Maps job IDs to the version of the job last loaded or written by this instance
+        self._journalVersions = {}
+        self._journalCompactor = None
+        self._journalClosed = threading.Event()
 
     def initialize(self, config):
         try:
@@ -71,7 +130,9 @@ class FileJobStore(AbstractJobStore):
             else:
                 raise
         os.mkdir(self.tempFilesDir)
+        self._createLayout(self.jobIndexDir)
         self.linkImports = config.linkImports
+        self.journal = config.jobStoreJournal
         super(FileJobStore, self).initialize(config)
 
     def resume(self):
@@ -79,11 +140,26 @@ class FileJobStore(AbstractJobStore):
             raise NoSuchJobStoreException(self.jobStoreDir)
         require( os.path.isdir, "'%s' is not a directory", self.jobStoreDir)
         super(FileJobStore, self).resume()
+        if not os.path.exists(self.jobIndexDir):
+            self._migrateLegacyLayout()
+        self.journal = self.config.jobStoreJournal
 
     def destroy(self):
+        self._closeJobIndexSegments()
+        self._closeJournal(compact=False)
         if os.path.exists(self.jobStoreDir):
             shutil.rmtree(self.jobStoreDir)
 
+    def clean(self, jobCache=None, activeJobsOnly=False):
+        if self.journal:
+            self._adoptJournals()
+        rootJob = super(FileJobStore, self).clean(jobCache=jobCache,
+                                                  activeJobsOnly=activeJobsOnly)
+        if not activeJobsOnly:
+            # Orphaned jobs have been deleted, so this is a good time to drop them from the index
+            self._compactJobIndex()
+        return rootJob
+
     ##########################################
     # The following methods deal with creating/loading/updating/writing/checking for the
     # existence of jobs
@@ -91,14 +167,24 @@ class FileJobStore(AbstractJobStore):
 
     def create(self, jobNode):
         # The absolute path to the job directory.
-        absJobDir = tempfile.mkdtemp(prefix="job", dir=self._getTempSharedDir())
+        jobHash = uuid.uuid4().hex
+        absJobDir = os.path.join(self._getFanOutDir(self.jobsDir, jobHash), 'job' + jobHash)
+        os.mkdir(absJobDir)
         # Sub directory to put temporary files associated with the job in
         os.mkdir(os.path.join(absJobDir, "g"))
         # Make the job
         job = JobGraph.fromJobNode(jobNode, jobStoreID=self._getRelativePath(absJobDir),
                                    tryCount=self._defaultTryCount())
         # Write job file to disk
-        self.update(job)
+        if self.journal:
+            # A journaled job is compacted into its job file so the file has to exist first
+            self._writeJobFile(job, version=0)
+            with self._journalLock:
+                self._journalVersions[job.jobStoreID] = 0
+        else:
+            self.update(job)
+        # Only index the job once it can be loaded
+        self._appendToJobIndex(job.jobStoreID)
         return job
 
     def exists(self, jobStoreID):
@@ -120,45 +206,70 @@ class FileJobStore(AbstractJobStore):
             raise NoSuchFileException(sharedFileName)
 
     def load(self, jobStoreID):
-        self._checkJobStoreId(jobStoreID)
-        # Load a valid version of the job
+        if self.journal:
+            # The journal must be read before the job file. A record that is compacted and
+            # dropped from the journal in between will then be reflected in the job file.
+            records = self._readPendingJournalRecords(jobStoreID)
+        # Load a valid version of the job. Opening the file right away instead of checking for
+        # its existence first saves a metadata operation per job, which matters for loadMany().
         jobFile = self._getJobFileName(jobStoreID)
-        with open(jobFile, 'r') as fileHandle:
-            job = pickler.load(fileHandle)
+        try:
+            fileHandle = open(jobFile, 'rb')
+        except IOError as e:
+            if e.errno in (errno.ENOENT, errno.ENOTDIR):
+                raise NoSuchJobException(jobStoreID)
+            raise
+        with fileHandle:
+            job, version = self._readJobFile(fileHandle)
+        if self.journal:
+            # The job file is only ever replaced atomically in journaled mode, so there is no
+            # need to look for a .new file.
+            job, version = self._replayJournalRecords(job, version, records)
+            with self._journalLock:
+                self._journalVersions[jobStoreID] = version
         # The following cleans up any issues resulting from the failure of the
         # job during writing by the batch system.
-        if os.path.isfile(jobFile + ".new"):
+        elif os.path.isfile(jobFile + ".new"):
             logger.warn("There was a .new file for the job: %s", jobStoreID)
             os.remove(jobFile + ".new")
             job.setupJobAfterFailure(self.config)
         return job
 
     def update(self, job):
-        # The job is serialised to a file suffixed by ".new"
-        # The file is then moved to its correct path.
-        # Atomicity guarantees use the fact the underlying file systems "move"
-        # function is atomic.
-        with open(self._getJobFileName(job.jobStoreID) + ".new", 'w') as f:
-            pickler.dump(job, f)
-        # This should be atomic for the file system
-        os.rename(self._getJobFileName(job.jobStoreID) + ".new", self._getJobFileName(job.jobStoreID))
+        """
+        In journaled mode, the changes to the job are appended to this instance's journal
+        instead, avoiding the metadata operations involved in rewriting the job file. The
+        journal is compacted into the job files periodically by a background thread and when
+        the process exits. Until then, :meth:`load` replays the pending changes on top of the
+        job file.
+        """
+        if self.journal:
+            self._appendToJournal(job)
+        else:
+            self._writeJobFile(job)
 
     def delete(self, jobStoreID):
         # The jobStoreID is the relative path to the directory containing the job,
         # removing this directory deletes the job.
+        if self.journal:
+            with self._journalLock:
+                self._journalPending.pop(jobStoreID, None)
+                self._journalVersions.pop(jobStoreID, None)
         if self.exists(jobStoreID):
             shutil.rmtree(self._getAbsPath(jobStoreID))
 
     def jobs(self):
-        # Walk through list of temporary directories searching for jobs
-        for tempDir in self._tempDirectories():
-            for i in os.listdir(tempDir):
-                if i.startswith( 'job' ):
-                    try:
-                        yield self.load(self._getRelativePath(os.path.join(tempDir, i)))
-                    except NoSuchJobException:
-                        # An orphaned job may leave an empty or incomplete job file which we can safely ignore
-                        pass
+        # Stream the job index instead of walking the tree. Deleted jobs are not removed from the
+        # index until it is compacted, so they have to be skipped here.
+        for jobStoreID in self._jobIndex():
+            try:
+                yield self.load(jobStoreID)
+            except NoSuchJobException:
+                pass
+            except (IOError, EOFError):
+                # An orphaned job may leave an empty or incomplete job file which we can safely
+                # ignore, as may a job that is deleted while we load it.
+                pass
 
     ##########################################
     # Functions that deal with temporary files associated with jobs
@@ -167,16 +278,9 @@ class FileJobStore(AbstractJobStore):
     def _copyOrLink(self, srcURL, destPath):
         # linking is not done be default because of issue #1755
         srcPath = self._extractPathFromUrl(srcURL)
-        if self.linkImports:
-            try:
-                os.link(os.path.realpath(srcPath), destPath)
-            except OSError:
-                shutil.copyfile(srcPath, destPath)
-            else:
-                # make imported files read-only if they're linked for protection
-                os.chmod(destPath, 0o444)
-        else:
-            shutil.copyfile(srcPath, destPath)
+        if copyFile(srcPath, destPath, allowLink=self.linkImports) == LINK:
+            # make imported files read-only if they're linked for protection
+            os.chmod(destPath, 0o444)
 
     def _importFile(self, otherCls, url, sharedFileName=None):
         if issubclass(otherCls, FileJobStore):
@@ -185,7 +289,12 @@ class FileJobStore(AbstractJobStore):
                 os.close(fd)
                 os.unlink(absPath)
                 self._copyOrLink(url, absPath)
-                return FileID(self._getRelativePath(absPath), os.stat(absPath).st_size)
+                if self.config.nodeCacheDir is None:
+                    contentKey = None
+                else:
+                    contentKey = NodeCache.contentKeyForPath(absPath)
+                return FileID.forPath(self._getRelativePath(absPath), absPath,
+                                      contentKey=contentKey)
             else:
                 self._requireValidSharedFileName(sharedFileName)
                 path = self._getSharedFilePath(sharedFileName)
@@ -197,7 +306,7 @@ class FileJobStore(AbstractJobStore):
 
     def _exportFile(self, otherCls, jobStoreFileID, url):
         if issubclass(otherCls, FileJobStore):
-            shutil.copyfile(self._getAbsPath(jobStoreFileID), self._extractPathFromUrl(url))
+            copyFile(self._getAbsPath(jobStoreFileID), self._extractPathFromUrl(url))
         else:
             super(FileJobStore, self)._exportFile(otherCls, jobStoreFileID, url)
 
@@ -230,7 +339,7 @@ class FileJobStore(AbstractJobStore):
 
     def writeFile(self, localFilePath, jobStoreID=None):
         fd, absPath = self._getTempFile(jobStoreID)
-        shutil.copyfile(localFilePath, absPath)
+        copyFile(localFilePath, absPath)
         os.close(fd)
         return self._getRelativePath(absPath)
 
@@ -247,7 +356,7 @@ class FileJobStore(AbstractJobStore):
 
     def updateFile(self, jobStoreFileID, localFilePath):
         self._checkJobStoreFileID(jobStoreFileID)
-        shutil.copyfile(localFilePath, self._getAbsPath(jobStoreFileID))
+        copyFile(localFilePath, self._getAbsPath(jobStoreFileID))
 
     def readFile(self, jobStoreFileID, localFilePath):
         self._checkJobStoreFileID(jobStoreFileID)
@@ -269,7 +378,7 @@ class FileJobStore(AbstractJobStore):
                     raise
         else:
             # ... otherwise we have to copy it.
-            shutil.copyfile(jobStoreFilePath, localFilePath)
+            copyFile(jobStoreFilePath, localFilePath)
 
     def deleteFile(self, jobStoreFileID):
         if not self.fileExists(jobStoreFileID):
@@ -329,8 +438,7 @@ class FileJobStore(AbstractJobStore):
                 raise
 
     def writeStatsAndLogging(self, statsAndLoggingString):
-        # Temporary files are placed in the set of temporary files/directoies
-        fd, tempStatsFile = tempfile.mkstemp(prefix="stats", suffix=".new", dir=self._getTempSharedDir())
+        fd, tempStatsFile = tempfile.mkstemp(prefix="stats", suffix=".new", dir=self.statsDir)
         with open(tempStatsFile, "w") as f:
             f.write(statsAndLoggingString)
         os.close(fd)
@@ -338,18 +446,24 @@ class FileJobStore(AbstractJobStore):
 
     def readStatsAndLogging(self, callback, readAll=False):
         numberOfFilesProcessed = 0
-        for tempDir in self._tempDirectories():
-            for tempFile in os.listdir(tempDir):
-                if tempFile.startswith('stats'):
-                    absTempFile = os.path.join(tempDir, tempFile)
-                    if readAll or not tempFile.endswith('.new'):
-                        with open(absTempFile, 'r') as fH:
-                            callback(fH)
-                        numberOfFilesProcessed += 1
-                        newName = tempFile.rsplit('.', 1)[0] + '.new'
-                        newAbsTempFile = os.path.join(tempDir, newName)
-                        # Mark this item as read
-                        os.rename(absTempFile, newAbsTempFile)
+        justRead = set()
+        for tempFile in os.listdir(self.statsDir):
+            # Skip files that are still being written as well as the directory of read files
+            if tempFile.startswith('stats') and not tempFile.endswith('.new'):
+                absTempFile = os.path.join(self.statsDir, tempFile)
+                with open(absTempFile, 'r') as fH:
+                    callback(fH)
+                numberOfFilesProcessed += 1
+                # Mark this item as read
+                os.rename(absTempFile, os.path.join(self.readStatsDir, tempFile))
+                justRead.add(tempFile)
+        if readAll:
+            for tempFile in os.listdir(self.readStatsDir):
+                # Files read above have already been passed to the callback
+                if tempFile not in justRead:
+                    with open(os.path.join(self.readStatsDir, tempFile), 'r') as fH:
+                        callback(fH)
+                    numberOfFilesProcessed += 1
         return numberOfFilesProcessed
 
     ##########################################
@@ -382,6 +496,58 @@ class FileJobStore(AbstractJobStore):
         """
         return os.path.join(self._getAbsPath(jobStoreID), "job")
 
+    def _writeJobFile(self, job, version=None, suffix='.new'):
+        """
+        Atomically replaces the job file of the given job.
+
+        :param JobGraph job: the job to write
+
+        :param int version: the version of the job, see _appendToJournal. Only written in
+               journaled mode.
+
+        :param str suffix: the suffix of the temporary file the job is written to
+        """
+        jobFile = self._getJobFileName(job.jobStoreID)
+        # The job is serialised to a file suffixed by ".new"
+        # The file is then moved to its correct path.
+        # Atomicity guarantees use the fact the underlying file systems "move"
+        # function is atomic.
+        with open(jobFile + suffix, 'wb') as f:
+            if version is not None:
+                f.write(self._jobFileVersionHeader.pack(self._jobFileVersionMagic, version))
+            f.write(self.jobSerializer.serialize(job))
+        # This should be atomic for the file system
+        os.rename(jobFile + suffix, jobFile)
+
+    # In journaled mode, job files start with a header holding the version of the job. The
+    # header's magic prefix can't be mistaken for the start of a serialized job.
+    _jobFileVersionHeader = struct.Struct('>3sQ')
+    _jobFileVersionMagic = b'\x00TV'
+
+    def _readJobFile(self, fileHandle):
+        """
+        Reads a job file written by _writeJobFile.
+
+        :rtype: (JobGraph, int), the job and its version, 0 if the file is unversioned
+        """
+        data = fileHandle.read()
+        version = 0
+        if data.startswith(self._jobFileVersionMagic):
+            _, version = self._jobFileVersionHeader.unpack_from(data)
+            data = data[self._jobFileVersionHeader.size:]
+        return self.jobSerializer.deserialize(data), version
+
+    def _readJobFileVersion(self, jobStoreID):
+        """
+        :rtype: int, the version of the given job's file, read without reading the entire file
+        """
+        with open(self._getJobFileName(jobStoreID), 'rb') as f:
+            header = f.read(self._jobFileVersionHeader.size)
+        if header.startswith(self._jobFileVersionMagic):
+            return self._jobFileVersionHeader.unpack(header)[1]
+        else:
+            return 0
+
     def _checkJobStoreId(self, jobStoreID):
         """
         Raises a NoSuchJobException if the jobStoreID does not exist.
@@ -396,40 +562,436 @@ class FileJobStore(AbstractJobStore):
         if not self.fileExists(jobStoreFileID):
             raise NoSuchFileException(jobStoreFileID)
 
-    def _getTempSharedDir(self):
+    def _getFanOutDir(self, rootDir, hexDigest):
+        """
+        Gets the leaf directory of the hashed fan-out tree below the given root directory that
+        corresponds to the given hash, creating it if necessary.
+
+        :param str rootDir: the root of the fan-out tree
+
+        :param str hexDigest: a hexadecimal hash, e.g. of a UUID
+
+        :rtype : string, path to the directory in which to place files/directories.
+        """
+        tempDir = rootDir
+        for i in xrange(self.fanOutLevels):
+            tempDir = os.path.join(tempDir,
+                                   hexDigest[i * self.fanOutWidth:(i + 1) * self.fanOutWidth])
+        try:
+            os.makedirs(tempDir)
+        except OSError as e:
+            # In the case that a collision occurs and it is created while we wait then we ignore
+            if e.errno != errno.EEXIST:
+                raise
+        return tempDir
+
+    def _createLayout(self, jobIndexDir):
+        """
+        Creates the directories of the current layout below self.tempFilesDir, placing the job
+        index at the given path. Existing directories are left alone.
+        """
+        for path in (self.jobsDir, self.filesDir, self.statsDir, self.readStatsDir,
+                     self.journalDir, jobIndexDir):
+            try:
+                os.mkdir(path)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+    def _jobIndexSegmentPath(self, jobStoreID):
+        """
+        :rtype: str, the absolute path of the segment of the job index the given job belongs in
+        """
+        segment = zlib.crc32(jobStoreID.encode('utf-8')) % self.numJobIndexSegments
+        return os.path.join(self.jobIndexDir, 'segment%02x' % segment)
+
+    def _appendToJobIndex(self, jobStoreID):
+        """
+        Records the given job in its segment of the job index. Segments are shared by all
+        processes, so each write is made while holding the segment's lock in order to prevent
+        concurrent writers on different nodes of a shared file system from interleaving.
+        """
+        segmentPath = self._jobIndexSegmentPath(jobStoreID)
+        while True:
+            try:
+                segmentFile = self._openJobIndexSegments[segmentPath]
+            except KeyError:
+                segmentFile = self._openJobIndexSegments[segmentPath] = open(segmentPath, 'a')
+            flock(segmentFile, LOCK_EX)
+            try:
+                # A compaction replaces a segment while holding its lock, so once we hold the
+                # lock the open segment is either still current or must be reopened
+                if os.fstat(segmentFile.fileno()).st_nlink > 0:
+                    segmentFile.write(jobStoreID + '\n')
+                    segmentFile.flush()
+                    return
+            finally:
+                flock(segmentFile, LOCK_UN)
+            segmentFile.close()
+            del self._openJobIndexSegments[segmentPath]
+
+    def _closeJobIndexSegments(self):
+        for segmentFile in itervalues(self._openJobIndexSegments):
+            segmentFile.close()
+        self._openJobIndexSegments.clear()
+
+    def _jobIndexSegments(self):
+        """
+        :rtype: list[str], the absolute paths of all segments of the job index
+        """
+        return [os.path.join(self.jobIndexDir, segment)
+                for segment in os.listdir(self.jobIndexDir)
+                if segment.startswith('segment')]
+
+    def _jobIndex(self, segments=None):
+        """
+        Streams the IDs of all jobs ever recorded in the job index, including jobs that have
+        since been deleted.
+
+        :param list[str] segments: the segments to read, all segments by default
+
+        :rtype: Iterator[str]
         """
-        Gets a temporary directory in the hierarchy of directories in self.tempFilesDir.
-        This directory may contain multiple shared jobs/files.
+        for segment in self._jobIndexSegments() if segments is None else segments:
+            try:
+                with open(segment, 'r') as f:
+                    for line in f:
+                        # Ignore a partial last line left behind by a crashed writer
+                        if line.endswith('\n'):
+                            yield line[:-1]
+            except IOError as e:
+                # The segment may have been removed by a concurrent compaction
+                if e.errno != errno.ENOENT:
+                    raise
 
-        :rtype : string, path to temporary directory in which to place files/directories.
+    def _compactJobIndex(self):
+        """
+        Rewrites each segment of the job index such that it only lists jobs that still exist.
+        Each segment is replaced while holding its lock so that no job appended to it
+        concurrently is lost.
         """
-        tempDir = self.tempFilesDir
-        for i in xrange(self.levels):
-            tempDir = os.path.join(tempDir, random.choice(self.validDirs))
-            if not os.path.exists(tempDir):
+        self._closeJobIndexSegments()
+        for segment in self._jobIndexSegments():
+            try:
+                segmentFile = open(segment, 'r')
+            except IOError as e:
+                # The segment may have been replaced by a concurrent compaction
+                if e.errno != errno.ENOENT:
+                    raise
+                continue
+            with segmentFile:
+                flock(segmentFile, LOCK_EX)
                 try:
-                    os.mkdir(tempDir)
-                except os.error:
-                    if not os.path.exists(tempDir): # In the case that a collision occurs and
-                        # it is created while we wait then we ignore
+                    if os.fstat(segmentFile.fileno()).st_nlink == 0:
+                        continue
+                    compacted = set()
+                    fd, tempPath = tempfile.mkstemp(prefix='compacting', dir=self.jobIndexDir)
+                    try:
+                        with os.fdopen(fd, 'w') as f:
+                            for jobStoreID in self._jobIndex([segment]):
+                                if jobStoreID not in compacted and self.exists(jobStoreID):
+                                    compacted.add(jobStoreID)
+                                    f.write(jobStoreID + '\n')
+                        os.rename(tempPath, segment)
+                    except:
+                        os.unlink(tempPath)
                         raise
-        return tempDir
+                finally:
+                    flock(segmentFile, LOCK_UN)
 
-    def _tempDirectories(self):
+    # Journal records are framed by their length so that a partial record at the end of a
+    # journal left behind by a crashed writer can be detected.
+    _journalRecordHeader = struct.Struct('>I')
+
+    @staticmethod
+    def _getJobState(job):
+        """
+        :rtype: dict, maps the name of each attribute of the given job to its pickled value
+        """
+        return {name: pickler.dumps(value, pickler.HIGHEST_PROTOCOL)
+                for name, value in iteritems(job.__getstate__())}
+
+    @staticmethod
+    def _setJobState(job, state):
+        """
+        Restores the attributes of the given, uninitialized job from the given state.
+
+        :param dict state: the state of a job as returned by _getJobState
+        """
+        job.__setstate__({name: pickler.loads(value) for name, value in iteritems(state)})
+
+    def _getJournalMarker(self, jobStoreID, journalName):
+        return os.path.join(self._getAbsPath(jobStoreID), self.journalMarkerPrefix + journalName)
+
+    def _appendToJournal(self, job):
+        """
+        Appends a record of the changes to the given job to this instance's journal. Every
+        record bumps the version of the job by one. The first record for a job in a journal
+        holds all of its attributes, subsequent records only the ones that changed since the
+        previous record. A record also holds all attributes if the job was loaded since the
+        previous record and found at a different version, e.g. one written by another process.
+        """
+        jobStoreID = job.jobStoreID
+        state = self._getJobState(job)
+        with self._journalLock:
+            if self._journalFile is None:
+                self._openJournal()
+            try:
+                _, pendingVersion, base = self._journalPending[jobStoreID]
+            except KeyError:
+                pendingVersion, base = None, None
+                # Tell readers of the job to look at this journal
+                open(self._getJournalMarker(jobStoreID, self._journalName), 'w').close()
+            try:
+                version = self._journalVersions[jobStoreID]
+            except KeyError:
+                version = self._readJobFileVersion(jobStoreID)
+            if pendingVersion == version:
+                full = False
+                changed = {name: value for name, value in iteritems(state)
+                           if base.get(name) != value}
+                deleted = [name for name in base if name not in state]
+            else:
+                # Never reuse a version, readers would drop the record
+                version = max(version, pendingVersion)
+                full, changed, deleted = True, state, []
+            version += 1
+            record = pickler.dumps((jobStoreID, version, full, changed, deleted),
+                                   pickler.HIGHEST_PROTOCOL)
+            self._journalFile.write(self._journalRecordHeader.pack(len(record)) + record)
+            self._journalFile.flush()
+            self._journalPending[jobStoreID] = (type(job), version, state)
+            self._journalVersions[jobStoreID] = version
+
+    def _openJournal(self):
+        """
+        Starts a new journal for this instance and, if necessary, the thread that compacts it.
+        """
+        self._journalName = uuid.uuid4().hex
+        self._journalFile = open(os.path.join(self.journalDir, self._journalName), 'ab')
+        if self._journalCompactor is None:
+            self._journalCompactor = threading.Thread(target=self._compactJournalPeriodically)
+            self._journalCompactor.daemon = True
+            self._journalCompactor.start()
+            atexit.register(self._closeJournal)
+
+    def _compactJournalPeriodically(self):
+        while not self._journalClosed.wait(self.journalCompactionInterval):
+            try:
+                self._compactJournal()
+            except:
+                logger.exception("Failed to compact the journal of job store '%s'.",
+                                 self.jobStoreDir)
+
+    def _closeJournal(self, compact=True):
+        """
+        Stops the compaction thread and, optionally, compacts the journal one last time.
+        """
+        self._journalClosed.set()
+        if self._journalCompactor is not None:
+            self._journalCompactor.join()
+        if compact:
+            self._compactJournal()
+        elif self._journalFile is not None:
+            self._journalFile.close()
+            self._journalFile = None
+
+    def _compactJournal(self):
+        """
+        Writes the latest version of every job with records in this instance's journal to the
+        job's file and drops the journal. Updates made while this is in progress go to a new
+        journal.
+        """
+        with self._journalCompactionLock:
+            with self._journalLock:
+                if self._journalFile is None:
+                    return
+                journalFile, journalName = self._journalFile, self._journalName
+                pending, self._journalPending = self._journalPending, {}
+                self._journalFile, self._journalName = None, None
+            journalFile.close()
+            for jobStoreID, (jobClass, version, state) in iteritems(pending):
+                try:
+                    # Another process may have taken over the job and written a newer version
+                    if self._readJobFileVersion(jobStoreID) < version:
+                        job = jobClass.__new__(jobClass)
+                        self._setJobState(job, state)
+                        # Don't use .new, load() would mistake it for a failed write
+                        self._writeJobFile(job, version, suffix='.compacting')
+                    os.unlink(self._getJournalMarker(jobStoreID, journalName))
+                except (IOError, OSError) as e:
+                    # The job was deleted
+                    if e.errno not in (errno.ENOENT, errno.ENOTDIR):
+                        raise
+            try:
+                os.unlink(os.path.join(self.journalDir, journalName))
+            except OSError as e:
+                # The job store was destroyed
+                if e.errno != errno.ENOENT:
+                    raise
+
+    def _readJournal(self, journalName):
+        """
+        Reads the complete records in the given journal.
+
+        :rtype: Iterator[(str, int, bool, dict, list)], the job ID, version, whether the record
+        holds all attributes, the pickled values of the changed attributes and the names of the
+        deleted attributes
+        """
+        try:
+            with open(os.path.join(self.journalDir, journalName), 'rb') as f:
+                journal = f.read()
+        except IOError as e:
+            # The journal was compacted
+            if e.errno == errno.ENOENT:
+                return
+            raise
+        headerSize = self._journalRecordHeader.size
+        offset = 0
+        while offset + headerSize <= len(journal):
+            recordSize, = self._journalRecordHeader.unpack_from(journal, offset)
+            offset += headerSize
+            if offset + recordSize > len(journal):
+                # Ignore a partial last record left behind by a crashed writer
+                break
+            yield pickler.loads(journal[offset:offset + recordSize])
+            offset += recordSize
+
+    def _readPendingJournalRecords(self, jobStoreID):
+        """
+        :rtype: list, the records for the given job in all journals that have not been
+        compacted into the job file yet, in no particular order
+        """
+        try:
+            names = os.listdir(self._getAbsPath(jobStoreID))
+        except OSError as e:
+            if e.errno in (errno.ENOENT, errno.ENOTDIR):
+                return []
+            raise
+        return [record
+                for name in names if name.startswith(self.journalMarkerPrefix)
+                for record in self._readJournal(name[len(self.journalMarkerPrefix):])
+                if record[0] == jobStoreID]
+
+    def _replayJournalRecords(self, job, version, records):
+        """
+        Applies the journal records that are newer than the given version of the given job.
+
+        :rtype: (toil.jobGraph.JobGraph, int), the resulting job and its version
+        """
+        state = None
+        for _, recordVersion, full, changed, deleted in sorted(records, key=lambda r: r[1]):
+            if recordVersion <= version:
+                # Already compacted into the job file
+                continue
+            if recordVersion > version + 1:
+                logger.warn("Version %i of job %s is missing from the journal, ignoring later "
+                            "versions.", version + 1, job.jobStoreID)
+                break
+            if state is None or full:
+                state = {} if full else self._getJobState(job)
+            state.update(changed)
+            for name in deleted:
+                state.pop(name, None)
+            version = recordVersion
+        if state is not None:
+            jobClass = type(job)
+            job = jobClass.__new__(jobClass)
+            self._setJobState(job, state)
+        return job, version
+
+    def _adoptJournals(self):
+        """
+        Compacts the journals left behind by other instances that crashed before they could
+        compact them. Must not be invoked while other processes are updating jobs in this job
+        store.
+        """
+        try:
+            journalNames = os.listdir(self.journalDir)
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                return
+            raise
+        for journalName in journalNames:
+            if journalName == self._journalName:
+                continue
+            for jobStoreID in {record[0] for record in self._readJournal(journalName)}:
+                try:
+                    job = self.load(jobStoreID)
+                except NoSuchJobException:
+                    continue
+                version = self._journalVersions[jobStoreID]
+                try:
+                    if self._readJobFileVersion(jobStoreID) < version:
+                        self._writeJobFile(job, version, suffix='.compacting')
+                    os.unlink(self._getJournalMarker(jobStoreID, journalName))
+                except OSError as e:
+                    if e.errno != errno.ENOENT:
+                        raise
+            logger.info("Compacted journal %s left behind by a failed process.", journalName)
+            os.unlink(os.path.join(self.journalDir, journalName))
+
+    def _legacyDirectories(self):
         """
         :rtype : an iterator to the temporary directories containing jobs/stats files
-        in the hierarchy of directories in self.tempFilesDir
+        in the hierarchy of directories of the legacy layout in self.tempFilesDir
         """
         def _dirs(path, levels):
             if levels > 0:
                 for subPath in os.listdir(path):
-                    for i in _dirs(os.path.join(path, subPath), levels-1):
-                        yield i
+                    if len(subPath) == 1 and subPath in self.validDirs:
+                        for i in _dirs(os.path.join(path, subPath), levels-1):
+                            yield i
             else:
                 yield path
         for tempDir in _dirs(self.tempFilesDir, self.levels):
             yield tempDir
 
+    def _migrateLegacyLayout(self):
+        """
+        Migrates a job store created by a version of Toil that placed jobs, files and stats files
+        in randomly chosen directories directly below self.tempFilesDir. Jobs and files are left
+        in place so that their IDs, which may be referenced from job graphs and promises, remain
+        valid. The jobs are recorded in the job index and the stats files are moved into the
+        stats directory. This is done once, by the first process to resume the job store.
+        """
+        logger.info("Migrating job store '%s' to the indexed layout.", self.jobStoreDir)
+        # Build the index in a private directory and only publish it once it is complete
+        migratingIndexDir = tempfile.mkdtemp(prefix='index', dir=self.tempFilesDir)
+        self._createLayout(migratingIndexDir)
+        numJobs = 0
+        segmentName = os.path.basename(self._jobIndexSegmentPath(''))
+        with open(os.path.join(migratingIndexDir, segmentName), 'w') as f:
+            for tempDir in self._legacyDirectories():
+                for i in os.listdir(tempDir):
+                    absPath = os.path.join(tempDir, i)
+                    if i.startswith('job'):
+                        f.write(self._getRelativePath(absPath) + '\n')
+                        numJobs += 1
+                    elif i.startswith('stats'):
+                        # Legacy stats files ending in .new were either read already or
+                        # abandoned by a failed writer
+                        if i.endswith('.new'):
+                            newAbsPath = os.path.join(self.readStatsDir, i[:-4])
+                        else:
+                            newAbsPath = os.path.join(self.statsDir, i)
+                        try:
+                            os.rename(absPath, newAbsPath)
+                        except OSError as e:
+                            # A concurrent migration may have moved it already
+                            if e.errno != errno.ENOENT:
+                                raise
+        try:
+            os.rename(migratingIndexDir, self.jobIndexDir)
+        except OSError as e:
+            if e.errno in (errno.EEXIST, errno.ENOTEMPTY):
+                # Another process beat us to it
+                shutil.rmtree(migratingIndexDir)
+            else:
+                raise
+        else:
+            logger.info("Migrated %d jobs to the indexed layout.", numJobs)
+
     def _getTempFile(self, jobStoreID=None):
         """
         :rtype : file-descriptor, string, string is the absolute path to a temporary file within
@@ -443,5 +1005,6 @@ class FileJobStore(AbstractJobStore):
             return tempfile.mkstemp(suffix=".tmp",
                                 dir=os.path.join(self._getAbsPath(jobStoreID), "g"))
         else:
-            # Make a temporary file within the temporary file structure
-            return tempfile.mkstemp(prefix="tmp", suffix=".tmp", dir=self._getTempSharedDir())
+            # Make a temporary file within the fan-out tree of files not associated with a job
+            return tempfile.mkstemp(prefix="tmp", suffix=".tmp",
+                                    dir=self._getFanOutDir(self.filesDir, uuid.uuid4().hex))
@@ -9,12 +9,12 @@ import logging
 import time
 
 # Python 3 compatibility imports
-from six.moves import cPickle, StringIO
+from six.moves import StringIO
 
 from toil.jobStores.abstractJobStore import (AbstractJobStore, NoSuchJobException,
                                              NoSuchFileException,
                                              ConcurrentFileModificationException)
-from toil.jobStores.utils import WritablePipe, ReadablePipe
+from toil.jobStores.utils import WritablePipe, ReadablePipe, readPartsInParallel
 from toil.jobGraph import JobGraph
 
 log = logging.getLogger(__name__)
@@ -118,7 +118,7 @@ class GoogleJobStore(AbstractJobStore):
                        command=jobNode.command, remainingRetryCount=self._defaultTryCount(),
                        logJobStoreFileID=None, predecessorNumber=jobNode.predecessorNumber,
                        **jobNode._requirements)
-        self._writeString(jobStoreID, cPickle.dumps(job, protocol=cPickle.HIGHEST_PROTOCOL))
+        self._writeString(jobStoreID, self.jobSerializer.serialize(job))
         return job
 
     def exists(self, jobStoreID):
@@ -145,10 +145,10 @@ class GoogleJobStore(AbstractJobStore):
             jobString = self._readContents(jobStoreID)
         except NoSuchFileException:
             raise NoSuchJobException(jobStoreID)
-        return cPickle.loads(jobString)
+        return self.jobSerializer.deserialize(jobString)
 
     def update(self, job):
-        self._writeString(job.jobStoreID, cPickle.dumps(job, protocol=cPickle.HIGHEST_PROTOCOL), update=True)
+        self._writeString(job.jobStoreID, self.jobSerializer.serialize(job), update=True)
 
     def delete(self, jobStoreID):
         # jobs will always be encrypted when avaliable
@@ -187,6 +187,25 @@ class GoogleJobStore(AbstractJobStore):
         with open(localFilePath, 'w') as writeable:
             self._getKey(jobStoreFileID, headers).get_contents_to_file(writeable, headers=headers)
 
+    def readFileInParallel(self, jobStoreFileID, localFilePath, partSize, threads):
+        headers = self.encryptedHeaders
+        if not self.exists(jobStoreFileID):
+            raise NoSuchFileException(jobStoreFileID)
+        size = self._getKey(jobStoreFileID, headers).size
+
+        def readRange(start, end):
+            def readPart(writable):
+                # Boto keys aren't thread-safe so each part gets its own
+                key = self._getKey(jobStoreFileID, headers)
+                key.get_contents_to_file(writable, headers=dict(
+                    headers, Range='bytes=%d-%d' % (start, end - 1)))
+            return start, readPart
+
+        readPartsInParallel(localFilePath,
+                            [readRange(start, end)
+                             for start, end in self._partRanges(size, partSize)],
+                            threads)
+
     @contextmanager
     def readFileStream(self, jobStoreFileID):
         with self.readSharedFileStream(jobStoreFileID, isProtected=True) as readable:
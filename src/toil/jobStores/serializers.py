@@ -0,0 +1,317 @@
+# Copyright (C) 2015-2016 Regents of the University of California
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import absolute_import
+
+import importlib
+import logging
+import struct
+
+# Python 3 compatibility imports
+from six import integer_types, binary_type, text_type, iteritems
+from six.moves import cPickle, xrange
+
+from toil.job import JobNode
+
+log = logging.getLogger(__name__)
+
+
+class PickleJobSerializer(object):
+    """
+    Serializes jobs using pickle. This is the format job stores have always used and the one
+    other serializers fall back to.
+    """
+
+    def serialize(self, job):
+        """
+        :param toil.jobGraph.JobGraph job: the job to serialize
+
+        :rtype: str
+        """
+        return cPickle.dumps(job, protocol=cPickle.HIGHEST_PROTOCOL)
+
+    def deserialize(self, data):
+        """
+        :param str data: a job serialized by this serializer
+
+        :rtype: toil.jobGraph.JobGraph
+        """
+        return cPickle.loads(data)
+
+
+class CompactJobSerializer(PickleJobSerializer):
+    """
+    Serializes jobs to a compact, schema-based binary format. Every distinct string is stored
+    once in a string table and referenced by its index. Job nodes, including the ones in a job's
+    stack and services, are stored as the values of their attributes. The attribute names are
+    stored once per class in a table of schemas. Jobs that hold values other than job nodes,
+    strings, numbers and the built-in container types are pickled instead.
+
+    Data written by this serializer starts with a magic prefix and a format version. Data
+    without that prefix is assumed to be pickled, so pickled jobs can still be read.
+
+    >>> from toil.jobGraph import JobGraph
+    >>> job = JobGraph(command='foo', memory=2 ** 31, cores=0.5, disk=-1, unitName=None,
+    ...                jobName='bar', preemptable=False, jobStoreID='job', remainingRetryCount=1,
+    ...                predecessorNumber=1, predecessorsFinished={'pred'}, chainedJobs=[u'bar'])
+    >>> job.stack.append([JobNode.fromJobGraph(job) for _ in range(3)])
+    >>> serializer = CompactJobSerializer()
+    >>> data = serializer.serialize(job)
+    >>> data.startswith(serializer.magic)
+    True
+    >>> copy = serializer.deserialize(data)
+    >>> copy == job, copy.__getstate__() == job.__getstate__(), type(copy) is JobGraph
+    (True, True, True)
+    >>> len(data) < len(PickleJobSerializer().serialize(job))
+    True
+    >>> serializer.deserialize(PickleJobSerializer().serialize(job)) == job
+    True
+
+    Jobs that can't be encoded are pickled:
+
+    >>> job.filesToDelete.append(object())
+    >>> serializer.serialize(job).startswith(serializer.magic)
+    False
+    """
+
+    # Pickled data never starts with a NUL byte
+    magic = b'\x00TJ'
+
+    formatVersion = 1
+
+    def serialize(self, job):
+        encoder = _Encoder()
+        try:
+            encoder.encode(job)
+        except _UnsupportedValueError as e:
+            log.debug("Pickling job %s because it holds %r.", job.jobStoreID, e.value)
+            return super(CompactJobSerializer, self).serialize(job)
+        return encoder.getValue(self.magic + struct.pack('>B', self.formatVersion))
+
+    def deserialize(self, data):
+        if not data.startswith(self.magic):
+            return super(CompactJobSerializer, self).deserialize(data)
+        offset = len(self.magic)
+        formatVersion, = struct.unpack_from('>B', data, offset)
+        if formatVersion != self.formatVersion:
+            raise ValueError("Unsupported version %i of the job serialization format"
+                             % formatVersion)
+        return _Decoder(data, offset + 1).decode()
+
+
+# The type tags of the encoded values
+
+_NONE, _TRUE, _FALSE, _INT, _NEGATIVE_INT, _FLOAT, _STR, _UNICODE, \
+    _LIST, _TUPLE, _SET, _FROZENSET, _DICT, _OBJECT = range(14)
+
+_containerTags = {list: _LIST, tuple: _TUPLE, set: _SET, frozenset: _FROZENSET}
+
+_containerTypes = {tag: containerType for containerType, tag in iteritems(_containerTags)}
+
+_float = struct.Struct('>d')
+
+
+class _UnsupportedValueError(Exception):
+    def __init__(self, value):
+        super(_UnsupportedValueError, self).__init__(value)
+        self.value = value
+
+
+def _writeVarint(out, n):
+    """
+    Appends the given non-negative integer to the given bytearray, seven bits per byte.
+
+    >>> out = bytearray()
+    >>> _writeVarint(out, 0); _writeVarint(out, 300); _writeVarint(out, 2 ** 64)
+    >>> len(out)
+    13
+    >>> _readVarint(out, 0), _readVarint(out, 1), _readVarint(out, 3)
+    ((0, 1), (300, 3), (18446744073709551616L, 13))
+    """
+    while n >= 0x80:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _readVarint(buf, offset):
+    """
+    :param bytearray buf: the buffer to read from
+
+    :rtype: (int, int), the integer at the given offset and the offset following it
+    """
+    n = 0
+    shift = 0
+    while True:
+        b = buf[offset]
+        offset += 1
+        n |= (b & 0x7f) << shift
+        if b < 0x80:
+            return n, offset
+        shift += 7
+
+
+class _Encoder(object):
+
+    def __init__(self):
+        # Maps each string to its index in the string table
+        self.strings = {}
+        # Maps each (class, attribute names) pair to its index in the schema table
+        self.schemas = {}
+        self.body = bytearray()
+
+    def encode(self, value):
+        body = self.body
+        valueType = type(value)
+        if value is None:
+            body.append(_NONE)
+        elif value is True:
+            body.append(_TRUE)
+        elif value is False:
+            body.append(_FALSE)
+        elif isinstance(value, integer_types):
+            if value < 0:
+                body.append(_NEGATIVE_INT)
+                _writeVarint(body, -value)
+            else:
+                body.append(_INT)
+                _writeVarint(body, value)
+        elif valueType is float:
+            body.append(_FLOAT)
+            body.extend(_float.pack(value))
+        elif valueType is binary_type:
+            body.append(_STR)
+            _writeVarint(body, self._intern(value))
+        elif valueType is text_type:
+            body.append(_UNICODE)
+            _writeVarint(body, self._intern(value.encode('utf-8')))
+        elif valueType in _containerTags:
+            body.append(_containerTags[valueType])
+            _writeVarint(body, len(value))
+            for item in value:
+                self.encode(item)
+        elif valueType is dict:
+            body.append(_DICT)
+            _writeVarint(body, len(value))
+            for key, item in iteritems(value):
+                self.encode(key)
+                self.encode(item)
+        elif isinstance(value, JobNode):
+            state = value.__getstate__()
+            names = tuple(sorted(state))
+            body.append(_OBJECT)
+            _writeVarint(body, self._schema(valueType, names))
+            for name in names:
+                self.encode(state[name])
+        else:
+            raise _UnsupportedValueError(value)
+
+    def _intern(self, s):
+        try:
+            return self.strings[s]
+        except KeyError:
+            index = self.strings[s] = len(self.strings)
+            return index
+
+    def _schema(self, cls, names):
+        key = (cls, names)
+        try:
+            return self.schemas[key]
+        except KeyError:
+            index = self.schemas[key] = len(self.schemas)
+            # Intern the names now so the table can be written without adding strings
+            for s in (cls.__module__, cls.__name__) + names:
+                self._intern(s)
+            return index
+
+    def getValue(self, prefix):
+        """
+        :param str prefix: the bytes to prepend to the encoded value
+
+        :rtype: str
+        """
+        out = bytearray(prefix)
+        _writeVarint(out, len(self.strings))
+        for s, _ in sorted(iteritems(self.strings), key=lambda item: item[1]):
+            _writeVarint(out, len(s))
+            out.extend(s)
+        _writeVarint(out, len(self.schemas))
+        for (cls, names), _ in sorted(iteritems(self.schemas), key=lambda item: item[1]):
+            _writeVarint(out, len(names))
+            for s in (cls.__module__, cls.__name__) + names:
+                _writeVarint(out, self.strings[s])
+        out.extend(self.body)
+        return binary_type(out)
+
+
+class _Decoder(object):
+
+    def __init__(self, data, offset):
+        self.data = data
+        self.buf = bytearray(data)
+        self.offset = offset
+        self.strings = [self._readString() for _ in xrange(self._readVarint())]
+        self.schemas = [self._readSchema() for _ in xrange(self._readVarint())]
+
+    def _readVarint(self):
+        n, self.offset = _readVarint(self.buf, self.offset)
+        return n
+
+    def _readString(self):
+        size = self._readVarint()
+        s = self.data[self.offset:self.offset + size]
+        self.offset += size
+        return s
+
+    def _readSchema(self):
+        numNames = self._readVarint()
+        module, name = (self.strings[self._readVarint()] for _ in xrange(2))
+        names = [self.strings[self._readVarint()] for _ in xrange(numNames)]
+        cls = getattr(importlib.import_module(module), name)
+        if not (isinstance(cls, type) and issubclass(cls, JobNode)):
+            raise ValueError("Class %s.%s is not a job node" % (module, name))
+        return cls, names
+
+    def decode(self):
+        tag = self.buf[self.offset]
+        self.offset += 1
+        if tag == _NONE:
+            return None
+        elif tag == _TRUE:
+            return True
+        elif tag == _FALSE:
+            return False
+        elif tag == _INT:
+            return self._readVarint()
+        elif tag == _NEGATIVE_INT:
+            return -self._readVarint()
+        elif tag == _FLOAT:
+            value, = _float.unpack_from(self.data, self.offset)
+            self.offset += _float.size
+            return value
+        elif tag == _STR:
+            return self.strings[self._readVarint()]
+        elif tag == _UNICODE:
+            return self.strings[self._readVarint()].decode('utf-8')
+        elif tag in _containerTypes:
+            return _containerTypes[tag](self.decode() for _ in xrange(self._readVarint()))
+        elif tag == _DICT:
+            return dict((self.decode(), self.decode()) for _ in xrange(self._readVarint()))
+        elif tag == _OBJECT:
+            cls, names = self.schemas[self._readVarint()]
+            obj = cls.__new__(cls)
+            obj.__setstate__({name: self.decode() for name in names})
+            return obj
+        else:
+            raise ValueError("Invalid type tag %i in serialized job" % tag)
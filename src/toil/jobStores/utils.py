@@ -2,6 +2,7 @@ import logging
 import os
 from abc import ABCMeta
 from abc import abstractmethod
+from multiprocessing.pool import ThreadPool
 
 from bd2k.util.threading import ExceptionalThread
 
@@ -234,3 +235,80 @@ class ReadablePipe(object):
                 # FIXME: This is still racy. The writer thread could close it now, and someone
                 # else may immediately open a new file, reusing the file handle.
                 os.close(writable_fh)
+
+
+def batches(items, maxItems, maxSize=None, sizeOf=len):
+    """
+    Splits the given items into consecutive batches of at most the given number of items. If a
+    maximum size is given, a batch is also closed before its total size, as computed by the given
+    function, would exceed that maximum. An item larger than the maximum size forms a batch of
+    its own. This is useful for honoring the request limits of bulk storage APIs.
+
+    >>> list(batches(range(5), 2))
+    [[0, 1], [2, 3], [4]]
+    >>> list(batches(['a', 'bb', 'ccc', 'd'], 3, maxSize=3))
+    [['a', 'bb'], ['ccc'], ['d']]
+    >>> list(batches([], 2))
+    []
+
+    :param Iterable items: the items to batch
+    :param int maxItems: the maximum number of items per batch
+    :param int|None maxSize: the maximum total size of the items in a batch
+    :param Callable sizeOf: a function returning the size of an item
+    :rtype: Iterator[list]
+    """
+    batch, batchSize = [], 0
+    for item in items:
+        itemSize = sizeOf(item) if maxSize is not None else 0
+        if batch and (len(batch) == maxItems
+                      or maxSize is not None and batchSize + itemSize > maxSize):
+            yield batch
+            batch, batchSize = [], 0
+        batch.append(item)
+        batchSize += itemSize
+    if batch:
+        yield batch
+
+
+def readPartsInParallel(localFilePath, parts, threads):
+    """
+    Assembles a local file from parts that are read concurrently, for example with ranged reads
+    of a file in a job store.
+
+    >>> import tempfile
+    >>> fd, path = tempfile.mkstemp()
+    >>> os.close(fd)
+    >>> def part(data):
+    ...     return lambda writable: writable.write(data)
+    >>> readPartsInParallel(path, [(0, part('abc')), (3, part('de')), (5, part(''))], threads=2)
+    >>> with open(path) as f:
+    ...     f.read()
+    'abcde'
+    >>> os.unlink(path)
+
+    :param str localFilePath: the path of the file to create or overwrite
+
+    :param list[(int,Callable)] parts: a list of pairs, each holding the offset of a part in the
+           local file and a function that writes the part to the file handle passed to it
+
+    :param int threads: the maximum number of parts to read at the same time
+    """
+    with open(localFilePath, 'w'):
+        pass
+
+    def readPart(part):
+        offset, writePart = part
+        with open(localFilePath, 'r+') as writable:
+            writable.seek(offset)
+            writePart(writable)
+
+    if threads > 1 and len(parts) > 1:
+        pool = ThreadPool(min(threads, len(parts)))
+        try:
+            pool.map(readPart, parts)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for part in parts:
+            readPart(part)
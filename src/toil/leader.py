@@ -22,15 +22,18 @@ import gzip
 import os
 import time
 from collections import namedtuple
+from functools import partial
+from threading import Event, Thread
 
 # Python 3 compatibility imports
 from six.moves import cPickle
+from six.moves.queue import Empty, Queue
+from six import itervalues
 
 from bd2k.util.expando import Expando
 from bd2k.util.humanize import bytes2human
 
 from toil import resolveEntryPoint
-from toil.jobStores.abstractJobStore import NoSuchJobException
 from toil.provisioners.clusterScaler import ClusterScaler
 from toil.serviceManager import ServiceManager
 from toil.statsAndLogging import StatsAndLogging
@@ -80,6 +83,13 @@ class DeadlockException( Exception ):
 class Leader:
     """ Class that encapsulates the logic of the leader.
     """
+    # The maximum number of finished jobs to take from the batch system and process together
+    maxFinishedJobsPerBatch = 100
+
+    # The number of seconds between timer events. Rescuing jobs, writing snapshots, checking on
+    # threads and detecting deadlocks happen at least this often.
+    timerEventInterval = 2
+
     def __init__(self, config, batchSystem, provisioner, jobStore, rootJob, jobCache=None):
         """
         :param toil.common.Config config:
@@ -109,6 +119,14 @@ class Leader:
         assert len(self.batchSystem.getIssuedBatchJobIDs()) == 0 #Batch system must start with no active jobs!
         logger.info("Checked batch system has no running jobs and no updated jobs")
 
+        # The queue the main loop waits on. The batch system, the service manager, the stats
+        # and logging thread and a timer put their name on it whenever they have something for
+        # the leader.
+        self.events = Queue()
+        # If the batch system doesn't support this, the main loop has to poll it instead
+        self.batchSystemPostsEvents = self.batchSystem.setUpdateListener(
+            partial(self.events.put, 'batchSystem'))
+
         # Map of batch system IDs to IsseudJob tuples
         self.jobBatchSystemIDToIssuedJob = {}
 
@@ -135,10 +153,14 @@ class Leader:
         self.clusterScaler = None if self.provisioner is None else ClusterScaler(self.provisioner, self, self.config)
 
         # A service manager thread to start and terminate services
-        self.serviceManager = ServiceManager(jobStore, self.toilState)
+        self.serviceManager = ServiceManager(jobStore, self.toilState,
+                                             updateListener=partial(self.events.put,
+                                                                    'serviceManager'))
 
         # A thread to manage the aggregation of statistics and logging from the run
-        self.statsAndLogging = StatsAndLogging(self.jobStore, self.config)
+        self.statsAndLogging = StatsAndLogging(self.jobStore, self.config,
+                                               updateListener=partial(self.events.put,
+                                                                      'statsAndLogging'))
 
         # Set used to monitor deadlocked jobs
         self.potentialDeadlockedJobs = set()
@@ -170,10 +192,17 @@ class Leader:
                 if self.clusterScaler != None:
                     self.clusterScaler.start()
 
+                # Post timer events
+                stopTimer = Event()
+                timer = Thread(target=self._postTimerEvents, args=(stopTimer,))
+                timer.daemon = True
+                timer.start()
                 try:
                     # Run the main loop
                     self.innerLoop()
                 finally:
+                    stopTimer.set()
+                    timer.join()
                     if self.clusterScaler is not None:
                         logger.info('Waiting for workers to shutdown')
                         startTime = time.time()
@@ -187,6 +216,8 @@ class Leader:
         finally:
             # Ensure the stats and logging thread is properly shutdown
             self.statsAndLogging.shutdown()
+            # The batch system may outlive this leader
+            self.batchSystem.setUpdateListener(None)
 
         # Filter the failed jobs
         self.toilState.totalFailedJobs = filter(lambda j : self.jobStore.exists(j.jobStoreID), self.toilState.totalFailedJobs)
@@ -214,6 +245,10 @@ class Leader:
         """
         # Sets up the timing of the jobGraph rescuing method
         timeSinceJobsLastRescued = time.time()
+        # The first snapshot is written in the first iteration
+        timeOfLastSnapshot = 0
+        # Whether the batch system had more updated jobs than were processed in an iteration
+        hasMoreUpdatedJobs = False
 
         logger.info("Starting the main loop")
         while True:
@@ -416,25 +451,30 @@ class Leader:
                 jobGraph.services = []
                 self.toilState.updatedJobs.add((jobGraph, 0))
 
-            # Gather any new, updated jobGraph from the batch system
-            updatedJobTuple = self.batchSystem.getUpdatedBatchJob(2)
-            if updatedJobTuple is not None:
-                jobID, result, wallTime = updatedJobTuple
-                # easy, track different state
-                try:
-                    updatedJob = self.jobBatchSystemIDToIssuedJob[jobID]
-                except KeyError:
-                    logger.warn("A result seems to already have been processed "
-                                "for job %s", jobID)
-                else:
-                    if result == 0:
-                        cur_logger = (logger.debug if str(updatedJob.jobName).startswith(self.debugJobNames)
-                                      else logger.info)
-                        cur_logger('Job ended successfully: %s', updatedJob)
+            # Wait for an event, unless there is work left to do, and gather any new, updated
+            # jobs from the batch system
+            hasWork = len(self.toilState.updatedJobs) > 0 or hasMoreUpdatedJobs
+            updatedJobTuples = self.getUpdatedBatchJobs(wait=not hasWork)
+            hasMoreUpdatedJobs = len(updatedJobTuples) == self.maxFinishedJobsPerBatch
+            if updatedJobTuples:
+                finishedJobs = []
+                for jobID, result, wallTime in updatedJobTuples:
+                    # easy, track different state
+                    try:
+                        updatedJob = self.jobBatchSystemIDToIssuedJob[jobID]
+                    except KeyError:
+                        logger.warn("A result seems to already have been processed "
+                                    "for job %s", jobID)
                     else:
-                        logger.warn('Job failed with exit value %i: %s',
-                                    result, updatedJob)
-                    self.processFinishedJob(jobID, result, wallTime=wallTime)
+                        if result == 0:
+                            cur_logger = (logger.debug if str(updatedJob.jobName).startswith(self.debugJobNames)
+                                          else logger.info)
+                            cur_logger('Job ended successfully: %s', updatedJob)
+                        else:
+                            logger.warn('Job failed with exit value %i: %s',
+                                        result, updatedJob)
+                        finishedJobs.append((jobID, result, wallTime))
+                self.processFinishedJobs(finishedJobs)
 
             else:
                 # Process jobs that have gone awry
@@ -466,6 +506,13 @@ class Leader:
             if self.clusterScaler is not None:
                 self.clusterScaler.check()
 
+            # Periodically record the jobs being worked on so that a restart doesn't have to
+            # examine the entire job graph
+            if (self.config.leaderSnapshotFrequency
+                    and time.time() - timeOfLastSnapshot >= self.config.leaderSnapshotFrequency):
+                self.writeSnapshot()
+                timeOfLastSnapshot = time.time()
+
             # The exit criterion
             if len(self.toilState.updatedJobs) == 0 and self.getNumberOfJobsIssued() == 0 and self.serviceManager.jobsIssuedToServiceManager == 0:
                 logger.info("No jobs left to run so exiting.")
@@ -476,6 +523,10 @@ class Leader:
 
         logger.info("Finished the main loop")
 
+        # Record any failed jobs, a restart will retry them
+        if self.config.leaderSnapshotFrequency:
+            self.writeSnapshot()
+
         # Consistency check the toil state
         assert self.toilState.updatedJobs == set()
         assert self.toilState.successorCounts == {}
@@ -485,6 +536,72 @@ class Leader:
         # assert self.toilState.jobsToBeScheduledWithMultiplePredecessors # These are not properly emptied yet
         # assert self.toilState.hasFailedSuccessors == set() # These are not properly emptied yet
 
+    def getUpdatedBatchJobs(self, wait):
+        """
+        Optionally waits for an event and then gathers the jobs the batch system has updated.
+        Jobs that are already available are gathered together so that they can be resolved with
+        a single bulk call to the job store.
+
+        :param bool wait: whether to wait for an event. If the batch system doesn't post events,
+               it is polled for up to timerEventInterval seconds instead, unless events from
+               other sources are pending.
+
+        :return: up to maxFinishedJobsPerBatch tuples of (jobID, exitValue, wallTime), as
+                 returned by the batch system's getUpdatedBatchJob()
+        :rtype: list[tuple]
+        """
+        if self.batchSystemPostsEvents or not self.events.empty():
+            sources = self.waitForEvents(block=wait)
+            if sources:
+                logger.debug('Handling events from %s.', ', '.join(sorted(sources)))
+            maxWait = 0
+        else:
+            maxWait = self.timerEventInterval if wait else 0
+        updatedJobTuples = []
+        while len(updatedJobTuples) < self.maxFinishedJobsPerBatch:
+            updatedJobTuple = self.batchSystem.getUpdatedBatchJob(maxWait)
+            if updatedJobTuple is None:
+                break
+            updatedJobTuples.append(updatedJobTuple)
+            maxWait = 0
+        return updatedJobTuples
+
+    def waitForEvents(self, block):
+        """
+        Takes all pending events off the event queue.
+
+        :param bool block: whether to wait for an event if none is pending. The timer posts an
+               event every timerEventInterval seconds, so this won't wait for much longer.
+
+        :return: the names of the sources of the events, empty if there were none
+        :rtype: set[str]
+        """
+        sources = set()
+        try:
+            # Blocking without a timeout wakes up as soon as an event is posted
+            sources.add(self.events.get(block=block))
+            while True:
+                sources.add(self.events.get_nowait())
+        except Empty:
+            pass
+        return sources
+
+    def _postTimerEvents(self, stop):
+        """
+        Posts an event every timerEventInterval seconds until the given threading.Event is set.
+        """
+        while not stop.wait(self.timerEventInterval):
+            self.events.put('timer')
+
+    def writeSnapshot(self):
+        """
+        Records the jobs the leader is working on in the job store, see
+        :meth:`toil.toilState.ToilState.writeSnapshot`.
+        """
+        self.toilState.writeSnapshot(self.jobStore,
+                                     issuedJobStoreIDs=(jobNode.jobStoreID for jobNode in
+                                                        itervalues(self.jobBatchSystemIDToIssuedJob)))
+
     def checkForDeadlocks(self):
         """
         Checks if the system is deadlocked running service jobs.
@@ -630,8 +747,8 @@ class Leader:
         """
         if len(jobsToKill) > 0:
             self.batchSystem.killBatchJobs(jobsToKill)
-            for jobBatchSystemID in jobsToKill:
-                self.processFinishedJob(jobBatchSystemID, 1)
+            self.processFinishedJobs([(jobBatchSystemID, 1, None)
+                                      for jobBatchSystemID in jobsToKill])
 
     #Following functions handle error cases for when jobs have gone awry with the batch system.
 
@@ -693,32 +810,40 @@ class Leader:
         """
         Function reads a processed jobGraph file and updates it state.
         """
-        def processRemovedJob(issuedJob):
+        self.processFinishedJobs([(batchSystemID, resultStatus, wallTime)])
+
+    def processFinishedJobs(self, finishedJobs):
+        """
+        Reads the jobGraph files of a batch of processed jobs and updates their state. The
+        jobGraphs are loaded from and written back to the job store with one bulk call each.
+
+        :param list[(int,int,float|None)] finishedJobs: a tuple of batch system ID, exit status
+               and wall time for each finished job
+        """
+        def processRemovedJob(issuedJob, resultStatus):
             if resultStatus != 0:
                 logger.warn("Despite the batch system claiming failure the "
                             "job %s seems to have finished and been removed", issuedJob)
             self._updatePredecessorStatus(issuedJob.jobStoreID)
-        jobNode = self.removeJob(batchSystemID)
-        jobStoreID = jobNode.jobStoreID
-        if wallTime is not None and self.clusterScaler is not None:
-            self.clusterScaler.addCompletedJob(jobNode, wallTime)
-        if self.jobStore.exists(jobStoreID):
-            logger.debug("Job %s continues to exist (i.e. has more to do)", jobNode)
+        jobNodes = []
+        for batchSystemID, resultStatus, wallTime in finishedJobs:
+            jobNode = self.removeJob(batchSystemID)
+            if wallTime is not None and self.clusterScaler is not None:
+                self.clusterScaler.addCompletedJob(jobNode, wallTime)
+            jobNodes.append((jobNode, resultStatus))
+        # Jobs that don't exist anymore are done. This also covers ghost jobs, i.e. jobs that
+        # have been deleted but for which a stale read from SDB indicated their existence, see
+        # https://github.com/BD2KGenomics/toil/issues/1091
+        jobGraphs = self.jobStore.loadMany(jobNode.jobStoreID for jobNode, _ in jobNodes)
+        jobGraphsToUpdate = []
+        for jobNode, resultStatus in jobNodes:
+            jobStoreID = jobNode.jobStoreID
             try:
-                jobGraph = self.jobStore.load(jobStoreID)
-            except NoSuchJobException:
-                # Avoid importing AWSJobStore as the corresponding extra might be missing
-                if self.jobStore.__class__.__name__ == 'AWSJobStore':
-                    # We have a ghost job - the job has been deleted but a stale read from
-                    # SDB gave us a false positive when we checked for its existence.
-                    # Process the job from here as any other job removed from the job store.
-                    # This is a temporary work around until https://github.com/BD2KGenomics/toil/issues/1091
-                    # is completed
-                    logger.warn('Got a stale read from SDB for job %s', jobNode)
-                    processRemovedJob(jobNode)
-                    return
-                else:
-                    raise
+                jobGraph = jobGraphs[jobStoreID]
+            except KeyError:  #The jobGraph is done
+                processRemovedJob(jobNode, resultStatus)
+                continue
+            logger.debug("Job %s continues to exist (i.e. has more to do)", jobNode)
             if jobGraph.logJobStoreFileID is not None:
                 with jobGraph.getLogFileHandle( self.jobStore ) as logFileStream:
                     # more memory efficient than read().striplines() while leaving off the
@@ -736,7 +861,7 @@ class Leader:
                 if jobGraph.logJobStoreFileID is None:
                     logger.warn("No log file is present, despite job failing: %s", jobNode)
                 jobGraph.setupJobAfterFailure(self.config)
-                self.jobStore.update(jobGraph)
+                jobGraphsToUpdate.append(jobGraph)
             elif jobStoreID in self.toilState.hasFailedSuccessors:
                 # If the job has completed okay, we can remove it from the list of jobs with failed successors
                 self.toilState.hasFailedSuccessors.remove(jobStoreID)
@@ -744,41 +869,42 @@ class Leader:
             self.toilState.updatedJobs.add((jobGraph, resultStatus)) #Now we know the
             #jobGraph is done we can add it to the list of updated jobGraph files
             logger.debug("Added job: %s to active jobs", jobGraph)
-        else:  #The jobGraph is done
-            processRemovedJob(jobNode)
+        if jobGraphsToUpdate:
+            self.jobStore.updateMany(jobGraphsToUpdate)
 
     @staticmethod
     def getSuccessors(jobGraph, alreadySeenSuccessors, jobStore):
         """
-        Gets successors of the given job by walking the job graph recursively.
+        Gets successors of the given job by walking the job graph breadth-first, loading each
+        level of the graph with one bulk call to the job store.
         Any successor in alreadySeenSuccessors is ignored and not traversed.
         Returns the set of found successors. This set is added to alreadySeenSuccessors.
         """
         successors = set()
-
-        def successorRecursion(jobGraph):
-            # For lists of successors
-            for successorList in jobGraph.stack:
-
-                # For each successor in list of successors
-                for successorJobNode in successorList:
-
-                    # Id of the successor
-                    successorJobStoreID = successorJobNode.jobStoreID
-
-                    # If successor not already visited
-                    if successorJobStoreID not in alreadySeenSuccessors:
-
-                        # Add to set of successors
-                        successors.add(successorJobStoreID)
-                        alreadySeenSuccessors.add(successorJobStoreID)
-
-                        # Recurse if job exists
-                        # (job may not exist if already completed)
-                        if jobStore.exists(successorJobStoreID):
-                            successorRecursion(jobStore.load(successorJobStoreID))
-
-        successorRecursion(jobGraph) # Recurse from jobGraph
+        jobGraphs = [jobGraph]
+        while jobGraphs:
+            newSuccessors = []
+            # For lists of successors of each job at the current level
+            for jobGraph in jobGraphs:
+                for successorList in jobGraph.stack:
+
+                    # For each successor in list of successors
+                    for successorJobNode in successorList:
+
+                        # Id of the successor
+                        successorJobStoreID = successorJobNode.jobStoreID
+
+                        # If successor not already visited
+                        if successorJobStoreID not in alreadySeenSuccessors:
+
+                            # Add to set of successors
+                            successors.add(successorJobStoreID)
+                            alreadySeenSuccessors.add(successorJobStoreID)
+                            newSuccessors.append(successorJobStoreID)
+
+            # Descend into the successors that exist
+            # (a job may not exist if already completed)
+            jobGraphs = list(jobStore.loadMany(newSuccessors).values())
 
         return successors
 
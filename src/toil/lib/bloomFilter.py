@@ -0,0 +1,107 @@
+# Copyright (C) 2015-2016 Regents of the University of California
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import absolute_import, division
+
+import base64
+import math
+import struct
+from hashlib import sha1
+
+
+class BloomFilter(object):
+    """
+    A compact summary of a set of strings that can tell for certain that a string is not in the
+    set but may wrongly claim that it is, at the error rate the filter was created with.
+
+    >>> summary = BloomFilter(capacity=100, errorRate=0.01)
+    >>> summary.update(str(i) for i in range(100))
+    >>> all(str(i) in summary for i in range(100))
+    True
+    >>> sum(str(i) in summary for i in range(100, 1100)) < 50
+    True
+    >>> BloomFilter.fromString(summary.toString()) == summary
+    True
+    >>> '0' in BloomFilter(capacity=0)
+    False
+    """
+
+    def __init__(self, capacity, errorRate=0.01, numHashes=None, bits=None):
+        """
+        :param int capacity: The number of strings the filter is sized for. Adding more increases
+               the error rate.
+
+        :param float errorRate: The probability of a string that isn't in the set being reported
+               as in it, once the filter holds as many strings as its capacity
+
+        :param int numHashes: The number of bit positions per string, computed from the capacity
+               and error rate if omitted
+
+        :param bytearray bits: The bits of an existing filter, in which case the capacity and
+               error rate are ignored. All bits are unset if omitted.
+        """
+        if bits is None:
+            capacity = max(capacity, 1)
+            numBits = int(math.ceil(-capacity * math.log(errorRate) / math.log(2) ** 2))
+            bits = bytearray((numBits + 7) // 8)
+            if numHashes is None:
+                numHashes = max(1, int(round(len(bits) * 8 / capacity * math.log(2))))
+        self.bits = bits
+        self.numHashes = numHashes
+
+    def _positions(self, string):
+        if not isinstance(string, bytes):
+            string = string.encode('utf-8')
+        # Derive all positions from two hashes, see Kirsch and Mitzenmacher, "Less Hashing, Same
+        # Performance: Building a Better Bloom Filter"
+        h1, h2 = struct.unpack('<QQ', sha1(string).digest()[:16])
+        numBits = len(self.bits) * 8
+        return ((h1 + i * h2) % numBits for i in range(self.numHashes))
+
+    def add(self, string):
+        for position in self._positions(string):
+            self.bits[position // 8] |= 1 << (position % 8)
+
+    def update(self, strings):
+        for string in strings:
+            self.add(string)
+
+    def __contains__(self, string):
+        return all(self.bits[position // 8] & (1 << (position % 8))
+                   for position in self._positions(string))
+
+    def __eq__(self, other):
+        return (isinstance(other, BloomFilter)
+                and self.numHashes == other.numHashes
+                and self.bits == other.bits)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def toString(self):
+        """
+        :return: A printable representation of this filter, see :meth:`fromString`
+        :rtype: str
+        """
+        return '%i:%s' % (self.numHashes, base64.b64encode(bytes(self.bits)).decode('ascii'))
+
+    @classmethod
+    def fromString(cls, string):
+        """
+        :param str string: The result of :meth:`toString`
+        :rtype: BloomFilter
+        """
+        numHashes, bits = string.split(':', 1)
+        return cls(capacity=None, numHashes=int(numHashes),
+                   bits=bytearray(base64.b64decode(bits)))
@@ -0,0 +1,165 @@
+# Copyright (C) 2015-2016 Regents of the University of California
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Copies local files in the cheapest way the file system supports. In order of preference, a copy
+is a reflink, which shares the blocks of the source until either file is modified, a hard link,
+if the caller allows it, a copy made by the kernel or a copy made in user space.
+"""
+
+from __future__ import absolute_import
+
+import errno
+import os
+import shutil
+from fcntl import ioctl
+
+# From linux/fs.h, clones the file referred to by the given descriptor into the target file
+FICLONE = 0x40049409
+
+# The ways in which a file can be copied, as returned by copyFile() and copyFileObj()
+REFLINK = 'reflink'
+LINK = 'link'
+KERNEL = 'kernel'
+USERSPACE = 'userspace'
+
+# The errors that signify the file system or kernel don't support a way of copying the files
+_unsupportedErrors = {errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.ENOSYS,
+                      errno.EBADF, errno.EPERM}
+
+_bufferSize = 1024 * 1024
+
+
+def copyFile(srcPath, dstPath, allowLink=False):
+    """
+    Copies the source file to the destination path, which is overwritten if it exists. Like
+    shutil.copyfile(), the permissions of the source file aren't copied.
+
+    :param str srcPath: the path of the file to copy
+
+    :param str dstPath: the path of the copy
+
+    :param bool allowLink: whether the copy may be a hard link to the source file if the file
+           system doesn't support reflinks. A hard link shares all future modifications with the
+           source file.
+
+    :return: one of REFLINK, LINK, KERNEL or USERSPACE, depending on how the file was copied
+    :rtype: str
+    """
+    if os.path.exists(dstPath) and os.path.samefile(srcPath, dstPath):
+        raise shutil.Error('%s and %s are the same file' % (srcPath, dstPath))
+    with open(srcPath, 'rb') as src:
+        with open(dstPath, 'wb') as dst:
+            if _reflink(src, dst):
+                return REFLINK
+            if not allowLink:
+                return _copyData(src, dst)
+        os.unlink(dstPath)
+        try:
+            os.link(os.path.realpath(srcPath), dstPath)
+        except OSError:
+            # Across file systems, for example, or beyond the maximum number of links to a file
+            pass
+        else:
+            return LINK
+        with open(dstPath, 'wb') as dst:
+            return _copyData(src, dst)
+
+
+def copyFileObj(src, dst):
+    """
+    Copies the entire content of an open file to another one, like copyFile() but without ever
+    linking the files. This is useful if the source file may be removed concurrently.
+
+    :param file src: the file to copy, opened for reading
+
+    :param file dst: the empty file to copy to, opened for writing
+
+    :return: one of REFLINK, KERNEL or USERSPACE, depending on how the file was copied
+    :rtype: str
+    """
+    if _reflink(src, dst):
+        return REFLINK
+    return _copyData(src, dst)
+
+
+def _reflink(src, dst):
+    """
+    :return: whether the destination file was turned into a reflink of the source file
+    :rtype: bool
+    """
+    dst.flush()
+    try:
+        ioctl(dst.fileno(), FICLONE, src.fileno())
+    except (IOError, OSError) as e:
+        if e.errno not in _unsupportedErrors:
+            raise
+        return False
+    return True
+
+
+def _copyData(src, dst):
+    """
+    Copies the content of one open file to another in the kernel if possible, without passing
+    the data through user space.
+    """
+    dst.flush()
+    src.seek(0)
+    for kernelCopy in (_copyFileRange, _sendFile):
+        if kernelCopy(src.fileno(), dst.fileno()):
+            return KERNEL
+    shutil.copyfileobj(src, dst, _bufferSize)
+    return USERSPACE
+
+
+def _copyFileRange(srcFd, dstFd):
+    # Only available in Python 3.8 and newer
+    copyFileRange = getattr(os, 'copy_file_range', None)
+    if copyFileRange is None:
+        return False
+    return _copyChunks(srcFd, lambda offset, count: copyFileRange(srcFd, dstFd, count,
+                                                                  offset, offset))
+
+
+def _sendFile(srcFd, dstFd):
+    # Only available in Python 3, and only Linux supports a regular file as the destination
+    sendFile = getattr(os, 'sendfile', None)
+    if sendFile is None:
+        return False
+    return _copyChunks(srcFd, lambda offset, count: sendFile(dstFd, srcFd, offset, count))
+
+
+def _copyChunks(srcFd, copyChunk):
+    """
+    Copies the file with the given descriptor by invoking the given function for consecutive
+    chunks of it.
+
+    :param callable copyChunk: takes the offset and the size of a chunk and returns the number
+           of bytes it copied
+
+    :return: False if the first chunk couldn't be copied because the copy isn't supported
+    """
+    size = os.fstat(srcFd).st_size
+    offset = 0
+    while offset < size:
+        try:
+            copied = copyChunk(offset, min(size - offset, 1 << 30))
+        except OSError as e:
+            if offset == 0 and e.errno in _unsupportedErrors:
+                return False
+            raise
+        if copied == 0:
+            break
+        offset += copied
+    return True
@@ -684,6 +684,7 @@ class ClusterStats(object):
 
     def _gatherStats(self, preemptable):
         def toDict(nodeInfo):
+            cacheReads = nodeInfo.cacheHits + nodeInfo.cacheMisses
             # convert NodeInfo object to dict to improve JSON output
             return dict(memory=nodeInfo.memoryUsed,
                         cores=nodeInfo.coresUsed,
@@ -692,6 +693,10 @@ class ClusterStats(object):
                         requestedCores=nodeInfo.requestedCores,
                         requestedMemory=nodeInfo.requestedMemory,
                         workers=nodeInfo.workers,
+                        cacheHits=nodeInfo.cacheHits,
+                        cacheMisses=nodeInfo.cacheMisses,
+                        cacheHitRate=(float(nodeInfo.cacheHits) / cacheReads
+                                      if cacheReads else None),
                         time=time.time()  # add time stamp
                         )
         if self.scaleable:
@@ -28,7 +28,12 @@ class ServiceManager( object ):
     """
     Manages the scheduling of services.
     """
-    def __init__(self, jobStore, toilState):
+    def __init__(self, jobStore, toilState, updateListener=None):
+        """
+        :param callable updateListener: if given, invoked without arguments by the service
+               manager's thread whenever a service job or a job whose services are running becomes
+               available from getServiceJobsToStart() or getJobGraphWhoseServicesAreRunning()
+        """
         logger.debug("Initializing service manager")
         self.jobStore = jobStore
         
@@ -58,7 +63,7 @@ class ServiceManager( object ):
                                      args=(self._jobGraphsWithServicesToStart,
                                            self._jobGraphsWithServicesThatHaveStarted,
                                            self._serviceJobGraphsToStart, self._terminate,
-                                           self.jobStore))
+                                           self.jobStore, updateListener))
         
     def start(self): 
         """
@@ -164,10 +169,14 @@ class ServiceManager( object ):
     def _startServices(jobGraphsWithServicesToStart,
                        jobGraphsWithServicesThatHaveStarted,
                        serviceJobsToStart,
-                       terminate, jobStore):
+                       terminate, jobStore, updateListener):
         """
         Thread used to schedule services.
         """
+        def notify():
+            if updateListener is not None:
+                updateListener()
+
         while True:
             try:
                 # Get a jobGraph with services to start, waiting a short period
@@ -190,6 +199,7 @@ class ServiceManager( object ):
                     assert jobStore.fileExists(serviceJob.startJobStoreID)
                     # At this point the terminateJobStoreID and errorJobStoreID could have been deleted!
                     serviceJobsToStart.put(serviceJob)
+                    notify()
 
                 # Wait until all the services of the batch are running
                 for serviceJob in serviceJobList:
@@ -204,3 +214,4 @@ class ServiceManager( object ):
 
             # Add the jobGraph to the output queue of jobs whose services have been started
             jobGraphsWithServicesThatHaveStarted.put(jobGraph)
+            notify()
@@ -32,10 +32,14 @@ class StatsAndLogging( object ):
     Class manages a thread that aggregates statistics and logging information on a toil run.
     """
 
-    def __init__(self, jobStore, config):
+    def __init__(self, jobStore, config, updateListener=None):
+        """
+        :param callable updateListener: if given, invoked without arguments when the thread
+               exits, so that a failure can be noticed by :meth:`check` without delay
+        """
         self._stop = Event()
-        self._worker = Thread(target=self.statsAndLoggingAggregator,
-                              args=(jobStore, self._stop, config))
+        self._worker = Thread(target=self._run,
+                              args=(jobStore, self._stop, config, updateListener))
 
     def start(self):
         """
@@ -92,6 +96,14 @@ class StatsAndLogging( object ):
             name = createName(path, alternateName, extension)
             os.symlink(os.path.relpath(fullName, path), name)
 
+    @classmethod
+    def _run(cls, jobStore, stop, config, updateListener):
+        try:
+            cls.statsAndLoggingAggregator(jobStore, stop, config)
+        finally:
+            if updateListener is not None:
+                updateListener()
+
     @classmethod
     def statsAndLoggingAggregator(cls, jobStore, stop, config):
         """
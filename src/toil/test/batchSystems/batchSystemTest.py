@@ -26,6 +26,7 @@ import time
 import multiprocessing
 import sys
 import subprocess
+from threading import Event
 from unittest import skipIf
 
 from toil.common import Config
@@ -36,6 +37,7 @@ from toil.batchSystems.singleMachine import SingleMachineBatchSystem
 from toil.batchSystems.abstractBatchSystem import (InsufficientSystemResources,
                                                    AbstractBatchSystem,
                                                    BatchSystemSupport)
+from toil.fileStore import CachingFileStore
 from toil.job import Job, JobNode
 from toil.test import (ToilTest,
                        needs_mesos,
@@ -214,6 +216,18 @@ class hidden:
         def testGetRescueJobFrequency(self):
             self.assertTrue(self.batchSystem.getRescueBatchJobFrequency() > 0)
 
+        def testUpdateListener(self):
+            updated = Event()
+            if not self.batchSystem.setUpdateListener(updated.set):
+                self.skipTest('The batch system does not support update listeners')
+            jobNode = JobNode(command='true', jobName='test', unitName=None, jobStoreID='1',
+                              requirements=defaultRequirements)
+            jobID = self.batchSystem.issueBatchJob(jobNode)
+            self.assertTrue(updated.wait(timeout=10))
+            # The job must be available by the time the listener is invoked
+            self.assertEqual(self.batchSystem.getUpdatedBatchJob(0)[:2], (jobID, 0))
+            self.batchSystem.setUpdateListener(None)
+
         def testScalableBatchSystem(self):
             # If instance of scalable batch system
             pass
@@ -343,6 +357,65 @@ class SingleMachineBatchSystemTest(hidden.AbstractBatchSystemTest):
     def createBatchSystem(self):
         return SingleMachineBatchSystem(config=self.config,
                                         maxCores=numCores, maxMemory=1e9, maxDisk=2001)
+
+    def testSmallJobsOvertakeLargeJob(self):
+        """
+        A job that needs all cores waits for a running job, while a later job that fits into the
+        free cores starts right away.
+        """
+        def issue(command, cores):
+            requirements = dict(defaultRequirements, cores=cores, disk=1)
+            return self.batchSystem.issueBatchJob(JobNode(command=command, jobName=command,
+                                                          unitName=None, jobStoreID=command,
+                                                          requirements=requirements))
+        running = issue('sleep 2', cores=1)
+        large = issue('sleep 0', cores=numCores)
+        small = issue('true', cores=1)
+        updatedIDs = [self.batchSystem.getUpdatedBatchJob(maxWait=1000)[0] for _ in range(3)]
+        self.assertEqual(updatedIDs, [small, running, large])
+        stats = self.batchSystem.getSchedulerStats()
+        self.assertEqual(stats['jobsStarted'], 3)
+        self.assertEqual(stats['jobsWaiting'], 0)
+        self.assertTrue(stats['maxQueueWait'] >= 1)
+        self.assertTrue(0 < stats['coreUtilization'] <= 1)
+
+    def testKillManyJobs(self):
+        """
+        Kill many running and waiting jobs at once, and ensure that the processes the running
+        jobs started are killed along with them.
+        """
+        pidPath = os.path.join(self.tempDir, 'pid%i')
+        requirements = dict(defaultRequirements, cores=0.1, disk=1)
+        jobIDs = [self.batchSystem.issueBatchJob(
+            JobNode(command='sleep 1000 & echo $! > %s; wait' % (pidPath % i), jobName=str(i),
+                    unitName=None, jobStoreID=str(i), requirements=requirements))
+                  for i in range(1000)]
+        numRunning = int(numCores / SingleMachineBatchSystem.minCores)
+        self._waitForJobsToStart(numRunning)
+        while not all(os.path.exists(pidPath % i) for i in range(numRunning)):
+            time.sleep(0.1)
+        startTime = time.time()
+        self.batchSystem.killBatchJobs(jobIDs)
+        self.assertTrue(time.time() - startTime < 10)
+        self.assertEqual({}, self.batchSystem.getRunningBatchJobIDs())
+        self.assertEqual([], list(self.batchSystem.getIssuedBatchJobIDs()))
+        self.assertEqual(0, self.batchSystem.getSchedulerStats()['jobsWaiting'])
+        self.assertFalse(self.batchSystem.getUpdatedBatchJob(0))
+        for i in range(numRunning):
+            with open(pidPath % i) as f:
+                pid = int(f.read())
+            for _ in range(50):
+                try:
+                    with open('/proc/%i/stat' % pid) as f:
+                        state = f.read().split()[2]
+                except IOError:
+                    break
+                # Killed but not yet reaped by the init process
+                if state == 'Z':
+                    break
+                time.sleep(0.1)
+            else:
+                self.fail('Process %i of a killed job is still running' % pid)
         
 class MaxCoresSingleMachineBatchSystemTest(ToilTest):
     """
@@ -653,6 +726,127 @@ class TorqueBatchSystemTest(hidden.AbstractGridEngineBatchSystemTest):
         for f in glob('toil_job_*.[oe]*'):
             os.unlink(f)
 
+class GridEngineJobArrayTest(ToilTest):
+    """
+    Tests the submission of jobs with the same requirements as job arrays by the GridEngine batch
+    system, against stand-ins for the GridEngine commands that run each job as it is submitted.
+    """
+
+    # Serves as qhost, qsub, qacct, qstat and qdel, depending on the name it is invoked by. Keeps
+    # the names of the commands invoked, the submitted command lines and the exit status of each
+    # job next to itself.
+    standInScheduler = dedent("""
+        from __future__ import print_function
+        import os
+        import subprocess
+        import sys
+        stateDir = os.path.dirname(os.path.abspath(sys.argv[0]))
+        submissionsPath = os.path.join(stateDir, 'submissions')
+        command, args = os.path.basename(sys.argv[0]), sys.argv[1:]
+        with open(os.path.join(stateDir, 'calls'), 'a') as f:
+            f.write(command + '\\n')
+        if command == 'qhost':
+            print('HOSTNAME ARCH NCPU NSOC NCOR NTHR LOAD MEMTOT MEMUSE SWAPTO SWAPUS')
+            print('-' * 80)
+            print('localhost lx-amd64 64 1 64 64 0.01 256.0G 1.0G 0.0 0.0')
+        elif command == 'qsub':
+            with open(submissionsPath, 'a') as f:
+                f.write(' '.join(args) + '\\n')
+            with open(submissionsPath) as f:
+                batchJobID = len(f.readlines())
+            if '-t' in args:
+                numTasks = int(args[args.index('-t') + 1].split('-')[1])
+                # Like Grid Engine, ignore the shebang of the script and run it with the given
+                # shell or else the default shell of a queue
+                shell = args[args.index('-S') + 1] if '-S' in args else '/bin/csh'
+                for task in range(1, numTasks + 1):
+                    try:
+                        status = subprocess.call([shell, args[-1]],
+                                                 env=dict(os.environ, SGE_TASK_ID=str(task)))
+                    except OSError:
+                        status = 127
+                    with open(os.path.join(stateDir, '%i.%i' % (batchJobID, task)), 'w') as f:
+                        f.write(str(status))
+                print('%i.1-%i:1' % (batchJobID, numTasks))
+            else:
+                status = subprocess.call(args[-1], shell=True)
+                with open(os.path.join(stateDir, str(batchJobID)), 'w') as f:
+                    f.write(str(status))
+                print(batchJobID)
+        elif command == 'qacct':
+            job = args[1]
+            for name in sorted(os.listdir(stateDir)):
+                if name == job or name.startswith(job + '.'):
+                    print('=' * 62)
+                    print('jobnumber    ' + job)
+                    print('taskid       ' + (name.split('.')[1] if '.' in name else 'undefined'))
+                    print('failed       0')
+                    with open(os.path.join(stateDir, name)) as f:
+                        print('exit_status  ' + f.read())
+        """)
+
+    def setUp(self):
+        super(GridEngineJobArrayTest, self).setUp()
+        self.binDir = self._createTempDir('bin')
+        for command in ('qhost', 'qsub', 'qacct', 'qstat', 'qdel'):
+            path = os.path.join(self.binDir, command)
+            with open(path, 'w') as f:
+                f.write('#!' + sys.executable + '\n' + self.standInScheduler)
+            os.chmod(path, 0o755)
+        self.oldPath = os.environ['PATH']
+        os.environ['PATH'] = self.binDir + os.pathsep + self.oldPath
+        config = hidden.AbstractBatchSystemTest.createConfig()
+        config.jobStore = 'file:' + self._createTempDir('jobStore')
+        from toil.batchSystems.gridengine import GridEngineBatchSystem
+        self.batchSystem = GridEngineBatchSystem(config=config, maxCores=100, maxMemory=1000e9,
+                                                 maxDisk=1e9)
+
+    def tearDown(self):
+        self.batchSystem.shutdown()
+        os.environ['PATH'] = self.oldPath
+        super(GridEngineJobArrayTest, self).tearDown()
+
+    def _runJobs(self, numJobs):
+        """
+        Issues jobs that exit with different codes and checks that the exit code of each job is
+        reported for that job.
+
+        :return: the command lines of the submissions to the stand-in scheduler
+        :rtype: list[str]
+        """
+        expectedStatus = {}
+        for i in range(numJobs):
+            jobNode = JobNode(command='exit %i' % (i % 3), requirements=defaultRequirements,
+                              jobName='testJobArray', unitName=None, jobStoreID=str(i))
+            expectedStatus[self.batchSystem.issueBatchJob(jobNode)] = i % 3
+        status = {}
+        while len(status) < numJobs:
+            update = self.batchSystem.getUpdatedBatchJob(maxWait=60)
+            self.assertIsNotNone(update)
+            jobID, exitStatus, _ = update
+            status[jobID] = exitStatus
+        # Every job's status is reported for that job, even if it ran as a task of an array
+        self.assertEqual(status, expectedStatus)
+        with open(os.path.join(self.binDir, 'submissions')) as f:
+            return f.readlines()
+
+    def testJobsWithSameRequirementsAreSubmittedAsArray(self):
+        numJobs = 10
+        submissions = self._runJobs(numJobs)
+        self.assertLess(len(submissions), numJobs)
+        arraySubmissions = [submission for submission in submissions if ' -t ' in submission]
+        self.assertTrue(arraySubmissions)
+        for submission in arraySubmissions:
+            self.assertIn(' -S /bin/sh ', submission)
+
+    def testStatusIsPolledInBulk(self):
+        submissions = self._runJobs(10)
+        with open(os.path.join(self.binDir, 'calls')) as f:
+            calls = [call.strip() for call in f]
+        # One query of the accounting per submission, not per job
+        self.assertLessEqual(calls.count('qacct'), len(submissions))
+        self.assertGreater(calls.count('qstat'), 0)
+
 class SingleMachineBatchSystemJobTest(hidden.AbstractBatchSystemJobTest):
     """
     Tests Toil workflow against the SingleMachine batch system
@@ -762,6 +956,133 @@ class SingleMachineBatchSystemJobTest(hidden.AbstractBatchSystemJobTest):
         assert outString.startswith(possibleStarts)
         assert outString.endswith('sJCsJGCfJC')
 
+    def testDispatchLatency(self):
+        """
+        Measures the time from the end of a job to the start of its successor, which includes
+        the time it takes the leader to notice that the job has finished and to issue the
+        successor.
+        """
+        numJobs = 20
+        options = Job.Runner.getDefaultOptions(self._getTestJobStorePath())
+        options.workDir = self._createTempDir('testFiles')
+        options.batchSystem = self.batchSystemName
+        root = Job.wrapJobFn(_measureDispatchLatency, numJobs, [], None, memory='100M')
+        latencies = sorted(Job.Runner.startToil(root, options))
+        self.assertEqual(len(latencies), numJobs)
+        log.info('Dispatching %i successors took %.3fs on average, %.3fs at the median and '
+                 '%.3fs at most.', numJobs, sum(latencies) / numJobs, latencies[numJobs // 2],
+                 latencies[-1])
+
+
+class InProcessBatchSystemJobTest(SingleMachineBatchSystemJobTest):
+    """
+    Tests Toil workflow against the in-process batch system
+    """
+
+    def getBatchSystemName(self):
+        return "inProcess"
+
+    def testJobsRunInLeaderProcess(self):
+        options = Job.Runner.getDefaultOptions(self._getTestJobStorePath())
+        options.workDir = self._createTempDir('testFiles')
+        options.batchSystem = self.batchSystemName
+        root = Job.wrapJobFn(_getPid)
+        child = root.addChildJobFn(_getPid)
+        root.addFollowOnFn(_assertSamePid, root.rv(), child.rv())
+        Job.Runner.startToil(root, options)
+
+    def testFailedJobIsRetried(self):
+        options = Job.Runner.getDefaultOptions(self._getTestJobStorePath())
+        options.workDir = self._createTempDir('testFiles')
+        options.batchSystem = self.batchSystemName
+        options.retryCount = 1
+        markerPath = os.path.join(options.workDir, 'marker')
+        Job.Runner.startToil(Job.wrapFn(_failOnce, markerPath), options)
+        self.assertTrue(os.path.exists(markerPath))
+
+    def testCachingIsDisabled(self):
+        options = Job.Runner.getDefaultOptions(self._getTestJobStorePath())
+        options.workDir = self._createTempDir('testFiles')
+        options.batchSystem = self.batchSystemName
+        options.disableCaching = False
+        Job.Runner.startToil(Job.wrapJobFn(_assertNotCaching), options)
+
+
+class WorkerPoolSingleMachineBatchSystemJobTest(ToilTest):
+    """
+    Tests Toil workflows against the single-machine batch system with a pool of worker processes
+    """
+
+    def _getOptions(self):
+        options = Job.Runner.getDefaultOptions(self._getTestJobStorePath())
+        options.workDir = self._createTempDir('testFiles')
+        options.batchSystem = 'singleMachine'
+        options.workerPoolSize = 2
+        return options
+
+    def testJobsRunInPool(self):
+        root = Job.wrapJobFn(_getParentPid)
+        second = root.addFollowOnJobFn(_getParentPid)
+        second.addFollowOnFn(_assertPooled, os.getpid(), root.rv(), second.rv())
+        Job.Runner.startToil(root, self._getOptions())
+
+    def testCrashedPoolProcessIsReplaced(self):
+        options = self._getOptions()
+        options.retryCount = 1
+        markerPath = os.path.join(options.workDir, 'marker')
+        Job.Runner.startToil(Job.wrapFn(_killParentOnce, markerPath), options)
+        self.assertTrue(os.path.exists(markerPath))
+
+
+def _getParentPid(job):
+    return os.getppid()
+
+
+def _assertPooled(leaderPid, *parentPids):
+    # One job at a time ran, so each of them was forked from the same pooled process
+    assert set(parentPids) == {os.getppid()}
+    assert leaderPid != os.getppid()
+
+
+def _killParentOnce(markerPath):
+    if not os.path.exists(markerPath):
+        open(markerPath, 'w').close()
+        os.kill(os.getppid(), 9)
+        os.kill(os.getpid(), 9)
+
+
+def _getPid(job):
+    return os.getpid()
+
+
+def _assertSamePid(*pids):
+    assert set(pids) == {os.getpid()}
+
+
+def _assertNotCaching(job):
+    assert not isinstance(job.fileStore, CachingFileStore)
+
+
+def _failOnce(markerPath):
+    if not os.path.exists(markerPath):
+        open(markerPath, 'w').close()
+        raise RuntimeError('Failing on purpose')
+
+
+def _measureDispatchLatency(job, remaining, latencies, predecessorEndTime):
+    """
+    Runs a chain of the given number of successors and returns the time between the end of
+    each job in the chain and the start of its successor.
+    """
+    if predecessorEndTime is not None:
+        latencies = latencies + [time.time() - predecessorEndTime]
+    if remaining == 0:
+        return latencies
+    # Requiring more memory than this job keeps the worker from running the successor itself
+    successor = job.addChildJobFn(_measureDispatchLatency, remaining - 1, latencies, time.time(),
+                                  memory=job.memory + 1)
+    return successor.rv()
+
 
 def _resourceBlockTestAuxFn(outFile, sleepTime, writeVal):
     """
@@ -0,0 +1,140 @@
+# Copyright (C) 2015-2016 Regents of the University of California
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Measures how the cache of the caching file store holds up when many workers on the same node use
+it at once. A number of concurrent jobs repeatedly read a set of shared files from the cache,
+delete their local copies again and write a new file, all of which update the state of the cache
+on the node. Reports the number of these cache operations completed per second by all workers
+together and the mean time each operation took.
+
+Usage: python -m toil.test.benchmarks.cacheBenchmark [--workers N] [--files N] [--rounds N]
+       JOBSTORE
+
+Unless another batch system is selected with --batchSystem, each worker runs in its own process
+on the single-machine batch system. At most ten workers run at once per core.
+"""
+from __future__ import absolute_import, division, print_function
+
+import logging
+import os
+import time
+from argparse import ArgumentParser
+from collections import namedtuple
+
+from toil.common import Toil
+from toil.job import Job
+
+log = logging.getLogger(__name__)
+
+# Small enough for many workers to run at once on a single core
+jobRequirements = dict(cores=0.1, memory='10M', disk='10M')
+
+BenchmarkResult = namedtuple('BenchmarkResult', (
+    'workers',
+    # The number of cache operations made by all workers together
+    'operations',
+    # The wall-clock time from the start of the first worker to the end of the last, in seconds
+    'wallTime',
+    'operationsPerSecond',
+    # The mean time a cache operation took, in seconds
+    'meanLatency'))
+
+
+def _writeFile(job, size):
+    path = job.fileStore.getLocalTempFile()
+    with open(path, 'wb') as f:
+        f.write(os.urandom(size))
+    return job.fileStore.writeGlobalFile(path)
+
+
+def _setUp(job, workers, files, rounds, fileSize):
+    fileIDs = [_writeFile(job, fileSize) for _ in range(files)]
+    results = [job.addChildJobFn(_worker, fileIDs, rounds, fileSize, **jobRequirements).rv()
+               for _ in range(workers)]
+    return job.addFollowOnJobFn(_identity, results, **jobRequirements).rv()
+
+
+def _worker(job, fileIDs, rounds, fileSize):
+    """
+    :return: the number of cache operations made, the time they took and the time at which they
+             started and ended
+    :rtype: (int, float, float, float)
+    """
+    operations = 0
+    startTime = time.time()
+    for _ in range(rounds):
+        for fileID in fileIDs:
+            job.fileStore.readGlobalFile(fileID)
+            job.fileStore.deleteLocalFile(fileID)
+            operations += 2
+        _writeFile(job, fileSize)
+        operations += 1
+    endTime = time.time()
+    return operations, endTime - startTime, startTime, endTime
+
+
+def _identity(job, value):
+    return value
+
+
+def runBenchmark(workers, files, rounds, options, fileSize=1024):
+    """
+    Runs the given number of concurrent workers against the cache.
+
+    :param int workers: the number of concurrent workers
+    :param int files: the number of files shared by the workers
+    :param int rounds: the number of times each worker reads all of the shared files
+    :param options: the options to run the workflow with. The job store must not exist yet.
+    :param int fileSize: the size of each file, in bytes
+
+    :rtype: BenchmarkResult
+    """
+    with Toil(options) as toil:
+        results = toil.start(Job.wrapJobFn(_setUp, workers, files, rounds, fileSize,
+                                           **jobRequirements))
+    operations = sum(result[0] for result in results)
+    wallTime = max(result[3] for result in results) - min(result[2] for result in results)
+    return BenchmarkResult(workers=workers, operations=operations, wallTime=wallTime,
+                           operationsPerSecond=operations / wallTime,
+                           meanLatency=sum(result[1] for result in results) / operations)
+
+
+def formatResult(result):
+    """
+    :param BenchmarkResult result:
+
+    :rtype: str
+    """
+    return ('%i workers made %i cache operations in %.2f s: %.1f operations/s, %.2f ms mean '
+            'latency' % (result.workers, result.operations, result.wallTime,
+                         result.operationsPerSecond, result.meanLatency * 1000))
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    Job.Runner.addToilOptions(parser)
+    parser.add_argument('--workers', type=int, default=8,
+                        help='The number of concurrent workers. default=%(default)s')
+    parser.add_argument('--files', type=int, default=10,
+                        help='The number of files shared by the workers. default=%(default)s')
+    parser.add_argument('--rounds', type=int, default=20,
+                        help='The number of times each worker reads all of the shared files. '
+                             'default=%(default)s')
+    options = parser.parse_args()
+    print(formatResult(runBenchmark(options.workers, options.files, options.rounds, options)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+# Copyright (C) 2015-2016 Regents of the University of California
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import absolute_import
+
+import logging
+
+from toil.job import Job
+from toil.test import ToilTest
+from toil.test.benchmarks.cacheBenchmark import runBenchmark, formatResult
+
+log = logging.getLogger(__name__)
+
+
+class CacheBenchmarkTest(ToilTest):
+    """
+    Runs a small version of the cache contention benchmark.
+    """
+
+    def testConcurrentWorkers(self):
+        workers, files, rounds = 3, 2, 2
+        options = Job.Runner.getDefaultOptions(self._getTestJobStorePath())
+        options.workDir = self._createTempDir()
+        result = runBenchmark(workers, files, rounds, options)
+        self.assertEqual(result.workers, workers)
+        self.assertEqual(result.operations, workers * rounds * (2 * files + 1))
+        self.assertTrue(result.operationsPerSecond > 0)
+        self.assertTrue(result.meanLatency > 0)
+        log.info('Cache benchmark result: %s', formatResult(result))
@@ -0,0 +1,303 @@
+# Copyright (C) 2015-2016 Regents of the University of California
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Measures the throughput of the leader by running synthetic workflows of different shapes against a
+file job store. For each shape, reports the number of jobs run per second, the CPU time used by
+the leader process, the number of job store operations made by the leader process per job and the
+peak resident size of the leader process.
+
+Usage: python -m toil.test.benchmarks.leaderBenchmark [--shapes SHAPE ...] [--size N] DIRECTORY
+
+Each workflow gets its own job store in the given directory. Unless another batch system is
+selected with --batchSystem, the jobs run in the leader process on the in-process batch system
+such that the cost of spawning workers doesn't hide that of the leader. Note that the leader's CPU
+time then includes that of the jobs, which do nothing.
+"""
+from __future__ import absolute_import, print_function
+
+import logging
+import multiprocessing
+import os
+import resource
+import threading
+import time
+import traceback
+from argparse import ArgumentParser
+from collections import Counter, OrderedDict, namedtuple
+from copy import copy
+from functools import wraps
+
+from toil.common import Toil
+from toil.job import Job
+
+log = logging.getLogger(__name__)
+
+# Small enough for many jobs to run at once on a single core
+jobRequirements = dict(cores=0.1, memory='10M', disk='1M')
+
+# The job store operations counted by countJobStoreOperations(). Reading and writing stats and
+# logging are left out because the leader polls for them at a fixed rate.
+jobStoreOperations = ('create', 'exists', 'load', 'loadMany', 'update', 'updateMany', 'delete',
+                      'deleteMany', 'jobs', 'writeFile', 'writeFileStream',
+                      'getEmptyFileStoreID', 'readFile', 'readFileStream', 'deleteFile',
+                      'fileExists', 'updateFile', 'updateFileStream', 'writeSharedFileStream',
+                      'readSharedFileStream')
+
+BenchmarkResult = namedtuple('BenchmarkResult', (
+    'shape',
+    # The number of jobs in the workflow, including service jobs
+    'jobs',
+    # The return value of the workflow
+    'returnValue',
+    # The wall-clock time the workflow took, in seconds
+    'wallTime',
+    'jobsPerSecond',
+    # The CPU time used by the leader process while running the workflow, in seconds
+    'leaderCpuTime',
+    # The number of job store operations made by the leader process, per job
+    'jobStoreOpsPerJob',
+    # The peak resident size of the leader process, in bytes
+    'peakMemory'))
+
+
+def _noOp(job):
+    pass
+
+
+def _identity(job, value):
+    return value
+
+
+def _sum(job, values):
+    return sum(values)
+
+
+def _extendChain(job, remaining):
+    if remaining > 0:
+        # Requiring more memory than this job keeps the worker from running the successor itself,
+        # so each link of the chain goes through the leader
+        requirements = dict(jobRequirements, memory=job.memory + 1)
+        job.addChildJobFn(_extendChain, remaining - 1, **requirements)
+
+
+def _fanInPromises(job, size):
+    values = [job.addChildJobFn(_identity, i, **jobRequirements).rv() for i in range(size)]
+    return job.addFollowOnJobFn(_sum, values, **jobRequirements).rv()
+
+
+class _NoOpService(Job.Service):
+    def start(self, job):
+        return None
+
+    def stop(self, job):
+        pass
+
+
+def fanOut(size):
+    """
+    A root job with the given number of children.
+
+    :rtype: (toil.job.Job, int)
+    :return: the root job of the workflow and the number of jobs in it
+    """
+    rootJob = Job.wrapJobFn(_noOp, **jobRequirements)
+    for _ in range(size):
+        rootJob.addChildJobFn(_noOp, **jobRequirements)
+    return rootJob, size + 1
+
+
+def chain(size):
+    """
+    A chain of the given number of jobs, each of which adds the next one when it runs.
+    """
+    return Job.wrapJobFn(_extendChain, size - 1, **jobRequirements), size
+
+
+def diamond(size, width=10):
+    """
+    A sequence of the given number of diamonds. In each diamond, a job has the given number of
+    children, all of which have the same single child.
+    """
+    rootJob = top = Job.wrapJobFn(_noOp, **jobRequirements)
+    for _ in range(size):
+        bottom = Job.wrapJobFn(_noOp, **jobRequirements)
+        for _ in range(width):
+            top.addChildJobFn(_noOp, **jobRequirements).addChild(bottom)
+        top = bottom
+    return rootJob, size * (width + 1) + 1
+
+
+def promises(size):
+    """
+    A job with the given number of children, whose return values are promised to a follow-on that
+    sums them up.
+    """
+    return Job.wrapJobFn(_fanInPromises, size, **jobRequirements), size + 2
+
+
+def services(size):
+    """
+    A sequence of the given number of jobs, each of which hosts a service.
+    """
+    rootJob = previous = Job.wrapJobFn(_noOp, **jobRequirements)
+    for _ in range(size):
+        host = Job.wrapJobFn(_noOp, **jobRequirements)
+        host.addService(_NoOpService(**jobRequirements))
+        previous.addFollowOn(host)
+        previous = host
+    return rootJob, 2 * size + 1
+
+
+shapes = OrderedDict((f.__name__, f) for f in (fanOut, chain, diamond, promises, services))
+
+defaultSizes = dict(fanOut=1000, chain=100, diamond=20, promises=1000, services=10)
+
+
+def countJobStoreOperations(jobStore):
+    """
+    Instruments the given job store such that the calls to it of the operations in
+    jobStoreOperations are counted. Calls made by the job store to itself are not counted.
+
+    :param toil.jobStores.abstractJobStore.AbstractJobStore jobStore: the job store to instrument
+
+    :return: a counter that maps the name of each operation to the number of calls of it so far
+    :rtype: collections.Counter
+    """
+    counts = Counter()
+    lock = threading.Lock()
+    local = threading.local()
+
+    def instrument(name, method):
+        @wraps(method)
+        def wrapper(*args, **kwargs):
+            depth = getattr(local, 'depth', 0)
+            if depth == 0:
+                with lock:
+                    counts[name] += 1
+            local.depth = depth + 1
+            try:
+                return method(*args, **kwargs)
+            finally:
+                local.depth = depth
+        return wrapper
+
+    for name in jobStoreOperations:
+        setattr(jobStore, name, instrument(name, getattr(jobStore, name)))
+    return counts
+
+
+def runBenchmark(shape, size, options):
+    """
+    Runs a workflow of the given shape and size in this process.
+
+    :param str shape: the name of the shape, one of the keys of shapes
+    :param int size: the size of the workflow, see the function generating the shape
+    :param options: the options to run the workflow with. The job store must not exist yet.
+
+    :rtype: BenchmarkResult
+    """
+    rootJob, numJobs = shapes[shape](size)
+    with Toil(options) as toil:
+        counts = countJobStoreOperations(toil._jobStore)
+        startTime = time.time()
+        startCpuTime = _getCpuTime()
+        returnValue = toil.start(rootJob)
+        leaderCpuTime = _getCpuTime() - startCpuTime
+        wallTime = time.time() - startTime
+    # On Linux, ru_maxrss is in KiB
+    peakMemory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return BenchmarkResult(shape=shape, jobs=numJobs, returnValue=returnValue,
+                           wallTime=wallTime, jobsPerSecond=numJobs / wallTime,
+                           leaderCpuTime=leaderCpuTime,
+                           jobStoreOpsPerJob=float(sum(counts.values())) / numJobs,
+                           peakMemory=peakMemory)
+
+
+def runBenchmarkInChildProcess(shape, size, options):
+    """
+    Like :func:`runBenchmark` but runs the workflow in a new child process, so that the peak
+    resident size is that of the workflow alone.
+
+    :rtype: BenchmarkResult
+    """
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_runBenchmarkAndPut,
+                                      args=(queue, shape, size, options))
+    process.start()
+    try:
+        result, error = queue.get()
+    finally:
+        process.join()
+    if error is not None:
+        raise RuntimeError("Benchmark of shape '%s' failed:\n%s" % (shape, error))
+    return result
+
+
+def _runBenchmarkAndPut(queue, shape, size, options):
+    try:
+        queue.put((runBenchmark(shape, size, options), None))
+    except:
+        queue.put((None, traceback.format_exc()))
+
+
+def _getCpuTime():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def formatResults(results):
+    """
+    :param list[BenchmarkResult] results:
+
+    :return: a table of the given results
+    :rtype: str
+    """
+    header = ('shape', 'jobs', 'jobs/s', 'leader CPU (s)', 'job store ops/job', 'peak RSS (MiB)')
+    rows = [header] + [(result.shape,
+                        '%i' % result.jobs,
+                        '%.1f' % result.jobsPerSecond,
+                        '%.2f' % result.leaderCpuTime,
+                        '%.1f' % result.jobStoreOpsPerJob,
+                        '%.1f' % (result.peakMemory / 2.0 ** 20)) for result in results]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+    return '\n'.join('  '.join(cell.rjust(width) for cell, width in zip(row, widths))
+                     for row in rows)
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    Job.Runner.addToilOptions(parser)
+    parser.set_defaults(batchSystem='inProcess')
+    parser.add_argument('--shapes', nargs='+', choices=list(shapes), default=list(shapes),
+                        help='The shapes of the workflows to run. default=all of them')
+    parser.add_argument('--size', type=int, default=None,
+                        help='The size of each workflow. default=%s' % defaultSizes)
+    options = parser.parse_args()
+    name, directory = Toil.parseLocator(options.jobStore)
+    if name != 'file':
+        parser.error('The job store must be a directory.')
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    results = []
+    for shape in options.shapes:
+        shapeOptions = copy(options)
+        shapeOptions.jobStore = Toil.buildLocator('file', os.path.join(directory, shape))
+        size = defaultSizes[shape] if options.size is None else options.size
+        results.append(runBenchmarkInChildProcess(shape, size, shapeOptions))
+    print(formatResults(results))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+# Copyright (C) 2015-2016 Regents of the University of California
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import absolute_import
+
+import logging
+
+from toil.job import Job
+from toil.test import ToilTest
+from toil.test.benchmarks.leaderBenchmark import (shapes,
+                                                  runBenchmarkInChildProcess,
+                                                  formatResults)
+
+log = logging.getLogger(__name__)
+
+
+class LeaderBenchmarkTest(ToilTest):
+    """
+    Runs small versions of the workflows of the leader benchmark.
+    """
+
+    size = 3
+
+    def testShapes(self):
+        results = []
+        for shape in shapes:
+            options = Job.Runner.getDefaultOptions(self._getTestJobStorePath())
+            options.workDir = self._createTempDir()
+            options.batchSystem = 'inProcess'
+            result = runBenchmarkInChildProcess(shape, self.size, options)
+            self.assertEqual(result.shape, shape)
+            self.assertTrue(result.jobs >= self.size)
+            self.assertTrue(result.jobsPerSecond > 0)
+            self.assertTrue(result.leaderCpuTime > 0)
+            self.assertTrue(result.jobStoreOpsPerJob > 0)
+            self.assertTrue(result.peakMemory > 0)
+            results.append(result)
+        self.assertEqual(results[list(shapes).index('promises')].returnValue,
+                         sum(range(self.size)))
+        log.info('Leader benchmark results:\n%s', formatResults(results))
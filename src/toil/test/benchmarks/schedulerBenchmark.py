@@ -0,0 +1,110 @@
+# Copyright (C) 2015-2016 Regents of the University of California
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Measures how well the single-machine batch system packs jobs of mixed sizes onto the cores of
+this machine. Issues a random mix of small jobs that need a fraction of a core and large jobs
+that need most of the cores, all of which sleep, and reports the time it took to run all of
+them, the scheduler's average core utilization and the time jobs spent waiting for resources.
+
+Usage: python -m toil.test.benchmarks.schedulerBenchmark [--jobs N] [--largeFraction F]
+       [--maxCores N] [--seed N]
+"""
+from __future__ import absolute_import, division, print_function
+
+import multiprocessing
+import random
+import time
+from argparse import ArgumentParser
+from uuid import uuid4
+
+from toil.batchSystems.singleMachine import SingleMachineBatchSystem
+from toil.common import Config
+from toil.job import JobNode
+
+
+def mixedJobs(numJobs, largeFraction, maxCores, seed=None):
+    """
+    Generates the requirements and durations of a random mix of small and large jobs.
+
+    :param float largeFraction: the fraction of the jobs that are large
+
+    :return: the cores required by each job and the number of seconds it sleeps
+    :rtype: list[(float, float)]
+    """
+    rng = random.Random(seed)
+    jobs = []
+    for _ in range(numJobs):
+        if rng.random() < largeFraction:
+            jobs.append((max(1, maxCores - 1), rng.uniform(1.0, 2.0)))
+        else:
+            jobs.append((rng.choice((0.1, 0.5, 1)), rng.uniform(0.1, 0.5)))
+    return jobs
+
+
+def runMixedJobs(jobs, maxCores):
+    """
+    Runs the given jobs on a new single-machine batch system.
+
+    :param list[(float, float)] jobs: see :func:`mixedJobs`
+
+    :return: the time it took to run all jobs, in seconds, and the scheduler statistics of the
+             batch system, see :meth:`SingleMachineBatchSystem.getSchedulerStats`
+    :rtype: (float, dict)
+    """
+    config = Config()
+    config.workflowID = str(uuid4())
+    batchSystem = SingleMachineBatchSystem(config, maxCores=maxCores, maxMemory=int(1e9),
+                                           maxDisk=int(1e9))
+    try:
+        startTime = time.time()
+        for i, (cores, duration) in enumerate(jobs):
+            jobNode = JobNode(command='sleep %f' % duration, jobName='job%i' % i, unitName=None,
+                              jobStoreID=str(i),
+                              requirements=dict(cores=cores, memory=int(1e6), disk=int(1e6),
+                                                preemptable=False))
+            batchSystem.issueBatchJob(jobNode)
+        for _ in jobs:
+            update = batchSystem.getUpdatedBatchJob(maxWait=3600)
+            assert update is not None and update[1] == 0
+        makespan = time.time() - startTime
+        return makespan, batchSystem.getSchedulerStats()
+    finally:
+        batchSystem.shutdown()
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--jobs', type=int, default=200,
+                        help='The number of jobs to run. default=%(default)s')
+    parser.add_argument('--largeFraction', type=float, default=0.1,
+                        help='The fraction of the jobs that need most of the cores. '
+                             'default=%(default)s')
+    parser.add_argument('--maxCores', type=int, default=multiprocessing.cpu_count(),
+                        help='The number of cores the batch system may use. default=%(default)s')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='The seed of the random mix of jobs. default=%(default)s')
+    options = parser.parse_args()
+    jobs = mixedJobs(options.jobs, options.largeFraction, options.maxCores, options.seed)
+    makespan, stats = runMixedJobs(jobs, options.maxCores)
+    # The time it would take if the cores were always fully used
+    idealTime = sum(cores * duration for cores, duration in jobs) / options.maxCores
+    print('jobs: %i, time: %.1fs, lower bound: %.1fs' % (len(jobs), makespan, idealTime))
+    print('core utilization: %.1f%%' % (100 * stats['coreUtilization']))
+    print('queue wait: %.2fs on average, %.2fs at most' % (stats['meanQueueWait'],
+                                                          stats['maxQueueWait']))
+
+
+if __name__ == '__main__':
+    main()
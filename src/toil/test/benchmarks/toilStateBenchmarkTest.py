@@ -0,0 +1,86 @@
+# Copyright (C) 2015-2016 Regents of the University of California
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import absolute_import
+
+import logging
+import sys
+import time
+import uuid
+
+from toil.common import Toil
+from toil.job import Job, JobNode
+from toil.jobGraph import JobGraph
+from toil.lib.bioio import getTotalCpuTimeAndMemoryUsage
+from toil.test import ToilTest, integrative
+from toil.toilState import ToilState
+
+log = logging.getLogger(__name__)
+
+
+@integrative
+class ToilStateBenchmarkTest(ToilTest):
+    """
+    Measures the time and memory it takes the leader to build the state of a large workflow.
+    """
+
+    numJobs = 100000
+
+    def setUp(self):
+        super(ToilStateBenchmarkTest, self).setUp()
+        options = Job.Runner.getDefaultOptions(self._getTestJobStorePath())
+        self.toil = Toil(options)
+        self.toil.__enter__()
+
+    def tearDown(self):
+        self.toil.__exit__(None, None, None)
+        self.toil._jobStore.destroy()
+        super(ToilStateBenchmarkTest, self).tearDown()
+
+    def testToilStateMemory(self):
+        numJobs = self.numJobs
+        before = getTotalCpuTimeAndMemoryUsage()[1]
+        start = time.time()
+        jobCache = {}
+        rootJob = makeJob(predecessorNumber=0)
+        # Make the root job look like one whose successors are to be run
+        rootJob.command = None
+        successors = []
+        for _ in range(numJobs):
+            job = makeJob(predecessorNumber=1)
+            jobCache[job.jobStoreID] = job
+            successors.append(JobNode.fromJobGraph(job))
+        rootJob.stack.append(successors)
+        state = ToilState(jobStore=self.toil._jobStore, rootJob=rootJob, jobCache=jobCache)
+        elapsed = time.time() - start
+        self.assertEquals(len(state.updatedJobs), numJobs)
+        # The size of the job objects themselves, excluding the values of their attributes
+        objects = list(jobCache.values()) + successors
+        objectSize = sum(sys.getsizeof(o) for o in objects)
+        # The peak resident size of this process in KiB, only meaningful if the state is the
+        # largest data structure it has built so far
+        increase = getTotalCpuTimeAndMemoryUsage()[1] - before
+        log.info('Building the state of %i jobs took %.2fs. The job graphs and job nodes take '
+                 'up %i bytes per job. The peak resident size increased by %i bytes per job.',
+                 numJobs, elapsed, objectSize / numJobs, increase * 1024 / numJobs)
+
+
+def makeJob(predecessorNumber):
+    """
+    :rtype: JobGraph, a job graph with typical requirements and a random ID
+    """
+    return JobGraph(command='_toil ' + uuid.uuid4().hex, memory=2 ** 31, cores=1,
+                    disk=2 ** 31, preemptable=False, jobStoreID=uuid.uuid4().hex,
+                    remainingRetryCount=1, predecessorNumber=predecessorNumber,
+                    jobName='job', unitName=None)
@@ -0,0 +1,88 @@
+# Copyright (C) 2015-2016 Regents of the University of California
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compares the number of jobs per second the single-machine batch system runs with a new process
+for each worker to the number it runs with a pool of worker processes (see --workerPoolSize).
+The workflows are those of the leader benchmark.
+
+Usage: python -m toil.test.benchmarks.workerPoolBenchmark [--shapes SHAPE ...] [--size N]
+       [--workerPoolSize N] DIRECTORY
+"""
+from __future__ import absolute_import, print_function
+
+import multiprocessing
+import os
+from argparse import ArgumentParser
+from copy import copy
+
+from toil.common import Toil
+from toil.job import Job
+from toil.test.benchmarks.leaderBenchmark import (defaultSizes,
+                                                  formatResults,
+                                                  runBenchmarkInChildProcess)
+
+# Workflows of many jobs that can run at the same time and of jobs that run one after the other
+defaultShapes = ('fanOut', 'chain')
+
+
+def compareModes(shape, size, options, workerPoolSize):
+    """
+    Runs a workflow of the given shape and size once without and once with a worker pool.
+
+    :param options: the options to run the workflows with. The job store must not exist yet.
+
+    :return: the result of the run without a pool followed by that of the run with one
+    :rtype: (toil.test.benchmarks.leaderBenchmark.BenchmarkResult,
+             toil.test.benchmarks.leaderBenchmark.BenchmarkResult)
+    """
+    name, directory = Toil.parseLocator(options.jobStore)
+    results = []
+    for mode, poolSize in (('processes', 0), ('pool', workerPoolSize)):
+        modeOptions = copy(options)
+        modeOptions.batchSystem = 'singleMachine'
+        modeOptions.workerPoolSize = poolSize
+        modeOptions.jobStore = Toil.buildLocator(name, directory + '-' + mode)
+        result = runBenchmarkInChildProcess(shape, size, modeOptions)
+        results.append(result._replace(shape='%s (%s)' % (shape, mode)))
+    return tuple(results)
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    Job.Runner.addToilOptions(parser)
+    parser.add_argument('--shapes', nargs='+', choices=list(defaultSizes),
+                        default=list(defaultShapes),
+                        help='The shapes of the workflows to run. default=%s' % list(defaultShapes))
+    parser.add_argument('--size', type=int, default=None,
+                        help='The size of each workflow. default=%s' % defaultSizes)
+    options = parser.parse_args()
+    if not options.workerPoolSize:
+        options.workerPoolSize = multiprocessing.cpu_count()
+    name, directory = Toil.parseLocator(options.jobStore)
+    if name != 'file':
+        parser.error('The job store must be a directory.')
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    results = []
+    for shape in options.shapes:
+        shapeOptions = copy(options)
+        shapeOptions.jobStore = Toil.buildLocator('file', os.path.join(directory, shape))
+        size = defaultSizes[shape] if options.size is None else options.size
+        results.extend(compareModes(shape, size, shapeOptions, int(options.workerPoolSize)))
+    print(formatResults(results))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+# Copyright (C) 2015-2016 Regents of the University of California
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import absolute_import
+
+import logging
+
+from toil.job import Job
+from toil.test import ToilTest
+from toil.test.benchmarks.workerPoolBenchmark import compareModes, defaultShapes
+from toil.test.benchmarks.leaderBenchmark import formatResults
+
+log = logging.getLogger(__name__)
+
+
+class WorkerPoolBenchmarkTest(ToilTest):
+    """
+    Runs small versions of the workflows of the worker pool benchmark.
+    """
+
+    size = 3
+
+    def testShapes(self):
+        results = []
+        for shape in defaultShapes:
+            options = Job.Runner.getDefaultOptions(self._getTestJobStorePath())
+            options.workDir = self._createTempDir()
+            withoutPool, withPool = compareModes(shape, self.size, options, workerPoolSize=2)
+            for result in withoutPool, withPool:
+                self.assertTrue(result.jobs >= self.size)
+                self.assertTrue(result.jobsPerSecond > 0)
+            results.extend((withoutPool, withPool))
+        log.info('Worker pool benchmark results:\n%s', formatResults(results))
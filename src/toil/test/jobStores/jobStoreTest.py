@@ -19,6 +19,7 @@ import hashlib
 import logging
 import threading
 import os
+import pickle
 import shutil
 import tempfile
 import time
@@ -31,7 +32,7 @@ from unittest import skip
 
 # Python 3 compatibility imports
 from six.moves.queue import Queue
-from six.moves import xrange, socketserver as SocketServer, SimpleHTTPServer
+from six.moves import xrange, socketserver as SocketServer, SimpleHTTPServer, StringIO
 from six import iteritems
 import six.moves.urllib.parse as urlparse
 from six.moves.urllib.request import urlopen, Request
@@ -49,6 +50,7 @@ from toil.jobStores.abstractJobStore import (AbstractJobStore,
                                              NoSuchFileException)
 from toil.jobStores.aws.utils import region_to_bucket_location
 from toil.jobStores.fileJobStore import FileJobStore
+from toil.toilState import ToilState
 from toil.test import (ToilTest,
                        needs_aws,
                        needs_azure,
@@ -647,6 +649,32 @@ class AbstractJobStoreTest:
                     hashOut.update(buf)
             self.assertEqual(hashIn.digest(), hashOut.digest())
 
+        def testLargeFileInParallel(self):
+            dirPath = self._createTempDir()
+            filePath = os.path.join(dirPath, 'large')
+            # Not a multiple of the part size so the last part is shorter
+            data = os.urandom(self._partSize() * 3 + 1)
+            with open(filePath, 'w') as f:
+                f.write(data)
+            job = self.master.create(self.arbitraryJob)
+            jobStoreFileID = self.master.writeFile(filePath, job.jobStoreID)
+            os.unlink(filePath)
+            self.master.readFileInParallel(jobStoreFileID, filePath,
+                                           partSize=self._partSize(), threads=2)
+            with open(filePath) as f:
+                self.assertEqual(f.read(), data)
+
+        def testUpdateFileInParts(self):
+            job = self.master.create(self.arbitraryJob)
+            jobStoreFileID = self.master.getEmptyFileStoreID(job.jobStoreID)
+            self.master.partSize = self.mpTestPartSize
+            # Not a multiple of the part size so the last part is shorter
+            for size in (1, self.mpTestPartSize * 3 + 1):
+                data = os.urandom(size)
+                self.master.updateFileInParts(jobStoreFileID, StringIO(data), threads=2)
+                with self.master.readFileStream(jobStoreFileID) as f:
+                    self.assertEqual(f.read(), data)
+
         def assertUrl(self, url):
             prefix, path = url.split(':', 1)
             if prefix == 'file':
@@ -690,6 +718,122 @@ class AbstractJobStoreTest:
             # Running with the cache should be faster.
             self.assertTrue(cacheTime <= noCacheTime)
 
+        def testTraverse(self):
+            master = self.master
+            rootJob = master.createRootJob(self.arbitraryJob)
+            children = [master.create(self.arbitraryJob) for _ in range(10)]
+            rootJob.stack.append([JobNode.fromJobGraph(child) for child in children])
+            # A chain of jobs below the first child, and a job missing from the job store
+            chain = [children[0]]
+            for _ in range(50):
+                job = master.create(self.arbitraryJob)
+                chain[-1].stack.append([JobNode.fromJobGraph(job)])
+                chain.append(job)
+            missingJob = master.create(self.arbitraryJob)
+            master.delete(missingJob.jobStoreID)
+            chain[-1].stack.append([JobNode.fromJobGraph(rootJob),
+                                    JobNode.fromJobGraph(missingJob)])
+            master.updateMany(chain)
+
+            def getSuccessorIDs(jobGraph):
+                return [jobNode.jobStoreID for jobs in jobGraph.stack for jobNode in jobs]
+
+            # Load the children with several threads
+            master.traversalBatchSize = 3
+            visitedJobs = list(master.traverse([rootJob], getSuccessorIDs))
+            # Jobs are visited breadth-first, once, and missing jobs are skipped
+            self.assertEquals([job.jobStoreID for job in [rootJob] + children + chain[1:]],
+                              [job.jobStoreID for job in visitedJobs])
+            jobCache = {}
+            with self.assertRaises(NoSuchJobException):
+                list(master.traverse([rootJob], getSuccessorIDs, jobCache=jobCache,
+                                     ignoreMissing=False))
+            self.assertEquals(set(job.jobStoreID for job in children + chain), set(jobCache))
+
+        def testCleanActiveJobsOnly(self):
+            master = self.master
+            rootJob = master.createRootJob(self.arbitraryJob)
+            laterJob, activeJob, finishedJob, previousJob, orphanJob = (
+                master.create(self.arbitraryJob) for _ in range(5))
+            rootJob.command = None
+            rootJob.stack = [[JobNode.fromJobGraph(laterJob)],
+                             [JobNode.fromJobGraph(activeJob), JobNode.fromJobGraph(finishedJob)],
+                             [JobNode.fromJobGraph(previousJob)]]
+            master.update(rootJob)
+            for job in laterJob, activeJob:
+                job.remainingRetryCount = 0
+                master.update(job)
+            for job in finishedJob, previousJob:
+                master.delete(job.jobStoreID)
+            jobCache = master.loadMany([rootJob.jobStoreID, activeJob.jobStoreID])
+            rootJob = master.clean(jobCache, activeJobsOnly=True)
+            # The finished job is removed from the stack
+            self.assertEquals([[laterJob.jobStoreID], [activeJob.jobStoreID]],
+                              [[jobNode.jobStoreID for jobNode in jobs] for jobs in rootJob.stack])
+            # Only the job that may have been issued is repaired
+            self.assertEquals(master.load(activeJob.jobStoreID).remainingRetryCount,
+                              master._defaultTryCount())
+            self.assertEquals(master.load(laterJob.jobStoreID).remainingRetryCount, 0)
+            # Orphans are kept
+            self.assertTrue(master.exists(orphanJob.jobStoreID))
+            master.clean()
+            self.assertFalse(master.exists(orphanJob.jobStoreID))
+            self.assertEquals(master.load(laterJob.jobStoreID).remainingRetryCount,
+                              master._defaultTryCount())
+
+        def testToilStateSnapshot(self):
+            master = self.master
+            self.assertIsNone(ToilState.readSnapshot(master))
+            rootJob = master.createRootJob(self.arbitraryJob)
+            children = [master.create(self.arbitraryJob) for _ in range(3)]
+            rootJob.command = None
+            rootJob.stack.append([JobNode.fromJobGraph(child) for child in children])
+            master.update(rootJob)
+            toilState = ToilState(master, rootJob)
+            toilState.writeSnapshot(master, issuedJobStoreIDs=['issued'])
+            self.assertEquals({job.jobStoreID for job in [rootJob] + children} | {'issued'},
+                              ToilState.readSnapshot(master))
+            # Jobs in the snapshot may have a different retry count than a restart would give them
+            self.config.retryCount += 1
+            self.assertIsNone(ToilState.readSnapshot(master))
+
+        def testBatchedJobOperations(self):
+            master = self.master
+            jobs = [master.create(self.arbitraryJob) for _ in range(30)]
+            jobStoreIDs = [job.jobStoreID for job in jobs]
+            # Missing jobs are omitted from the result
+            loadedJobs = master.loadMany(jobStoreIDs + ['missing'])
+            self.assertEquals(set(jobStoreIDs), set(loadedJobs.keys()))
+            for job in jobs:
+                self.assertEquals(job, loadedJobs[job.jobStoreID])
+            for job in jobs:
+                job.remainingRetryCount = 66
+            master.updateMany(jobs)
+            for job in master.loadMany(jobStoreIDs).values():
+                self.assertEquals(66, job.remainingRetryCount)
+            # Files associated with the deleted jobs go with them
+            fileID = master.getEmptyFileStoreID(jobStoreIDs[0])
+            master.deleteMany(jobStoreIDs[:20] + ['missing'])
+            self.assertFalse(master.fileExists(fileID))
+            self.assertEquals(set(jobStoreIDs[20:]), set(master.loadMany(jobStoreIDs).keys()))
+            # Deletion is idempotent
+            master.deleteMany(jobStoreIDs)
+            self.assertEquals({}, master.loadMany(jobStoreIDs))
+
+        def testJobSerialization(self):
+            master = self.master
+            job = master.create(self.arbitraryJob)
+            children = [master.create(self.arbitraryJob) for _ in range(20)]
+            job.stack.append([JobNode.fromJobGraph(child) for child in children])
+            job.predecessorsFinished.add(children[0].jobStoreID)
+            job.chainedJobs = [u'arbitrary']
+            master.update(job)
+            self.assertEquals(job.__getstate__(), master.load(job.jobStoreID).__getstate__())
+            # Jobs that can't be encoded compactly are pickled instead
+            job.filesToDelete.append(Config())
+            master.update(job)
+            self.assertIsInstance(master.load(job.jobStoreID).filesToDelete[0], Config)
+
         @skip("too slow")  # This takes a long time on the remote JobStores
         def testManyJobs(self):
             # Make sure we can store large numbers of jobs
@@ -828,6 +972,237 @@ class FileJobStoreTest(AbstractJobStoreTest.Test):
     def _cleanUpExternalStore(self, dirPath):
         shutil.rmtree(dirPath)
 
+    def testJobIndexCompaction(self):
+        master = self.master
+        rootJob = master.createRootJob(self.arbitraryJob)
+        children = [master.create(self.arbitraryJob) for _ in range(10)]
+        rootJob.stack.append(children[:5])
+        master.update(rootJob)
+        self.assertEquals({rootJob.jobStoreID} | {child.jobStoreID for child in children},
+                          set(master._jobIndex()))
+        # The orphaned children are deleted by clean() and subsequently dropped from the index
+        master.clean()
+        self.assertEquals({rootJob.jobStoreID} | {child.jobStoreID for child in children[:5]},
+                          set(master._jobIndex()))
+        self.assertLessEqual(len(master._jobIndexSegments()), master.numJobIndexSegments)
+        # New jobs are still indexed after the compaction
+        child = master.create(self.arbitraryJob)
+        self.assertIn(child.jobStoreID, {job.jobStoreID for job in master.jobs()})
+
+    def testJobIndexSegmentsAreShared(self):
+        numJobs = 3 * self.master.numJobIndexSegments
+        for _ in range(numJobs):
+            # Every worker that creates a job uses its own job store instance
+            worker = self._createJobStore()
+            worker.resume()
+            worker.create(self.arbitraryJob)
+            worker._closeJobIndexSegments()
+        self.assertEquals(numJobs, len(set(self.master._jobIndex())))
+        self.assertLessEqual(len(self.master._jobIndexSegments()),
+                             self.master.numJobIndexSegments)
+
+    def testJobIndexCompactionKeepsConcurrentlyIndexedJobs(self):
+        master = self.master
+        worker = self._createJobStore()
+        worker.resume()
+        # Make sure that both jobs are recorded in the same segment
+        master.numJobIndexSegments = worker.numJobIndexSegments = 1
+        rootJob = master.createRootJob(self.arbitraryJob)
+        workerJobs = [worker.create(self.arbitraryJob)]
+        threads = []
+        exists = master.exists
+
+        def existsWhileIndexing(jobStoreID):
+            # Another process records a job in the segment while it is being rewritten. It
+            # blocks on the lock held by the compaction and then finds the segment replaced.
+            if not threads:
+                threads.append(Thread(target=lambda: workerJobs.append(
+                    worker.create(self.arbitraryJob))))
+                threads[0].start()
+            return exists(jobStoreID)
+
+        master.exists = existsWhileIndexing
+        try:
+            master._compactJobIndex()
+        finally:
+            master.exists = exists
+        threads[0].join()
+        self.assertEquals(1, len(master._jobIndexSegments()))
+        self.assertEquals({rootJob.jobStoreID} | {job.jobStoreID for job in workerJobs},
+                          set(master._jobIndex()))
+
+    def testReadAllStatsAndLoggingOnce(self):
+        master = self.master
+        stats = []
+        master.writeStatsAndLogging('1')
+        self.assertEquals(1, master.readStatsAndLogging(lambda f: stats.append(f.read())))
+        master.writeStatsAndLogging('2')
+        stats = []
+        self.assertEquals(2, master.readStatsAndLogging(lambda f: stats.append(f.read()),
+                                                        readAll=True))
+        self.assertEquals(['1', '2'], sorted(stats))
+
+    def testMigrateLegacyLayout(self):
+        master = self.master
+        job = master.create(self.arbitraryJob)
+        fileID = master.writeFile(self._writeLocalFile('foo'), job.jobStoreID)
+        # Rearrange the job store so it looks like one created by an older version of Toil
+        legacyJobDir = os.path.join(master.tempFilesDir, 'A', 'b', 'jobabc')
+        legacyStatsDir = os.path.dirname(legacyJobDir)
+        shutil.move(master._getAbsPath(job.jobStoreID), legacyJobDir)
+        shutil.rmtree(master.jobIndexDir)
+        shutil.rmtree(master.statsDir)
+        for name, content in ('statsfoo', 'unread'), ('statsbar.new', 'read'):
+            with open(os.path.join(legacyStatsDir, name), 'w') as f:
+                f.write(content)
+        legacyJobStoreID = master._getRelativePath(legacyJobDir)
+        legacyFileID = os.path.join(legacyJobStoreID, os.path.relpath(fileID, job.jobStoreID))
+        job.jobStoreID = legacyJobStoreID
+        master.update(job)
+
+        worker = self._createJobStore()
+        worker.resume()
+        self.assertEquals([legacyJobStoreID], [j.jobStoreID for j in worker.jobs()])
+        with worker.readFileStream(legacyFileID) as f:
+            self.assertEquals('foo', f.read())
+        stats = []
+        self.assertEquals(1, worker.readStatsAndLogging(lambda f: stats.append(f.read())))
+        self.assertEquals(['unread'], stats)
+        self.assertEquals(2, worker.readStatsAndLogging(lambda f: stats.append(f.read()),
+                                                        readAll=True))
+        self.assertEquals(['read', 'unread', 'unread'], sorted(stats))
+
+    def testLoadPickledJob(self):
+        # Job stores created by older versions of Toil hold pickled jobs
+        master = self.master
+        job = master.create(self.arbitraryJob)
+        job.remainingRetryCount = 42
+        with open(master._getJobFileName(job.jobStoreID), 'w') as f:
+            pickle.dump(job, f)
+        self.assertEquals(job, master.load(job.jobStoreID))
+
+    def _writeLocalFile(self, content):
+        fd, path = tempfile.mkstemp(dir=self._createTempDir())
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+        return path
+
+    def testJournalMetadataOps(self):
+        # Compare the number of metadata operations per job with and without the journal, for
+        # a worker running a chain of jobs that updates the job graph several times
+        updatesPerJob = 10
+        numJobs = 20
+        opsPerJob = {}
+        for journal in (False, True):
+            self.config.jobStoreJournal = journal
+            self.master.writeConfig()
+            leader = self._createJobStore()
+            leader.resume()
+            jobStoreIDs = [leader.create(self.arbitraryJob).jobStoreID for _ in range(numJobs)]
+            counters = [patch.object(os, name, wraps=getattr(os, name))
+                        for name in ('rename', 'remove', 'unlink', 'listdir', 'mkdir', 'stat')]
+            counters.append(patch.object(os.path, 'isfile', wraps=os.path.isfile))
+            counters.append(patch('toil.jobStores.fileJobStore.open', wraps=open, create=True))
+            mocks = [counter.start() for counter in counters]
+            try:
+                worker = self._createJobStore()
+                worker.resume()
+                for jobStoreID in jobStoreIDs:
+                    job = worker.load(jobStoreID)
+                    for i in range(updatesPerJob):
+                        job.remainingRetryCount = i
+                        worker.update(job)
+                # What happens when the worker process exits
+                if journal:
+                    worker._closeJournal()
+                for job in leader.loadMany(jobStoreIDs).values():
+                    self.assertEquals(updatesPerJob - 1, job.remainingRetryCount)
+            finally:
+                for counter in counters:
+                    counter.stop()
+            opsPerJob[journal] = sum(mock.call_count for mock in mocks) / float(numJobs)
+        logger.info("Metadata operations per job with %i updates each: %f without journal, "
+                    "%f with journal.", updatesPerJob, opsPerJob[False], opsPerJob[True])
+        self.assertTrue(opsPerJob[True] < opsPerJob[False])
+
+
+class JournaledFileJobStoreTest(FileJobStoreTest):
+    def _createConfig(self):
+        config = super(JournaledFileJobStoreTest, self)._createConfig()
+        config.jobStoreJournal = True
+        return config
+
+    def testJournalReplay(self):
+        master = self.master
+        master.journalCompactionInterval = 3600
+        job = master.createRootJob(self.arbitraryJob)
+        job.remainingRetryCount = 42
+        master.update(job)
+        job.chainedJobs = ['foo']
+        master.update(job)
+        # Another process sees the pending updates before they are compacted ...
+        worker = self._createJobStore()
+        worker.journalCompactionInterval = 3600
+        worker.resume()
+        self.assertEquals(job, worker.load(job.jobStoreID))
+        # ... and can continue to update the job
+        job = worker.load(job.jobStoreID)
+        job.remainingRetryCount = 43
+        worker.update(job)
+        worker._compactJournal()
+        self.assertEquals(job, master.load(job.jobStoreID))
+        # Compacting the older updates of the first process doesn't undo the newer ones
+        master._compactJournal()
+        self.assertEquals(job, master.load(job.jobStoreID))
+        self.assertEquals([], os.listdir(master.journalDir))
+        # A process that crashes before compacting leaves its journal behind ...
+        job.chainedJobs.append('bar')
+        worker.update(job)
+        worker._closeJournal(compact=False)
+        self.assertEquals(job, master.load(job.jobStoreID))
+        # ... which is compacted when the job store is cleaned
+        master.clean()
+        master._compactJournal()
+        self.assertEquals([], os.listdir(master.journalDir))
+        self.assertEquals(['g', 'job'], sorted(os.listdir(master._getAbsPath(job.jobStoreID))))
+        self.assertEquals(['foo', 'bar'], master.load(job.jobStoreID).chainedJobs)
+
+    def testUpdateAfterReload(self):
+        master = self.master
+        master.journalCompactionInterval = 3600
+        job = master.createRootJob(self.arbitraryJob)
+        job.remainingRetryCount = 42
+        master.update(job)
+        # Another process updates the job while the first one still has a pending update ...
+        worker = self._createJobStore()
+        worker.journalCompactionInterval = 3600
+        worker.resume()
+        job = worker.load(job.jobStoreID)
+        job.chainedJobs = ['foo']
+        worker.update(job)
+        job.chainedJobs.append('bar')
+        worker.update(job)
+        # ... so the update after reloading the job must not reuse one of the worker's versions
+        job = master.load(job.jobStoreID)
+        job.remainingRetryCount -= 1
+        master.update(job)
+        for jobStore in (master, worker, self._createJobStore()):
+            self.assertEquals(job, jobStore.load(job.jobStoreID))
+        worker._compactJournal()
+        master._compactJournal()
+        job = master.load(job.jobStoreID)
+        self.assertEquals(41, job.remainingRetryCount)
+        self.assertEquals(['foo', 'bar'], job.chainedJobs)
+
+    def testJournaledJobDeletion(self):
+        master = self.master
+        job = master.create(self.arbitraryJob)
+        master.update(job)
+        master.delete(job.jobStoreID)
+        master._compactJournal()
+        self.assertFalse(master.exists(job.jobStoreID))
+        self.assertEquals([], os.listdir(master.journalDir))
+
 
 @experimental
 @needs_google
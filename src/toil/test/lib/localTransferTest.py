@@ -0,0 +1,67 @@
+# Copyright (C) 2015-2016 Regents of the University of California
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import absolute_import
+
+import os
+import shutil
+
+from toil.lib.localTransfer import (copyFile, copyFileObj, REFLINK, LINK, KERNEL,
+                                    USERSPACE)
+from toil.test import ToilTest
+
+
+class LocalTransferTest(ToilTest):
+
+    def setUp(self):
+        super(LocalTransferTest, self).setUp()
+        self.tempDir = self._createTempDir()
+        self.srcPath = os.path.join(self.tempDir, 'src')
+        self.data = os.urandom(3 * 1024 * 1024 + 1)
+        with open(self.srcPath, 'wb') as f:
+            f.write(self.data)
+
+    def _assertCopied(self, dstPath):
+        with open(dstPath, 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+
+    def testCopyFile(self):
+        dstPath = os.path.join(self.tempDir, 'dst')
+        # The destination is overwritten
+        with open(dstPath, 'w') as f:
+            f.write('old content that is longer than nothing')
+        self.assertIn(copyFile(self.srcPath, dstPath), (REFLINK, KERNEL, USERSPACE))
+        self._assertCopied(dstPath)
+        self.assertFalse(os.path.samefile(self.srcPath, dstPath))
+
+    def testCopyFileAllowingLink(self):
+        dstPath = os.path.join(self.tempDir, 'dst')
+        how = copyFile(self.srcPath, dstPath, allowLink=True)
+        self._assertCopied(dstPath)
+        if how == LINK:
+            self.assertTrue(os.path.samefile(self.srcPath, dstPath))
+            # Copying a file onto a link to it would truncate both
+            self.assertRaises(shutil.Error, copyFile, self.srcPath, dstPath)
+        else:
+            self.assertEqual(how, REFLINK)
+            self.assertFalse(os.path.samefile(self.srcPath, dstPath))
+
+    def testCopyFileObj(self):
+        dstPath = os.path.join(self.tempDir, 'dst')
+        with open(self.srcPath, 'rb') as src:
+            # The copy is complete even if the source is removed in the meantime
+            os.unlink(self.srcPath)
+            with open(dstPath, 'wb') as dst:
+                self.assertIn(copyFileObj(src, dst), (REFLINK, KERNEL, USERSPACE))
+        self._assertCopied(dstPath)
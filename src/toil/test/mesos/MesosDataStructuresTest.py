@@ -21,7 +21,7 @@ from toil.test import ToilTest, needs_mesos
 @needs_mesos
 class DataStructuresTest(ToilTest):
 
-    def _getJob(self, cores=1, memory=1000, disk=5000, preemptable=True):
+    def _getJob(self, cores=1, memory=1000, disk=5000, preemptable=True, inputs=()):
         from toil.batchSystems.mesos import ResourceRequirement
         from toil.batchSystems.mesos import ToilJob
 
@@ -33,6 +33,7 @@ class DataStructuresTest(ToilTest):
                       command="do nothing",
                       userScript=None,
                       environment=None,
+                      inputs=inputs,
                       workerCleanupInfo=None)
         return job
 
@@ -76,3 +77,23 @@ class DataStructuresTest(ToilTest):
         self.assertEqual(len(jobQueue.jobIDs()), testJobs)
         # Ensure FIFO
         self.assertIs(testJob, tmpJob)
+
+    def testJobQueuePrefersCachedInputs(self):
+        from toil.batchSystems.mesos import JobQueue
+        from toil.lib.bloomFilter import BloomFilter
+        jobQueue = JobQueue()
+        jobs = [self._getJob(inputs=[str(i)]) for i in range(10)]
+        for job in jobs:
+            jobQueue.insertJob(job, job.resources)
+        jobType = jobs[0].resources
+        self.assertEqual(jobQueue.firstJobsOfType(jobType), jobs)
+        cachedFiles = BloomFilter(capacity=100)
+        cachedFiles.add('5')
+
+        def score(job):
+            return sum(fileStoreID in cachedFiles for fileStoreID in job.inputs)
+
+        # The job with the cached input is taken out of order, the others are still FIFO
+        self.assertIs(jobQueue.nextJobOfType(jobType, score), jobs[5])
+        self.assertIs(jobQueue.nextJobOfType(jobType, score), jobs[0])
+        self.assertIs(jobQueue.nextJobOfType(jobType), jobs[1])
@@ -17,11 +17,14 @@ from __future__ import print_function
 
 import filecmp
 from abc import abstractmethod, ABCMeta
+from hashlib import sha256
 from struct import pack, unpack
 from uuid import uuid4
 
 from toil.job import Job
-from toil.fileStore import IllegalDeletionCacheError, CachingFileStore
+from toil.common import Toil
+from toil.fileStore import (IllegalDeletionCacheError, CachingFileStore, evictionPolicies,
+                            NodeCache, FileID)
 from toil.test import ToilTest, needs_aws, needs_azure, needs_google, experimental
 from toil.leader import FailedJobsException
 from toil.jobStores.abstractJobStore import NoSuchFileException
@@ -32,6 +35,7 @@ import inspect
 import os
 import random
 import signal
+import subprocess
 import time
 import unittest
 
@@ -449,6 +453,111 @@ class hidden:
             super(hidden.AbstractNonCachingFileStoreTest, self).setUp()
             self.options.disableCaching = True
 
+        def testNodeCacheIsSharedByWorkflows(self):
+            """
+            Import the same file in two workflows that share a node cache and ensure the second
+            workflow gets the file from the node cache, even after it was removed from the job
+            store.
+            """
+            self.options.nodeCacheDir = self._createTempDir(purpose='nodeCache')
+            srcFile = os.path.join(self._createTempDir(), 'reference')
+            with open(srcFile, 'w') as f:
+                f.write('reference data')
+            for removeFromJobStore in (False, True):
+                self.options.jobStore = self._getTestJobStore()
+                with Toil(self.options) as toil:
+                    fileID = toil.importFile('file://' + srcFile)
+                    self.assertEqual(fileID.contentKey, NodeCache.contentKeyForPath(srcFile))
+                    toil.start(Job.wrapJobFn(self._readReference, fileID, removeFromJobStore))
+
+        @staticmethod
+        def _readReference(job, fileID, removeFromJobStore):
+            if removeFromJobStore:
+                job.fileStore.jobStore.deleteFile(fileID)
+            with open(job.fileStore.readGlobalFile(fileID)) as f:
+                assert f.read() == 'reference data'
+
+        def testPrefetchInputs(self):
+            """
+            Declare a file written by the parent as the input of its child, via a promise, and
+            ensure the child gets the prefetched file.
+            """
+            parent = Job.wrapJobFn(self._writeInput)
+            parent.addChildJobFn(self._readInput, parent.rv()).addInputs(parent.rv())
+            Job.Runner.startToil(parent, self.options)
+
+        @staticmethod
+        def _writeInput(job):
+            with job.fileStore.writeGlobalFileStream() as (f, fileID):
+                f.write('input data')
+            return fileID
+
+        @staticmethod
+        def _readInput(job, fileID):
+            assert job._inputs == [fileID]
+            with open(job.fileStore.readGlobalFile(fileID)) as f:
+                assert f.read() == 'input data'
+            assert job.fileStore.prefetchStats['files'] == 1
+            # The prefetched file is handed over, so a second read downloads it again
+            with job.fileStore.readGlobalFileStream(fileID) as f:
+                assert f.read() == 'input data'
+
+        def testNodeCacheEviction(self):
+            """
+            Add files to a node cache that only fits one of them and ensure the least recently used
+            one is evicted and that a file larger than the node cache is read but not cached.
+            """
+            nodeCache = NodeCache(self._createTempDir(purpose='nodeCache'), maxSize=10,
+                                  policy=evictionPolicies['lru']())
+            localDir = self._createTempDir()
+
+            def read(content):
+                contentKey = sha256(content).hexdigest()
+                localFilePath = os.path.join(localDir, str(uuid4()))
+
+                def download(path):
+                    with open(path, 'w') as f:
+                        f.write(content)
+
+                wasCached = nodeCache.readFile(contentKey, localFilePath, download)
+                with open(localFilePath) as f:
+                    self.assertEqual(f.read(), content)
+                return wasCached
+
+            self.assertFalse(read('a' * 6))
+            self.assertTrue(read('a' * 6))
+            self.assertFalse(read('b' * 6))
+            self.assertTrue(read('b' * 6))
+            self.assertFalse(read('a' * 6))
+            self.assertFalse(read('c' * 20))
+            self.assertFalse(read('c' * 20))
+            self.assertTrue(read('a' * 6))
+
+        def testNodeCacheCopiesLinkedDownloads(self):
+            """
+            Add a file to the node cache with a download that hard-links it, like a file job store
+            on the same file system does, and ensure the node cache keeps a copy of its own.
+            """
+            nodeCache = NodeCache(self._createTempDir(purpose='nodeCache'), maxSize=100,
+                                  policy=evictionPolicies['lru']())
+            srcFile = os.path.join(self._createTempDir(), 'reference')
+            with open(srcFile, 'w') as f:
+                f.write('reference data')
+            contentKey = NodeCache.contentKeyForPath(srcFile)
+
+            def download(path):
+                os.unlink(path)
+                os.link(srcFile, path)
+
+            localFilePath = os.path.join(self._createTempDir(), 'local')
+            self.assertFalse(nodeCache.readFile(contentKey, localFilePath, download))
+            self.assertEqual(os.stat(srcFile).st_nlink, 1)
+            self.assertEqual(os.stat(nodeCache._filePath(contentKey)).st_nlink, 1)
+            with open(srcFile, 'w') as f:
+                f.write('modified')
+            with nodeCache.openFile(contentKey) as f:
+                self.assertEqual(f.read(), 'reference data')
+
     class AbstractCachingFileStoreTest(AbstractFileStoreTest):
         """
         Abstract tests for the the various cache-related functions in
@@ -539,6 +648,243 @@ class hidden:
                 assert cacheInfo.nlink == 0
                 assert cacheInfo.cached > 1
 
+        def testDeadJobIsRemovedFromCacheState(self):
+            """
+            Register a job whose process has died in the cache state and ensure that the next job
+            to start on the node removes it and returns its disk requirements to the cache.
+            """
+            A = Job.wrapJobFn(self._registerDeadJob)
+            B = Job.wrapJobFn(self._assertDeadJobRemoved, A.rv())
+            A.addChild(B)
+            Job.Runner.startToil(A, self.options)
+
+        @staticmethod
+        def _registerDeadJob(job):
+            """
+            :return: the work directory of the dead job
+            """
+            deadProcess = subprocess.Popen(['true'])
+            deadProcess.wait()
+            jobDir = job.fileStore.getLocalTempDir()
+            with job.fileStore._stateTransaction() as state:
+                job.fileStore._CacheState.addJob(state, 'deadJob', 'deadJob', 1024, jobDir,
+                                                 deadProcess.pid)
+                job.fileStore._CacheState.update(state, sigmaJob=1024)
+            return jobDir
+
+        @staticmethod
+        def _assertDeadJobRemoved(job, deadJobDir):
+            cacheInfo = job.fileStore._CacheState._load(job.fileStore.cacheStateFile)
+            assert 'deadJob' not in cacheInfo.jobState
+            assert not os.path.exists(deadJobDir)
+            # Only this job's requirements remain
+            assert cacheInfo.sigmaJob == cacheInfo.jobState[job.fileStore.jobID]['jobReqs']
+
+        def testEvictionPolicies(self):
+            """
+            Add a small and a large file to the eviction index of a new cache state, read the small
+            file once and then the large one twice and ensure each policy evicts in the expected
+            order.
+            """
+            expectedOrders = dict(lru=['small', 'large'], lfu=['small', 'large'],
+                                  gdsf=['large', 'small'])
+            for policyName, expectedOrder in expectedOrders.items():
+                policy = evictionPolicies[policyName]()
+                stateFile = os.path.join(self._createTempDir(), '_cacheState')
+                CachingFileStore._CacheState(dict(nlink=1, attemptNumber=0, total=100, cached=0,
+                                                  sigmaJob=0, cacheDir=None,
+                                                  inflation=0.0)).create(stateFile)
+                connection = CachingFileStore._CacheState.connect(stateFile)
+                try:
+                    with CachingFileStore._CacheState.transaction(connection) as state:
+                        CachingFileStore._CacheState.addCachedFile(state, 'large', 100, policy)
+                        CachingFileStore._CacheState.addCachedFile(state, 'small', 1, policy)
+                        for fileStoreID in ('small', 'large', 'large'):
+                            # Keep the access times of the two files apart
+                            time.sleep(0.01)
+                            CachingFileStore._CacheState.recordCacheHit(state, fileStoreID, policy)
+                        order = [fileStoreID for fileStoreID, _ in
+                                 CachingFileStore._CacheState.getCachedFiles(state)]
+                finally:
+                    connection.close()
+                self.assertEqual(order, expectedOrder, policyName)
+
+        def testCacheHitsAndMissesAreCounted(self):
+            """
+            Read a file that is not in the cache twice and ensure the first read is counted as a
+            miss and the second one as a hit.
+            """
+            A = Job.wrapJobFn(self._writeFileToJobStoreOnly)
+            B = Job.wrapJobFn(self._readFileTwice, A.rv())
+            A.addChild(B)
+            Job.Runner.startToil(A, self.options)
+
+        @staticmethod
+        def _writeFileToJobStoreOnly(job, withSize=False):
+            """
+            Write a file to the job store without adding it to the cache.
+
+            :param bool withSize: Whether to return the ID with the size of the file, which is
+                   needed to stream the file into the cache
+            """
+            testFile = job.fileStore.getLocalTempFile()
+            with open(testFile, 'w') as f:
+                f.write('data')
+            fileStoreID = job.fileStore.jobStore.writeFile(testFile)
+            return FileID.forPath(fileStoreID, testFile) if withSize else fileStoreID
+
+        @staticmethod
+        def _readFileTwice(job, fileStoreID):
+            job.fileStore.readGlobalFile(fileStoreID)
+            job.fileStore.readGlobalFile(fileStoreID)
+            assert job.fileStore.cacheStats['misses'] == 1
+            assert job.fileStore.cacheStats['hits'] == 1
+
+        def testCacheSummary(self):
+            """
+            Read a cached file and ensure that a later job finds the file and the cache hit in
+            the summary of the cache.
+            """
+            A = Job.wrapJobFn(self._writeFileToJobStoreOnly)
+            B = Job.wrapJobFn(self._readFileTwice, A.rv())
+            C = Job.wrapJobFn(self._checkCacheSummary, A.rv())
+            A.addChild(B)
+            B.addChild(C)
+            Job.Runner.startToil(A, self.options)
+
+        @staticmethod
+        def _checkCacheSummary(job, fileStoreID):
+            cachedFiles, hits, misses = CachingFileStore.summarizeCache(
+                job.fileStore.localCacheDir)
+            assert fileStoreID in cachedFiles
+            assert 'notAFileID' not in cachedFiles
+            assert (hits, misses) == (1, 1)
+
+        def testStreamedFileIsCached(self):
+            """
+            Stream a file that is not in the cache, follow the download with a second stream
+            while it is in progress and ensure the file ends up in the cache once the first stream
+            was read to the end. A stream that is only read in part must not fill the cache.
+            """
+            A = Job.wrapJobFn(self._writeFileToJobStoreOnly, withSize=True)
+            B = Job.wrapJobFn(self._streamFileTwice, A.rv())
+            C = Job.wrapJobFn(self._writeFileToJobStoreOnly, withSize=True)
+            D = Job.wrapJobFn(self._streamFileInPart, C.rv())
+            A.addChild(B)
+            B.addChild(C)
+            C.addChild(D)
+            Job.Runner.startToil(A, self.options)
+
+        @staticmethod
+        def _streamFileTwice(job, fileStoreID):
+            fileStore = job.fileStore
+            with fileStore.readGlobalFileStream(fileStoreID) as f:
+                assert f.read(2) == 'da'
+                if fileStore.nlinkThreshold == 2:
+                    # Files in a local job store are linked into the cache, not streamed
+                    return
+                assert not fileStore._fileIsCached(fileStoreID)
+                with fileStore.readGlobalFileStream(fileStoreID) as g:
+                    assert g.read(4) == 'data'
+                assert f.read() == 'ta'
+            assert fileStore._fileIsCached(fileStoreID)
+            assert fileStore.cacheStats['misses'] == 1
+            assert fileStore.cacheStats['hits'] == 1
+            with fileStore.readGlobalFileStream(fileStoreID) as f:
+                assert f.read() == 'data'
+
+        @staticmethod
+        def _streamFileInPart(job, fileStoreID):
+            fileStore = job.fileStore
+            with fileStore._stateTransaction(write=False) as state:
+                cacheInfo = fileStore._CacheState.load(state)
+            with fileStore.readGlobalFileStream(fileStoreID) as f:
+                assert f.read(2) == 'da'
+            assert not fileStore._fileIsCached(fileStoreID)
+            assert not os.path.exists(
+                fileStore.HarbingerFile(fileStore, fileStoreID=fileStoreID).streamingFileName)
+            # The space reserved for the copy was returned
+            with fileStore._stateTransaction(write=False) as state:
+                newCacheInfo = fileStore._CacheState.load(state)
+            assert (newCacheInfo.sigmaJob, newCacheInfo.cached) == (cacheInfo.sigmaJob,
+                                                                    cacheInfo.cached)
+
+        def testPrefetchedInputIsCached(self):
+            """
+            Declare a file that is only in the job store as the input of a job and ensure the
+            prefetched file is moved into the cache and counted against it when the job reads it.
+            """
+            A = Job.wrapJobFn(self._writeFileToJobStoreOnly, withSize=True)
+            A.addChildJobFn(self._readPrefetchedInput, A.rv()).addInputs(A.rv())
+            Job.Runner.startToil(A, self.options)
+
+        @staticmethod
+        def _readPrefetchedInput(job, fileStoreID):
+            fileStore = job.fileStore
+            jobStore = fileStore.jobStore
+
+            def copyFromJobStore(jobStoreFileID, localFilePath):
+                with jobStore.readFileStream(jobStoreFileID) as src:
+                    with open(localFilePath, 'w') as dst:
+                        dst.write(src.read())
+
+            if fileStore.nlinkThreshold == 2:
+                # Files in a job store on the same file system are linked into the cache rather
+                # than prefetched. Make the job store copy them and prefetch the file now.
+                assert fileStore.prefetchStats['files'] == 0
+                fileStore.nlinkThreshold = 1
+                jobStore.readFile = copyFromJobStore
+                fileStore._startPrefetching(job._inputs)
+            try:
+                assert fileStore.prefetchStats['files'] == 1
+                with fileStore._stateTransaction(write=False) as state:
+                    cacheInfo = fileStore._CacheState.load(state)
+                with open(fileStore.readGlobalFile(fileStoreID)) as f:
+                    assert f.read() == 'data'
+                assert fileStore._fileIsCached(fileStoreID)
+                assert fileStore.cacheStats['misses'] == 1
+                with fileStore._stateTransaction(write=False) as state:
+                    newCacheInfo = fileStore._CacheState.load(state)
+                assert newCacheInfo.cached == cacheInfo.cached + fileStoreID.size
+            finally:
+                vars(jobStore).pop('readFile', None)
+
+        def testReadAndWriteManyFiles(self):
+            """
+            Write several small files at once, read them back at once in a child job and ensure
+            the contents are intact and that every file ends up in the cache.
+            """
+            self.options.transferThreads = 4
+            A = Job.wrapJobFn(self._writeManyFiles, numFiles=10)
+            B = Job.wrapJobFn(self._readManyFiles, A.rv())
+            A.addChild(B)
+            Job.Runner.startToil(A, self.options)
+
+        @staticmethod
+        def _writeManyFiles(job, numFiles):
+            localFileNames = []
+            for i in xrange(numFiles):
+                localFileName = job.fileStore.getLocalTempFileName()
+                with open(localFileName, 'w') as f:
+                    f.write('data%i' % i)
+                localFileNames.append(localFileName)
+            return job.fileStore.writeGlobalFiles(localFileNames)
+
+        @staticmethod
+        def _readManyFiles(job, fileStoreIDs):
+            fileStore = job.fileStore
+            for mutable in (False, True):
+                localFileNames = fileStore.readGlobalFiles(fileStoreIDs, mutable=mutable)
+                assert len(localFileNames) == len(fileStoreIDs)
+                for i, (fileStoreID, localFileName) in enumerate(zip(fileStoreIDs,
+                                                                     localFileNames)):
+                    with open(localFileName) as f:
+                        assert f.read() == 'data%i' % i
+                    assert fileStore._fileIsCached(fileStoreID)
+                    # Only immutable local copies are links to the cached copy
+                    cachedFile = fileStore.encodedFileID(fileStoreID)
+                    assert os.path.samefile(localFileName, cachedFile) != mutable
+
         def testCacheEvictionPartialEvict(self):
             """
             Ensure the cache eviction happens as expected.  Two files (20MB and 30MB) are written
@@ -14,11 +14,14 @@
 
 from __future__ import absolute_import
 import os
+import pickle
+import uuid
 from argparse import ArgumentParser
 from toil.common import Toil
-from toil.job import Job
+from toil.job import Job, JobNode
 from toil.test import ToilTest
 from toil.jobGraph import JobGraph
+from toil.toilState import ToilState
 
 class JobGraphTest(ToilTest):
     
@@ -80,3 +83,53 @@ class JobGraphTest(ToilTest):
         self.assertNotEquals(j, j2)
         
         ###TODO test other functionality
+
+    def testPickling(self):
+        """
+        Tests that job graphs are pickled as dictionaries of their attributes, the format used
+        before they were slotted, with every pickle protocol.
+        """
+        j = JobGraph(command='command', memory=2 ** 32, cores=0.5, disk='1G', preemptable=None,
+                     jobStoreID='job', remainingRetryCount=1, predecessorNumber=1,
+                     jobName='testJobGraph', unitName='noName')
+        j.stack.append([JobNode.fromJobGraph(j)])
+        self.assertFalse(hasattr(j, '__dict__'))
+        state = j.__getstate__()
+        self.assertEquals(state['_disk'], 2 ** 30)
+        self.assertEquals(state['_preemptable'], None)
+        self.assertEquals(state['stack'], j.stack)
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            copy = pickle.loads(pickle.dumps(j, protocol))
+            self.assertEquals(copy.__getstate__(), state)
+            self.assertEquals(copy.cores, 0.5)
+        # Jobs with equal requirements share them
+        self.assertIs(copy._requirementValues, j._requirementValues)
+
+    def testToilStateSlots(self):
+        """
+        Builds the state of a small workflow and checks that its job graphs and job nodes are
+        slotted and share their requirements.
+        """
+        numJobs = 100
+        jobCache = {}
+        rootJob = self._makeJob(predecessorNumber=0)
+        # Make the root job look like one whose successors are to be run
+        rootJob.command = None
+        successors = []
+        for _ in range(numJobs):
+            job = self._makeJob(predecessorNumber=1)
+            jobCache[job.jobStoreID] = job
+            successors.append(JobNode.fromJobGraph(job))
+        rootJob.stack.append(successors)
+        state = ToilState(jobStore=self.toil._jobStore, rootJob=rootJob, jobCache=jobCache)
+        self.assertEquals(len(state.updatedJobs), numJobs)
+        objects = list(jobCache.values()) + successors
+        self.assertFalse(any(hasattr(o, '__dict__') for o in objects))
+        self.assertEquals(1, len({id(o._requirementValues) for o in objects}))
+
+    @staticmethod
+    def _makeJob(predecessorNumber):
+        return JobGraph(command='_toil ' + uuid.uuid4().hex, memory=2 ** 31, cores=1,
+                        disk=2 ** 31, preemptable=False, jobStoreID=uuid.uuid4().hex,
+                        remainingRetryCount=1, predecessorNumber=predecessorNumber,
+                        jobName='job', unitName=None)
@@ -50,7 +50,10 @@ class RestartDAGTest(ToilTest):
     def testRestartedWorkflowSchedulesCorrectJobsOnKilledParent(self):
         self._testRestartedWorkflowSchedulesCorrectJobs('kill')
 
-    def _testRestartedWorkflowSchedulesCorrectJobs(self, failType):
+    def testRestartedWorkflowSchedulesCorrectJobsWithoutSnapshot(self):
+        self._testRestartedWorkflowSchedulesCorrectJobs('raise', leaderSnapshotFrequency=0)
+
+    def _testRestartedWorkflowSchedulesCorrectJobs(self, failType, leaderSnapshotFrequency=None):
         """
         Creates a diamond DAG
             /->passingParent-\
@@ -62,12 +65,16 @@ class RestartDAGTest(ToilTest):
         iff child is run is not present on the system.
 
         :param str failType: Does failingParent fail on an assertionError, or is it killed.
+
+        :param int leaderSnapshotFrequency: The value of the option of the same name. If 0, the
+               restart examines the entire job graph.
         """
         # Specify options
         options = Job.Runner.getDefaultOptions(self.testJobStore)
         options.logLevel = 'DEBUG'
         options.retryCount = 0
         options.clean = "never"
+        options.leaderSnapshotFrequency = leaderSnapshotFrequency
 
         parentFile = os.path.join(self.tempDir, 'parent')
         childFile = os.path.join(self.tempDir, 'child')
@@ -16,12 +16,23 @@ from __future__ import absolute_import
 
 import logging
 
+# Python 3 compatibility imports
+from six.moves import cPickle
+
+from toil.jobStores.abstractJobStore import NoSuchFileException
+
 logger = logging.getLogger( __name__ )
 
 class ToilState( object ):
     """
     Represents a snapshot of the jobs in the jobStore. Used by the leader to manage the batch.
     """
+    # The name of the shared file in the job store holding the latest snapshot written by
+    # writeSnapshot()
+    snapshotFileName = 'toilStateSnapshot'
+
+    snapshotFormatVersion = 1
+
     def __init__( self, jobStore, rootJob, jobCache=None):
         """
         Loads the state from the jobStore, using the rootJob 
@@ -71,25 +82,122 @@ class ToilState( object ):
         logger.info("(Re)building internal scheduler state")
         self._buildToilState(rootJob, jobStore, jobCache)
 
-    def _buildToilState(self, jobGraph, jobStore, jobCache=None):
+    def getJobStoreIDs(self):
+        """
+        :rtype: set[str], the IDs of the jobs this state refers to
+        """
+        jobStoreIDs = set(self.successorCounts)
+        jobStoreIDs.update(self.successorJobStoreIDToPredecessorJobs)
+        jobStoreIDs.update(self.serviceJobStoreIDToPredecessorJob)
+        jobStoreIDs.update(self.servicesIssued)
+        jobStoreIDs.update(self.jobsToBeScheduledWithMultiplePredecessors)
+        jobStoreIDs.update(jobGraph.jobStoreID for jobGraph, _ in self.updatedJobs)
+        jobStoreIDs.update(jobNode.jobStoreID for jobNode in self.totalFailedJobs)
+        jobStoreIDs.update(self.hasFailedSuccessors)
+        jobStoreIDs.update(self.failedSuccessors)
+        return jobStoreIDs
+
+    def writeSnapshot(self, jobStore, issuedJobStoreIDs=()):
+        """
+        Records the IDs of the jobs this state refers to and of the given issued jobs in the job
+        store. These are the jobs the leader may have been working on, so a restarted leader can
+        load them in bulk, see readSnapshot(). The state of the jobs isn't recorded. It is loaded
+        from the job store on restart, which accounts for any changes since the snapshot.
+
+        :param toil.jobStores.abstractJobStore.AbstractJobStore jobStore:
+
+        :param Iterable[str] issuedJobStoreIDs: the IDs of the jobs issued to the batch system
+        """
+        jobStoreIDs = self.getJobStoreIDs()
+        jobStoreIDs.update(issuedJobStoreIDs)
+        snapshot = dict(version=self.snapshotFormatVersion,
+                        retryCount=jobStore.config.retryCount,
+                        jobStoreIDs=jobStoreIDs)
+        with jobStore.writeSharedFileStream(self.snapshotFileName) as fileHandle:
+            cPickle.dump(snapshot, fileHandle, cPickle.HIGHEST_PROTOCOL)
+        logger.debug("Wrote a snapshot of the state referring to %i jobs", len(jobStoreIDs))
+
+    @classmethod
+    def readSnapshot(cls, jobStore):
+        """
+        Reads the latest snapshot written by writeSnapshot().
+
+        A snapshot is only usable if the jobs in the job store still have the retry count they
+        were created with, i.e. if the retry count hasn't been changed on restart.
+
+        :param toil.jobStores.abstractJobStore.AbstractJobStore jobStore:
+
+        :return: the IDs of the jobs recorded in the snapshot or None if there is no usable
+                 snapshot
+        :rtype: set[str]|None
+        """
+        try:
+            with jobStore.readSharedFileStream(cls.snapshotFileName) as fileHandle:
+                snapshot = cPickle.load(fileHandle)
+        except NoSuchFileException:
+            return None
+        except (EOFError, ValueError, cPickle.UnpicklingError):
+            # The leader died while writing the snapshot
+            logger.warn("Ignoring an incomplete snapshot of the state.")
+            return None
+        if snapshot['version'] != cls.snapshotFormatVersion:
+            logger.warn("Ignoring a snapshot of the state in an unsupported format.")
+            return None
+        if snapshot['retryCount'] != jobStore.config.retryCount:
+            logger.info("Ignoring the snapshot of the state because the retry count changed.")
+            return None
+        return snapshot['jobStoreIDs']
+
+    def _buildToilState(self, rootJob, jobStore, jobCache=None):
         """
         Traverses tree of jobs from the root jobGraph (rootJob) building the
         ToilState class.
 
         If jobCache is passed, it must be a dict from job ID to JobGraph
         object. Jobs will be loaded from the cache (which can be downloaded from
-        the jobStore in a batch) instead of piecemeal when recursed into.
+        the jobStore in a batch) instead of piecemeal when traversed.
+
+        The jobs are traversed breadth-first by jobStore.traverse(), which loads the successors
+        of the jobs on one level of the graph concurrently.
         """
+        # Maps the ID of each successor with multiple predecessors that is being loaded to the
+        # predecessors that referenced it in the meantime
+        pendingPredecessors = {}
+        # The IDs of the jobs to traverse once the job currently being visited is processed
+        successorIDs = []
 
-        def getJob(jobId):
-            if jobCache is not None:
-                try:
-                    return jobCache[jobId]
-                except ValueError:
-                    return jobStore.load(jobId)
+        def getSuccessorIDs(jobGraph):
+            result = list(successorIDs)
+            del successorIDs[:]
+            return result
+
+        for jobGraph in jobStore.traverse([rootJob], getSuccessorIDs,
+                                          jobCache=jobCache, ignoreMissing=False):
+            try:
+                predecessors = pendingPredecessors.pop(jobGraph.jobStoreID)
+            except KeyError:
+                self._processJob(jobGraph, pendingPredecessors, successorIDs)
             else:
-                return jobStore.load(jobId)
+                # We put the successor job in the cache of successor jobs with multiple
+                # predecessors
+                assert jobGraph.jobStoreID not in self.jobsToBeScheduledWithMultiplePredecessors
+                self.jobsToBeScheduledWithMultiplePredecessors[jobGraph.jobStoreID] = jobGraph
+                for predecessor in predecessors:
+                    self._processSuccessorWithMultiplePredecessors(
+                        predecessor, jobGraph, pendingPredecessors, successorIDs)
+        assert not pendingPredecessors
 
+    def _processJob(self, jobGraph, pendingPredecessors, successorIDs):
+        """
+        Adds the given job to the state.
+
+        :param dict[str,list[toil.jobGraph.JobGraph]] pendingPredecessors: maps the ID of each
+               successor with multiple predecessors that is yet to be loaded to the
+               predecessors referencing it
+
+        :param list[str] successorIDs: the IDs of the successors that need to be loaded before
+               they can be considered are appended to this list
+        """
         # If the jobGraph has a command, is a checkpoint, has services or is ready to be
         # deleted it is ready to be processed
         if (jobGraph.command is not None
@@ -107,68 +215,65 @@ class ToilState( object ):
 
         else: # There exist successors
             logger.debug("Adding job: %s to the state with %s successors" % (jobGraph.jobStoreID, len(jobGraph.stack[-1])))
-            
+
             # Record the number of successors
             self.successorCounts[jobGraph.jobStoreID] = len(jobGraph.stack[-1])
-            
-            def processSuccessorWithMultiplePredecessors(successorJobGraph):
-                # If jobGraph is not reported as complete by the successor
-                if jobGraph.jobStoreID not in successorJobGraph.predecessorsFinished:
-                    
-                    # Update the sucessor's status to mark the predecessor complete
-                    successorJobGraph.predecessorsFinished.add(jobGraph.jobStoreID)
-            
-                # If the successor has no predecessors to finish
-                assert len(successorJobGraph.predecessorsFinished) <= successorJobGraph.predecessorNumber
-                if len(successorJobGraph.predecessorsFinished) == successorJobGraph.predecessorNumber:
-                    
-                    # It is ready to be run, so remove it from the cache
-                    self.jobsToBeScheduledWithMultiplePredecessors.pop(successorJobStoreID)
-                    
-                    # Recursively consider the successor
-                    self._buildToilState(successorJobGraph, jobStore, jobCache=jobCache)
-            
+
             # For each successor
             for successorJobNode in jobGraph.stack[-1]:
                 successorJobStoreID = successorJobNode.jobStoreID
-                
+
                 # If the successor jobGraph does not yet point back at a
                 # predecessor we have not yet considered it
                 if successorJobStoreID not in self.successorJobStoreIDToPredecessorJobs:
 
                     # Add the job as a predecessor
                     self.successorJobStoreIDToPredecessorJobs[successorJobStoreID] = [jobGraph]
-                    
+
                     # If predecessor number > 1 then the successor has multiple predecessors
                     if successorJobNode.predecessorNumber > 1:
-                        
-                        # We load the successor job
-                        successorJobGraph =  getJob(successorJobStoreID)
-                        
-                        # We put the successor job in the cache of successor jobs with multiple predecessors
-                        assert successorJobStoreID not in self.jobsToBeScheduledWithMultiplePredecessors
-                        self.jobsToBeScheduledWithMultiplePredecessors[successorJobStoreID] = successorJobGraph
-                        
-                        # Process successor
-                        processSuccessorWithMultiplePredecessors(successorJobGraph)
-                            
-                    else:
-                        # The successor has only the jobGraph as a predecessor so
-                        # recursively consider the successor
-                        self._buildToilState(getJob(successorJobStoreID), jobStore, jobCache=jobCache)
-                
+                        # We load the successor job and process it once it is loaded
+                        pendingPredecessors[successorJobStoreID] = [jobGraph]
+
+                    # Otherwise the successor has only the jobGraph as a predecessor so
+                    # we consider the successor once it is loaded
+                    successorIDs.append(successorJobStoreID)
+
                 else:
                     # We've already seen the successor
-                    
+
                     # Add the job as a predecessor
                     assert jobGraph not in self.successorJobStoreIDToPredecessorJobs[successorJobStoreID]
                     self.successorJobStoreIDToPredecessorJobs[successorJobStoreID].append(jobGraph)
-                    
+
                     # If the successor has multiple predecessors
                     if successorJobStoreID in self.jobsToBeScheduledWithMultiplePredecessors:
-                        
+
                         # Get the successor from cache
                         successorJobGraph = self.jobsToBeScheduledWithMultiplePredecessors[successorJobStoreID]
-                        
+
                         # Process successor
-                        processSuccessorWithMultiplePredecessors(successorJobGraph)
\ No newline at end of file
+                        self._processSuccessorWithMultiplePredecessors(
+                            jobGraph, successorJobGraph, pendingPredecessors, successorIDs)
+
+                    # If the successor with multiple predecessors is still being loaded
+                    elif successorJobStoreID in pendingPredecessors:
+                        pendingPredecessors[successorJobStoreID].append(jobGraph)
+
+    def _processSuccessorWithMultiplePredecessors(self, jobGraph, successorJobGraph,
+                                                  pendingPredecessors, successorIDs):
+        # If jobGraph is not reported as complete by the successor
+        if jobGraph.jobStoreID not in successorJobGraph.predecessorsFinished:
+
+            # Update the sucessor's status to mark the predecessor complete
+            successorJobGraph.predecessorsFinished.add(jobGraph.jobStoreID)
+
+        # If the successor has no predecessors to finish
+        assert len(successorJobGraph.predecessorsFinished) <= successorJobGraph.predecessorNumber
+        if len(successorJobGraph.predecessorsFinished) == successorJobGraph.predecessorNumber:
+
+            # It is ready to be run, so remove it from the cache
+            self.jobsToBeScheduledWithMultiplePredecessors.pop(successorJobGraph.jobStoreID)
+
+            # Consider the successor
+            self._processJob(successorJobGraph, pendingPredecessors, successorIDs)
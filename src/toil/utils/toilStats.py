@@ -396,6 +396,22 @@ def reportPrettyData(root, worker, job, job_types, options):
         reportTime(get(root, "total_clock"), options),
         reportTime(get(root, "total_run_time"), options),
         ))
+    cacheReads = get(root, "cache_hits") + get(root, "cache_misses")
+    out_str += ("Cache Hits: %s  Cache Misses: %s  Cache Hit Rate: %.1f%%  "
+                "Cache Evicted: %s\n" % (
+        reportNumber(get(root, "cache_hits"), options),
+        reportNumber(get(root, "cache_misses"), options),
+        100.0 * get(root, "cache_hits") / cacheReads if cacheReads else 0.0,
+        reportMemory(get(root, "cache_evicted_bytes"), options, isBytes=True),
+        ))
+    out_str += ("Prefetched Files: %s  Prefetch Time: %s  Prefetch Wait: %s  "
+                "Prefetch Overlap: %s\n" % (
+        reportNumber(get(root, "prefetched_files"), options),
+        reportTime(get(root, "prefetch_time"), options),
+        reportTime(get(root, "prefetch_wait_time"), options),
+        reportTime(max(0.0, get(root, "prefetch_time") - get(root, "prefetch_wait_time")),
+                   options),
+        ))
     job_types = sortJobs(job_types, options)
     columnWidths = computeColumnWidths(job_types, worker, job, options)
     out_str += "Worker\n"
@@ -560,6 +576,15 @@ def processData(config, stats):
         except TypeError:
             return []
 
+    # Sum up the cache operations of the jobs, which stats from older versions of Toil lack
+    collatedStatsTag.cache_hits = sum(job.get("cache_hits", 0) for job in jobs)
+    collatedStatsTag.cache_misses = sum(job.get("cache_misses", 0) for job in jobs)
+    collatedStatsTag.cache_evicted_bytes = sum(job.get("cache_evicted_bytes", 0) for job in jobs)
+    collatedStatsTag.prefetched_files = sum(job.get("prefetched_files", 0) for job in jobs)
+    collatedStatsTag.prefetch_time = sum(float(job.get("prefetch_time", 0)) for job in jobs)
+    collatedStatsTag.prefetch_wait_time = sum(float(job.get("prefetch_wait_time", 0))
+                                              for job in jobs)
+
     buildElement(collatedStatsTag, worker, "worker")
     createSummary(buildElement(collatedStatsTag, jobs, "jobs"),
                   stats.workers, "worker", fn4)
@@ -20,6 +20,7 @@ from __future__ import print_function
 
 import logging
 import sys
+from itertools import chain
 
 from toil.lib.bioio import logStream
 from toil.lib.bioio import getBasicOptionParser
@@ -82,28 +83,12 @@ def main():
         sys.exit(0)
 
     def traverseGraph(jobGraph):
-        foundJobStoreIDs = set()
-        totalJobs = []
-        def inner(jobGraph):
-            if jobGraph.jobStoreID in foundJobStoreIDs:
-                return
-            foundJobStoreIDs.add(jobGraph.jobStoreID)
-            totalJobs.append(jobGraph)
-            # Traverse jobs in stack
-            for jobs in jobGraph.stack:
-                for successorJobStoreID in map(lambda x: x.jobStoreID, jobs):
-                    if (successorJobStoreID not in foundJobStoreIDs and jobStore.exists(successorJobStoreID)):
-                        inner(jobStore.load(successorJobStoreID))
-
-            # Traverse service jobs
-            for jobs in jobGraph.services:
-                for serviceJobStoreID in map(lambda x: x.jobStoreID, jobs):
-                    if jobStore.exists(serviceJobStoreID):
-                        assert serviceJobStoreID not in foundJobStoreIDs
-                        foundJobStoreIDs.add(serviceJobStoreID)
-                        totalJobs.append(jobStore.load(serviceJobStoreID))
-        inner(jobGraph)
-        return totalJobs
+        def getSuccessorIDs(jobGraph):
+            # Traverse jobs in stack and service jobs
+            return [jobNode.jobStoreID
+                    for jobs in chain(jobGraph.stack, jobGraph.services)
+                    for jobNode in jobs]
+        return list(jobStore.traverse([jobGraph], getSuccessorIDs))
 
     logger.info('Traversing the job graph. This may take a couple minutes.')
     totalJobs = traverseGraph(rootJob)
@@ -25,7 +25,7 @@ import time
 import socket
 import logging
 import shutil
-from threading import Thread
+from threading import Thread, Event, current_thread
 
 # Python 3 compatibility imports
 from six.moves import cPickle
@@ -48,6 +48,17 @@ def nextOpenDescriptor():
     os.close(descriptor)
     return descriptor
 
+class CurrentThreadFilter(logging.Filter):
+    """
+    Passes the log records of the thread that created this filter.
+    """
+    def __init__(self):
+        logging.Filter.__init__(self)
+        self.threadID = current_thread().ident
+
+    def filter(self, record):
+        return record.thread == self.threadID
+
 class AsyncJobStoreWrite:
     def __init__(self, jobStore):
         pass
@@ -75,9 +86,6 @@ def main():
     
     #Now we can import all the necessary functions
     from toil.lib.bioio import setLogLevel
-    from toil.lib.bioio import getTotalCpuTime
-    from toil.lib.bioio import getTotalCpuTimeAndMemoryUsage
-    from toil.job import Job
     try:
         import boto
     except ImportError:
@@ -92,9 +100,6 @@ def main():
     
     jobStoreLocator = sys.argv[1]
     jobStoreID = sys.argv[2]
-    # we really want a list of job names but the ID will suffice if the job graph can't
-    # be loaded. If we can discover the name, we will replace this initial entry
-    listOfJobs = [jobStoreID]
     
     ##########################################
     #Load the jobStore/config file
@@ -107,8 +112,6 @@ def main():
     #Create the worker killer, if requested
     ##########################################
 
-    logFileByteReportLimit = config.maxLogFileSize
-
     if config.badWorker > 0 and random.random() < config.badWorker:
         def badWorker():
             #This will randomly kill the worker process at a random time 
@@ -144,6 +147,32 @@ def main():
 
     setLogLevel(config.logLevel)
 
+    workerScript(jobStore, config, jobStoreID)
+
+
+def workerScript(jobStore, config, jobStoreID, redirectOutputToLogFile=True):
+    """
+    Runs the job with the given ID and as many of its successors as can be chained to it, then
+    records the outcome in the job store and cleans up after the jobs.
+
+    :param toil.jobStores.abstractJobStore.AbstractJobStore jobStore: the job store of the workflow
+    :param toil.common.Config config: the configuration of the workflow
+    :param str jobStoreID: the ID of the job to run
+    :param bool redirectOutputToLogFile: If True, the standard output and standard error of this
+           process and its children are redirected to the worker log while the jobs run. If
+           False, only the messages logged by the current thread go to the worker log, which
+           allows for running jobs in a thread of a process that does other things as well.
+    """
+    from toil.lib.bioio import getTotalCpuTime
+    from toil.lib.bioio import getTotalCpuTimeAndMemoryUsage
+    from toil.job import Job
+
+    # we really want a list of job names but the ID will suffice if the job graph can't
+    # be loaded. If we can discover the name, we will replace this initial entry
+    listOfJobs = [jobStoreID]
+
+    logFileByteReportLimit = config.maxLogFileSize
+
     toilWorkflowDir = Toil.getWorkflowDir(config.workflowID, config.workDir)
 
     ##########################################
@@ -170,28 +199,36 @@ def main():
     #What file do we want to point FDs 1 and 2 to?
     tempWorkerLogPath = os.path.join(localWorkerTempDir, "worker_log.txt")
     
-    #Save the original stdout and stderr (by opening new file descriptors to the
-    #same files)
-    origStdOut = os.dup(1)
-    origStdErr = os.dup(2)
+    if redirectOutputToLogFile:
+        #Save the original stdout and stderr (by opening new file descriptors to the
+        #same files)
+        origStdOut = os.dup(1)
+        origStdErr = os.dup(2)
 
-    #Open the file to send stdout/stderr to.
-    logFh = os.open(tempWorkerLogPath, os.O_WRONLY | os.O_CREAT | os.O_APPEND)
+        #Open the file to send stdout/stderr to.
+        logFh = os.open(tempWorkerLogPath, os.O_WRONLY | os.O_CREAT | os.O_APPEND)
 
-    #Replace standard output with a descriptor for the log file
-    os.dup2(logFh, 1)
-    
-    #Replace standard error with a descriptor for the log file
-    os.dup2(logFh, 2)
-    
-    #Since we only opened the file once, all the descriptors duped from the
-    #original will share offset information, and won't clobber each others'
-    #writes. See <http://stackoverflow.com/a/5284108/402891>. This shouldn't
-    #matter, since O_APPEND seeks to the end of the file before every write, but
-    #maybe there's something odd going on...
-    
-    #Close the descriptor we used to open the file
-    os.close(logFh)
+        #Replace standard output with a descriptor for the log file
+        os.dup2(logFh, 1)
+
+        #Replace standard error with a descriptor for the log file
+        os.dup2(logFh, 2)
+
+        #Since we only opened the file once, all the descriptors duped from the
+        #original will share offset information, and won't clobber each others'
+        #writes. See <http://stackoverflow.com/a/5284108/402891>. This shouldn't
+        #matter, since O_APPEND seeks to the end of the file before every write, but
+        #maybe there's something odd going on...
+
+        #Close the descriptor we used to open the file
+        os.close(logFh)
+    else:
+        #The file descriptors are shared with the rest of the process, so we only
+        #capture what this thread logs
+        logHandler = logging.FileHandler(tempWorkerLogPath)
+        logHandler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+        logHandler.addFilter(CurrentThreadFilter())
+        logging.getLogger().addHandler(logHandler)
 
     debugging = logging.getLogger().isEnabledFor(logging.DEBUG)
     ##########################################
@@ -204,11 +241,14 @@ def main():
     statsDict.workers.logsToMaster = []
     blockFn = lambda : True
     cleanCacheFn = lambda x : True
+    # Used to signify crashes in the threads of the file stores of this worker
+    terminateEvent = Event()
     try:
 
         #Put a message at the top of the log, just to make sure it's working.
-        print("---TOIL WORKER OUTPUT LOG---")
-        sys.stdout.flush()
+        if redirectOutputToLogFile:
+            print("---TOIL WORKER OUTPUT LOG---")
+            sys.stdout.flush()
         
         #Log the number of open file descriptors so we can tell if we're leaking
         #them.
@@ -329,7 +369,9 @@ def main():
 
                 # Create a fileStore object for the job
                 fileStore = FileStore.createFileStore(jobStore, jobGraph, localWorkerTempDir, blockFn,
-                                                      caching=not config.disableCaching)
+                                                      caching=not config.disableCaching,
+                                                      terminateEvent=terminateEvent,
+                                                      changeDir=redirectOutputToLogFile)
                 with job._executor(jobGraph=jobGraph,
                                    stats=statsDict if config.stats else None,
                                    fileStore=fileStore):
@@ -348,7 +390,7 @@ def main():
                 #been scheduled after a failure to cleanup
                 break
             
-            if FileStore._terminateEvent.isSet():
+            if terminateEvent.isSet():
                 raise RuntimeError("The termination flag is set")
 
             ##########################################
@@ -442,7 +484,9 @@ def main():
             
             #Build a fileStore to update the job
             fileStore = FileStore.createFileStore(jobStore, jobGraph, localWorkerTempDir, blockFn,
-                                                  caching=not config.disableCaching)
+                                                  caching=not config.disableCaching,
+                                                  terminateEvent=terminateEvent,
+                                                  changeDir=redirectOutputToLogFile)
 
             #Update blockFn
             blockFn = fileStore._blockFn
@@ -476,9 +520,12 @@ def main():
     #Trapping where worker goes wrong
     ##########################################
     except: #Case that something goes wrong in worker
-        traceback.print_exc()
+        if redirectOutputToLogFile:
+            traceback.print_exc()
+        else:
+            logger.error(traceback.format_exc())
         logger.error("Exiting the worker because of a failed job on host %s", socket.gethostname())
-        FileStore._terminateEvent.set()
+        terminateEvent.set()
     
     ##########################################
     #Wait for the asynchronous chain of writes/updates to finish
@@ -491,7 +538,7 @@ def main():
     #so safe to test if they completed okay
     ########################################## 
     
-    if FileStore._terminateEvent.isSet():
+    if terminateEvent.isSet():
         jobGraph = jobStore.load(jobStoreID)
         jobGraph.setupJobAfterFailure(config)
         workerFailed = True
@@ -501,28 +548,32 @@ def main():
     ##########################################
     
     #Close the worker logging
-    #Flush at the Python level
-    sys.stdout.flush()
-    sys.stderr.flush()
-    #Flush at the OS level
-    os.fsync(1)
-    os.fsync(2)
+    if redirectOutputToLogFile:
+        #Flush at the Python level
+        sys.stdout.flush()
+        sys.stderr.flush()
+        #Flush at the OS level
+        os.fsync(1)
+        os.fsync(2)
 
-    #Close redirected stdout and replace with the original standard output.
-    os.dup2(origStdOut, 1)
+        #Close redirected stdout and replace with the original standard output.
+        os.dup2(origStdOut, 1)
 
-    #Close redirected stderr and replace with the original standard error.
-    os.dup2(origStdErr, 2)
+        #Close redirected stderr and replace with the original standard error.
+        os.dup2(origStdErr, 2)
 
-    #sys.stdout and sys.stderr don't need to be modified at all. We don't need
-    #to call redirectLoggerStreamHandlers since they still log to sys.stderr
+        #sys.stdout and sys.stderr don't need to be modified at all. We don't need
+        #to call redirectLoggerStreamHandlers since they still log to sys.stderr
 
-    #Close our extra handles to the original standard output and standard error
-    #streams, so we don't leak file handles.
-    os.close(origStdOut)
-    os.close(origStdErr)
+        #Close our extra handles to the original standard output and standard error
+        #streams, so we don't leak file handles.
+        os.close(origStdOut)
+        os.close(origStdErr)
 
-    #Now our file handles are in exactly the state they were in before.
+        #Now our file handles are in exactly the state they were in before.
+    else:
+        logging.getLogger().removeHandler(logHandler)
+        logHandler.close()
 
     #Copy back the log file to the global dir, if needed
     if workerFailed: